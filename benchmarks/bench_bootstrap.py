@@ -0,0 +1,105 @@
+"""Compares bootstrapping an index with COPY against reading the source page by page.
+
+Loads synthetic titles into a scratch schema of a Postgres database, then reads all of them
+with the page query and with the COPY reader - first just reading, then also turning them into
+actions and writing them to the in-process fake elasticsearch, as an initial load does.
+
+    source environment.sh && python -m benchmarks.bench_bootstrap \\
+        --database-uri postgresql+pg8000://... --titles 2000000
+"""
+import argparse
+from datetime import datetime
+import os
+import time
+
+from sqlalchemy.orm import Session  # type: ignore
+
+from benchmarks import bench_page_query
+from benchmarks.fake_elasticsearch import FakeElasticsearch
+from benchmarks.synthetic_data import generate_titles
+from service import es_utils
+from service.database import copy_reader, page_reader
+from service.updaters.property_by_address_updater_v1 import PropertyByAddressUpdaterV1
+
+BENCHMARK_INDEX_NAME = 'bench_bootstrap'
+DOC_TYPE = 'property_by_address'
+
+
+def stream_titles_by_page(engine, page_size):
+    session = Session(bind=engine)
+    last_title_number, last_modification_date = '', datetime.min
+
+    try:
+        while True:
+            page = page_reader._get_page_query(
+                session, last_title_number, last_modification_date, page_size
+            ).all()
+
+            if not page:
+                return
+
+            yield from page
+            last_title_number = page[-1].title_number
+            last_modification_date = page[-1].last_modified
+            # like the page reader, which reads every page in a session of its own
+            session.expunge_all()
+    finally:
+        session.close()
+
+
+def stream_titles_with_copy(engine, page_size):
+    return copy_reader.stream_titles_with_copy(engine=engine)
+
+
+def run_read_pass(stream_titles, engine, page_size):
+    start = time.perf_counter()
+    title_count = sum(1 for title in stream_titles(engine, page_size))
+    return time.perf_counter() - start, title_count
+
+
+def run_load_pass(stream_titles, engine, page_size):
+    es_utils.elasticsearch_client = client = FakeElasticsearch()
+    updater = PropertyByAddressUpdaterV1(BENCHMARK_INDEX_NAME, DOC_TYPE)
+    updater.versioned_writes = True
+    start = time.perf_counter()
+    actions = (
+        action for title in stream_titles(engine, page_size)
+        for action in updater.prepare_elasticsearch_actions(title)
+    )
+    success_count, errors = es_utils.execute_elasticsearch_actions(actions, client)
+    return time.perf_counter() - start, success_count
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument('--database-uri', default=os.environ.get('BENCH_DATABASE_URI'))
+    parser.add_argument('--titles', type=int, default=1000000)
+    parser.add_argument('--page-size', type=int, default=1000)
+    args = parser.parse_args()
+
+    if not args.database_uri:
+        parser.error('--database-uri or BENCH_DATABASE_URI must be set')
+
+    engine = bench_page_query.load_titles(args.database_uri, generate_titles(args.titles))
+    print('titles={} page_size={}'.format(args.titles, args.page_size))
+
+    try:
+        for pass_name, run_pass, count_name in [
+                ('read', run_read_pass, 'titles'),
+                ('read+load', run_load_pass, 'actions')]:
+            for reader_name, stream_titles in [
+                    ('pages', stream_titles_by_page),
+                    ('COPY', stream_titles_with_copy)]:
+                elapsed, count = run_pass(stream_titles, engine, args.page_size)
+                print('{:<10} {:<6} {:8.3f}s  {:9.0f} titles/s  {}: {}'.format(
+                    pass_name, reader_name, elapsed, args.titles / elapsed, count_name, count
+                ))
+    finally:
+        engine.execute('DROP SCHEMA IF EXISTS {} CASCADE'.format(
+            bench_page_query.BENCHMARK_SCHEMA_NAME
+        ))
+        engine.dispose()
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,109 @@
+"""Compares the address-based document IDs of property-by-address-v1-updater with the compact
+IDs of property-by-address-v2-updater.
+
+Prepares the actions of a synthetic corpus with each updater and measures the IDs and the
+bulk request bodies they make up, serialised the way the elasticsearch client does. Part of the
+titles get flat and building names in front of their addresses, as many registered addresses
+have. With --local-es, the corpus is also written to ELASTICSEARCH_URI with versioned writes,
+one index per updater, and the store size of each index is compared once it's optimised to a
+single segment.
+
+    source environment.sh && python -m benchmarks.bench_document_ids --titles 100000
+"""
+import argparse
+import random
+
+from elasticsearch.helpers import bulk, expand_action  # type: ignore
+from elasticsearch.serializer import JSONSerializer  # type: ignore
+
+from benchmarks.synthetic_data import generate_titles
+from service import es_utils
+from service.updaters import base
+from service.updaters.property_by_address_updater_v1 import PropertyByAddressUpdaterV1
+from service.updaters.property_by_address_updater_v2 import PropertyByAddressUpdaterV2
+
+BENCHMARK_INDEX_NAME = 'bench_document_ids'
+DOC_TYPE = 'property_by_address'
+UPDATER_CLASSES = [PropertyByAddressUpdaterV1, PropertyByAddressUpdaterV2]
+BUILDING_NAMES = ['THE OLD RECTORY', 'VICTORIA COURT', 'ST JOHNS HOUSE', 'ALBION MANSIONS']
+
+
+def generate_corpus(count, flat_ratio):
+    rng = random.Random(1)
+
+    for title in generate_titles(count):
+        if rng.random() < flat_ratio:
+            address = title.register_data['address']
+            address_string = 'FLAT {}, {}, {}'.format(
+                rng.randint(1, 60), rng.choice(BUILDING_NAMES), address['address_string']
+            )
+            title = title._replace(register_data={
+                'address': dict(address, address_string=address_string)
+            })
+
+        yield title
+
+
+def measure_actions(actions):
+    """Bytes of the IDs and of the bulk request lines of the actions"""
+    serializer = JSONSerializer()
+    id_bytes = 0
+    bulk_bytes = 0
+
+    for action in actions:
+        id_bytes += len(action['_id'].encode('utf-8'))
+
+        for line in expand_action(dict(action)):
+            if line is not None:
+                bulk_bytes += len(serializer.dumps(line).encode('utf-8')) + 1
+
+    return id_bytes, bulk_bytes
+
+
+def measure_store_size(client, updater, actions, page_size):
+    index_name = updater.index_name
+    client.indices.delete(index=index_name, ignore=[404])
+    client.indices.create(index=index_name, body={'mappings': {DOC_TYPE: updater.get_mapping()}})
+    bulk(client, actions, chunk_size=page_size)
+    client.indices.optimize(index=index_name, max_num_segments=1)
+    stats = client.indices.stats(index=index_name, metric='store')
+    store_bytes = stats['indices'][index_name]['primaries']['store']['size_in_bytes']
+    client.indices.delete(index=index_name, ignore=[404])
+    return store_bytes
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument('--titles', type=int, default=100000)
+    parser.add_argument('--flat-ratio', type=float, default=0.3)
+    parser.add_argument('--page-size', type=int, default=1000)
+    parser.add_argument('--local-es', action='store_true')
+    args = parser.parse_args()
+
+    titles = list(generate_corpus(args.titles, args.flat_ratio))
+    print('titles={} flat_ratio={} target={}'.format(
+        args.titles, args.flat_ratio, 'local elasticsearch' if args.local_es else 'none'
+    ))
+
+    for updater_class in UPDATER_CLASSES:
+        for versioned_writes in [False, True]:
+            index_name = '{}_{}'.format(BENCHMARK_INDEX_NAME, updater_class.__name__.lower())
+            updater = updater_class(index_name, DOC_TYPE)
+            updater.versioned_writes = versioned_writes
+            actions = list(base.stream_actions(updater, titles))
+            id_bytes, bulk_bytes = measure_actions(actions)
+            line = '{:<28} versioned={:<5} avg ID: {:5.1f}B  IDs: {:10d}B  bulk: {:11d}B'.format(
+                updater_class.__name__, str(versioned_writes), id_bytes / len(actions), id_bytes,
+                bulk_bytes,
+            )
+
+            if args.local_es and versioned_writes:
+                line += '  store: {:11d}B'.format(measure_store_size(
+                    es_utils.elasticsearch_client, updater, actions, args.page_size
+                ))
+
+            print(line)
+
+
+if __name__ == '__main__':
+    main()
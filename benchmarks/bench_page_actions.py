@@ -0,0 +1,83 @@
+"""Compares preparing actions title by title with preparing them for a batch of titles at once.
+
+Turns synthetic titles into actions with each built-in updater, calling
+prepare_elasticsearch_actions for each title and prepare_page_actions for each batch, the way
+the synchroniser does. Titles share their modification dates in groups, as after bulk changes
+to the register. Nothing is written - it measures the transform alone.
+
+    source environment.sh && python -m benchmarks.bench_page_actions --titles 200000
+"""
+import argparse
+import time
+
+from benchmarks.synthetic_data import generate_titles
+from service.updaters import base
+from service.updaters.property_by_address_updater_v1 import PropertyByAddressUpdaterV1
+from service.updaters.property_by_postcode_updater_v3 import PropertyByPostcodeUpdaterV3
+
+UPDATER_CLASSES = [PropertyByAddressUpdaterV1, PropertyByPostcodeUpdaterV3]
+
+
+def generate_titles_sharing_dates(count, titles_per_date, deleted_ratio):
+    titles = generate_titles(count, deleted_ratio=deleted_ratio)
+    dates = []
+
+    for number, title in enumerate(titles):
+        if number % titles_per_date == 0:
+            dates.append(title.last_modified)
+
+        yield title._replace(last_modified=dates[-1])
+
+
+def prepare_title_by_title(updater, titles, batch_size):
+    return sum(len(updater.prepare_elasticsearch_actions(title)) for title in titles)
+
+
+def prepare_by_page(updater, titles, batch_size):
+    return sum(1 for action in base.stream_actions(updater, titles, batch_size))
+
+
+def run_pass(prepare, updater, titles, batch_size):
+    start = time.perf_counter()
+    action_count = prepare(updater, titles, batch_size)
+    return time.perf_counter() - start, action_count
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument('--titles', type=int, default=100000)
+    parser.add_argument('--batch-size', type=int, default=100)
+    parser.add_argument('--titles-per-date', type=int, default=50)
+    parser.add_argument('--deleted-ratio', type=float, default=0.05)
+    parser.add_argument('--repeats', type=int, default=3)
+    args = parser.parse_args()
+
+    titles = list(generate_titles_sharing_dates(
+        args.titles, args.titles_per_date, args.deleted_ratio
+    ))
+    print('titles={} batch_size={} titles_per_date={} deleted_ratio={}'.format(
+        args.titles, args.batch_size, args.titles_per_date, args.deleted_ratio
+    ))
+
+    for updater_class in UPDATER_CLASSES:
+        for versioned_writes in [False, True]:
+            updater = updater_class('bench_page_actions', 'doctype')
+            updater.versioned_writes = versioned_writes
+
+            for mode_name, prepare in [
+                    ('per title', prepare_title_by_title),
+                    ('per page', prepare_by_page)]:
+                # the best of the repeats, to leave out warm-up and noise
+                elapsed, action_count = min(
+                    run_pass(prepare, updater, titles, args.batch_size)
+                    for _ in range(args.repeats)
+                )
+                print('{:<28} versioned={:<5} {:<9} {:8.3f}s  {:9.0f} titles/s  '
+                      'actions: {}'.format(
+                    updater_class.__name__, str(versioned_writes), mode_name, elapsed,
+                    args.titles / elapsed, action_count
+                ))
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,117 @@
+"""Measures the per-page overhead of reading source pages with and without dedicated connections.
+
+Loads synthetic titles into a scratch schema of a Postgres database and reads all of them in
+small pages, where what it takes to set a page up outweighs reading its rows:
+
+    session   - a new ORM session for every page, with the query built and compiled each time
+    pooled    - the cached page statement, on a connection checked out of the pool for the page
+    dedicated - the cached page statement, on one connection held for all pages
+
+    source environment.sh && python -m benchmarks.bench_page_overhead \\
+        --database-uri postgresql+pg8000://... --titles 100000 --page-size 20 --pre-ping
+"""
+import argparse
+from datetime import datetime
+import os
+import time
+
+from sqlalchemy import event  # type: ignore
+from sqlalchemy.orm import Session  # type: ignore
+
+from benchmarks import bench_page_query
+from benchmarks.synthetic_data import generate_titles
+from config import CONFIG_DICT
+from service.database import engines, page_reader, read_source
+
+
+def read_page_with_session(engine, last_title_number, last_modification_date, page_size):
+    # how pages were read before the page statement was cached
+    session = Session(bind=engine)
+
+    try:
+        return page_reader._get_page_query(
+            session, last_title_number, last_modification_date, page_size
+        ).all()
+    finally:
+        session.close()
+
+
+def read_page_with_statement(engine, last_title_number, last_modification_date, page_size):
+    return list(page_reader.stream_next_data_page(
+        last_title_number, last_modification_date, page_size
+    ))
+
+
+def run_pass(engine, read_page, page_size, is_dedicated):
+    CONFIG_DICT['DEDICATED_PAGE_CONNECTIONS'] = is_dedicated
+    last_title_number, last_modification_date = '', datetime.min
+    page_secs = []
+    title_count = 0
+    start = time.perf_counter()
+
+    with page_reader.dedicated_page_connections():
+        while True:
+            page_start = time.perf_counter()
+            page = read_page(engine, last_title_number, last_modification_date, page_size)
+            page_secs.append(time.perf_counter() - page_start)
+
+            if not page:
+                break
+
+            title_count += len(page)
+            last_title_number = page[-1].title_number
+            last_modification_date = page[-1].last_modified
+
+    page_secs.sort()
+    return (
+        time.perf_counter() - start, title_count, len(page_secs),
+        page_secs[len(page_secs) // 2], page_secs[int(len(page_secs) * 0.95)],
+    )
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument('--database-uri', default=os.environ.get('BENCH_DATABASE_URI'))
+    parser.add_argument('--titles', type=int, default=100000)
+    parser.add_argument('--page-size', type=int, default=20)
+    parser.add_argument('--pre-ping', action='store_true',
+                        help='test connections as they are checked out of the pool')
+    args = parser.parse_args()
+
+    if not args.database_uri:
+        parser.error('--database-uri or BENCH_DATABASE_URI must be set')
+
+    engine = bench_page_query.load_titles(args.database_uri, generate_titles(args.titles))
+
+    if args.pre_ping:
+        event.listen(engine, 'engine_connect', engines._ping_connection)
+
+    # pages are read from the benchmark's schema rather than the configured database
+    read_source.get_read_source = lambda: read_source.ReadSource(
+        read_source.PRIMARY_SOURCE_NAME, engine, None
+    )
+    print('titles={} page_size={} pre_ping={}'.format(args.titles, args.page_size, args.pre_ping))
+
+    try:
+        for mode_name, read_page, is_dedicated in [
+                ('session', read_page_with_session, False),
+                ('pooled', read_page_with_statement, False),
+                ('dedicated', read_page_with_statement, True)]:
+            elapsed, title_count, page_count, median_page_secs, p95_page_secs = run_pass(
+                engine, read_page, args.page_size, is_dedicated
+            )
+            print('{:<10} {:8.3f}s  {:9.0f} titles/s  pages: {}  per page: {:.3f}ms  '
+                  'median: {:.3f}ms  p95: {:.3f}ms'.format(
+                      mode_name, elapsed, title_count / elapsed, page_count,
+                      elapsed / page_count * 1000, median_page_secs * 1000,
+                      p95_page_secs * 1000
+                  ))
+    finally:
+        engine.execute('DROP SCHEMA IF EXISTS {} CASCADE'.format(
+            bench_page_query.BENCHMARK_SCHEMA_NAME
+        ))
+        engine.dispose()
+
+
+if __name__ == '__main__':
+    main()
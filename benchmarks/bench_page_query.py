@@ -0,0 +1,167 @@
+"""Compares the OR-of-comparisons page predicate with the row value comparison.
+
+Loads synthetic titles into a scratch schema of a Postgres database and reads all of them
+page by page with each predicate. By default most titles share a handful of modification
+dates, as after a bulk migration, which is where the two predicates differ most.
+
+    python -m benchmarks.bench_page_query --database-uri postgresql+pg8000://... --titles 200000
+"""
+import argparse
+from datetime import datetime
+import itertools
+import os
+import random
+import time
+
+from sqlalchemy import create_engine, event  # type: ignore
+from sqlalchemy.orm import Session           # type: ignore
+
+from benchmarks.synthetic_data import generate_titles
+from service.database import indexes, page_reader
+from service.database.model import Base, TitleRegisterData
+
+BENCHMARK_SCHEMA_NAME = 'bench_page_query'
+INSERT_BATCH_SIZE = 1000
+
+
+def get_or_predicate_page_query(session, last_title_number, last_modification_date, page_size):
+    """The page query as it was before the row value comparison"""
+    return session.query(TitleRegisterData).filter(
+        (
+            (TitleRegisterData.last_modified == last_modification_date) &
+            (TitleRegisterData.title_number > last_title_number)
+        ) |
+        (TitleRegisterData.last_modified > last_modification_date)
+    ).order_by(
+        TitleRegisterData.last_modified,
+        TitleRegisterData.title_number
+    ).limit(page_size)
+
+
+def get_row_value_page_query(session, last_title_number, last_modification_date, page_size):
+    return page_reader._get_page_query(
+        session, last_title_number, last_modification_date, page_size
+    )
+
+
+def generate_skewed_titles(count, hot_dates, hot_ratio, seed=0):
+    """Titles where hot_ratio of them have one of hot_dates as their modification date"""
+    rng = random.Random(seed)
+    hot_dates = [datetime(2016, 1, 1 + day) for day in range(hot_dates)]
+
+    for title in generate_titles(count, seed=seed):
+        if rng.random() < hot_ratio:
+            title = title._replace(last_modified=rng.choice(hot_dates))
+
+        yield title
+
+
+def create_engine_for_schema(database_uri):
+    engine = create_engine(database_uri)
+
+    @event.listens_for(engine, 'connect')
+    def set_search_path(dbapi_connection, connection_record):
+        cursor = dbapi_connection.cursor()
+        cursor.execute('SET search_path TO {}'.format(BENCHMARK_SCHEMA_NAME))
+        cursor.close()
+
+    return engine
+
+
+def load_titles(database_uri, titles):
+    setup_engine = create_engine(database_uri)
+    setup_engine.execute('DROP SCHEMA IF EXISTS {} CASCADE'.format(BENCHMARK_SCHEMA_NAME))
+    setup_engine.execute('CREATE SCHEMA {}'.format(BENCHMARK_SCHEMA_NAME))
+    setup_engine.dispose()
+
+    engine = create_engine_for_schema(database_uri)
+    Base.metadata.create_all(engine, tables=[TitleRegisterData.__table__])
+    # titles can be a generator - only a batch of rows is held in memory at a time
+    rows = (
+        {
+            'title_number': title.title_number,
+            'register_data': title.register_data,
+            'last_modified': title.last_modified,
+            'is_deleted': title.is_deleted,
+        }
+        for title in titles
+    )
+
+    for batch in iter(lambda: list(itertools.islice(rows, INSERT_BATCH_SIZE)), []):
+        engine.execute(TitleRegisterData.__table__.insert(), batch)
+
+    engine.execute(indexes.get_page_index_ddl().replace(' CONCURRENTLY', ''))
+    engine.execute('ANALYZE {}'.format(indexes.SOURCE_TABLE_NAME))
+    return engine
+
+
+def run_pass(engine, get_page_query, page_size):
+    session = Session(bind=engine)
+    last_title_number, last_modification_date = '', datetime.min
+    title_count = page_count = 0
+    slowest_page_secs = 0.0
+    start = time.perf_counter()
+
+    try:
+        while True:
+            page_start = time.perf_counter()
+            page = get_page_query(
+                session, last_title_number, last_modification_date, page_size
+            ).all()
+            slowest_page_secs = max(slowest_page_secs, time.perf_counter() - page_start)
+
+            if not page:
+                break
+
+            title_count += len(page)
+            page_count += 1
+            last_title_number = page[-1].title_number
+            last_modification_date = page[-1].last_modified
+
+        elapsed = time.perf_counter() - start
+        # the plan of a page starting in the middle of the hottest date
+        hot_page_query = get_page_query(session, '', datetime(2016, 1, 1), page_size)
+        plan = page_reader.explain_query(session, hot_page_query)
+    finally:
+        session.close()
+
+    return elapsed, title_count, page_count, slowest_page_secs, plan
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument('--database-uri', default=os.environ.get('BENCH_DATABASE_URI'))
+    parser.add_argument('--titles', type=int, default=100000)
+    parser.add_argument('--page-size', type=int, default=1000)
+    parser.add_argument('--hot-dates', type=int, default=3)
+    parser.add_argument('--hot-ratio', type=float, default=0.9)
+    args = parser.parse_args()
+
+    if not args.database_uri:
+        parser.error('--database-uri or BENCH_DATABASE_URI must be set')
+
+    titles = list(generate_skewed_titles(args.titles, args.hot_dates, args.hot_ratio))
+    engine = load_titles(args.database_uri, titles)
+    print('titles={} page_size={} hot_dates={} hot_ratio={}'.format(
+        args.titles, args.page_size, args.hot_dates, args.hot_ratio
+    ))
+
+    try:
+        for mode_name, get_page_query in [
+                ('OR predicate', get_or_predicate_page_query),
+                ('row value', get_row_value_page_query)]:
+            elapsed, title_count, page_count, slowest_page_secs, plan = run_pass(
+                engine, get_page_query, args.page_size
+            )
+            print('{:<13} {:8.3f}s  {:9.0f} titles/s  pages: {}  slowest page: {:.3f}s  '
+                  'index range scan: {}'.format(
+                      mode_name, elapsed, title_count / elapsed, page_count, slowest_page_secs,
+                      page_reader.uses_index_range_scan(plan)
+                  ))
+    finally:
+        engine.execute('DROP SCHEMA IF EXISTS {} CASCADE'.format(BENCHMARK_SCHEMA_NAME))
+        engine.dispose()
+
+
+if __name__ == '__main__':
+    main()
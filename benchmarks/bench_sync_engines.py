@@ -0,0 +1,183 @@
+"""Compares the threaded sync engine with the async one, for growing numbers of updaters.
+
+Every updater synchronises its own synthetic corpus into the in-process fake elasticsearch.
+Page reads and bulk requests wait for a fixed time each, standing in for the database and
+the cluster, so that the engines are compared on how they overlap I/O and what they cost
+on top of it.
+
+    source environment.sh && python -m benchmarks.bench_sync_engines --updaters 2 10 50
+"""
+import argparse
+import asyncio
+import bisect
+from datetime import datetime
+import threading
+import time
+
+from elasticsearch.helpers import expand_action  # type: ignore
+
+from config import CONFIG_DICT
+from benchmarks.fake_elasticsearch import FakeElasticsearch
+from benchmarks.synthetic_data import generate_titles
+from service import async_engine, es_utils, synchroniser
+from service.updaters.property_by_address_updater_v1 import PropertyByAddressUpdaterV1
+
+BENCHMARK_INDEX_NAME = 'bench_sync_engines'
+DOC_TYPE = 'property_by_address'
+
+
+class SlowFakeElasticsearch(FakeElasticsearch):
+    """Fake elasticsearch taking a while over each bulk request, without holding the GIL"""
+
+    def __init__(self, bulk_latency_secs):
+        super().__init__()
+        self._bulk_latency_secs = bulk_latency_secs
+
+    def bulk(self, body, index=None, doc_type=None, params=None):
+        time.sleep(self._bulk_latency_secs)
+        return super().bulk(body, index, doc_type, params)
+
+
+class SyntheticSource():
+    """Titles of one updater, read page by page after a cursor"""
+
+    def __init__(self, title_count, seed):
+        self._titles = list(generate_titles(title_count, seed=seed))
+        self._keys = [(title.last_modified, title.title_number) for title in self._titles]
+
+    def get_page(self, last_modified, last_title_number, page_size):
+        start = bisect.bisect_right(self._keys, (last_modified, last_title_number))
+        return self._titles[start:start + page_size]
+
+
+def create_updaters(updater_count, title_count):
+    updaters = []
+
+    for number in range(updater_count):
+        updater = PropertyByAddressUpdaterV1(BENCHMARK_INDEX_NAME, DOC_TYPE)
+        updater.id = 'bench-updater-{}'.format(number)
+        updater.versioned_writes = True
+        updater.last_title_modification_date = datetime.min
+        updater.last_updated_title_number = ''
+        updaters.append((updater, SyntheticSource(title_count, seed=number)))
+
+    return updaters
+
+
+def run_threaded(updaters, page_size, fetch_latency_secs, bulk_latency_secs):
+    client = SlowFakeElasticsearch(bulk_latency_secs)
+    original_client = es_utils.elasticsearch_client
+    es_utils.elasticsearch_client = client
+    synchroniser.page_size = page_size
+
+    for updater, source in updaters:
+        updater.get_next_source_data_page = _get_threaded_page_reader(
+            updater, source, fetch_latency_secs
+        )
+
+    threads = [
+        threading.Thread(target=synchroniser.synchronise_index_with_source, args=(updater,))
+        for updater, source in updaters
+    ]
+
+    try:
+        for thread in threads:
+            thread.start()
+
+        peak_thread_count = threading.active_count()
+
+        for thread in threads:
+            thread.join()
+    finally:
+        es_utils.elasticsearch_client = original_client
+
+    return client, peak_thread_count
+
+
+def run_async(updaters, page_size, fetch_latency_secs, bulk_latency_secs):
+    client = FakeElasticsearch()
+    sources = {updater.id: source for updater, source in updaters}
+
+    async def fetch_page(index_updater, page_size):
+        await asyncio.sleep(fetch_latency_secs)
+        return sources[index_updater.id].get_page(
+            index_updater.last_title_modification_date,
+            index_updater.last_updated_title_number,
+            page_size,
+        )
+
+    async def execute_bulk(elasticsearch_actions, elasticsearch_uri):
+        await asyncio.sleep(bulk_latency_secs)
+        bulk_body = []
+
+        for action in elasticsearch_actions:
+            action_line, data = expand_action(action)
+            bulk_body.append(action_line)
+            if data is not None:
+                bulk_body.append(data)
+
+        return async_engine.get_bulk_result(client.bulk(bulk_body))
+
+    engine = async_engine.AsyncSyncEngine(
+        fetch_page, execute_bulk, page_size=page_size,
+        # the same limit as the threaded engine's bulk budget
+        max_concurrent_fetches=len(updaters),
+        max_concurrent_bulks=CONFIG_DICT['BULK_MAX_CONCURRENCY'],
+    )
+    engine.start()
+
+    try:
+        futures = [engine.submit(updater) for updater, source in updaters]
+        peak_thread_count = threading.active_count()
+
+        for future in futures:
+            future.result()
+    finally:
+        engine.stop()
+
+    return client, peak_thread_count
+
+
+def _get_threaded_page_reader(updater, source, fetch_latency_secs):
+    def get_next_source_data_page(page_size, backfill_lane=None):
+        time.sleep(fetch_latency_secs)
+        return source.get_page(
+            updater.last_title_modification_date, updater.last_updated_title_number, page_size
+        )
+
+    return get_next_source_data_page
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument('--updaters', type=int, nargs='+', default=[2, 10, 50])
+    parser.add_argument('--titles', type=int, default=2000, help='titles per updater')
+    parser.add_argument('--page-size', type=int, default=100)
+    parser.add_argument('--fetch-latency-ms', type=float, default=5)
+    parser.add_argument('--bulk-latency-ms', type=float, default=20)
+    args = parser.parse_args()
+
+    print('titles per updater={} page_size={} fetch latency={}ms bulk latency={}ms'.format(
+        args.titles, args.page_size, args.fetch_latency_ms, args.bulk_latency_ms
+    ))
+
+    for updater_count in args.updaters:
+        for engine_name, run_engine in [('threaded', run_threaded), ('async', run_async)]:
+            updaters = create_updaters(updater_count, args.titles)
+            start, cpu_start = time.perf_counter(), time.process_time()
+            client, peak_thread_count = run_engine(
+                updaters, args.page_size,
+                args.fetch_latency_ms / 1000, args.bulk_latency_ms / 1000,
+            )
+            elapsed, cpu_secs = time.perf_counter() - start, time.process_time() - cpu_start
+            documents = client.count()
+
+            print('updaters={:<3} {:<9} {:8.3f}s  cpu {:7.3f}s  {:9.0f} docs/s  '
+                  'threads: {:<3} documents: {}'.format(
+                      updater_count, engine_name, elapsed, cpu_secs, documents / elapsed,
+                      peak_thread_count, documents
+                  ))
+
+
+if __name__ == '__main__':
+    main()
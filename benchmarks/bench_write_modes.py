@@ -0,0 +1,84 @@
+"""Compares doc_as_upsert updates with externally versioned index operations.
+
+Each mode loads a synthetic corpus and then replays the same pages, as happens when
+an updater re-reads a page after a failure. Runs against the in-process fake
+elasticsearch unless --local-es is given, in which case ELASTICSEARCH_URI is used.
+
+    source environment.sh && python -m benchmarks.bench_write_modes --titles 20000
+"""
+import argparse
+import time
+
+from elasticsearch.helpers import bulk  # type: ignore
+
+from benchmarks.fake_elasticsearch import FakeElasticsearch
+from benchmarks.synthetic_data import generate_titles
+from service import es_utils
+from service.updaters.property_by_address_updater_v1 import PropertyByAddressUpdaterV1
+
+BENCHMARK_INDEX_NAME = 'bench_write_modes'
+DOC_TYPE = 'property_by_address'
+
+
+def run_pass(client, updater, titles, page_size):
+    start = time.perf_counter()
+    rejected = 0
+
+    for page_start in range(0, len(titles), page_size):
+        page = titles[page_start:page_start + page_size]
+        actions = [
+            action for title in page for action in updater.prepare_elasticsearch_actions(title)
+        ]
+        success_count, errors = bulk(client, actions, chunk_size=page_size)
+        rejected += len([error for error in errors if es_utils.is_version_conflict(error)])
+
+    return time.perf_counter() - start, rejected
+
+
+def run_mode(client, versioned_writes, titles, page_size, replays):
+    updater = PropertyByAddressUpdaterV1(BENCHMARK_INDEX_NAME, DOC_TYPE)
+    updater.versioned_writes = versioned_writes
+    results = [run_pass(client, updater, titles, page_size)]
+
+    for _ in range(replays):
+        results.append(run_pass(client, updater, titles, page_size))
+
+    return results
+
+
+def _get_client(use_local_es):
+    if not use_local_es:
+        return FakeElasticsearch()
+
+    client = es_utils.elasticsearch_client
+    client.indices.delete(index=BENCHMARK_INDEX_NAME, ignore=[404])
+    return client
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument('--titles', type=int, default=10000)
+    parser.add_argument('--page-size', type=int, default=100)
+    parser.add_argument('--replays', type=int, default=2)
+    parser.add_argument('--local-es', action='store_true')
+    args = parser.parse_args()
+
+    titles = list(generate_titles(args.titles))
+    target = 'local elasticsearch' if args.local_es else 'fake elasticsearch'
+    print('titles={} page_size={} target={}'.format(args.titles, args.page_size, target))
+
+    for mode_name, versioned_writes in [('upsert', False), ('versioned index', True)]:
+        client = _get_client(args.local_es)
+        results = run_mode(client, versioned_writes, titles, args.page_size, args.replays)
+
+        for pass_number, (elapsed, rejected) in enumerate(results):
+            print('{:<16} pass {}  {:8.3f}s  {:9.0f} docs/s  rejected as stale: {}'.format(
+                mode_name, pass_number, elapsed, len(titles) / elapsed, rejected
+            ))
+
+    if args.local_es:
+        es_utils.elasticsearch_client.indices.delete(index=BENCHMARK_INDEX_NAME, ignore=[404])
+
+
+if __name__ == '__main__':
+    main()
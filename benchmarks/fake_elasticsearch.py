@@ -0,0 +1,92 @@
+import copy
+import json
+import threading
+
+
+class FakeElasticsearch():
+    """In-process stand-in for the parts of the elasticsearch client the service uses.
+
+    Bulk bodies go through a JSON round trip, like they would over HTTP, and update operations
+    fetch, parse and merge the stored source the way elasticsearch does for doc_as_upsert.
+    """
+
+    def __init__(self):
+        self._documents = {}
+        self._lock = threading.Lock()
+        self.bulk_request_count = 0
+        self.bulk_bytes = 0
+
+    def bulk(self, body, index=None, doc_type=None, params=None):
+        payload = '\n'.join(json.dumps(line) for line in body) + '\n'
+        lines = [json.loads(line) for line in payload.splitlines()]
+
+        with self._lock:
+            self.bulk_request_count += 1
+            self.bulk_bytes += len(payload.encode())
+            items = []
+            position = 0
+
+            while position < len(lines):
+                (op_type, metadata), = lines[position].items()
+                position += 1
+                data = None
+
+                if op_type != 'delete':
+                    data = lines[position]
+                    position += 1
+
+                items.append({op_type: self._execute(op_type, metadata, data)})
+
+        return {'took': 1, 'errors': False, 'items': items}
+
+    def get_source(self, index, doc_type, id):
+        version, source = self._documents[(index, doc_type, id)]
+        return json.loads(source)
+
+    def count(self, index=None, doc_type=None):
+        return len([
+            key for key in self._documents
+            if (index is None or key[0] == index) and (doc_type is None or key[1] == doc_type)
+        ])
+
+    def _execute(self, op_type, metadata, data):
+        key = (metadata['_index'], metadata['_type'], metadata['_id'])
+        result = dict(metadata)
+        existing = self._documents.get(key)
+
+        if op_type == 'delete':
+            if existing is None:
+                result['status'] = 404
+            elif self._is_stale(metadata, existing):
+                result['status'] = 409
+            else:
+                del self._documents[key]
+                result['status'] = 200
+        elif op_type == 'index':
+            if existing is not None and self._is_stale(metadata, existing):
+                result['status'] = 409
+            else:
+                version = metadata.get('_version', existing[0] + 1 if existing else 1)
+                self._documents[key] = (version, json.dumps(data))
+                result['status'] = 200 if existing else 201
+        elif op_type == 'update':
+            if existing is None:
+                source = data['doc']
+                version = 1
+            else:
+                source = json.loads(existing[1])
+                source.update(copy.deepcopy(data['doc']))
+                version = existing[0] + 1
+
+            self._documents[key] = (version, json.dumps(source))
+            result['status'] = 200 if existing else 201
+        else:
+            raise ValueError('Unsupported bulk operation: {}'.format(op_type))
+
+        return result
+
+    def _is_stale(self, metadata, existing):
+        return (
+            metadata.get('_version_type') == 'external' and
+            metadata['_version'] <= existing[0]
+        )
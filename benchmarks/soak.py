@@ -0,0 +1,298 @@
+"""Soak test - runs the sync manager with its real scheduler for hours of simulated time and
+fails when memory, threads or lag keep growing.
+
+Simulated time runs --speedup times faster than real time, and so does the polling interval.
+Every updater reads from a synthetic source that keeps receiving new titles at --titles-per-sec
+of simulated time, going round a pool of --title-pool titles so that the in-process fake
+elasticsearch stops growing once the pool is indexed. Nothing of the source is kept in memory -
+titles are built from their position in it.
+
+Every --window-secs (real time), the harness takes a tracemalloc snapshot, reads the RSS and
+counts threads, titles read, and the sync lag - how far, in simulated seconds, the
+slowest updater's cursor is behind the source. After --warm-up-windows, the trend of each is
+fitted with a least-squares line over simulated hours, and the run fails (exit status 1) when a
+slope is steeper than allowed. The allocations that grew most are listed either way.
+
+    source environment.sh && python -m benchmarks.soak --hours 6 --speedup 360
+"""
+import argparse
+from collections import namedtuple
+from datetime import datetime, timedelta
+import os
+import random
+import resource
+import sys
+import threading
+import time
+import tracemalloc
+
+from benchmarks.fake_elasticsearch import FakeElasticsearch
+from benchmarks.synthetic_data import STREETS, TOWNS, SyntheticTitle
+from service import bulk_backpressure, es_utils, sync_manager
+from service.updaters.property_by_address_updater_v1 import PropertyByAddressUpdaterV1
+
+SOAK_INDEX_NAME = 'soak'
+DOC_TYPE = 'property_by_address'
+SOURCE_START = datetime(2015, 1, 1)
+TOP_ALLOCATION_COUNT = 10
+DELETED_RATIO = 0.01
+
+Sample = namedtuple('Sample', [
+    'simulated_hours', 'traced_bytes', 'rss_bytes', 'thread_count', 'titles_per_sec',
+    'lag_secs', 'bulk_latency_ms',
+])
+
+# sample field, allowed growth per simulated hour argument, unit
+TRENDS = [
+    ('traced_bytes', 'max_traced_kb_per_hour', 1024),
+    ('rss_bytes', 'max_rss_kb_per_hour', 1024),
+    ('thread_count', 'max_threads_per_hour', 1),
+    ('lag_secs', 'max_lag_secs_per_hour', 1),
+    ('bulk_latency_ms', 'max_bulk_latency_ms_per_hour', 1),
+]
+
+
+class SimulatedClock():
+
+    def __init__(self, speedup):
+        self.speedup = speedup
+        self._real_start = time.monotonic()
+
+    @property
+    def elapsed_secs(self):
+        return (time.monotonic() - self._real_start) * self.speedup
+
+    def now(self):
+        return SOURCE_START + timedelta(seconds=self.elapsed_secs)
+
+
+class GrowingSource():
+    """Titles arriving at a steady rate of simulated time. The title at position n is modified
+    n / titles_per_sec seconds after SOURCE_START and reuses a title number of the pool."""
+
+    def __init__(self, clock, titles_per_sec, title_pool, seed):
+        self._clock = clock
+        self._micros_between_titles = max(1, int(1000000 / titles_per_sec))
+        self._title_pool = title_pool
+        self._seed = seed
+        self.titles_read = 0
+
+    def get_page(self, last_modified, page_size):
+        first_position = self._get_position(last_modified) + 1
+        available_count = int(self._clock.elapsed_secs * 1000000 / self._micros_between_titles)
+        last_position = min(first_position + page_size, available_count)
+        self.titles_read += max(last_position - first_position, 0)
+        return [self._create_title(position) for position in range(first_position, last_position)]
+
+    def get_latest_modification_date(self):
+        available_count = int(self._clock.elapsed_secs * 1000000 / self._micros_between_titles)
+        return self._get_last_modified(max(available_count - 1, 0))
+
+    def _get_position(self, last_modified):
+        title_interval = timedelta(microseconds=self._micros_between_titles)
+        return (last_modified - SOURCE_START) // title_interval
+
+    def _get_last_modified(self, position):
+        return SOURCE_START + timedelta(microseconds=position * self._micros_between_titles)
+
+    def _create_title(self, position):
+        # a title number always has the same address, so its documents are replaced in place
+        title_slot = position % self._title_pool
+        rng = random.Random(self._seed * 1000003 + title_slot)
+        postcode = 'PL{} {}AB'.format(rng.randint(1, 20), rng.randint(1, 9))
+        register_data = {
+            'address': {
+                'house_no': str(rng.randint(1, 250)),
+                'address_string': '{} {}, {} ({})'.format(
+                    rng.randint(1, 250), rng.choice(STREETS), rng.choice(TOWNS), postcode
+                ),
+                'postcode': postcode,
+            }
+        }
+
+        return SyntheticTitle(
+            'SOAK{:07d}'.format(title_slot),
+            register_data,
+            self._get_last_modified(position),
+            random.Random(position).random() < DELETED_RATIO,
+        )
+
+
+def create_updaters(updater_count, clock, titles_per_sec, title_pool):
+    updaters = []
+
+    for number in range(updater_count):
+        updater = PropertyByAddressUpdaterV1('{}-{}'.format(SOAK_INDEX_NAME, number), DOC_TYPE)
+        updater.id = 'soak-updater-{}'.format(number)
+        updater.versioned_writes = True
+        # just before the first title, so that the status isn't loaded from the index
+        updater.last_title_modification_date = SOURCE_START - timedelta(microseconds=1)
+        updater.last_updated_title_number = ''
+        source = GrowingSource(clock, titles_per_sec, title_pool, seed=number)
+        updater.get_next_source_data_page = _get_page_reader(updater, source)
+        updaters.append((updater, source))
+
+    return updaters
+
+
+def _get_page_reader(updater, source):
+    def get_next_source_data_page(page_size, backfill_lane=None):
+        return source.get_page(updater.last_title_modification_date, page_size)
+
+    return get_next_source_data_page
+
+
+def get_rss_bytes():
+    """Resident set size of this process - the peak RSS where /proc isn't available"""
+    try:
+        with open('/proc/self/statm', 'rt') as statm_file:
+            return int(statm_file.read().split()[1]) * os.sysconf('SC_PAGE_SIZE')
+    except (IOError, OSError):
+        return resource.getrusage(resource.RUSAGE_SELF).ru_maxrss * 1024
+
+
+def get_slope(xs, ys):
+    """Slope of the least-squares line through the points"""
+    count = len(xs)
+    mean_x, mean_y = sum(xs) / count, sum(ys) / count
+    variance = sum((x - mean_x) ** 2 for x in xs)
+
+    if not variance:
+        return 0.0
+
+    return sum((x - mean_x) * (y - mean_y) for x, y in zip(xs, ys)) / variance
+
+
+def run_soak(updaters, clock, hours, polling_interval_secs, window_secs, client):
+    """Runs the sync manager's scheduled synchronisation until the simulated hours have passed.
+    Returns the samples taken and the first and last tracemalloc snapshots."""
+    sync_manager._index_updaters = [updater for updater, source in updaters]
+    sync_manager._updater_statuses = {
+        updater.id: sync_manager.UPDATER_STATUS_IDLE for updater, source in updaters
+    }
+    sync_manager._polling_interval_in_secs = polling_interval_secs / clock.speedup
+    samples, snapshots = [], []
+    sync_manager._schedule_data_synchronisation()
+
+    try:
+        window_start, window_titles_read = time.monotonic(), 0
+
+        while clock.elapsed_secs < hours * 3600:
+            time.sleep(window_secs)
+            snapshot = tracemalloc.take_snapshot()
+            snapshots = [snapshots[0], snapshot] if snapshots else [snapshot]
+            now = time.monotonic()
+            titles_read = sum(source.titles_read for updater, source in updaters)
+            budget = bulk_backpressure.find_budget(client)
+
+            samples.append(Sample(
+                simulated_hours=clock.elapsed_secs / 3600,
+                traced_bytes=tracemalloc.get_traced_memory()[0],
+                rss_bytes=get_rss_bytes(),
+                thread_count=threading.active_count(),
+                titles_per_sec=(titles_read - window_titles_read) / (now - window_start),
+                lag_secs=max(
+                    (source.get_latest_modification_date() - updater.last_title_modification_date)
+                    .total_seconds() for updater, source in updaters
+                ),
+                bulk_latency_ms=(budget.latency_ms or 0.0) if budget else 0.0,
+            ))
+            window_start, window_titles_read = now, titles_read
+            print_sample(samples[-1])
+    finally:
+        sync_manager.scheduler.shutdown(wait=True)
+
+    return samples, snapshots
+
+
+def print_sample(sample):
+    print('{:7.2f}h  traced {:9.0f} KB  rss {:9.0f} KB  threads {:3}  {:8.0f} titles/s  '
+          'lag {:8.1f}s  bulk {:6.1f}ms'.format(
+              sample.simulated_hours, sample.traced_bytes / 1024, sample.rss_bytes / 1024,
+              sample.thread_count, sample.titles_per_sec, sample.lag_secs,
+              sample.bulk_latency_ms,
+          ))
+    sys.stdout.flush()
+
+
+def check_trends(samples, args):
+    """Names of the trends steeper than allowed, printing all of them"""
+    xs = [sample.simulated_hours for sample in samples]
+    failed_trends = []
+
+    for field, limit_argument, unit in TRENDS:
+        slope = get_slope(xs, [getattr(sample, field) for sample in samples]) / unit
+        limit = getattr(args, limit_argument)
+        failed = slope > limit
+        print('{:<16} {:12.2f} per hour (limit {}){}'.format(
+            field, slope, limit, '  FAILED' if failed else ''
+        ))
+
+        if failed:
+            failed_trends.append(field)
+
+    throughput_slope = get_slope(xs, [sample.titles_per_sec for sample in samples])
+    print('{:<16} {:12.2f} per hour'.format('titles_per_sec', throughput_slope))
+    return failed_trends
+
+
+def print_top_allocation_growth(first_snapshot, last_snapshot):
+    print('Allocations that grew most:')
+
+    for statistic in last_snapshot.compare_to(first_snapshot, 'lineno')[:TOP_ALLOCATION_COUNT]:
+        print('  {}'.format(statistic))
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument('--hours', type=float, default=6, help='simulated hours to run for')
+    parser.add_argument('--speedup', type=float, default=360,
+                        help='simulated seconds per real second')
+    parser.add_argument('--updaters', type=int, default=2)
+    parser.add_argument('--titles-per-sec', type=float, default=2,
+                        help='new titles per simulated second, for each updater')
+    parser.add_argument('--title-pool', type=int, default=2000,
+                        help='distinct title numbers of each source')
+    parser.add_argument('--polling-interval-secs', type=float, default=60,
+                        help='polling interval, in simulated seconds')
+    parser.add_argument('--window-secs', type=float, default=5,
+                        help='real seconds between samples')
+    parser.add_argument('--warm-up-windows', type=int, default=3,
+                        help='samples left out of the trends')
+    parser.add_argument('--max-traced-kb-per-hour', type=float, default=256)
+    parser.add_argument('--max-rss-kb-per-hour', type=float, default=2048)
+    parser.add_argument('--max-threads-per-hour', type=float, default=0.5)
+    parser.add_argument('--max-lag-secs-per-hour', type=float, default=60)
+    parser.add_argument('--max-bulk-latency-ms-per-hour', type=float, default=5)
+    args = parser.parse_args()
+
+    client = FakeElasticsearch()
+    es_utils.elasticsearch_client = client
+    clock = SimulatedClock(args.speedup)
+    updaters = create_updaters(args.updaters, clock, args.titles_per_sec, args.title_pool)
+    tracemalloc.start()
+
+    print('{} simulated hour(s) at {}x: updaters={} titles/s={} pool={} polling every {}s'.format(
+        args.hours, args.speedup, args.updaters, args.titles_per_sec, args.title_pool,
+        args.polling_interval_secs,
+    ))
+    samples, snapshots = run_soak(
+        updaters, clock, args.hours, args.polling_interval_secs, args.window_secs, client
+    )
+    trend_samples = samples[args.warm_up_windows:]
+
+    if len(trend_samples) < 2:
+        print('Not enough samples after the warm-up to fit trends - run for longer')
+        sys.exit(2)
+
+    failed_trends = check_trends(trend_samples, args)
+    print_top_allocation_growth(*snapshots)
+    print('documents: {}'.format(client.count()))
+
+    if failed_trends:
+        print('FAILED: {} grew faster than allowed'.format(', '.join(failed_trends)))
+        sys.exit(1)
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,40 @@
+from collections import namedtuple
+from datetime import datetime, timedelta
+import random
+
+SyntheticTitle = namedtuple(
+    'SyntheticTitle', ['title_number', 'register_data', 'last_modified', 'is_deleted']
+)
+
+STREETS = ['HIGH STREET', 'CHURCH ROAD', 'STATION ROAD', 'MILL LANE', 'THE GREEN', 'PARK AVENUE']
+TOWNS = ['PLYMOUTH', 'LONDON', 'GLOUCESTER', 'DURHAM', 'CROYDON', 'SWANSEA']
+POSTCODE_LETTERS = 'ABDEFGHJLNPQRSTUWXYZ'
+
+
+def generate_titles(count, start=datetime(2015, 1, 1), seed=0, deleted_ratio=0.0):
+    """Yields titles ordered the way the page reader returns them"""
+    rng = random.Random(seed)
+
+    for number in range(count):
+        house_no = str(rng.randint(1, 250))
+        postcode = '{}{} {}{}{}'.format(
+            rng.choice(['PL', 'SW', 'GL', 'DH', 'CR', 'SA']), rng.randint(1, 20),
+            rng.randint(1, 9), rng.choice(POSTCODE_LETTERS), rng.choice(POSTCODE_LETTERS)
+        )
+        address_string = '{} {}, {} ({})'.format(
+            house_no, rng.choice(STREETS), rng.choice(TOWNS), postcode
+        )
+        register_data = {
+            'address': {
+                'house_no': house_no,
+                'address_string': address_string,
+                'postcode': postcode,
+            }
+        }
+
+        yield SyntheticTitle(
+            'BNC{:07d}'.format(number),
+            register_data,
+            start + timedelta(milliseconds=number),
+            rng.random() < deleted_ratio,
+        )
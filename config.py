@@ -12,6 +12,114 @@ CONFIG_DICT = {
     'ELASTICSEARCH_URI': os.environ['ELASTICSEARCH_URI'],
     'PAGE_SIZE': int(os.environ['PAGE_SIZE']),
     'POLLING_INTERVAL_SECS': int(os.environ['POLLING_INTERVAL_SECS']),
+    # Optional read replica for source pages - pages are read from the primary database when it's
+    # not set, can't be reached or lags behind by more than REPLICA_MAX_LAG_SECS
+    'READ_REPLICA_DATABASE_URI': os.environ.get('READ_REPLICA_DATABASE_URI', ''),
+    'REPLICA_MAX_LAG_SECS': int(os.environ.get('REPLICA_MAX_LAG_SECS', 60)),
+    'REPLICA_SAFETY_MARGIN_SECS': int(os.environ.get('REPLICA_SAFETY_MARGIN_SECS', 5)),
+    # Connection pools of the source database and the read replica (see service.database.engines).
+    # With DEDICATED_PAGE_CONNECTIONS, every sync worker holds a connection of each pool it reads
+    # pages from for as long as it synchronises, so the pools need room for all updaters at once.
+    # Connections are tested on checkout with DB_POOL_PRE_PING and replaced once they're older
+    # than DB_POOL_RECYCLE_SECS (-1 for never).
+    'DB_POOL_SIZE': int(os.environ.get('DB_POOL_SIZE', 5)),
+    'DB_MAX_OVERFLOW': int(os.environ.get('DB_MAX_OVERFLOW', 10)),
+    'DB_POOL_PRE_PING': os.environ.get('DB_POOL_PRE_PING', 'true').lower() == 'true',
+    'DB_POOL_RECYCLE_SECS': int(os.environ.get('DB_POOL_RECYCLE_SECS', 3600)),
+    'DEDICATED_PAGE_CONNECTIONS': (
+        os.environ.get('DEDICATED_PAGE_CONNECTIONS', 'true').lower() == 'true'
+    ),
+    # 'embedded' synchronises in the web server's process, 'external' in a process of its own
+    # (python -m service.sync_process), whose status the web workers read from the status file.
+    # With SYNC_PROCESS_MANAGED, the gunicorn master runs the sync process itself.
+    'SYNC_MODE': os.environ.get('SYNC_MODE', 'embedded'),
+    'SYNC_STATUS_FILE_PATH': os.environ.get(
+        'SYNC_STATUS_FILE_PATH', '/tmp/elasticsearch-updater-sync-status.json'
+    ),
+    'SYNC_STATUS_INTERVAL_SECS': int(os.environ.get('SYNC_STATUS_INTERVAL_SECS', 5)),
+    'SYNC_COMMAND_DIR': os.environ.get(
+        'SYNC_COMMAND_DIR', '/tmp/elasticsearch-updater-sync-commands'
+    ),
+    'SYNC_PROCESS_MANAGED': os.environ.get('SYNC_PROCESS_MANAGED', 'false').lower() == 'true',
+    'SYNC_PROCESS_RESTART_DELAY_SECS': int(os.environ.get('SYNC_PROCESS_RESTART_DELAY_SECS', 5)),
+    'SYNC_PROCESS_STOP_TIMEOUT_SECS': int(os.environ.get('SYNC_PROCESS_STOP_TIMEOUT_SECS', 30)),
+    # On shutdown, how long synchronisations have to finish the page they're on - less than
+    # SYNC_PROCESS_STOP_TIMEOUT_SECS and gunicorn's graceful timeout, which kill the process
+    'SHUTDOWN_TIMEOUT_SECS': int(os.environ.get('SHUTDOWN_TIMEOUT_SECS', 20)),
+    # gunicorn's worker timeout - a worker busy with a request for longer is killed
+    'WORKER_TIMEOUT_SECS': int(os.environ.get('WORKER_TIMEOUT_SECS', 30)),
+    # 'threaded' runs each updater on its own thread, 'async' runs all of them on one event loop
+    # (requires asyncpg and aiohttp)
+    'SYNC_ENGINE': os.environ.get('SYNC_ENGINE', 'threaded'),
+    'ASYNC_MAX_CONCURRENT_FETCHES': int(os.environ.get('ASYNC_MAX_CONCURRENT_FETCHES', 5)),
+    'ASYNC_MAX_CONCURRENT_BULKS': int(os.environ.get('ASYNC_MAX_CONCURRENT_BULKS', 8)),
+    # Distribution of updaters across service instances with leases kept in the source database.
+    # When disabled, every instance runs all updaters. The instance ID defaults to
+    # <hostname>-<pid>-<random suffix>.
+    'LEASES_ENABLED': os.environ.get('LEASES_ENABLED', 'false').lower() == 'true',
+    'LEASE_TTL_SECS': int(os.environ.get('LEASE_TTL_SECS', 30)),
+    'LEASE_REFRESH_INTERVAL_SECS': int(os.environ.get('LEASE_REFRESH_INTERVAL_SECS', 10)),
+    'LEASE_INSTANCE_ID': os.environ.get('LEASE_INSTANCE_ID', ''),
+    # Upper bounds of what's held in memory at once when streaming a page to elasticsearch
+    'READ_BATCH_SIZE': int(os.environ.get('READ_BATCH_SIZE', 100)),
+    'BULK_CHUNK_SIZE': int(os.environ.get('BULK_CHUNK_SIZE', 500)),
+    # Backpressure against bulk rejections - limits of each cluster's shared bulk budget, which
+    # starts at BULK_CHUNK_SIZE actions per request and BULK_MAX_CONCURRENCY requests in flight,
+    # counted over all the writers to the cluster - each sends its own chunks one at a time
+    'BULK_MIN_CHUNK_SIZE': int(os.environ.get('BULK_MIN_CHUNK_SIZE', 50)),
+    'BULK_MAX_CHUNK_SIZE': int(os.environ.get('BULK_MAX_CHUNK_SIZE', 2000)),
+    'BULK_CHUNK_SIZE_STEP': int(os.environ.get('BULK_CHUNK_SIZE_STEP', 50)),
+    'BULK_MAX_CONCURRENCY': int(os.environ.get('BULK_MAX_CONCURRENCY', 8)),
+    'BULK_TARGET_LATENCY_MS': int(os.environ.get('BULK_TARGET_LATENCY_MS', 2000)),
+    'BULK_MAX_RETRIES': int(os.environ.get('BULK_MAX_RETRIES', 5)),
+    'BULK_RETRY_BACKOFF_MS': int(os.environ.get('BULK_RETRY_BACKOFF_MS', 200)),
+    # combines the bulk requests of all writers to a cluster (see service.bulk_coalescer)
+    'BULK_COALESCING_ENABLED': (
+        os.environ.get('BULK_COALESCING_ENABLED', 'false').lower() == 'true'
+    ),
+    'BULK_COALESCE_MAX_WAIT_MS': int(os.environ.get('BULK_COALESCE_MAX_WAIT_MS', 50)),
+    # loads empty indexes with a single COPY of the source table, before paging on from there
+    # (see service.database.copy_reader) - for updaters without write targets or dual lanes
+    'COPY_BOOTSTRAP_ENABLED': os.environ.get('COPY_BOOTSTRAP_ENABLED', 'false').lower() == 'true',
+    # drops deletes of documents never written, with a Bloom filter of each index's document IDs
+    # (see service.id_filter) - for updaters without write targets
+    'DELETE_FILTER_ENABLED': os.environ.get('DELETE_FILTER_ENABLED', 'false').lower() == 'true',
+    'DELETE_FILTER_FALSE_POSITIVE_RATE': float(
+        os.environ.get('DELETE_FILTER_FALSE_POSITIVE_RATE', 0.01)
+    ),
+    'DELETE_FILTER_MIN_CAPACITY': int(os.environ.get('DELETE_FILTER_MIN_CAPACITY', 1000000)),
+    'DELETE_FILTER_SCROLL_SIZE': int(os.environ.get('DELETE_FILTER_SCROLL_SIZE', 1000)),
+    # Reconciliation of indexes with the source - throttled to a number of titles per second (0 for
+    # no limit). The admin endpoints, starting and cancelling reconciliations, are disabled when no
+    # token is set.
+    'RECONCILE_TITLES_PER_SEC': int(os.environ.get('RECONCILE_TITLES_PER_SEC', 1000)),
+    'RECONCILE_SCROLL_SIZE': int(os.environ.get('RECONCILE_SCROLL_SIZE', 500)),
+    # Migration of indexes to compact document IDs - documents scrolled and moved at a time
+    'ID_MIGRATION_BATCH_SIZE': int(os.environ.get('ID_MIGRATION_BATCH_SIZE', 500)),
+    # Quarantine of titles the updaters fail on, instead of failing their pages - retried after an
+    # interval (0 for no retries), and no more than the given number per updater
+    'QUARANTINE_ENABLED': os.environ.get('QUARANTINE_ENABLED', 'false').lower() == 'true',
+    'QUARANTINE_RETRY_INTERVAL_SECS': int(os.environ.get('QUARANTINE_RETRY_INTERVAL_SECS', 3600)),
+    'QUARANTINE_MAX_TITLES': int(os.environ.get('QUARANTINE_MAX_TITLES', 1000)),
+    'ADMIN_TOKEN': os.environ.get('ADMIN_TOKEN', ''),
+    # Recording of source pages and/or prepared actions, for replays - disabled when no directory
+    'RECORDING_DIR': os.environ.get('RECORDING_DIR', ''),
+    'RECORD_PAGES': os.environ.get('RECORD_PAGES', 'false').lower() == 'true',
+    'RECORD_ACTIONS': os.environ.get('RECORD_ACTIONS', 'false').lower() == 'true',
+    'RECORDING_SEGMENT_MAX_BYTES': int(os.environ.get('RECORDING_SEGMENT_MAX_BYTES', 64000000)),
+    # the oldest segments of each updater and record type beyond this are removed (0 for no limit)
+    'RECORDING_MAX_SEGMENTS': int(os.environ.get('RECORDING_MAX_SEGMENTS', 100)),
+    # Profiling of sync threads - the endpoint is disabled when no token is set and the signal
+    # handler when no output directory is set. The endpoint samples within the request, so its
+    # profiles are also kept PROFILING_TIMEOUT_MARGIN_SECS below WORKER_TIMEOUT_SECS.
+    'PROFILING_TOKEN': os.environ.get('PROFILING_TOKEN', ''),
+    'PROFILING_MAX_SECS': int(os.environ.get('PROFILING_MAX_SECS', 20)),
+    'PROFILING_TIMEOUT_MARGIN_SECS': int(os.environ.get('PROFILING_TIMEOUT_MARGIN_SECS', 10)),
+    'PROFILING_SAMPLE_INTERVAL_MS': int(os.environ.get('PROFILING_SAMPLE_INTERVAL_MS', 5)),
+    'PROFILING_OUTPUT_DIR': os.environ.get('PROFILING_OUTPUT_DIR', ''),
+    # the signals gunicorn uses (e.g. SIGHUP, SIGUSR1, SIGUSR2) are refused
+    'PROFILING_SIGNAL': os.environ.get('PROFILING_SIGNAL', 'SIGPROF'),
+    'PROFILING_SIGNAL_SECS': int(os.environ.get('PROFILING_SIGNAL_SECS', 30)),
 }  # type: Dict[str, Union[bool, str, int]]
 
 settings = os.environ.get('SETTINGS')
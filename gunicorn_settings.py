@@ -1,9 +1,16 @@
 import logging
-from service import logging_config
+from config import CONFIG_DICT
+from service import logging_config, sync_supervisor
 
 logging_config.setup_logging()
 LOGGER = logging.getLogger(__name__)
 
+# runs the sync process when the master manages it (see service.sync_process)
+_sync_process_supervisor = None
+
+# the profiling endpoint keeps its profiles below it (see service.server)
+timeout = CONFIG_DICT['WORKER_TIMEOUT_SECS']
+
 # Application event handlers for when the server is run by gunicorn
 
 
@@ -16,8 +23,26 @@ def on_reload(server):
 
 
 def when_ready(server):
+    global _sync_process_supervisor
+
+    if CONFIG_DICT['SYNC_MODE'] == 'external' and CONFIG_DICT['SYNC_PROCESS_MANAGED']:
+        _sync_process_supervisor = sync_supervisor.SyncProcessSupervisor()
+        _sync_process_supervisor.start()
+
     LOGGER.info("Server is ready")
 
 
+def worker_exit(server, worker):
+    # workers synchronise in embedded mode - the sync process stops on its own otherwise.
+    # Imported here, so that the master doesn't load the synchronisation.
+    from service import sync_manager, sync_process
+
+    if not sync_process.is_external():
+        sync_manager.stop()
+
+
 def on_exit(server):
     LOGGER.info("Stopping the server")
+
+    if _sync_process_supervisor:
+        _sync_process_supervisor.stop()
@@ -2,6 +2,7 @@
 import atexit
 import logging
 
+from service import sync_manager, sync_process
 from service.server import app
 
 LOGGER = logging.getLogger(__name__)
@@ -9,6 +10,9 @@ LOGGER = logging.getLogger(__name__)
 
 @atexit.register
 def handle_shutdown(*args, **kwargs):
+    if not sync_process.is_external():
+        sync_manager.stop()
+
     LOGGER.info('Stopped the server')
 
 LOGGER.info('Starting the server')
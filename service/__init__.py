@@ -1,9 +1,9 @@
 import faulthandler                   # type: ignore
 from flask import Flask               # type: ignore
-from sqlalchemy import create_engine  # type: ignore
 
 from config import CONFIG_DICT
 from service import logging_config
+from service.database.engines import create_source_engine
 
 # This causes the traceback to be written to the fault log file in case of serious faults
 fault_log_file = open(CONFIG_DICT['FAULT_LOG_FILE_PATH'], 'a')
@@ -11,5 +11,9 @@ faulthandler.enable(file=fault_log_file)
 
 app = Flask(__name__)
 app.config.update(CONFIG_DICT)
-db = create_engine(CONFIG_DICT['SQLALCHEMY_DATABASE_URI'])
+db = create_source_engine(CONFIG_DICT['SQLALCHEMY_DATABASE_URI'])
+read_replica_db = (
+    create_source_engine(CONFIG_DICT['READ_REPLICA_DATABASE_URI'])
+    if CONFIG_DICT['READ_REPLICA_DATABASE_URI'] else None
+)
 logging_config.setup_logging()
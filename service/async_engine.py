@@ -0,0 +1,363 @@
+"""asyncio-based alternative to the threaded sync engine.
+
+All updaters are synchronised as coroutines on one event loop, running on a single thread,
+instead of one thread per updater. Page reads and bulk requests are coroutines, limited by
+semaphores - one for reads, shared by all updaters, and one per elasticsearch cluster for bulk
+requests. Turning titles into actions still goes through the updaters' usual interface
+(prepare_elasticsearch_actions and get_source_filter).
+
+The I/O is pluggable: the engine is given a coroutine function reading pages and one executing
+bulk requests. By default, pages are read with asyncpg and bulk requests are sent with aiohttp.
+Both are optional dependencies, only imported when the engine is created with the defaults.
+Their connections are closed on the event loop when the engine is stopped.
+
+The engine only supports the updater's own cursor - read replicas, write targets and dual lanes
+need the threaded engine, as do the delete filter (see service.id_filter), quarantine (see
+service.quarantine) and recording (see service.recorder). Updaters are checked for them when the
+engine is set up. A page whose bulk request has errors other than stale writes fails, so the
+cursor stays before it.
+"""
+import asyncio
+from datetime import datetime, timezone
+import json
+import logging
+import threading
+
+from elasticsearch.helpers import expand_action  # type: ignore
+
+from config import CONFIG_DICT
+from service import es_utils, leases
+from service.database import indexes
+from service.database.model import TitleRecord
+from service.updaters import base as updater_base
+
+LOGGER = logging.getLogger(__name__)
+
+PAGE_SQL_TEMPLATE = (
+    'SELECT title_number, register_data, last_modified, is_deleted '
+    'FROM {table} '
+    'WHERE (last_modified, title_number) > ($1, $2){filter} '
+    'ORDER BY last_modified, title_number '
+    'LIMIT $3'
+)
+# how long stopping the engine waits for the connections of the I/O to close
+CLOSE_TIMEOUT_SECS = 5
+
+
+class AsyncSyncEngine():
+    """Synchronises updaters as coroutines on an event loop running on its own thread.
+
+    fetch_page - coroutine function taking an updater and a page size and returning the titles
+        of the updater's next page
+    execute_bulk - coroutine function taking a list of actions and an elasticsearch URI and
+        returning the number of successful actions and the errors, like the bulk helper
+    owns - function telling whether this instance still holds the lease of an updater, checked
+        before each page, when updaters are distributed with leases
+    close_io - coroutine function closing the connections of the I/O, awaited on the event loop
+        when the engine stops
+    """
+
+    def __init__(self, fetch_page, execute_bulk, page_size=None,
+                 max_concurrent_fetches=None, max_concurrent_bulks=None, owns=None,
+                 close_io=None):
+        self._fetch_page = fetch_page
+        self._execute_bulk = execute_bulk
+        self._owns = owns
+        self._close_io = close_io
+        self._page_size = page_size or CONFIG_DICT['PAGE_SIZE']
+        self._max_concurrent_fetches = (
+            max_concurrent_fetches or CONFIG_DICT['ASYNC_MAX_CONCURRENT_FETCHES']
+        )
+        self._max_concurrent_bulks = (
+            max_concurrent_bulks or CONFIG_DICT['ASYNC_MAX_CONCURRENT_BULKS']
+        )
+        self._loop = None
+        self._thread = None
+        self._fetch_semaphore = None
+        self._bulk_semaphores = {}  # type: dict
+        self._is_stop_requested = False
+
+    def start(self):
+        """Starts the event loop on its own thread"""
+        self._loop = asyncio.new_event_loop()
+        ready = threading.Event()
+
+        def run_loop():
+            asyncio.set_event_loop(self._loop)
+            self._loop.call_soon(ready.set)
+            self._loop.run_forever()
+
+        self._thread = threading.Thread(target=run_loop, name='sync-async-engine')
+        self._thread.daemon = True
+        self._thread.start()
+        ready.wait()
+
+    def request_stop(self):
+        """Has the synchronisations stop after the page they're on"""
+        self._is_stop_requested = True
+
+    def stop(self, timeout_secs=CLOSE_TIMEOUT_SECS):
+        """Closes the connections of the I/O, waiting up to timeout_secs, and stops the loop"""
+        if self._close_io is not None:
+            try:
+                asyncio.run_coroutine_threadsafe(self._close_io(), self._loop).result(timeout_secs)
+            except Exception as e:
+                LOGGER.error('Failed to close the connections of the async sync engine',
+                             exc_info=e)
+
+        self._loop.call_soon_threadsafe(self._loop.stop)
+        self._thread.join()
+        self._loop.close()
+
+    @property
+    def thread(self):
+        return self._thread
+
+    def submit(self, index_updater):
+        """Schedules the synchronisation of the updater on the event loop.
+        Returns a concurrent.futures.Future of it."""
+        return asyncio.run_coroutine_threadsafe(
+            self.synchronise_index_with_source(index_updater), self._loop
+        )
+
+    async def synchronise_index_with_source(self, index_updater):
+        LOGGER.info("Synchronising index '{}' with source data, doc type '{}', "
+                    "using updater '{}' (async)".format(
+                        index_updater.index_name, index_updater.doc_type, index_updater.id
+                    ))
+
+        sync_time = datetime.now()
+
+        try:
+            is_up_to_date_with_source = False
+
+            while not is_up_to_date_with_source and not self._is_stop_requested:
+                sync_time = datetime.now()
+                title_count = await self._populate_index_with_data_page(index_updater)
+                index_updater.last_successful_sync_time = sync_time
+                is_up_to_date_with_source = title_count < self._page_size
+
+            if is_up_to_date_with_source:
+                LOGGER.info("Updater '{}' is up to date with source data store".format(
+                    index_updater.id
+                ))
+        except Exception as e:
+            index_updater.last_unsuccessful_sync_time = sync_time
+            LOGGER.error("Updater '{}' - aborted synchronising index '{}', doc type '{}'".format(
+                index_updater.id, index_updater.index_name, index_updater.doc_type
+            ), exc_info=e)
+
+    async def _populate_index_with_data_page(self, index_updater):
+        if self._owns is not None and not self._owns(index_updater.id):
+            raise leases.LeaseLostError(
+                "Lost the lease of updater '{}' - stopping its synchronisation".format(
+                    index_updater.id
+                )
+            )
+
+        async with self._get_fetch_semaphore():
+            titles = await self._fetch_page(index_updater, self._page_size)
+
+        if not titles:
+            return 0
+
+        elasticsearch_actions = list(updater_base.stream_actions(index_updater, titles))
+
+        if elasticsearch_actions:
+            async with self._get_bulk_semaphore(CONFIG_DICT['ELASTICSEARCH_URI']):
+                _, errors = await self._execute_bulk(
+                    elasticsearch_actions, CONFIG_DICT['ELASTICSEARCH_URI']
+                )
+
+            _check_bulk_errors(index_updater, errors)
+
+        index_updater.last_title_modification_date = titles[-1].last_modified
+        index_updater.last_updated_title_number = titles[-1].title_number
+        LOGGER.info("Processed {} title(s). Updater: '{}'".format(len(titles), index_updater.id))
+        return len(titles)
+
+    # semaphores are created on the event loop that uses them
+    def _get_fetch_semaphore(self):
+        if self._fetch_semaphore is None:
+            self._fetch_semaphore = asyncio.Semaphore(self._max_concurrent_fetches)
+
+        return self._fetch_semaphore
+
+    def _get_bulk_semaphore(self, elasticsearch_uri):
+        if elasticsearch_uri not in self._bulk_semaphores:
+            self._bulk_semaphores[elasticsearch_uri] = asyncio.Semaphore(
+                self._max_concurrent_bulks
+            )
+
+        return self._bulk_semaphores[elasticsearch_uri]
+
+
+def get_page_sql(source_filter=None):
+    filter_sql = ' AND ({})'.format(source_filter.condition) if source_filter else ''
+    return PAGE_SQL_TEMPLATE.format(table=indexes.SOURCE_TABLE_NAME, filter=filter_sql)
+
+
+def get_bulk_body(elasticsearch_actions):
+    """NDJSON body of a bulk request with the given actions"""
+    lines = []
+
+    for action in elasticsearch_actions:
+        action_line, data = expand_action(action)
+        lines.append(json.dumps(action_line))
+
+        if data is not None:
+            lines.append(json.dumps(data))
+
+    return '\n'.join(lines) + '\n'
+
+
+def get_bulk_result(response_body):
+    """Number of successful actions and errors of a bulk response, like the bulk helper"""
+    success_count = 0
+    errors = []
+
+    for item in response_body['items']:
+        op_type, item_result = next(iter(item.items()))
+
+        if 200 <= item_result.get('status', 500) < 300:
+            success_count += 1
+        else:
+            errors.append({op_type: item_result})
+
+    return success_count, errors
+
+
+def create_asyncpg_page_fetcher(database_uri, max_connections):
+    """Coroutine functions reading pages with an asyncpg pool, created on first use, and closing
+    the pool"""
+    import asyncpg  # type: ignore
+
+    pool_holder = []
+    # asyncpg doesn't know SQLAlchemy's driver suffixes
+    dsn = 'postgresql://' + database_uri.split('://', 1)[1]
+
+    async def fetch_page(index_updater, page_size):
+        if not pool_holder:
+            pool_holder.append(await asyncpg.create_pool(dsn, max_size=max_connections))
+
+        rows = await pool_holder[0].fetch(
+            get_page_sql(index_updater.get_source_filter()),
+            _to_naive(index_updater.last_title_modification_date),
+            index_updater.last_updated_title_number,
+            page_size,
+        )
+
+        return [
+            TitleRecord(
+                row['title_number'],
+                json.loads(row['register_data']) if isinstance(row['register_data'], str)
+                else row['register_data'],
+                row['last_modified'],
+                row['is_deleted'],
+            )
+            for row in rows
+        ]
+
+    async def close_pool():
+        if pool_holder:
+            await pool_holder.pop().close()
+
+    return fetch_page, close_pool
+
+
+def create_aiohttp_bulk_executor():
+    """Coroutine functions sending bulk requests with an aiohttp session, created on first use,
+    and closing the session"""
+    import aiohttp  # type: ignore
+
+    session_holder = []
+
+    async def execute_bulk(elasticsearch_actions, elasticsearch_uri):
+        if not session_holder:
+            session_holder.append(aiohttp.ClientSession())
+
+        bulk_url = '{}/_bulk'.format(elasticsearch_uri.rstrip('/'))
+        async with session_holder[0].post(
+                bulk_url, data=get_bulk_body(elasticsearch_actions).encode(),
+                headers={'Content-Type': 'application/x-ndjson'}) as response:
+            response.raise_for_status()
+            return get_bulk_result(await response.json())
+
+    async def close_session():
+        if session_holder:
+            await session_holder.pop().close()
+
+    return execute_bulk, close_session
+
+
+def create_engine(owns=None):
+    """Engine reading with asyncpg and writing with aiohttp, as configured"""
+    try:
+        fetch_page, close_pool = create_asyncpg_page_fetcher(
+            CONFIG_DICT['SQLALCHEMY_DATABASE_URI'], CONFIG_DICT['ASYNC_MAX_CONCURRENT_FETCHES']
+        )
+        execute_bulk, close_session = create_aiohttp_bulk_executor()
+    except ImportError as e:
+        raise Exception('The async sync engine requires the asyncpg and aiohttp packages', e)
+
+    async def close_io():
+        try:
+            await close_pool()
+        finally:
+            await close_session()
+
+    return AsyncSyncEngine(fetch_page, execute_bulk, owns=owns, close_io=close_io)
+
+
+def validate_index_updater(index_updater):
+    """Raises an error when the updater uses features the async engine doesn't support"""
+    if (list(index_updater.write_targets) or index_updater.dual_lanes or
+            CONFIG_DICT['READ_REPLICA_DATABASE_URI']):
+        raise Exception(
+            "Updater '{}' uses write targets, dual lanes or a read replica, "
+            "which the async sync engine doesn't support".format(index_updater.id)
+        )
+
+    unsupported_settings = [
+        setting for setting in ['DELETE_FILTER_ENABLED', 'QUARANTINE_ENABLED', 'RECORDING_DIR']
+        if CONFIG_DICT[setting]
+    ]
+
+    if unsupported_settings:
+        raise Exception(
+            "The async sync engine doesn't support {} - updater '{}' can't use it".format(
+                ', '.join(unsupported_settings), index_updater.id
+            )
+        )
+
+
+def _check_bulk_errors(index_updater, errors):
+    stale_write_count = len([error for error in errors if es_utils.is_version_conflict(error)])
+
+    if stale_write_count:
+        LOGGER.info("Elasticsearch rejected {} stale write(s). Updater: '{}'".format(
+            stale_write_count, index_updater.id
+        ))
+
+    failed_actions = [
+        error for error in errors
+        if not es_utils.is_version_conflict(error) and not _is_missing_document_delete(error)
+    ]
+
+    if failed_actions:
+        raise Exception("Bulk request failed for {} action(s). Updater: '{}', errors: {}".format(
+            len(failed_actions), index_updater.id, failed_actions[:5]
+        ))
+
+
+def _is_missing_document_delete(error):
+    # the document is gone either way
+    return error.get('delete', {}).get('status') == 404
+
+
+def _to_naive(date):
+    # the source column has no time zone, which asyncpg insists on
+    if date.tzinfo is not None:
+        return date.astimezone(timezone.utc).replace(tzinfo=None)
+
+    return date
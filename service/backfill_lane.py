@@ -0,0 +1,87 @@
+"""Backfill lane of updaters synchronising in two lanes.
+
+When an updater with dual lanes enabled falls far behind its source, the titles between its
+cursor and the latest title at that moment (the high-water mark) are left to a backfill lane.
+The updater's own cursor jumps to the high-water mark and carries on tailing recent changes
+(the live lane), reading a backfill page between catching up with them. Both lanes write to the
+same index with external versions, so a backfill write never replaces a newer document. Once
+the backfill lane reaches the high-water mark, it's dropped and the updater's cursor is the
+only one left.
+
+The lane's position is kept in the updater's index, under its own doc type, because it can't
+be inferred from the indexed documents the way the updater's cursor is.
+"""
+import logging
+
+from service import date_utils, es_utils
+
+LOGGER = logging.getLogger(__name__)
+
+LANE_DOC_TYPE = 'sync_backfill_lane'
+
+LANE_MAPPING = {
+    'properties': {
+        'last_modified_micros': {'type': 'long', 'index': 'no'},
+        'last_title_number': {'type': 'string', 'index': 'no'},
+        'high_water_modified_micros': {'type': 'long', 'index': 'no'},
+        'high_water_title_number': {'type': 'string', 'index': 'no'},
+    }
+}
+
+
+class BackfillLane():
+    """Position of a backfill lane and the high-water mark it stops at"""
+
+    def __init__(self, last_title_modification_date, last_updated_title_number,
+                 high_water_modification_date, high_water_title_number):
+        self.last_title_modification_date = last_title_modification_date
+        self.last_updated_title_number = last_updated_title_number
+        self.high_water_modification_date = high_water_modification_date
+        self.high_water_title_number = high_water_title_number
+
+    def to_dict(self):
+        return {
+            'last_modified_micros': date_utils.to_epoch_micros(self.last_title_modification_date),
+            'last_title_number': self.last_updated_title_number,
+            'high_water_modified_micros': date_utils.to_epoch_micros(
+                self.high_water_modification_date
+            ),
+            'high_water_title_number': self.high_water_title_number,
+        }
+
+    @staticmethod
+    def from_dict(lane_dict):
+        return BackfillLane(
+            date_utils.from_epoch_micros(lane_dict['last_modified_micros']),
+            lane_dict['last_title_number'],
+            date_utils.from_epoch_micros(lane_dict['high_water_modified_micros']),
+            lane_dict['high_water_title_number'],
+        )
+
+
+def ensure_mapping_exists(index_updater):
+    es_utils.ensure_mapping_exists(index_updater.index_name, LANE_DOC_TYPE, LANE_MAPPING)
+
+
+def load_backfill_lane(index_updater):
+    """Restores the updater's backfill lane, if it had one in progress"""
+    lane_dict = es_utils.get_document(index_updater.index_name, LANE_DOC_TYPE, index_updater.id)
+    index_updater.backfill_lane = BackfillLane.from_dict(lane_dict) if lane_dict else None
+
+    if index_updater.backfill_lane:
+        LOGGER.info("Updater '{}' has a backfill lane in progress, at '{}' of '{}'".format(
+            index_updater.id,
+            index_updater.backfill_lane.last_title_modification_date,
+            index_updater.backfill_lane.high_water_modification_date,
+        ))
+
+
+def save_backfill_lane(index_updater):
+    es_utils.index_document(
+        index_updater.index_name, LANE_DOC_TYPE, index_updater.id,
+        index_updater.backfill_lane.to_dict(),
+    )
+
+
+def delete_backfill_lane(index_updater):
+    es_utils.delete_document(index_updater.index_name, LANE_DOC_TYPE, index_updater.id)
@@ -0,0 +1,47 @@
+"""Bootstraps an updater's index with a single COPY of the source table.
+
+    python -m service.bootstrap <updater_id>
+
+Meant for initial loads and full rebuilds of an index - see service.database.copy_reader. The
+service picks up from the last title loaded, as it infers the position of updaters from their
+indexes when it starts.
+"""
+import argparse
+import json
+
+
+def main():
+    from service import sync_manager, sync_process, synchroniser
+
+    parser = argparse.ArgumentParser(description='Loads all titles of an updater with COPY')
+    parser.add_argument('updater_id', help='ID of a configured updater')
+    args = parser.parse_args()
+
+    updater_config = sync_manager.get_index_updater_config()
+    if args.updater_id not in updater_config:
+        parser.error("Unknown updater: '{}'".format(args.updater_id))
+
+    index_updater = sync_manager.create_index_updater(
+        args.updater_id, updater_config[args.updater_id]
+    )
+    if list(index_updater.write_targets):
+        parser.error("Updater '{}' has write targets - only its own index can be bootstrapped"
+                     .format(args.updater_id))
+
+    sync_manager._ensure_mapping_exists(index_updater)
+
+    with sync_process.suspend_id_filters([index_updater.id]):
+        title_count = synchroniser.bootstrap_index(index_updater)
+
+    print(json.dumps({
+        'updater': index_updater.id,
+        'title_count': title_count,
+        'last_modified': (
+            index_updater.last_title_modification_date.isoformat() if title_count else None
+        ),
+        'last_title_number': index_updater.last_updated_title_number if title_count else None,
+    }, indent=2, sort_keys=True))
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,243 @@
+"""Backpressure for elasticsearch bulk requests.
+
+Every cluster written to has a bulk budget, shared by all updaters and write targets using it.
+The budget limits how many bulk requests can be in flight at once and how many actions go into
+a request. Both limits are raised a little after each request that went through in good time,
+and halved when elasticsearch rejects work because its bulk queue is full (429 responses or
+es_rejected_execution errors). Requests slower than BULK_TARGET_LATENCY_MS halve the chunk size
+only. Rejected actions are sent again after a backoff, instead of failing the whole page - only
+actions still rejected after BULK_MAX_RETRIES retries fail it.
+
+The limit on requests in flight is shared by the writers to the cluster - each writer sends the
+chunks of a page one after another, in order, so it only takes effect with several writers.
+"""
+import itertools
+import threading
+import time
+
+from elasticsearch import TransportError       # type: ignore
+from elasticsearch.helpers import expand_action  # type: ignore
+
+from config import CONFIG_DICT
+
+REJECTED_STATUS = 429
+REJECTION_ERROR_MARKERS = ('es_rejected_execution', 'esrejectedexecution')
+# weight of the latest request in the moving averages of latency and rejection rate
+MOVING_AVERAGE_WEIGHT = 0.2
+
+_budgets_by_client = {}  # type: dict
+_budgets_lock = threading.Lock()
+
+
+class BulkRejectedError(Exception):
+    pass
+
+
+class BulkBudget():
+    """In-flight request and chunk size limits for one cluster, adjusted with AIMD"""
+
+    def __init__(self):
+        self._condition = threading.Condition()
+        self._concurrency = float(CONFIG_DICT['BULK_MAX_CONCURRENCY'])
+        self._chunk_size = CONFIG_DICT['BULK_CHUNK_SIZE']
+        self._in_flight = 0
+        self.latency_ms = None        # type: float
+        self.rejection_rate = 0.0
+        self.rejected_action_count = 0
+
+    @property
+    def concurrency_limit(self):
+        return max(1, int(self._concurrency))
+
+    @property
+    def chunk_size(self):
+        return self._chunk_size
+
+    @property
+    def in_flight(self):
+        return self._in_flight
+
+    def acquire(self):
+        with self._condition:
+            while self._in_flight >= self.concurrency_limit:
+                self._condition.wait()
+
+            self._in_flight += 1
+
+    def release(self):
+        with self._condition:
+            self._in_flight -= 1
+            self._condition.notify_all()
+
+    def record_response(self, latency_secs, action_count, rejected_count):
+        with self._condition:
+            latency_ms = latency_secs * 1000
+            self.latency_ms = _get_moving_average(self.latency_ms, latency_ms)
+            self.rejection_rate = _get_moving_average(
+                self.rejection_rate, rejected_count / max(action_count, 1)
+            )
+            self.rejected_action_count += rejected_count
+
+            if rejected_count:
+                self._decrease_concurrency()
+                self._decrease_chunk_size()
+            elif latency_ms > CONFIG_DICT['BULK_TARGET_LATENCY_MS']:
+                self._decrease_chunk_size()
+            else:
+                self._increase()
+
+            self._condition.notify_all()
+
+    def record_rejected_request(self, action_count):
+        with self._condition:
+            self.rejection_rate = _get_moving_average(self.rejection_rate, 1.0)
+            self.rejected_action_count += action_count
+            self._decrease_concurrency()
+            self._decrease_chunk_size()
+
+    def _increase(self):
+        # one more request in flight once a whole window of requests went through
+        self._concurrency = min(
+            self._concurrency + 1 / self.concurrency_limit,
+            float(CONFIG_DICT['BULK_MAX_CONCURRENCY']),
+        )
+        self._chunk_size = min(
+            self._chunk_size + CONFIG_DICT['BULK_CHUNK_SIZE_STEP'],
+            CONFIG_DICT['BULK_MAX_CHUNK_SIZE'],
+        )
+
+    def _decrease_concurrency(self):
+        self._concurrency = max(1.0, float(self.concurrency_limit // 2))
+
+    def _decrease_chunk_size(self):
+        self._chunk_size = max(self._chunk_size // 2, CONFIG_DICT['BULK_MIN_CHUNK_SIZE'])
+
+
+def get_budget(client):
+    with _budgets_lock:
+        if client not in _budgets_by_client:
+            _budgets_by_client[client] = BulkBudget()
+
+        return _budgets_by_client[client]
+
+
+def find_budget(client):
+    """Budget of the client, or None when nothing was written with it yet"""
+    with _budgets_lock:
+        return _budgets_by_client.get(client)
+
+
+def execute_bulk(client, actions):
+    """Sends the actions in chunks sized by the cluster's budget. Like the bulk helper, returns
+    the number of successful actions and the errors of the failed ones.
+
+    Actions can be a generator - only one chunk of them is held in memory at a time."""
+    budget = get_budget(client)
+    expanded_actions = map(expand_action, actions)
+    success_count = 0
+    errors = []
+
+    while True:
+        chunk = list(itertools.islice(expanded_actions, budget.chunk_size))
+
+        if not chunk:
+            return success_count, errors
+
+        for result_item in execute_chunk(client, chunk):
+            if is_success(result_item):
+                success_count += 1
+            else:
+                errors.append(result_item)
+
+
+def execute_chunk(client, chunk):
+    """Sends a chunk of expanded actions in one request, sending the actions elasticsearch
+    rejected again after a backoff. Returns the final response item of each action, in the
+    order of the chunk. Raises BulkRejectedError when actions are still rejected after
+    BULK_MAX_RETRIES retries."""
+    budget = get_budget(client)
+    result_items = [None] * len(chunk)
+    pending_positions = list(range(len(chunk)))
+    retry_count = 0
+
+    while True:
+        try:
+            response_items, latency_secs = _send_chunk(
+                client, budget, [chunk[position] for position in pending_positions]
+            )
+        except TransportError as e:
+            if e.status_code != REJECTED_STATUS or retry_count >= CONFIG_DICT['BULK_MAX_RETRIES']:
+                raise
+
+            budget.record_rejected_request(len(pending_positions))
+            retry_count += 1
+            _back_off(retry_count)
+            continue
+
+        rejected_positions = []
+
+        for position, (op_type, item) in zip(pending_positions, response_items):
+            result_items[position] = {op_type: item}
+
+            if _is_rejection(item):
+                rejected_positions.append(position)
+
+        budget.record_response(latency_secs, len(pending_positions), len(rejected_positions))
+
+        if not rejected_positions:
+            return result_items
+
+        if retry_count >= CONFIG_DICT['BULK_MAX_RETRIES']:
+            # the page fails rather than moving the cursor past actions that weren't written
+            raise BulkRejectedError('Elasticsearch still rejected {} action(s) after {} retries'
+                                    .format(len(rejected_positions), retry_count))
+
+        retry_count += 1
+        _back_off(retry_count)
+        pending_positions = rejected_positions
+
+
+def is_success(result_item):
+    """Tells if a bulk response item, as returned by execute_chunk, is of a successful action"""
+    op_type, item = next(iter(result_item.items()))
+    return 200 <= item.get('status', 500) < 300 and not _is_rejection(item)
+
+
+def _send_chunk(client, budget, chunk):
+    """Response items of the chunk's actions, with the time the request took"""
+    bulk_body = []
+
+    for action, data in chunk:
+        bulk_body.append(action)
+        if data is not None:
+            bulk_body.append(data)
+
+    budget.acquire()
+
+    try:
+        start = time.perf_counter()
+        response = client.bulk(bulk_body)
+        latency_secs = time.perf_counter() - start
+    finally:
+        budget.release()
+
+    return [next(iter(item.items())) for item in response['items']], latency_secs
+
+
+def _is_rejection(item):
+    if item.get('status') == REJECTED_STATUS:
+        return True
+
+    error = str(item.get('error', '')).lower()
+    return any(marker in error for marker in REJECTION_ERROR_MARKERS)
+
+
+def _back_off(retry_count):
+    time.sleep(CONFIG_DICT['BULK_RETRY_BACKOFF_MS'] * 2 ** (retry_count - 1) / 1000)
+
+
+def _get_moving_average(average, value):
+    if average is None:
+        return value
+
+    return average + MOVING_AVERAGE_WEIGHT * (value - average)
@@ -0,0 +1,168 @@
+"""Coalescing of the bulk requests of updaters and write targets sharing a cluster.
+
+With BULK_COALESCING_ENABLED set, actions written to a cluster go through the cluster's
+coalescer instead of being sent by each writer on its own. Writers hand their actions over a
+chunk at a time and wait for that chunk's results. The coalescer's flusher thread combines the
+chunks waiting into one bulk request as soon as they add up to the cluster's bulk chunk size
+(see service.bulk_backpressure), or once the oldest has waited BULK_COALESCE_MAX_WAIT_MS, so
+that the small pages of the live tail share requests instead of each paying for one.
+
+Each writer only gets the response items of its own actions back, so it moves its checkpoint
+the same way as when it sends its own requests. When a combined request fails as a whole, the
+chunks in it are sent again one by one, so that a chunk that can't be written fails only the
+writer it came from.
+"""
+from collections import deque
+from concurrent.futures import ThreadPoolExecutor
+import itertools
+import logging
+import threading
+import time
+
+from elasticsearch.helpers import expand_action  # type: ignore
+
+from config import CONFIG_DICT
+from service import bulk_backpressure
+
+LOGGER = logging.getLogger(__name__)
+
+
+class _Submission():
+    """A chunk of expanded actions of one writer, waiting for its response items"""
+
+    def __init__(self, chunk):
+        self.chunk = chunk
+        self.submitted_at = time.monotonic()
+        self.result_items = None  # type: list
+        self.error = None         # type: Exception
+        self._done = threading.Event()
+
+    def set_result(self, result_items=None, error=None):
+        self.result_items = result_items
+        self.error = error
+        self._done.set()
+
+    def wait(self):
+        self._done.wait()
+
+        if self.error is not None:
+            raise self.error
+
+        return self.result_items
+
+
+class BulkCoalescer():
+
+    def __init__(self, client, max_wait_secs=None):
+        self.client = client
+        self._max_wait_secs = (
+            max_wait_secs if max_wait_secs is not None
+            else CONFIG_DICT['BULK_COALESCE_MAX_WAIT_MS'] / 1000
+        )
+        self._submissions = deque()  # type: deque
+        self._pending_action_count = 0
+        self._condition = threading.Condition()
+        # the bulk budget limits the requests in flight - the executor only has to allow for it
+        self._executor = ThreadPoolExecutor(max_workers=CONFIG_DICT['BULK_MAX_CONCURRENCY'])
+        self.request_count = 0
+        self._flusher = threading.Thread(target=self._flush_continuously, name='bulk-coalescer')
+        self._flusher.daemon = True
+        self._flusher.start()
+
+    def execute(self, actions):
+        """Writes the actions along with those of other writers. Like the bulk helper, returns
+        the number of successful actions and the errors of the failed ones.
+
+        Actions can be a generator - only one chunk of them is held in memory at a time."""
+        budget = bulk_backpressure.get_budget(self.client)
+        expanded_actions = map(expand_action, actions)
+        success_count = 0
+        errors = []
+
+        while True:
+            chunk = list(itertools.islice(expanded_actions, budget.chunk_size))
+
+            if not chunk:
+                return success_count, errors
+
+            for result_item in self._submit(chunk).wait():
+                if bulk_backpressure.is_success(result_item):
+                    success_count += 1
+                else:
+                    errors.append(result_item)
+
+    def _submit(self, chunk):
+        submission = _Submission(chunk)
+
+        with self._condition:
+            self._submissions.append(submission)
+            self._pending_action_count += len(chunk)
+            self._condition.notify()
+
+        return submission
+
+    def _flush_continuously(self):
+        while True:
+            batch = self._take_batch()
+
+            try:
+                self._executor.submit(self._send_batch, batch)
+            except Exception as e:
+                for submission in batch:
+                    submission.set_result(error=e)
+
+    def _take_batch(self):
+        """Waits until the submissions waiting add up to a chunk, or the oldest one has waited
+        long enough, and takes as many of them as fit in a chunk - at least one"""
+        with self._condition:
+            while True:
+                if self._submissions:
+                    flush_size = bulk_backpressure.get_budget(self.client).chunk_size
+                    wait_secs = (
+                        self._submissions[0].submitted_at + self._max_wait_secs - time.monotonic()
+                    )
+
+                    if self._pending_action_count >= flush_size or wait_secs <= 0:
+                        break
+
+                    self._condition.wait(wait_secs)
+                else:
+                    self._condition.wait()
+
+            batch = [self._submissions.popleft()]
+            action_count = len(batch[0].chunk)
+
+            while self._submissions and \
+                    action_count + len(self._submissions[0].chunk) <= flush_size:
+                batch.append(self._submissions.popleft())
+                action_count += len(batch[-1].chunk)
+
+            self._pending_action_count -= action_count
+            return batch
+
+    def _send_batch(self, batch):
+        combined_chunk = [action for submission in batch for action in submission.chunk]
+
+        with self._condition:
+            self.request_count += 1
+
+        try:
+            result_items = bulk_backpressure.execute_chunk(self.client, combined_chunk)
+        except Exception as e:
+            if len(batch) == 1:
+                batch[0].set_result(error=e)
+                return
+
+            LOGGER.warning('Combined bulk request of {} chunk(s) failed - sending them one by '
+                           'one'.format(len(batch)), exc_info=e)
+
+            for submission in batch:
+                self._send_batch([submission])
+
+            return
+
+        position = 0
+
+        for submission in batch:
+            submission.set_result(result_items[position:position + len(submission.chunk)])
+            position += len(submission.chunk)
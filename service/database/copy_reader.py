@@ -0,0 +1,169 @@
+"""Reads the whole of title_register_data with COPY, for initial loads and full rebuilds.
+
+Paging through the table with keyset queries costs a query, a plan and a round trip per page.
+COPY streams all the titles in one go, in CSV, in the same (last_modified, title_number) order as
+the pages. pg8000 writes the COPY output on a thread of its own, which hands it over in chunks of
+about COPY_CHUNK_BYTES through a queue of COPY_QUEUE_CHUNKS chunks at most. The reader parses the
+chunks into titles as they arrive, so memory use doesn't grow with the table, and a reader that
+falls behind holds the COPY back instead of the output piling up.
+"""
+import codecs
+import csv
+from datetime import datetime
+import json
+import logging
+import queue
+import threading
+
+from service import db
+from service.database.model import TitleRecord, TitleRegisterData
+
+LOGGER = logging.getLogger(__name__)
+
+COPY_CHUNK_BYTES = 65536
+COPY_QUEUE_CHUNKS = 16
+# put in place of NULLs, which CSV can't tell from empty strings - JSON text can't be '\N'
+NULL_MARKER = '\\N'
+QUEUE_POLL_SECS = 0.1
+
+COPY_SQL = (
+    "COPY (SELECT title_number, register_data, last_modified, is_deleted FROM {}{} "
+    "ORDER BY last_modified, title_number) TO STDOUT WITH (FORMAT csv, NULL '{}')"
+)
+
+
+class CopyCancelledError(Exception):
+    pass
+
+
+class _CopyOutStream():
+    """File-like object pg8000 writes the COPY output to. The output is handed over to the reader
+    in chunks, through a bounded queue."""
+
+    _END = object()
+
+    def __init__(self):
+        self._queue = queue.Queue(maxsize=COPY_QUEUE_CHUNKS)  # type: queue.Queue
+        self._buffer = bytearray()
+        self._cancelled = threading.Event()
+
+    def write(self, data):
+        self._buffer += data
+
+        if len(self._buffer) >= COPY_CHUNK_BYTES:
+            self._put(bytes(self._buffer))
+            self._buffer.clear()
+
+    def finish(self, error=None):
+        if error is None and self._buffer:
+            self._put(bytes(self._buffer))
+
+        self._put(error or self._END)
+
+    def cancel(self):
+        self._cancelled.set()
+
+    def iterate_chunks(self):
+        while True:
+            chunk = self._queue.get()
+
+            if chunk is self._END:
+                return
+
+            if isinstance(chunk, Exception):
+                raise chunk
+
+            yield chunk
+
+    def _put(self, item):
+        # the reader may stop reading at any time - the COPY is then aborted
+        while not self._cancelled.is_set():
+            try:
+                self._queue.put(item, timeout=QUEUE_POLL_SECS)
+                return
+            except queue.Full:
+                pass
+
+        raise CopyCancelledError('The reader of the COPY output stopped reading')
+
+
+def stream_titles_with_copy(source_filter=None, engine=None):
+    """Yields all titles meeting the source filter, in order of (last_modified, title_number),
+    read from the primary database - or the given engine - with a single COPY"""
+    sql = get_copy_sql(source_filter)
+    connection = (engine or db).raw_connection()
+    stream = _CopyOutStream()
+    copier = threading.Thread(target=_copy, args=(connection, sql, stream), name='copy-reader')
+    copier.daemon = True
+    is_complete = False
+
+    try:
+        copier.start()
+
+        for row in csv.reader(iterate_lines(stream.iterate_chunks()), strict=True):
+            yield get_title_record(row)
+
+        is_complete = True
+    finally:
+        stream.cancel()
+        copier.join()
+
+        if is_complete:
+            connection.close()
+        else:
+            # the connection can't be reused after an aborted COPY
+            connection.invalidate()
+            connection.close()
+
+
+def get_copy_sql(source_filter=None):
+    where_clause = ' WHERE ({})'.format(source_filter.condition) if source_filter else ''
+    return COPY_SQL.format(TitleRegisterData.__tablename__, where_clause, NULL_MARKER)
+
+
+def iterate_lines(chunks):
+    """Lines of UTF-8 text split into chunks at any byte, each with its line feed. Lines are
+    only split at line feeds, like COPY writes them."""
+    decoder = codecs.getincrementaldecoder('utf-8')()
+    partial_line = ''
+
+    for chunk in chunks:
+        lines = (partial_line + decoder.decode(chunk)).split('\n')
+        partial_line = lines.pop()
+
+        for line in lines:
+            yield line + '\n'
+
+    partial_line += decoder.decode(b'', final=True)
+
+    if partial_line:
+        yield partial_line
+
+
+def get_title_record(row):
+    title_number, register_data, last_modified, is_deleted = row
+    return TitleRecord(
+        title_number,
+        json.loads(register_data) if register_data != NULL_MARKER else None,
+        datetime.fromisoformat(last_modified),
+        is_deleted == 't',
+    )
+
+
+def _copy(connection, sql, stream):
+    try:
+        cursor = connection.cursor()
+        # timestamps are written the way datetime.fromisoformat reads them
+        cursor.execute("SET LOCAL DateStyle TO 'ISO, YMD'")
+        cursor.execute(sql, stream=stream)
+        connection.rollback()
+        stream.finish()
+    except CopyCancelledError:
+        LOGGER.info('COPY cancelled by its reader')
+    except Exception as e:
+        LOGGER.error('COPY of title_register_data failed', exc_info=e)
+
+        try:
+            stream.finish(error=e)
+        except CopyCancelledError:
+            pass
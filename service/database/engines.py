@@ -0,0 +1,47 @@
+"""Engines of the source database and its read replica, with the pool settings of the config.
+
+Connections are tested as they're checked out of the pool when DB_POOL_PRE_PING is set, so that
+ones dropped by the server or a proxy while idle in the pool are replaced rather than failing
+the page read with them. The test is a SELECT 1 run on the first checkout of a connection per
+use - with the sync workers holding their connections for whole synchronisations, that's once
+per synchronisation rather than once per page.
+"""
+from sqlalchemy import create_engine, event, exc, select  # type: ignore
+
+from config import CONFIG_DICT
+
+
+def create_source_engine(database_uri):
+    engine = create_engine(
+        database_uri,
+        pool_size=CONFIG_DICT['DB_POOL_SIZE'],
+        max_overflow=CONFIG_DICT['DB_MAX_OVERFLOW'],
+        pool_recycle=CONFIG_DICT['DB_POOL_RECYCLE_SECS'],
+    )
+
+    if CONFIG_DICT['DB_POOL_PRE_PING']:
+        event.listen(engine, 'engine_connect', _ping_connection)
+
+    return engine
+
+
+def _ping_connection(connection, branch):
+    # branches share the connection of their parent, which was tested already
+    if branch:
+        return
+
+    # the ping mustn't close a connection meant to close after its first result
+    should_close_with_result = connection.should_close_with_result
+    connection.should_close_with_result = False
+
+    try:
+        connection.scalar(select([1]))
+    except exc.DBAPIError as e:
+        # a failed ping of a dead connection invalidates it and all the others of the pool -
+        # the connection reconnects on its next use, which is tested as well
+        if not e.connection_invalidated:
+            raise
+
+        connection.scalar(select([1]))
+    finally:
+        connection.should_close_with_result = should_close_with_result
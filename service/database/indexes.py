@@ -0,0 +1,129 @@
+"""Indexes over title_register_data used by the page reader. The page index, over the page
+order, is required - without it every page means sorting the titles modified since the cursor.
+The optional partial indexes support the source filters of the configured updaters. Each one
+covers the page order and only the titles meeting a filter, so pages of filtered titles are
+read with an index range scan that never visits other titles.
+
+To print the DDL for the configured updaters:
+
+    python -m service.database.indexes
+
+To create the missing indexes (concurrently, without blocking writes to the table):
+
+    python -m service.database.indexes --create
+
+With --reconciliation, the index over title numbers in byte order that reconciliation reads
+titles with (see service.reconciler) is included as well.
+"""
+import argparse
+import logging
+
+from service import db
+
+LOGGER = logging.getLogger(__name__)
+
+SOURCE_TABLE_NAME = 'title_register_data'
+PAGE_INDEX_COLUMNS = 'last_modified, title_number'
+PAGE_INDEX_NAME = 'ix_{}_page'.format(SOURCE_TABLE_NAME)
+TITLE_NUMBER_INDEX_NAME = 'ix_{}_title_number_c'.format(SOURCE_TABLE_NAME)
+
+
+def get_page_index_ddl():
+    return 'CREATE INDEX CONCURRENTLY {} ON {} ({})'.format(
+        PAGE_INDEX_NAME, SOURCE_TABLE_NAME, PAGE_INDEX_COLUMNS
+    )
+
+
+def get_title_number_index_ddl():
+    # reconciliation reads titles in byte order, which the primary key only has with a C locale
+    return 'CREATE INDEX CONCURRENTLY {} ON {} (title_number COLLATE "C")'.format(
+        TITLE_NUMBER_INDEX_NAME, SOURCE_TABLE_NAME
+    )
+
+
+def get_filter_index_name(source_filter):
+    return 'ix_{}_page_{}'.format(SOURCE_TABLE_NAME, source_filter.name)
+
+
+def get_filter_index_ddl(source_filter):
+    # the predicate has to be the filter's SQL as it is, for the planner to match the two
+    return 'CREATE INDEX CONCURRENTLY {} ON {} ({}) WHERE ({})'.format(
+        get_filter_index_name(source_filter),
+        SOURCE_TABLE_NAME,
+        PAGE_INDEX_COLUMNS,
+        source_filter.condition,
+    )
+
+
+def get_source_filters(index_updaters):
+    source_filters = [updater.get_source_filter() for updater in index_updaters]
+    unique_filters = {
+        source_filter.name: source_filter for source_filter in source_filters if source_filter
+    }
+    return [unique_filters[name] for name in sorted(unique_filters)]
+
+
+def create_missing_indexes(ddl_by_index_name):
+    connection = db.raw_connection()
+
+    try:
+        # CREATE INDEX CONCURRENTLY can't run inside a transaction
+        connection.autocommit = True
+        cursor = connection.cursor()
+        cursor.execute(
+            'SELECT indexname FROM pg_indexes WHERE tablename = %s', (SOURCE_TABLE_NAME,)
+        )
+        existing_index_names = {row[0] for row in cursor.fetchall()}
+
+        for index_name, ddl in sorted(ddl_by_index_name.items()):
+            if index_name in existing_index_names:
+                LOGGER.info("Index '{}' already exists".format(index_name))
+            else:
+                LOGGER.info("Creating index '{}'".format(index_name))
+                cursor.execute(ddl)
+                print('Created index {}'.format(index_name))
+    finally:
+        connection.close()
+
+
+def get_index_ddl_for_updaters(index_updaters):
+    ddl_by_index_name = {PAGE_INDEX_NAME: get_page_index_ddl()}
+    ddl_by_index_name.update({
+        get_filter_index_name(source_filter): get_filter_index_ddl(source_filter)
+        for source_filter in get_source_filters(index_updaters)
+    })
+    return ddl_by_index_name
+
+
+def main():
+    from service import sync_manager
+
+    parser = argparse.ArgumentParser(description='Source table indexes for configured updaters')
+    parser.add_argument(
+        '--create', action='store_true', help='create the indexes that are missing'
+    )
+    parser.add_argument(
+        '--reconciliation', action='store_true',
+        help='include the index reconciliation reads titles with',
+    )
+    args = parser.parse_args()
+
+    updater_config = sync_manager.get_index_updater_config()
+    index_updaters = [
+        sync_manager.create_index_updater(updater_id, updater_config[updater_id])
+        for updater_id in updater_config
+    ]
+    ddl_by_index_name = get_index_ddl_for_updaters(index_updaters)
+
+    if args.reconciliation:
+        ddl_by_index_name[TITLE_NUMBER_INDEX_NAME] = get_title_number_index_ddl()
+
+    if args.create:
+        create_missing_indexes(ddl_by_index_name)
+    else:
+        for index_name in sorted(ddl_by_index_name):
+            print('{};'.format(ddl_by_index_name[index_name]))
+
+
+if __name__ == '__main__':
+    main()
@@ -1,3 +1,4 @@
+from collections import namedtuple
 from sqlalchemy import Column, DateTime, String, Boolean  # type: ignore
 from sqlalchemy.dialects import postgresql                # type: ignore
 from sqlalchemy.ext.declarative import declarative_base   # type: ignore
@@ -14,3 +15,9 @@ class TitleRegisterData(Base):  # type: ignore
     register_data = Column(postgresql.JSON(), nullable=True)
     last_modified = Column(DateTime(), nullable=False)
     is_deleted = Column(Boolean(), nullable=False)
+
+
+# Detached copy of a title_register_data row, for titles that don't come from a database session
+TitleRecord = namedtuple(
+    'TitleRecord', ['title_number', 'register_data', 'last_modified', 'is_deleted']
+)
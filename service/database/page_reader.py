@@ -1,25 +1,420 @@
+from collections import namedtuple
+from contextlib import contextmanager
+from datetime import datetime
+import json
+import threading
+from sqlalchemy import bindparam, literal, literal_column, select, text, tuple_  # type: ignore
+from sqlalchemy.dialects import postgresql        # type: ignore
 from sqlalchemy.orm import Session, sessionmaker  # type: ignore
 
+from config import CONFIG_DICT
 from service import db
-from service.database.model import TitleRegisterData
+from service.database import read_source
+from service.database.model import TitleRecord, TitleRegisterData
+
+INDEX_SCAN_NODE_TYPES = ('Index Scan', 'Index Only Scan')
+EXPLAIN_START_DATE = datetime(1900, 1, 1)
+
+# Page statements, by the parts of their SQL that vary - the cursor and caps are bound
+# parameters, so a statement is built once for each updater rather than once for each page
+_page_statements = {}  # type: dict
+_page_statements_lock = threading.Lock()
+# SQL compiled from the page statements, by dialect and statement, shared by all connections
+_compiled_cache = {}  # type: dict
+# connections held by the sync worker of the current thread, by engine (see
+# dedicated_page_connections)
+_thread_state = threading.local()
+
+# Condition, in SQL, that titles have to meet to be of any use to an updater. Titles that don't
+# meet it are skipped by the database instead of being read and turned into no actions.
+# The condition is spelled out with literals, so that the planner can match it with the
+# predicate of a partial index built from the same SQL (see service.database.indexes).
+SourceFilter = namedtuple('SourceFilter', ['name', 'condition'])
+
+ADDRESS_STRING_SQL = "(register_data #>> '{address,address_string}')"
+POSTCODE_SQL = "(register_data #>> '{address,postcode}')"
+
+ADDRESS_PRESENT_FILTER = SourceFilter(
+    'address_present', '{} IS NOT NULL'.format(ADDRESS_STRING_SQL)
+)
+
+
+def get_postcode_present_or_address_matches_filter(postcode_regex):
+    if "'" in postcode_regex:
+        raise ValueError('Postcode regex must not contain quotes: {}'.format(postcode_regex))
+
+    return SourceFilter(
+        'postcode_present',
+        "{} <> '' OR {} ~ '{}'".format(POSTCODE_SQL, ADDRESS_STRING_SQL, postcode_regex),
+    )
 
 
 # If an updater needs to read data in a different way, it should use a different page reader
-def get_next_data_page(last_title_number, last_modification_date, page_size):
+# or declare a source filter
+def get_next_data_page(last_title_number, last_modification_date, page_size, source_filter=None):
+    session = Session(bind=db)
+
+    try:
+        return _get_page_query(
+            session, last_title_number, last_modification_date, page_size, source_filter
+        ).all()
+    finally:
+        session.close()
+
+
+def stream_next_data_page(last_title_number, last_modification_date, page_size,
+                          source_filter=None, high_water_mark=None):
+    """Yields the titles of the next page, fetching them in batches of READ_BATCH_SIZE so that
+    the whole page doesn't have to be held in memory. The connection is given back when the
+    generator is exhausted or closed.
+
+    The page is read from the read replica when it's in use, up to the titles it's known to have.
+    When a high-water mark - a (last_modified, title_number) position - is given, titles after it
+    aren't read.
+
+    Titles not meeting the source filter don't count towards the page size. The cursor only
+    needs to advance over the titles returned - the ones skipped before the last of them can't
+    produce any actions, and any later change to them gives them a newer modification date.
+
+    Within dedicated_page_connections, the page is read with the connection the thread holds.
+    The statement is the same for every page of an updater, and its compiled SQL is cached - the
+    driver prepares it on the server once for each connection."""
+    source = read_source.get_read_source()
+    page_statement = get_page_statement(
+        page_size, source_filter, source.max_last_modified is not None,
+        high_water_mark is not None,
+    )
+    parameters = {'last_modified': last_modification_date, 'title_number': last_title_number}
+
+    if source.max_last_modified is not None:
+        parameters['max_last_modified'] = source.max_last_modified
+
+    if high_water_mark is not None:
+        parameters['high_water_last_modified'], parameters['high_water_title_number'] = \
+            high_water_mark
+
+    with _get_page_connection(source.engine) as connection:
+        result = connection.execute(page_statement, parameters)
+
+        try:
+            for rows in iter(lambda: result.fetchmany(CONFIG_DICT['READ_BATCH_SIZE']), []):
+                for row in rows:
+                    yield TitleRecord(
+                        row.title_number, row.register_data, row.last_modified, row.is_deleted
+                    )
+        finally:
+            result.close()
+
+
+def get_page_statement(page_size, source_filter=None, is_capped=False,
+                       has_high_water_mark=False):
+    """Core statement of the page query (see _get_page_query), with the cursor as the bound
+    parameters last_modified and title_number. A capped statement takes max_last_modified, and
+    one with a high-water mark high_water_last_modified and high_water_title_number."""
+    statement_key = (page_size, source_filter, is_capped, has_high_water_mark)
+
+    with _page_statements_lock:
+        page_statement = _page_statements.get(statement_key)
+
+        if page_statement is None:
+            page_statement = _page_statements[statement_key] = _build_page_statement(
+                page_size, source_filter, is_capped, has_high_water_mark
+            )
+
+        return page_statement
+
+
+@contextmanager
+def dedicated_page_connections():
+    """Has the pages read on the current thread within the block share a connection to each
+    database they're read from, rather than checking one out of the pool for every page - for
+    the pages of a synchronisation. Every page is read in a transaction of its own.
+
+    A connection that fails is given back to the pool and the next page gets another one.
+    Nested blocks use the connections of the outermost one. Does nothing when
+    DEDICATED_PAGE_CONNECTIONS isn't set."""
+    if not CONFIG_DICT['DEDICATED_PAGE_CONNECTIONS'] or \
+            getattr(_thread_state, 'connections', None) is not None:
+        yield
+        return
+
+    _thread_state.connections = {}
+
+    try:
+        yield
+    finally:
+        connections, _thread_state.connections = _thread_state.connections, None
+
+        for connection in connections.values():
+            connection.close()
+
+
+@contextmanager
+def _get_page_connection(engine):
+    held_connections = getattr(_thread_state, 'connections', None)
+
+    if held_connections is None:
+        connection = _connect(engine)
+
+        try:
+            yield connection
+        finally:
+            connection.close()
+
+        return
+
+    if engine not in held_connections:
+        held_connections[engine] = _connect(engine)
+
+    connection = held_connections[engine]
+    transaction = connection.begin()
+    is_failed = False
+
+    try:
+        yield connection
+    except Exception:
+        is_failed = True
+        raise
+    finally:
+        if is_failed:
+            # closing the connection rolls its transaction back, or discards it if it's broken
+            del held_connections[engine]
+            connection.close()
+        else:
+            # pages only read, and a transaction left open would hold back vacuuming
+            transaction.rollback()
+
+
+def _connect(engine):
+    return engine.connect().execution_options(compiled_cache=_compiled_cache)
+
+
+def get_latest_title_position(source_filter=None):
+    """(last_modified, title_number) of the latest title meeting the filter, or None when there
+    are no such titles. With a read replica in use, only the titles it's known to have count."""
+    source = read_source.get_read_source()
+    session = Session(bind=source.engine)
+
+    try:
+        latest_title_query = session.query(
+            TitleRegisterData.last_modified, TitleRegisterData.title_number
+        )
+
+        if source_filter:
+            latest_title_query = latest_title_query.filter(
+                text('({})'.format(source_filter.condition))
+            )
+
+        if source.max_last_modified is not None:
+            latest_title_query = latest_title_query.filter(
+                TitleRegisterData.last_modified <= source.max_last_modified
+            )
+
+        latest_title = latest_title_query.order_by(
+            TitleRegisterData.last_modified.desc(),
+            TitleRegisterData.title_number.desc()
+        ).first()
+
+        return (latest_title[0], latest_title[1]) if latest_title else None
+    finally:
+        session.close()
+
+
+def stream_titles_by_title_number(source_filter=None):
+    """Yields all titles of the primary database, in byte order of their title numbers, each
+    with whether it meets the source filter. Titles are built in batches of READ_BATCH_SIZE.
+
+    The byte order ("C" collation) is the order elasticsearch sorts document IDs in."""
+    session = Session(bind=db)
+
+    try:
+        titles_query = _get_title_query(session, source_filter).order_by(
+            TitleRegisterData.title_number.collate('C')
+        ).execution_options(stream_results=True).yield_per(CONFIG_DICT['READ_BATCH_SIZE'])
+
+        for title, is_included in titles_query:
+            yield title, bool(is_included)
+    finally:
+        session.close()
+
+
+def get_title(title_number, source_filter=None):
+    """The title with the given number from the primary database, with whether it meets the
+    source filter - or None when there's no such title"""
+    session = Session(bind=db)
+
+    try:
+        title_with_filter = _get_title_query(session, source_filter).filter(
+            TitleRegisterData.title_number == title_number
+        ).first()
+
+        return (title_with_filter[0], bool(title_with_filter[1])) if title_with_filter else None
+    finally:
+        session.close()
+
+
+def stream_titles_with_numbers(title_numbers, source_filter=None):
+    """Yields the titles with the given numbers that meet the source filter, from the primary
+    database, looking each of them up by its primary key"""
+    session = Session(bind=db)
+
+    try:
+        titles_query = _filter_titles(
+            session.query(TitleRegisterData), source_filter
+        ).filter(
+            TitleRegisterData.title_number.in_(title_numbers)
+        ).order_by(TitleRegisterData.title_number)
+
+        for title in titles_query:
+            yield title
+    finally:
+        session.close()
+
+
+def stream_title_number_range_page(first_title_number, last_title_number, after_title_number,
+                                   page_size, source_filter=None):
+    """Yields the next page of titles numbered from first_title_number to last_title_number,
+    after after_title_number when given, from the primary database. Titles are read in order of
+    their title numbers with a range scan of the primary key."""
+    session = Session(bind=db)
+
+    try:
+        page_query = _filter_titles(session.query(TitleRegisterData), source_filter).filter(
+            TitleRegisterData.title_number >= first_title_number,
+            TitleRegisterData.title_number <= last_title_number,
+        )
+
+        if after_title_number is not None:
+            page_query = page_query.filter(TitleRegisterData.title_number > after_title_number)
+
+        page_query = page_query.order_by(TitleRegisterData.title_number).limit(page_size)
+
+        for title in page_query.execution_options(stream_results=True).yield_per(
+                CONFIG_DICT['READ_BATCH_SIZE']):
+            yield title
+    finally:
+        session.close()
+
+
+def stream_modified_window_page(last_title_number, last_modification_date, page_size,
+                                max_last_modified, source_filter=None):
+    """Yields the next page of titles after the given position and modified no later than
+    max_last_modified, from the primary database. It's read the same way as the pages of the
+    updaters, with a range scan of the (last_modified, title_number) index."""
     session = Session(bind=db)
 
     try:
-        page_query = session.query(TitleRegisterData).filter(
-            (
-                (TitleRegisterData.last_modified == last_modification_date) &
-                (TitleRegisterData.title_number > last_title_number)
-            ) |
-            (TitleRegisterData.last_modified > last_modification_date)
-        ).order_by(
-            TitleRegisterData.last_modified,
-            TitleRegisterData.title_number
-        ).limit(page_size)
+        page_query = _get_page_query(
+            session, last_title_number, last_modification_date, page_size, source_filter,
+            max_last_modified,
+        ).execution_options(stream_results=True).yield_per(CONFIG_DICT['READ_BATCH_SIZE'])
 
-        return page_query.all()
+        for title in page_query:
+            yield title
     finally:
         session.close()
+
+
+def _filter_titles(titles_query, source_filter):
+    if source_filter:
+        return titles_query.filter(text('({})'.format(source_filter.condition)))
+
+    return titles_query
+
+
+def _get_title_query(session, source_filter):
+    # a filter condition can be NULL as well as false for titles that don't meet it
+    is_included = (
+        literal_column('({})'.format(source_filter.condition)) if source_filter else literal(True)
+    )
+    return session.query(TitleRegisterData, is_included.label('is_included'))
+
+
+def _get_page_query(session, last_title_number, last_modification_date, page_size,
+                    source_filter=None, max_last_modified=None, high_water_mark=None):
+    # A row value comparison, unlike the equivalent OR of column comparisons, is turned by
+    # Postgres into a single range scan of the (last_modified, title_number) index
+    page_query = session.query(TitleRegisterData).filter(
+        tuple_(TitleRegisterData.last_modified, TitleRegisterData.title_number) >
+        tuple_(last_modification_date, last_title_number)
+    )
+
+    page_query = _filter_titles(page_query, source_filter)
+
+    if max_last_modified is not None:
+        page_query = page_query.filter(TitleRegisterData.last_modified <= max_last_modified)
+
+    if high_water_mark is not None:
+        page_query = page_query.filter(
+            tuple_(TitleRegisterData.last_modified, TitleRegisterData.title_number) <=
+            tuple_(*high_water_mark)
+        )
+
+    return page_query.order_by(
+        TitleRegisterData.last_modified,
+        TitleRegisterData.title_number
+    ).limit(page_size)
+
+
+def _build_page_statement(page_size, source_filter, is_capped, has_high_water_mark):
+    # the same SQL as _get_page_query, with bound parameters in place of the cursor and caps
+    table = TitleRegisterData.__table__
+    cursor_columns = tuple_(table.c.last_modified, table.c.title_number)
+    page_statement = select([table]).where(cursor_columns > tuple_(
+        bindparam('last_modified', type_=table.c.last_modified.type),
+        bindparam('title_number', type_=table.c.title_number.type),
+    ))
+
+    if source_filter:
+        page_statement = page_statement.where(text('({})'.format(source_filter.condition)))
+
+    if is_capped:
+        page_statement = page_statement.where(table.c.last_modified <= bindparam(
+            'max_last_modified', type_=table.c.last_modified.type
+        ))
+
+    if has_high_water_mark:
+        page_statement = page_statement.where(cursor_columns <= tuple_(
+            bindparam('high_water_last_modified', type_=table.c.last_modified.type),
+            bindparam('high_water_title_number', type_=table.c.title_number.type),
+        ))
+
+    # the limit is a literal in SQLAlchemy 0.9, so the page size is part of the statement's key
+    return page_statement.order_by(table.c.last_modified, table.c.title_number).limit(page_size)
+
+
+def get_page_query_plan(source_filter=None, engine=None):
+    """Plan Postgres chooses for reading a page from the start of the table, in JSON format -
+    on the primary database, or the one of the given engine"""
+    session = Session(bind=engine or db)
+
+    try:
+        page_query = _get_page_query(session, '', EXPLAIN_START_DATE, 1, source_filter)
+        return explain_query(session, page_query)
+    finally:
+        session.close()
+
+
+def explain_query(session, query):
+    compiled = query.statement.compile(dialect=postgresql.dialect(paramstyle='named'))
+    result = session.execute(text('EXPLAIN (FORMAT JSON) {}'.format(compiled)), compiled.params)
+    plan = result.scalar()
+    # depending on the driver, json values come back parsed or as text
+    return json.loads(plan) if isinstance(plan, str) else plan
+
+
+def uses_index_range_scan(query_plan):
+    """Tells whether the plan reads title_register_data with an index scan bounded by the cursor"""
+    return any(
+        node.get('Node Type') in INDEX_SCAN_NODE_TYPES and 'Index Cond' in node
+        for node in _get_plan_nodes(query_plan[0]['Plan'])
+        if node.get('Relation Name') == TitleRegisterData.__tablename__
+    )
+
+
+def _get_plan_nodes(plan_node):
+    yield plan_node
+
+    for child_node in plan_node.get('Plans', []):
+        for node in _get_plan_nodes(child_node):
+            yield node
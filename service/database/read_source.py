@@ -0,0 +1,116 @@
+"""Choice of the database source pages are read from - the read replica when it's configured
+and keeping up, the primary database otherwise.
+
+A replica only has the titles committed on the primary up to the time of the last transaction
+it replayed. Pages read from it are capped at that time, minus a safety margin for titles whose
+modification date was set a little before their transaction committed, so that the cursor never
+moves past titles the replica doesn't have yet.
+"""
+from collections import namedtuple
+from datetime import datetime, timedelta
+import logging
+import threading
+
+from config import CONFIG_DICT
+from service import db, read_replica_db
+
+LOGGER = logging.getLogger(__name__)
+
+PRIMARY_SOURCE_NAME = 'primary'
+REPLICA_SOURCE_NAME = 'replica'
+
+# When a replica has replayed everything it received, it's as up to date as it can tell and
+# its own clock is the limit. The timestamps are cast to the session's time zone, the same
+# way the naive last_modified dates are.
+REPLICA_STATUS_SQL = """
+SELECT
+    CASE
+        WHEN NOT pg_is_in_recovery() THEN 0
+        WHEN pg_last_wal_receive_lsn() = pg_last_wal_replay_lsn() THEN 0
+        ELSE EXTRACT(EPOCH FROM now() - pg_last_xact_replay_timestamp())
+    END AS lag_secs,
+    CASE
+        WHEN NOT pg_is_in_recovery() THEN LOCALTIMESTAMP
+        WHEN pg_last_wal_receive_lsn() = pg_last_wal_replay_lsn() THEN LOCALTIMESTAMP
+        ELSE CAST(pg_last_xact_replay_timestamp() AS timestamp)
+    END AS replayed_until
+"""
+
+# engine - engine to read from
+# max_last_modified - latest modification date of the titles that may be read, or None
+ReadSource = namedtuple('ReadSource', ['name', 'engine', 'max_last_modified'])
+
+# outcome of the last replica check, for the status endpoint
+ReplicaCheck = namedtuple('ReplicaCheck', ['checked_at', 'lag_secs', 'source_name', 'error'])
+
+_last_replica_check = None  # type: ReplicaCheck
+_replica_check_lock = threading.Lock()
+
+
+def is_replica_configured():
+    return read_replica_db is not None
+
+
+def get_source_engines():
+    """(name, engine) of each database pages may be read from"""
+    source_engines = [(PRIMARY_SOURCE_NAME, db)]
+
+    if is_replica_configured():
+        source_engines.append((REPLICA_SOURCE_NAME, read_replica_db))
+
+    return source_engines
+
+
+def get_read_source():
+    """The source the next page should be read from"""
+    if not is_replica_configured():
+        return ReadSource(PRIMARY_SOURCE_NAME, db, None)
+
+    try:
+        lag_secs, replayed_until = _get_replica_status()
+    except Exception as e:
+        LOGGER.warning('Failed to check the read replica - reading from the primary database',
+                       exc_info=e)
+        _record_replica_check(None, PRIMARY_SOURCE_NAME, str(e))
+        return ReadSource(PRIMARY_SOURCE_NAME, db, None)
+
+    if lag_secs is None or replayed_until is None:
+        LOGGER.warning('Read replica reports no replayed transactions - reading from the primary')
+        _record_replica_check(None, PRIMARY_SOURCE_NAME, 'No replayed transactions')
+        return ReadSource(PRIMARY_SOURCE_NAME, db, None)
+
+    if lag_secs > CONFIG_DICT['REPLICA_MAX_LAG_SECS']:
+        LOGGER.warning('Read replica lags behind by {:.1f}s - reading from the primary'.format(
+            lag_secs
+        ))
+        _record_replica_check(lag_secs, PRIMARY_SOURCE_NAME, None)
+        return ReadSource(PRIMARY_SOURCE_NAME, db, None)
+
+    _record_replica_check(lag_secs, REPLICA_SOURCE_NAME, None)
+    max_last_modified = replayed_until - timedelta(
+        seconds=CONFIG_DICT['REPLICA_SAFETY_MARGIN_SECS']
+    )
+    return ReadSource(REPLICA_SOURCE_NAME, read_replica_db, max_last_modified)
+
+
+def get_last_replica_check():
+    with _replica_check_lock:
+        return _last_replica_check
+
+
+def _get_replica_status():
+    connection = read_replica_db.connect()
+
+    try:
+        row = connection.execute(REPLICA_STATUS_SQL).fetchone()
+        lag_secs = float(row[0]) if row[0] is not None else None
+        return lag_secs, row[1]
+    finally:
+        connection.close()
+
+
+def _record_replica_check(lag_secs, source_name, error):
+    global _last_replica_check
+
+    with _replica_check_lock:
+        _last_replica_check = ReplicaCheck(datetime.utcnow(), lag_secs, source_name, error)
@@ -1,4 +1,6 @@
-from datetime import datetime
+from datetime import datetime, timedelta, timezone
+
+EPOCH = datetime(1970, 1, 1)
 
 
 def format_date_with_millis(date):
@@ -10,3 +12,36 @@ def format_date_with_millis(date):
 
 def string_to_date(datetime_string):
     return datetime.strptime(datetime_string, '%Y-%m-%dT%H:%M:%S.%f%z')
+
+
+def string_to_naive_utc_date(datetime_string):
+    """Naive UTC date of an ISO 8601 date string. Dates without an offset are taken to be UTC.
+    >>> string_to_naive_utc_date('2015-04-20T12:23:34.000005+01:00')
+    datetime.datetime(2015, 4, 20, 11, 23, 34, 5)
+    """
+    date = datetime.fromisoformat(datetime_string)
+
+    if date.tzinfo is not None:
+        date = date.astimezone(timezone.utc).replace(tzinfo=None)
+
+    return date
+
+
+def to_epoch_micros(date):
+    """Number of microseconds since the epoch. Naive dates are treated as UTC.
+    >>> to_epoch_micros(datetime(2015, 4, 20, 12, 23, 34, 5))
+    1429532614000005
+    """
+    if date.tzinfo is not None:
+        date = date.astimezone(timezone.utc).replace(tzinfo=None)
+
+    delta = date - EPOCH
+    return (delta.days * 86400 + delta.seconds) * 1000000 + delta.microseconds
+
+
+def from_epoch_micros(micros):
+    """Naive UTC date of the given number of microseconds since the epoch.
+    >>> from_epoch_micros(1429532614000005)
+    datetime.datetime(2015, 4, 20, 12, 23, 34, 5)
+    """
+    return EPOCH + timedelta(microseconds=micros)
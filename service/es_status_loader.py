@@ -32,11 +32,20 @@ def load_index_updater_status(index_updater):
     LOGGER.info("Loaded update status for '{}'".format(index_updater.id))
 
 
-def _retrieve_index_updater_status(index_name, doc_type):
+def load_write_target_status(write_target):
+    index_update_status = _retrieve_index_updater_status(
+        write_target.index_name, write_target.doc_type, write_target.client
+    )
+
+    write_target.last_title_modification_date = index_update_status['last_modification_date']
+    write_target.last_updated_title_number = index_update_status['last_updated_title_number']
+
+
+def _retrieve_index_updater_status(index_name, doc_type, client=None):
     _log_status_load_start(index_name, doc_type)
 
     try:
-        latest_title_result = es_utils.search(SEARCH_QUERY, index_name, doc_type)
+        latest_title_result = es_utils.search(SEARCH_QUERY, index_name, doc_type, client=client)
         latest_title = latest_title_result[0] if latest_title_result else None
 
         # default values
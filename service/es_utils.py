@@ -1,26 +1,52 @@
 from elasticsearch import Elasticsearch         # type: ignore
 from elasticsearch.client import IndicesClient  # type: ignore
-from elasticsearch.helpers import bulk          # type: ignore
 import logging
+import threading
 
 from config import CONFIG_DICT
+from service import bulk_backpressure
+from service.bulk_coalescer import BulkCoalescer
 
 
 LOGGER = logging.getLogger(__name__)
 
 ELASTICSEARCH_NODES = [CONFIG_DICT['ELASTICSEARCH_URI']]
+EXTERNAL_VERSION_TYPE = 'external'
+# accepts a write with the same version as the indexed document, to replace it in place
+EXTERNAL_GTE_VERSION_TYPE = 'external_gte'
+SCROLL_KEEP_ALIVE = '5m'
+VERSION_CONFLICT_STATUS = 409
 
 elasticsearch_client = Elasticsearch(ELASTICSEARCH_NODES)
 indices_client = IndicesClient(elasticsearch_client)
 
+_clients_by_uri = {CONFIG_DICT['ELASTICSEARCH_URI']: elasticsearch_client}
+_clients_lock = threading.Lock()
+_coalescers_by_client = {}  # type: dict
 
-def ensure_mapping_exists(index_name, doc_type, mapping):
-    if index_name not in elasticsearch_client.indices.status()['indices']:
+
+def get_client(elasticsearch_uri=None):
+    """Client of the cluster with the given URI - the default cluster when no URI is given"""
+    if not elasticsearch_uri:
+        return elasticsearch_client
+
+    with _clients_lock:
+        if elasticsearch_uri not in _clients_by_uri:
+            _clients_by_uri[elasticsearch_uri] = Elasticsearch([elasticsearch_uri])
+
+        return _clients_by_uri[elasticsearch_uri]
+
+
+def ensure_mapping_exists(index_name, doc_type, mapping, client=None):
+    client = client or elasticsearch_client
+    mapping_client = indices_client if client is elasticsearch_client else IndicesClient(client)
+
+    if index_name not in client.indices.status()['indices']:
         LOGGER.info(
             "Index '{}' not found in elasticsearch. Creating...".format(index_name)
         )
 
-        elasticsearch_client.index(index=index_name, doc_type=doc_type, body={})
+        client.index(index=index_name, doc_type=doc_type, body={})
     else:
         LOGGER.info("Index '{}' with doc type '{}' already exists".format(index_name, doc_type))
 
@@ -28,23 +54,133 @@ def ensure_mapping_exists(index_name, doc_type, mapping):
         index_name, doc_type
     ))
 
-    indices_client.put_mapping(
+    mapping_client.put_mapping(
         index=index_name, doc_type=doc_type, body=mapping,
     )
 
 
-def execute_elasticsearch_actions(actions):
-    return bulk(elasticsearch_client, actions)
+def execute_elasticsearch_actions(actions, client=None):
+    # actions can be a generator - only one chunk of them is held in memory at a time
+    client = client or elasticsearch_client
+
+    if CONFIG_DICT['BULK_COALESCING_ENABLED']:
+        return get_coalescer(client).execute(actions)
+
+    return bulk_backpressure.execute_bulk(client, actions)
+
+
+def get_coalescer(client):
+    """Coalescer of the bulk requests written with the client, created on first use"""
+    with _clients_lock:
+        if client not in _coalescers_by_client:
+            _coalescers_by_client[client] = BulkCoalescer(client)
+
+        return _coalescers_by_client[client]
+
+
+def get_bulk_budgets():
+    """Bulk budgets of the clusters written to so far, by URI"""
+    with _clients_lock:
+        clients_by_uri = dict(_clients_by_uri)
+
+    budgets_by_uri = {
+        uri: bulk_backpressure.find_budget(client) for uri, client in clients_by_uri.items()
+    }
+    return {uri: budget for uri, budget in budgets_by_uri.items() if budget}
 
 
-def search(query_dict, index_name, doc_type):
-    result = elasticsearch_client.search(
+def search(query_dict, index_name, doc_type, client=None):
+    result = (client or elasticsearch_client).search(
         index=index_name, doc_type=doc_type, body=query_dict
     )
 
     return result['hits']['hits']
 
 
+def scroll_documents_by_id(index_name, doc_type, batch_size, client=None,
+                           with_versions=False, query=None):
+    """Yields all documents of the doc type - or the ones matching the query - as search hits,
+    in order of their IDs. Only one batch of them is held in memory at a time. With versions,
+    hits have their _version."""
+    client = client or elasticsearch_client
+    # _uid is <doc type>#<id>, so within a doc type it sorts the same way as the ID
+    body = {'query': query or {'match_all': {}}, 'sort': [{'_uid': 'asc'}]}
+
+    if with_versions:
+        body['version'] = True
+
+    result = client.search(
+        index=index_name, doc_type=doc_type, scroll=SCROLL_KEEP_ALIVE, size=batch_size, body=body,
+    )
+    scroll_id = result.get('_scroll_id')
+
+    try:
+        while result['hits']['hits']:
+            for hit in result['hits']['hits']:
+                yield hit
+
+            scroll_id = result.get('_scroll_id', scroll_id)
+            result = client.scroll(scroll_id=scroll_id, scroll=SCROLL_KEEP_ALIVE)
+    finally:
+        if scroll_id:
+            client.clear_scroll(scroll_id=scroll_id, ignore=[404])
+
+
+def scroll_document_ids(index_name, doc_type, batch_size, client=None):
+    """Yields the IDs of all documents of the doc type, in no particular order, without
+    fetching their sources"""
+    client = client or elasticsearch_client
+    result = client.search(
+        index=index_name, doc_type=doc_type, scroll=SCROLL_KEEP_ALIVE, size=batch_size,
+        search_type='scan', body={'query': {'match_all': {}}, '_source': False},
+    )
+    scroll_id = result.get('_scroll_id')
+
+    try:
+        # a scan returns no hits until the first scroll
+        result = client.scroll(scroll_id=scroll_id, scroll=SCROLL_KEEP_ALIVE)
+
+        while result['hits']['hits']:
+            for hit in result['hits']['hits']:
+                yield hit['_id']
+
+            scroll_id = result.get('_scroll_id', scroll_id)
+            result = client.scroll(scroll_id=scroll_id, scroll=SCROLL_KEEP_ALIVE)
+    finally:
+        if scroll_id:
+            client.clear_scroll(scroll_id=scroll_id, ignore=[404])
+
+
+def count_documents(index_name, doc_type, client=None):
+    result = (client or elasticsearch_client).count(index=index_name, doc_type=doc_type)
+    return result['count']
+
+
+def refresh_index(index_name, client=None):
+    (client or elasticsearch_client).indices.refresh(index=index_name)
+
+
+def get_document(index_name, doc_type, id, client=None):
+    """Source of the document with the given ID, or None when there's no such document"""
+    result = (client or elasticsearch_client).get(
+        index=index_name, doc_type=doc_type, id=id, ignore=[404]
+    )
+
+    return result['_source'] if result.get('found') else None
+
+
+def index_document(index_name, doc_type, id, document, client=None):
+    (client or elasticsearch_client).index(
+        index=index_name, doc_type=doc_type, id=id, body=document
+    )
+
+
+def delete_document(index_name, doc_type, id, client=None):
+    (client or elasticsearch_client).delete(
+        index=index_name, doc_type=doc_type, id=id, ignore=[404]
+    )
+
+
 def get_upsert_action(index_name, doc_type, document, id):
     return {
         'doc_as_upsert': True,
@@ -56,14 +192,65 @@ def get_upsert_action(index_name, doc_type, document, id):
     }
 
 
-def get_delete_action(index_name, doc_type, id):
+def get_index_action(index_name, doc_type, document, id):
+    """Full-document write, replacing whatever document has the ID"""
     return {
+        '_op_type': 'index',
+        '_index': index_name,
+        '_type': doc_type,
+        '_id': id,
+        '_source': document,
+    }
+
+
+def get_create_action(index_name, doc_type, document, id):
+    """Write which elasticsearch rejects when there's a document with the ID already"""
+    action = get_index_action(index_name, doc_type, document, id)
+    action['_op_type'] = 'create'
+    return action
+
+
+def get_versioned_index_action(index_name, doc_type, document, id, version,
+                               version_type=EXTERNAL_VERSION_TYPE):
+    """Full-document write which elasticsearch rejects when it already holds a newer version"""
+    action = get_index_action(index_name, doc_type, document, id)
+    action['_version'] = version
+    action['_version_type'] = version_type
+    return action
+
+
+def get_delete_action(index_name, doc_type, id, version=None,
+                      version_type=EXTERNAL_VERSION_TYPE):
+    action = {
         '_op_type': 'delete',
         '_index': index_name,
         '_type': doc_type,
         '_id': id,
     }
 
+    if version is not None:
+        action['_version'] = version
+        action['_version_type'] = version_type
+
+    return action
+
+
+def is_version_conflict(error):
+    """Tells if a bulk error item is a rejection of a write older than the indexed document"""
+    return any(item.get('status') == VERSION_CONFLICT_STATUS for item in error.values())
+
 
 def get_cluster_info():
     return elasticsearch_client.info()
+
+
+def close_clients():
+    """Closes the connection pools of all clients, on shutdown - they can't be used afterwards"""
+    with _clients_lock:
+        clients = list(_clients_by_uri.values())
+
+    for client in clients:
+        for connection in client.transport.connection_pool.connections:
+            # the urllib3 pool of each node - elasticsearch-py 1.x clients have no close method
+            if hasattr(connection, 'pool'):
+                connection.pool.close()
@@ -0,0 +1,274 @@
+"""Freshness of the indexes - how long source changes take to become searchable.
+
+For every document elasticsearch acknowledges, the delay between its title's last_modified and
+the acknowledgement is recorded in a histogram of the updater, along with its stages:
+
+    polling_wait - from last_modified until the synchroniser started reading the page
+    fetch - reading the page from the source database
+    transform - preparing the page's actions
+    bulk - writing the page to elasticsearch, including waits for the bulk budget
+
+A page is read, transformed and written in chunks at the same time, so the stage times of a
+page are what its reads and transforms took between them, and the rest of it. All documents of
+a page are acknowledged when its write returns. Actions rejected as stale writes aren't
+counted, as a newer version of the document was already there.
+
+Histograms have fixed buckets, so they take the same memory however long the service runs.
+Percentiles are estimated from them, for the status endpoint, and they're served as
+Prometheus histograms by the metrics endpoint.
+"""
+import bisect
+from datetime import datetime
+import threading
+import time
+
+TOTAL = 'total'
+POLLING_WAIT_STAGE = 'polling_wait'
+FETCH_STAGE = 'fetch'
+TRANSFORM_STAGE = 'transform'
+BULK_STAGE = 'bulk'
+STAGES = [POLLING_WAIT_STAGE, FETCH_STAGE, TRANSFORM_STAGE, BULK_STAGE]
+
+# upper bounds of the buckets, in seconds - one more bucket takes the delays beyond them
+BUCKET_BOUNDS_SECS = [
+    0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1, 2.5, 5, 10, 30, 60, 120, 300, 600, 1800, 3600, 21600,
+    86400,
+]
+PERCENTILES = [50, 95, 99]
+
+_histograms_by_updater = {}  # type: dict
+_histograms_lock = threading.Lock()
+
+
+class Histogram():
+
+    def __init__(self):
+        self.bucket_counts = [0] * (len(BUCKET_BOUNDS_SECS) + 1)
+        self.count = 0
+        self.sum = 0.0
+        self.max = 0.0
+        self._lock = threading.Lock()
+
+    def observe(self, value, count=1):
+        value = max(value, 0.0)
+
+        with self._lock:
+            self.bucket_counts[bisect.bisect_left(BUCKET_BOUNDS_SECS, value)] += count
+            self.count += count
+            self.sum += value * count
+            self.max = max(self.max, value)
+
+    def to_dict(self):
+        with self._lock:
+            return {
+                'bucket_counts': list(self.bucket_counts),
+                'count': self.count,
+                'sum': self.sum,
+                'max': self.max,
+            }
+
+
+class PageFreshness():
+    """Times the stages of a page as its titles and actions stream through, and records the
+    freshness of the documents acknowledged.
+
+    Pages are streamed, so the polling waits of a page's actions are kept in buckets rather than
+    one by one. When some of the actions fail, the rest are recorded in proportion across the
+    buckets."""
+
+    def __init__(self, updater_id):
+        self.updater_id = updater_id
+        self.started_at = datetime.utcnow()
+        self._start = time.perf_counter()
+        self.fetch_secs = 0.0
+        self._prepare_secs = 0.0
+        self._current_wait_secs = None
+        self._wait_counts = [0] * (len(BUCKET_BOUNDS_SECS) + 1)
+        self._wait_sums = [0.0] * (len(BUCKET_BOUNDS_SECS) + 1)
+        self.action_count = 0
+
+    def track_titles(self, titles):
+        titles = iter(titles)
+
+        while True:
+            start = time.perf_counter()
+
+            try:
+                title = next(titles)
+            except StopIteration:
+                return
+            finally:
+                self.fetch_secs += time.perf_counter() - start
+
+            self._current_wait_secs = max(
+                (self.started_at - title.last_modified).total_seconds(), 0.0
+            )
+            yield title
+
+    def track_actions(self, elasticsearch_actions):
+        """Actions of the titles read with track_titles - reading an action reads its title, so
+        the title read last is the one the action was prepared for, or the last of its batch"""
+        elasticsearch_actions = iter(elasticsearch_actions)
+
+        while True:
+            start = time.perf_counter()
+
+            try:
+                action = next(elasticsearch_actions)
+            except StopIteration:
+                return
+            finally:
+                self._prepare_secs += time.perf_counter() - start
+
+            if self._current_wait_secs is not None:
+                position = bisect.bisect_left(BUCKET_BOUNDS_SECS, self._current_wait_secs)
+                self._wait_counts[position] += 1
+                self._wait_sums[position] += self._current_wait_secs
+                self.action_count += 1
+
+            yield action
+
+    @property
+    def transform_secs(self):
+        return max(self._prepare_secs - self.fetch_secs, 0.0)
+
+    def record_acknowledged(self, errors):
+        """Records the freshness of the page's actions, leaving out as many as there are errors"""
+        page_secs = time.perf_counter() - self._start
+        acknowledged_count = self.action_count - len(errors)
+
+        if acknowledged_count <= 0:
+            return
+
+        histograms = get_histograms(self.updater_id)
+        acknowledged_ratio = acknowledged_count / self.action_count
+
+        for wait_count, wait_sum in zip(self._wait_counts, self._wait_sums):
+            count = int(round(wait_count * acknowledged_ratio))
+
+            if count:
+                mean_wait_secs = wait_sum / wait_count
+                histograms[TOTAL].observe(mean_wait_secs + page_secs, count)
+                histograms[POLLING_WAIT_STAGE].observe(mean_wait_secs, count)
+
+        histograms[FETCH_STAGE].observe(self.fetch_secs, acknowledged_count)
+        histograms[TRANSFORM_STAGE].observe(self.transform_secs, acknowledged_count)
+        histograms[BULK_STAGE].observe(
+            page_secs - self.fetch_secs - self.transform_secs, acknowledged_count
+        )
+
+
+def get_histograms(updater_id):
+    """Histograms of the updater, by stage and TOTAL, created on first use"""
+    with _histograms_lock:
+        if updater_id not in _histograms_by_updater:
+            _histograms_by_updater[updater_id] = {
+                name: Histogram() for name in [TOTAL] + STAGES
+            }
+
+        return _histograms_by_updater[updater_id]
+
+
+def get_snapshot():
+    """Contents of all histograms, by updater and stage - what the metrics are formatted from"""
+    with _histograms_lock:
+        histograms_by_updater = dict(_histograms_by_updater)
+
+    return {
+        updater_id: {name: histogram.to_dict() for name, histogram in histograms.items()}
+        for updater_id, histograms in histograms_by_updater.items()
+    }
+
+
+def get_updater_snapshot(updater_id):
+    """Contents of the updater's histograms, by stage - None if nothing was recorded yet"""
+    with _histograms_lock:
+        histograms = _histograms_by_updater.get(updater_id)
+
+    if histograms is None:
+        return None
+
+    return {name: histogram.to_dict() for name, histogram in histograms.items()}
+
+
+def get_percentiles(histogram_dict):
+    return {
+        'p{}_secs'.format(percentile): _estimate_percentile(histogram_dict, percentile)
+        for percentile in PERCENTILES
+    }
+
+
+def get_freshness_status(updater_histograms):
+    """Percentiles of an updater's histograms (see get_snapshot), as shown in the status"""
+    status = dict(get_percentiles(updater_histograms[TOTAL]),
+                  count=updater_histograms[TOTAL]['count'])
+    status['stages'] = {stage: get_percentiles(updater_histograms[stage]) for stage in STAGES}
+    return status
+
+
+def format_metrics(snapshot):
+    """Histograms of a snapshot in the Prometheus text format"""
+    lines = [
+        '# HELP sync_freshness_seconds Delay from source modification to index acknowledgement',
+        '# TYPE sync_freshness_seconds histogram',
+    ]
+
+    for updater_id, updater_histograms in sorted(snapshot.items()):
+        lines.extend(_format_histogram(
+            'sync_freshness_seconds', {'updater': updater_id}, updater_histograms[TOTAL]
+        ))
+
+    lines.extend([
+        '# HELP sync_freshness_stage_seconds Stages of the delay from source modification to '
+        'index acknowledgement',
+        '# TYPE sync_freshness_stage_seconds histogram',
+    ])
+
+    for updater_id, updater_histograms in sorted(snapshot.items()):
+        for stage in STAGES:
+            lines.extend(_format_histogram(
+                'sync_freshness_stage_seconds', {'updater': updater_id, 'stage': stage},
+                updater_histograms[stage],
+            ))
+
+    return '\n'.join(lines) + '\n'
+
+
+def _format_histogram(name, labels, histogram_dict):
+    label_string = ','.join('{}="{}"'.format(key, value) for key, value in sorted(labels.items()))
+    lines = []
+    cumulative_count = 0
+
+    for bound, bucket_count in zip(BUCKET_BOUNDS_SECS + ['+Inf'], histogram_dict['bucket_counts']):
+        cumulative_count += bucket_count
+        lines.append('{}_bucket{{{},le="{}"}} {}'.format(
+            name, label_string, bound, cumulative_count
+        ))
+
+    lines.append('{}_sum{{{}}} {}'.format(name, label_string, histogram_dict['sum']))
+    lines.append('{}_count{{{}}} {}'.format(name, label_string, histogram_dict['count']))
+    return lines
+
+
+def _estimate_percentile(histogram_dict, percentile):
+    """Interpolates within the bucket the percentile falls in - the last bucket ends at the
+    largest value observed. None when nothing was observed."""
+    count = histogram_dict['count']
+
+    if not count:
+        return None
+
+    rank = count * percentile / 100
+    cumulative_count = 0
+    upper_bounds = BUCKET_BOUNDS_SECS + [max(histogram_dict['max'], BUCKET_BOUNDS_SECS[-1])]
+
+    for position, bucket_count in enumerate(histogram_dict['bucket_counts']):
+        if bucket_count and cumulative_count + bucket_count >= rank:
+            lower_bound = upper_bounds[position - 1] if position else 0.0
+            upper_bound = min(upper_bounds[position], histogram_dict['max'])
+            fraction = (rank - cumulative_count) / bucket_count
+            return round(lower_bound + (upper_bound - lower_bound) * fraction, 3)
+
+        cumulative_count += bucket_count
+
+    return round(histogram_dict['max'], 3)
@@ -0,0 +1,253 @@
+"""Bloom filters of the IDs of the documents in the updaters' indexes, to drop pointless deletes.
+
+Deleted titles turn into delete actions for the documents they would have had, which often
+were never written - titles created and deleted between polls, or addresses and postcodes the
+updater never indexed. Elasticsearch answers each of them with not_found.
+
+With DELETE_FILTER_ENABLED set, each updater writing only to its own index keeps a Bloom filter
+of the IDs of its documents. The filter is built from an ID-only scroll of the index, refreshed
+first, at the start of the updater's first synchronisation after it's prepared for use - on
+startup, or when this instance takes over its lease, which drops any filter it had - and IDs
+are added as actions writing them are prepared. The scroll of a large index takes a while, so
+it's run by the updater's sync thread rather than while the leases are refreshed. Delete
+actions for IDs the filter has never seen are dropped. A Bloom filter can claim to have seen an
+ID it hasn't, which only keeps a pointless delete, but never the other way round.
+
+IDs can't be removed from a Bloom filter, so the filter only grows. Once it holds more IDs
+than it was sized for, its false positive rate goes up, and it's rebuilt before the updater's
+next synchronisation - as is a filter that failed to build.
+
+A document written without passing through the filter would have its deletes dropped, so
+filters are only used when a single process writes each updater's index - the sync process
+(SYNC_MODE=external). The commands writing to the indexes from processes of their own - replays,
+re-syncs, reconciliations, ID migrations and bootstraps - suspend the filters of the updaters
+they write for while they run (see service.sync_process.suspend_id_filters), and the filters are
+built again once they're done.
+"""
+import hashlib
+import logging
+import math
+import threading
+
+from config import CONFIG_DICT
+from service import es_utils
+
+# sync_process imports the sync manager, which imports this module
+EXTERNAL_SYNC_MODE = 'external'
+
+LOGGER = logging.getLogger(__name__)
+
+WRITE_OP_TYPES = {'index', 'create', 'update'}
+DELETE_OP_TYPE = 'delete'
+# the filter is sized for this many times the documents in the index when it's built
+CAPACITY_GROWTH_FACTOR = 2
+
+_filters_by_updater = {}  # type: dict
+_suspension_counts_by_updater = {}  # type: dict
+_filters_lock = threading.Lock()
+
+
+class BloomFilter():
+
+    def __init__(self, capacity, false_positive_rate):
+        self.capacity = max(capacity, 1)
+        self.bit_count = max(
+            int(-self.capacity * math.log(false_positive_rate) / (math.log(2) ** 2)), 8
+        )
+        self.hash_count = max(int(round(self.bit_count / self.capacity * math.log(2))), 1)
+        self.id_count = 0
+        self._bits = bytearray((self.bit_count + 7) // 8)
+        self._lock = threading.Lock()
+
+    @property
+    def size_bytes(self):
+        return len(self._bits)
+
+    @property
+    def is_saturated(self):
+        return self.id_count > self.capacity
+
+    def add(self, id):
+        positions = self._get_bit_positions(id)
+
+        # bits are set by read-modify-write, so concurrent adds could lose one another's bits
+        with self._lock:
+            for position in positions:
+                self._bits[position >> 3] |= 1 << (position & 7)
+
+            self.id_count += 1
+
+    def __contains__(self, id):
+        return all(
+            self._bits[position >> 3] & (1 << (position & 7))
+            for position in self._get_bit_positions(id)
+        )
+
+    def _get_bit_positions(self, id):
+        # double hashing - the positions are derived from the two halves of a single digest
+        digest = hashlib.blake2b(id.encode('utf-8'), digest_size=16).digest()
+        first_hash = int.from_bytes(digest[:8], 'little')
+        second_hash = int.from_bytes(digest[8:], 'little') | 1
+        return [
+            (first_hash + number * second_hash) % self.bit_count
+            for number in range(self.hash_count)
+        ]
+
+
+class IdFilter():
+    """Bloom filter of an updater's document IDs. IDs written while it's being built are added
+    as well, but deletes are only dropped once it's complete."""
+
+    def __init__(self, capacity):
+        self.bloom_filter = BloomFilter(
+            capacity, CONFIG_DICT['DELETE_FILTER_FALSE_POSITIVE_RATE']
+        )
+        self.is_ready = False
+        self.dropped_delete_count = 0
+
+    def to_dict(self):
+        return {
+            'is_ready': self.is_ready,
+            'id_count': self.bloom_filter.id_count,
+            'capacity': self.bloom_filter.capacity,
+            'size_bytes': self.bloom_filter.size_bytes,
+            'dropped_deletes': self.dropped_delete_count,
+        }
+
+
+def is_filter_applicable(index_updater):
+    # write targets are separate indexes, each with documents of its own
+    return CONFIG_DICT['DELETE_FILTER_ENABLED'] and \
+        CONFIG_DICT['SYNC_MODE'] == EXTERNAL_SYNC_MODE and \
+        not list(index_updater.write_targets) and not is_suspended(index_updater.id)
+
+
+def build_filter(index_updater):
+    """Replaces the updater's filter with one built from the IDs in its index"""
+    if not is_filter_applicable(index_updater):
+        return
+
+    # documents written since the last refresh wouldn't be found by the scroll
+    es_utils.refresh_index(index_updater.index_name)
+    document_count = es_utils.count_documents(index_updater.index_name, index_updater.doc_type)
+    id_filter = IdFilter(max(
+        document_count * CAPACITY_GROWTH_FACTOR, CONFIG_DICT['DELETE_FILTER_MIN_CAPACITY']
+    ))
+    LOGGER.info("Building ID filter of updater '{}' from {} document(s)".format(
+        index_updater.id, document_count
+    ))
+
+    with _filters_lock:
+        # suspended while the index was counted
+        if index_updater.id in _suspension_counts_by_updater:
+            return
+
+        _filters_by_updater[index_updater.id] = id_filter
+
+    try:
+        for id in es_utils.scroll_document_ids(
+                index_updater.index_name, index_updater.doc_type,
+                CONFIG_DICT['DELETE_FILTER_SCROLL_SIZE']):
+            id_filter.bloom_filter.add(id)
+    except Exception:
+        # deletes are all sent until the filter is built
+        with _filters_lock:
+            _filters_by_updater.pop(index_updater.id, None)
+
+        raise
+
+    id_filter.is_ready = True
+    LOGGER.info("Built ID filter of updater '{}': {}".format(
+        index_updater.id, id_filter.to_dict()
+    ))
+
+
+def ensure_filter_current(index_updater):
+    """Builds the updater's filter when it has none, after a failure, or it's over capacity"""
+    if not is_filter_applicable(index_updater):
+        return
+
+    id_filter = get_filter(index_updater.id)
+
+    if id_filter is None or id_filter.bloom_filter.is_saturated:
+        build_filter(index_updater)
+
+
+def drop_filter(updater_id):
+    """Drops the updater's filter, for it to be built again before its next synchronisation"""
+    with _filters_lock:
+        _filters_by_updater.pop(updater_id, None)
+
+
+def suspend_filters(updater_ids):
+    """Drops the filters of the updaters, and builds none until they're resumed, for another
+    process to write to their indexes"""
+    with _filters_lock:
+        for updater_id in updater_ids:
+            _suspension_counts_by_updater[updater_id] = \
+                _suspension_counts_by_updater.get(updater_id, 0) + 1
+            _filters_by_updater.pop(updater_id, None)
+
+    LOGGER.info('Suspended ID filters of updaters: {}'.format(', '.join(updater_ids)))
+
+
+def resume_filters(updater_ids):
+    """Lets the filters of the updaters be built again, before their next synchronisations"""
+    with _filters_lock:
+        for updater_id in updater_ids:
+            suspension_count = _suspension_counts_by_updater.pop(updater_id, 0) - 1
+
+            if suspension_count > 0:
+                _suspension_counts_by_updater[updater_id] = suspension_count
+
+    LOGGER.info('Resumed ID filters of updaters: {}'.format(', '.join(updater_ids)))
+
+
+def is_suspended(updater_id):
+    with _filters_lock:
+        return updater_id in _suspension_counts_by_updater
+
+
+def get_filter(updater_id):
+    with _filters_lock:
+        return _filters_by_updater.get(updater_id)
+
+
+def filter_actions(index_updater, elasticsearch_actions):
+    """Passes the actions through, adding the IDs they write to the updater's filter and
+    dropping deletes of IDs the filter has never seen"""
+    id_filter = get_filter(index_updater.id)
+
+    if id_filter is None:
+        return elasticsearch_actions
+
+    return _filter_actions(id_filter, elasticsearch_actions)
+
+
+def add_written_ids(index_updater, elasticsearch_actions):
+    """Adds the IDs the actions write to the updater's filter, for writes made outside the
+    synchroniser"""
+    id_filter = get_filter(index_updater.id)
+
+    if id_filter is None:
+        return
+
+    for action in elasticsearch_actions:
+        if action.get('_op_type', 'index') in WRITE_OP_TYPES:
+            id_filter.bloom_filter.add(action['_id'])
+
+
+def _filter_actions(id_filter, elasticsearch_actions):
+    bloom_filter = id_filter.bloom_filter
+
+    for action in elasticsearch_actions:
+        op_type = action.get('_op_type', 'index')
+
+        if op_type in WRITE_OP_TYPES:
+            bloom_filter.add(action['_id'])
+        elif op_type == DELETE_OP_TYPE and id_filter.is_ready and \
+                action['_id'] not in bloom_filter:
+            id_filter.dropped_delete_count += 1
+            continue
+
+        yield action
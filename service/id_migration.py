@@ -0,0 +1,205 @@
+"""Migration of an index written by property-by-address-v1-updater to the compact document IDs
+of property-by-address-v2-updater.
+
+Documents keep their sources - only their IDs change. The index is scrolled and each document
+whose ID isn't the compact ID of its title number and address is copied under the compact ID,
+then deleted once the copy is in. Copies never overwrite a document the new updater has written
+already: with versioned writes they carry the version of the original and elasticsearch rejects
+them when the document is newer, otherwise they're created only when there's no such document.
+The legacy documents are deleted all the same, as they're superseded either way.
+
+Nothing is read from the source database, so the migration takes a fraction of the time of a
+full re-sync. It's meant to be run with the service stopped, after index_updaters.json is
+switched to the new updater. While the service runs, a title deleted before its legacy document
+is migrated would get the document back - a reconciliation afterwards removes any such orphans.
+
+To migrate the index of a configured updater from the command line:
+
+    python -m service.id_migration property-by-address-v2-updater [--dry-run]
+"""
+import argparse
+import json
+import logging
+
+from config import CONFIG_DICT
+from service import es_utils
+from service.updaters import property_by_address_updater_v2
+
+LOGGER = logging.getLogger(__name__)
+
+
+class IdMigration():
+    """Progress of an ID migration. Without migrate, legacy documents are only counted."""
+
+    def __init__(self, updater_id, migrate=True):
+        self.updater_id = updater_id
+        self.migrate = migrate
+        self.documents_checked = 0
+        self.legacy_count = 0
+        self.copied_count = 0
+        self.already_copied_count = 0
+        self.deleted_count = 0
+        self.failed_count = 0
+
+    def to_dict(self):
+        return {
+            'updater_id': self.updater_id,
+            'migrate': self.migrate,
+            'documents_checked': self.documents_checked,
+            'legacy_count': self.legacy_count,
+            'copied_count': self.copied_count,
+            'already_copied_count': self.already_copied_count,
+            'deleted_count': self.deleted_count,
+            'failed_count': self.failed_count,
+        }
+
+
+def migrate_document_ids(index_updater, id_migration, batch_size=None):
+    """Moves the documents of the updater's index, and of each of its write targets, that have
+    legacy IDs over to compact ones"""
+    batch_size = batch_size or CONFIG_DICT['ID_MIGRATION_BATCH_SIZE']
+
+    for index_name, doc_type, client in _get_indexes(index_updater):
+        LOGGER.info("Migrating document IDs of index '{}'. Updater: '{}'".format(
+            index_name, index_updater.id
+        ))
+        hits = es_utils.scroll_documents_by_id(
+            index_name, doc_type, batch_size, client, with_versions=index_updater.versioned_writes
+        )
+        batch = []
+
+        for hit in hits:
+            id_migration.documents_checked += 1
+
+            if _get_compact_id(index_updater, hit) != hit['_id']:
+                id_migration.legacy_count += 1
+                batch.append(hit)
+
+            if len(batch) >= batch_size:
+                _migrate_batch(index_updater, id_migration, index_name, doc_type, client, batch)
+                batch = []
+
+        _migrate_batch(index_updater, id_migration, index_name, doc_type, client, batch)
+
+    LOGGER.info("Migrated document IDs. Updater: '{}', migration: {}".format(
+        index_updater.id, id_migration.to_dict()
+    ))
+    return id_migration
+
+
+def _get_indexes(index_updater):
+    write_targets = list(index_updater.write_targets)
+
+    if write_targets:
+        return [(target.index_name, target.doc_type, target.client) for target in write_targets]
+
+    return [(index_updater.index_name, index_updater.doc_type, None)]
+
+
+def _get_compact_id(index_updater, hit):
+    title_number = hit['_source']['title_number']
+    legacy_id = index_updater.get_legacy_document_id(
+        title_number, hit['_source']['address_string']
+    )
+    return property_by_address_updater_v2.get_compact_document_id(title_number, legacy_id)
+
+
+def _migrate_batch(index_updater, id_migration, index_name, doc_type, client, hits):
+    if not hits or not id_migration.migrate:
+        return
+
+    copy_actions = [
+        _get_copy_action(index_updater, index_name, doc_type, hit) for hit in hits
+    ]
+    success_count, errors = es_utils.execute_elasticsearch_actions(copy_actions, client)
+    failed_ids = set()
+
+    for error in errors:
+        if es_utils.is_version_conflict(error):
+            # the new updater got there first, with the same or a newer document
+            id_migration.already_copied_count += 1
+        else:
+            failed_ids.add(_get_error_id(error))
+
+    id_migration.copied_count += success_count
+    id_migration.failed_count += len(failed_ids)
+
+    if failed_ids:
+        LOGGER.warning("{} document(s) failed to copy. Updater: '{}'".format(
+            len(failed_ids), index_updater.id
+        ))
+
+    # legacy documents are only deleted once their copy is in
+    delete_actions = [
+        _get_delete_action(index_updater, index_name, doc_type, hit) for hit in hits
+        if _get_compact_id(index_updater, hit) not in failed_ids
+    ]
+
+    if not delete_actions:
+        return
+
+    success_count, errors = es_utils.execute_elasticsearch_actions(delete_actions, client)
+    # a conflict means the legacy document was written again since it was scrolled
+    failed_count = len([error for error in errors if not es_utils.is_version_conflict(error)])
+    id_migration.deleted_count += success_count
+    id_migration.failed_count += failed_count
+
+    if failed_count:
+        LOGGER.warning("{} legacy document(s) failed to delete. Updater: '{}'".format(
+            failed_count, index_updater.id
+        ))
+
+
+def _get_copy_action(index_updater, index_name, doc_type, hit):
+    id = _get_compact_id(index_updater, hit)
+
+    if index_updater.versioned_writes:
+        return es_utils.get_versioned_index_action(
+            index_name, doc_type, hit['_source'], id, hit['_version']
+        )
+
+    return es_utils.get_create_action(index_name, doc_type, hit['_source'], id)
+
+
+def _get_delete_action(index_updater, index_name, doc_type, hit):
+    if index_updater.versioned_writes:
+        return es_utils.get_delete_action(
+            index_name, doc_type, hit['_id'], hit['_version'], es_utils.EXTERNAL_GTE_VERSION_TYPE
+        )
+
+    return es_utils.get_delete_action(index_name, doc_type, hit['_id'])
+
+
+def _get_error_id(error):
+    return next(iter(error.values())).get('_id')
+
+
+def main():
+    from service import sync_manager, sync_process
+
+    parser = argparse.ArgumentParser(
+        description="Moves an updater's index over to compact document IDs"
+    )
+    parser.add_argument('updater_id', help='ID of a configured updater')
+    parser.add_argument('--dry-run', action='store_true', help='only count the legacy documents')
+    args = parser.parse_args()
+
+    updater_config = sync_manager.get_index_updater_config()
+    if args.updater_id not in updater_config:
+        parser.error("Unknown updater: '{}'".format(args.updater_id))
+
+    index_updater = sync_manager.create_index_updater(
+        args.updater_id, updater_config[args.updater_id]
+    )
+    if not isinstance(index_updater, property_by_address_updater_v2.PropertyByAddressUpdaterV2):
+        parser.error("Updater '{}' doesn't write compact document IDs".format(args.updater_id))
+
+    id_migration = IdMigration(index_updater.id, migrate=not args.dry_run)
+
+    with sync_process.suspend_id_filters([index_updater.id]):
+        migrate_document_ids(index_updater, id_migration)
+    print(json.dumps(id_migration.to_dict(), indent=2, sort_keys=True))
+
+
+if __name__ == '__main__':
+    main()
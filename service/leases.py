@@ -0,0 +1,265 @@
+"""Ownership of updaters by service instances, when more than one instance runs.
+
+Each instance heartbeats into the sync_instance table, and each updater is run by the instance
+holding its lease in the sync_updater_lease table. Leases expire LEASE_TTL_SECS after their
+last renewal, so the updaters of an instance that stopped are picked up by the others within
+that time. Every instance aims for its fair share of the updaters - the number of updaters
+divided by the number of live instances, rounded up. An instance above its share gives up its
+idle updaters beyond it, and one below it takes over updaters without a live lease, so the work
+rebalances as instances join and leave.
+
+All times are the database's, so the instances' clocks don't need to agree. When a lease is
+renewed or taken, the database returns how long it has left, and the instance counts it as held
+until that much time has passed on its own monotonic clock since it sent the statement - which
+ends before the expiry the database stores.
+"""
+import logging
+import math
+import os
+import socket
+import threading
+import time
+import uuid
+
+from sqlalchemy import text  # type: ignore
+
+from config import CONFIG_DICT
+from service import db
+
+LOGGER = logging.getLogger(__name__)
+
+CREATE_TABLES_SQL = [
+    'CREATE TABLE IF NOT EXISTS sync_instance ('
+    ' instance_id VARCHAR(200) PRIMARY KEY,'
+    ' last_heartbeat TIMESTAMP WITH TIME ZONE NOT NULL)',
+    'CREATE TABLE IF NOT EXISTS sync_updater_lease ('
+    ' updater_id VARCHAR(200) PRIMARY KEY,'
+    ' owner_id VARCHAR(200) NOT NULL,'
+    ' expires_at TIMESTAMP WITH TIME ZONE NOT NULL)',
+]
+
+HEARTBEAT_SQL = text(
+    'INSERT INTO sync_instance (instance_id, last_heartbeat) VALUES (:instance_id, now()) '
+    'ON CONFLICT (instance_id) DO UPDATE SET last_heartbeat = now()'
+)
+DELETE_DEAD_INSTANCES_SQL = text(
+    "DELETE FROM sync_instance WHERE last_heartbeat < now() - :ttl_secs * interval '1 second'"
+)
+SELECT_LIVE_INSTANCES_SQL = text('SELECT instance_id FROM sync_instance ORDER BY instance_id')
+RENEW_LEASES_SQL = text(
+    "UPDATE sync_updater_lease SET expires_at = now() + :ttl_secs * interval '1 second' "
+    'WHERE owner_id = :instance_id AND expires_at >= now() '
+    'RETURNING updater_id, EXTRACT(EPOCH FROM expires_at - now())'
+)
+ACQUIRE_LEASE_SQL = text(
+    'INSERT INTO sync_updater_lease (updater_id, owner_id, expires_at) '
+    "VALUES (:updater_id, :instance_id, now() + :ttl_secs * interval '1 second') "
+    'ON CONFLICT (updater_id) DO UPDATE '
+    'SET owner_id = EXCLUDED.owner_id, expires_at = EXCLUDED.expires_at '
+    'WHERE sync_updater_lease.expires_at < now() '
+    'RETURNING updater_id, EXTRACT(EPOCH FROM sync_updater_lease.expires_at - now())'
+)
+RELEASE_LEASE_SQL = text(
+    'DELETE FROM sync_updater_lease WHERE updater_id = :updater_id AND owner_id = :instance_id'
+)
+SELECT_OWNERS_SQL = text(
+    'SELECT updater_id, owner_id FROM sync_updater_lease WHERE expires_at >= now()'
+)
+
+
+class LeaseLostError(Exception):
+    pass
+
+
+def get_default_instance_id():
+    return CONFIG_DICT['LEASE_INSTANCE_ID'] or '{}-{}-{}'.format(
+        socket.gethostname(), os.getpid(), uuid.uuid4().hex[:8]
+    )
+
+
+def get_fair_share(updater_count, live_instance_count):
+    return int(math.ceil(updater_count / max(live_instance_count, 1)))
+
+
+def create_lease_manager(updater_ids, is_busy, on_acquired):
+    """Lease manager of this instance, keeping leases in the source database"""
+    lease_store = LeaseStore(db, CONFIG_DICT['LEASE_TTL_SECS'])
+    lease_store.ensure_tables_exist()
+    return LeaseManager(
+        lease_store, get_default_instance_id(), updater_ids, is_busy, on_acquired
+    )
+
+
+class LeaseStore():
+    """The lease and instance tables"""
+
+    def __init__(self, engine, ttl_secs):
+        self._engine = engine
+        self.ttl_secs = ttl_secs
+
+    def ensure_tables_exist(self):
+        with self._engine.begin() as connection:
+            for create_table_sql in CREATE_TABLES_SQL:
+                connection.execute(text(create_table_sql))
+
+    def heartbeat(self, instance_id):
+        """Records the instance as alive and returns the IDs of all live instances"""
+        with self._engine.begin() as connection:
+            connection.execute(HEARTBEAT_SQL, instance_id=instance_id)
+            connection.execute(DELETE_DEAD_INSTANCES_SQL, ttl_secs=self.ttl_secs)
+            return [row[0] for row in connection.execute(SELECT_LIVE_INSTANCES_SQL)]
+
+    def renew(self, instance_id):
+        """Extends the instance's live leases and returns the seconds left on them as stored,
+        by the IDs of their updaters"""
+        with self._engine.begin() as connection:
+            rows = connection.execute(
+                RENEW_LEASES_SQL, instance_id=instance_id, ttl_secs=self.ttl_secs
+            )
+            return {row[0]: float(row[1]) for row in rows}
+
+    def try_acquire(self, instance_id, updater_id):
+        """Takes the updater's lease when no other instance holds a live one, and returns the
+        seconds left on it as stored - None when it wasn't taken"""
+        with self._engine.begin() as connection:
+            row = connection.execute(
+                ACQUIRE_LEASE_SQL,
+                instance_id=instance_id, updater_id=updater_id, ttl_secs=self.ttl_secs,
+            ).fetchone()
+            return float(row[1]) if row is not None else None
+
+    def release(self, instance_id, updater_id):
+        with self._engine.begin() as connection:
+            connection.execute(RELEASE_LEASE_SQL, instance_id=instance_id, updater_id=updater_id)
+
+    def get_owners(self):
+        with self._engine.begin() as connection:
+            return {row[0]: row[1] for row in connection.execute(SELECT_OWNERS_SQL)}
+
+
+class LeaseManager():
+    """Keeps this instance's leases renewed and its fair share of updaters.
+
+    is_busy - function telling whether an updater is running, as busy updaters aren't given up
+    on_acquired - function called with the ID of each updater whose lease was taken over, as
+        another instance may have moved it on since this one last ran it
+    """
+
+    def __init__(self, lease_store, instance_id, updater_ids, is_busy, on_acquired):
+        self._lease_store = lease_store
+        self.instance_id = instance_id
+        self._updater_ids = sorted(updater_ids)
+        self._is_busy = is_busy
+        self._on_acquired = on_acquired
+        self._owned_updater_ids = set()  # type: set
+        self._owners = {}                # type: dict
+        self._expiry_times = {}          # type: dict
+        self._lock = threading.Lock()
+
+    def owns(self, updater_id):
+        """Whether this instance holds the updater's lease. Leases that may have expired as
+        stored in the database, because they couldn't be renewed in time, count as lost."""
+        with self._lock:
+            return updater_id in self._owned_updater_ids and \
+                time.monotonic() < self._expiry_times.get(updater_id, 0)
+
+    def get_owner(self, updater_id):
+        """Owner of the updater as of the last refresh"""
+        with self._lock:
+            return self._owners.get(updater_id)
+
+    def refresh(self):
+        """Heartbeats, renews the leases held and rebalances towards the fair share"""
+        live_instance_ids = self._lease_store.heartbeat(self.instance_id)
+        renew_start = time.monotonic()
+        secs_left_by_updater = self._lease_store.renew(self.instance_id)
+        owned_updater_ids = set(secs_left_by_updater)
+
+        with self._lock:
+            lost_updater_ids = self._owned_updater_ids - owned_updater_ids
+            self._owned_updater_ids = set(owned_updater_ids)
+            self._expiry_times = {
+                updater_id: renew_start + secs_left
+                for updater_id, secs_left in secs_left_by_updater.items()
+            }
+
+        if lost_updater_ids:
+            LOGGER.warning('Lost the leases of updaters: {}'.format(sorted(lost_updater_ids)))
+
+        fair_share = get_fair_share(len(self._updater_ids), len(live_instance_ids))
+        owned_updater_ids = self._release_beyond_fair_share(owned_updater_ids, fair_share)
+        self._set_owned_updater_ids(owned_updater_ids)
+        self._acquire_up_to_fair_share(owned_updater_ids, fair_share)
+        owners = self._lease_store.get_owners()
+
+        with self._lock:
+            self._owners = owners
+
+    def release_idle(self):
+        """Releases the leases of the idle updaters held, so that other instances can take them
+        over without waiting for them to expire - on shutdown. Returns the IDs of the updaters."""
+        with self._lock:
+            owned_updater_ids = set(self._owned_updater_ids)
+
+        released_updater_ids = set(
+            updater_id for updater_id in owned_updater_ids if not self._is_busy(updater_id)
+        )
+
+        for updater_id in sorted(released_updater_ids):
+            self._lease_store.release(self.instance_id, updater_id)
+            LOGGER.info("Released the lease of updater '{}'".format(updater_id))
+
+        self._set_owned_updater_ids(owned_updater_ids - released_updater_ids)
+        return sorted(released_updater_ids)
+
+    def _release_beyond_fair_share(self, owned_updater_ids, fair_share):
+        idle_updater_ids = [
+            updater_id for updater_id in sorted(owned_updater_ids)
+            if not self._is_busy(updater_id)
+        ]
+        excess_count = len(owned_updater_ids) - fair_share
+        released_updater_ids = set(idle_updater_ids[::-1][:max(excess_count, 0)])
+
+        for updater_id in released_updater_ids:
+            self._lease_store.release(self.instance_id, updater_id)
+            LOGGER.info("Released the lease of updater '{}'".format(updater_id))
+
+        return owned_updater_ids - released_updater_ids
+
+    def _acquire_up_to_fair_share(self, owned_updater_ids, fair_share):
+        owned_updater_ids = set(owned_updater_ids)
+
+        for updater_id in self._updater_ids:
+            if len(owned_updater_ids) >= fair_share:
+                break
+
+            if updater_id in owned_updater_ids:
+                continue
+
+            acquire_start = time.monotonic()
+            secs_left = self._lease_store.try_acquire(self.instance_id, updater_id)
+
+            if secs_left is None:
+                continue
+
+            LOGGER.info("Acquired the lease of updater '{}'".format(updater_id))
+
+            try:
+                self._on_acquired(updater_id)
+            except Exception as e:
+                LOGGER.error("Failed to take over updater '{}' - releasing its lease".format(
+                    updater_id
+                ), exc_info=e)
+                self._lease_store.release(self.instance_id, updater_id)
+                continue
+
+            owned_updater_ids.add(updater_id)
+
+            with self._lock:
+                self._expiry_times[updater_id] = acquire_start + secs_left
+
+            self._set_owned_updater_ids(owned_updater_ids)
+
+    def _set_owned_updater_ids(self, owned_updater_ids):
+        with self._lock:
+            self._owned_updater_ids = set(owned_updater_ids)
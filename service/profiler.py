@@ -0,0 +1,141 @@
+from collections import Counter
+from datetime import datetime
+import logging
+import os
+import signal
+import sys
+import threading
+import time
+
+from config import CONFIG_DICT
+
+LOGGER = logging.getLogger(__name__)
+
+# signals gunicorn's master and workers handle - see gunicorn's signal handling docs
+GUNICORN_SIGNALS = (
+    'SIGHUP', 'SIGINT', 'SIGQUIT', 'SIGTERM', 'SIGTTIN', 'SIGTTOU', 'SIGUSR1', 'SIGUSR2',
+    'SIGWINCH', 'SIGCHLD', 'SIGABRT',
+)
+
+_profiling_lock = threading.Lock()
+
+
+class ProfilingInProgressError(Exception):
+    pass
+
+
+class StackSampler():
+    """Low-overhead sampling profiler for a set of threads.
+
+    Another thread periodically takes the current stacks of the profiled threads and counts them
+    in collapsed form ('outer;inner;innermost'), ready for flame graph tools. Nothing is hooked
+    into the profiled threads, so they run at full speed outside of the sampling moments.
+    """
+
+    def __init__(self, get_threads, interval_secs):
+        # threads are looked up on every sample, as sync threads are started on every poll
+        self._get_threads = get_threads
+        self._interval_secs = interval_secs
+
+    def sample(self, duration_secs):
+        stack_counts = Counter()  # type: Counter
+        end_time = time.monotonic() + duration_secs
+
+        while time.monotonic() < end_time:
+            self._take_sample(stack_counts)
+            time.sleep(self._interval_secs)
+
+        return stack_counts
+
+    def _take_sample(self, stack_counts):
+        threads_by_id = {thread.ident: thread for thread in self._get_threads()}
+        frames_by_thread_id = sys._current_frames()
+
+        for thread_id, thread in threads_by_id.items():
+            frame = frames_by_thread_id.get(thread_id)
+            if frame is not None:
+                stack_counts[_collapse_stack(thread.name, frame)] += 1
+
+
+def profile_sync_threads(get_threads, duration_secs):
+    """Profiles the threads for the given time and returns the stacks in collapsed format"""
+    if not _profiling_lock.acquire(blocking=False):
+        raise ProfilingInProgressError('Another profiling session is in progress')
+
+    try:
+        interval_secs = CONFIG_DICT['PROFILING_SAMPLE_INTERVAL_MS'] / 1000
+        stack_counts = StackSampler(get_threads, interval_secs).sample(duration_secs)
+        return format_collapsed_stacks(stack_counts)
+    finally:
+        _profiling_lock.release()
+
+
+def format_collapsed_stacks(stack_counts):
+    return ''.join(
+        '{} {}\n'.format(stack, count) for stack, count in sorted(stack_counts.items())
+    )
+
+
+def install_signal_handler(get_threads):
+    """Makes the profiling signal write a profile of the threads to PROFILING_OUTPUT_DIR.
+    Does nothing unless the directory is configured."""
+    output_dir = CONFIG_DICT['PROFILING_OUTPUT_DIR']
+
+    if not output_dir:
+        return
+
+    if threading.current_thread() is not threading.main_thread():
+        LOGGER.warning('Profiling signal handler can only be installed from the main thread')
+        return
+
+    if CONFIG_DICT['PROFILING_SIGNAL'] in GUNICORN_SIGNALS:
+        LOGGER.warning("Profiling signal handler not installed - gunicorn uses {}".format(
+            CONFIG_DICT['PROFILING_SIGNAL']
+        ))
+        return
+
+    signal_number = getattr(signal, CONFIG_DICT['PROFILING_SIGNAL'])
+
+    def handle_signal(signum, frame):
+        # the profile is taken on another thread, so that the signal handler returns immediately
+        thread = threading.Thread(
+            target=_write_profile_to_file, args=(get_threads, output_dir), name='profiler'
+        )
+        thread.daemon = True
+        thread.start()
+
+    signal.signal(signal_number, handle_signal)
+    LOGGER.info("Installed profiling signal handler for {}".format(
+        CONFIG_DICT['PROFILING_SIGNAL']
+    ))
+
+
+def _write_profile_to_file(get_threads, output_dir):
+    try:
+        LOGGER.info('Profiling sync threads on signal')
+        profile = profile_sync_threads(get_threads, CONFIG_DICT['PROFILING_SIGNAL_SECS'])
+        file_name = 'profile-{}-{}.collapsed'.format(
+            os.getpid(), datetime.utcnow().strftime('%Y%m%dT%H%M%S')
+        )
+        file_path = os.path.join(output_dir, file_name)
+
+        with open(file_path, 'wt') as file:
+            file.write(profile)
+
+        LOGGER.info("Wrote profile of sync threads to '{}'".format(file_path))
+    except Exception as e:
+        LOGGER.error('Failed to profile sync threads', exc_info=e)
+
+
+def _collapse_stack(thread_name, frame):
+    frame_names = []
+
+    while frame is not None:
+        code = frame.f_code
+        frame_names.append('{} ({}:{})'.format(
+            code.co_name, os.path.basename(code.co_filename), frame.f_lineno
+        ))
+        frame = frame.f_back
+
+    frame_names.append(thread_name)
+    return ';'.join(reversed(frame_names))
@@ -0,0 +1,286 @@
+"""Quarantine of titles an updater fails to turn into actions.
+
+A title the updater can't handle - e.g. one without an address, or without register data -
+would fail its whole page, and the same page again at every poll, while the backlog behind it
+grows. With QUARANTINE_ENABLED set, the title is quarantined instead: it's recorded with its
+error and left out, and the rest of the page is written, so the cursor moves past it. When an
+updater preparing the actions of a whole batch at once fails, the titles of the batch are
+prepared again one by one, to find the ones failing.
+
+Quarantined titles are kept in the updater's index, under their own doc type, as the cursor has
+moved past them and they couldn't be found again otherwise. Updaters can share an index, so the
+documents are keyed by updater ID and title number, and each updater only loads its own. They're
+retried with a re-sync of their title numbers (see service.resync)
+QUARANTINE_RETRY_INTERVAL_SECS after they failed, and released once they're written - by the
+retry, or by a page the title comes up in again after it changed in the source - or once a
+re-sync of their title numbers doesn't find them in the source any more. Titles failing again
+stay in quarantine, with the error of their latest attempt.
+
+No more than QUARANTINE_MAX_TITLES titles of an updater are quarantined. Beyond that, failing
+titles fail their page as they would without quarantine - that many failures are more likely a
+bug of the updater than bad data, and its titles had better wait in the source until it's fixed.
+"""
+from datetime import datetime, timedelta
+import logging
+import threading
+
+from config import CONFIG_DICT
+from service import date_utils, es_utils, resync
+from service.date_utils import format_date_with_millis
+
+LOGGER = logging.getLogger(__name__)
+
+QUARANTINE_DOC_TYPE = 'sync_quarantined_title'
+
+QUARANTINE_MAPPING = {
+    'properties': {
+        'updater_id': {'type': 'string', 'index': 'not_analyzed'},
+        'title_number': {'type': 'string', 'index': 'no'},
+        'last_modified_micros': {'type': 'long', 'index': 'no'},
+        'error': {'type': 'string', 'index': 'no'},
+        'quarantined_at_micros': {'type': 'long', 'index': 'no'},
+        'failed_at_micros': {'type': 'long', 'index': 'no'},
+        'attempt_count': {'type': 'integer', 'index': 'no'},
+    }
+}
+
+_quarantines_by_updater = {}  # type: dict
+_quarantines_lock = threading.Lock()
+
+
+class QuarantinedTitle():
+    """A title the updater failed on, with the error of its latest attempt"""
+
+    def __init__(self, updater_id, title_number, last_modified, error, quarantined_at,
+                 failed_at=None, attempt_count=1):
+        self.updater_id = updater_id
+        self.title_number = title_number
+        self.last_modified = last_modified
+        self.error = error
+        self.quarantined_at = quarantined_at
+        self.failed_at = failed_at or quarantined_at
+        self.attempt_count = attempt_count
+        self.retry_at = self.failed_at + timedelta(
+            seconds=CONFIG_DICT['QUARANTINE_RETRY_INTERVAL_SECS']
+        )
+
+    def to_dict(self):
+        return {
+            'title_number': self.title_number,
+            'last_modified': format_date_with_millis(self.last_modified),
+            'error': self.error,
+            'quarantined_at': format_date_with_millis(self.quarantined_at),
+            'failed_at': format_date_with_millis(self.failed_at),
+            'attempts': self.attempt_count,
+        }
+
+    def to_document(self):
+        return {
+            'updater_id': self.updater_id,
+            'title_number': self.title_number,
+            'last_modified_micros': date_utils.to_epoch_micros(self.last_modified),
+            'error': self.error,
+            'quarantined_at_micros': date_utils.to_epoch_micros(self.quarantined_at),
+            'failed_at_micros': date_utils.to_epoch_micros(self.failed_at),
+            'attempt_count': self.attempt_count,
+        }
+
+    @staticmethod
+    def from_document(document):
+        return QuarantinedTitle(
+            document['updater_id'],
+            document['title_number'],
+            date_utils.from_epoch_micros(document['last_modified_micros']),
+            document['error'],
+            date_utils.from_epoch_micros(document['quarantined_at_micros']),
+            date_utils.from_epoch_micros(document['failed_at_micros']),
+            document['attempt_count'],
+        )
+
+
+class PageQuarantine():
+    """Quarantines the titles of a page the updater fails on and, once the page is written,
+    releases the quarantined titles of the page it didn't fail on"""
+
+    def __init__(self, index_updater):
+        self.index_updater = index_updater
+        self._recovered_title_numbers = set()  # type: set
+        self._read_title_numbers = set()       # type: set
+
+    def track_titles(self, titles):
+        for title in titles:
+            if is_quarantined(self.index_updater.id, title.title_number):
+                self._recovered_title_numbers.add(title.title_number)
+                self._read_title_numbers.add(title.title_number)
+
+            yield title
+
+    def on_title_error(self, title, error):
+        self._recovered_title_numbers.discard(title.title_number)
+        quarantine_title(self.index_updater, title, error)
+
+    def release_recovered(self):
+        if self._recovered_title_numbers:
+            release_titles(self.index_updater, self._recovered_title_numbers)
+            self._recovered_title_numbers = set()
+
+    def release_missing(self, title_numbers):
+        """Releases the quarantined titles among the ones the page selected that it didn't read -
+        gone from the source, or left out by the updater's source filter"""
+        missing_title_numbers = [
+            title_number for title_number in title_numbers
+            if title_number not in self._read_title_numbers and
+            is_quarantined(self.index_updater.id, title_number)
+        ]
+
+        if missing_title_numbers:
+            release_titles(self.index_updater, missing_title_numbers)
+
+
+def is_enabled():
+    return CONFIG_DICT['QUARANTINE_ENABLED']
+
+
+def create_page_quarantine(index_updater):
+    """PageQuarantine for a page of the updater, or None when quarantine is disabled"""
+    return PageQuarantine(index_updater) if is_enabled() else None
+
+
+def ensure_mapping_exists(index_updater):
+    es_utils.ensure_mapping_exists(
+        index_updater.index_name, QUARANTINE_DOC_TYPE, QUARANTINE_MAPPING
+    )
+
+
+def load_quarantine(index_updater):
+    """Restores the titles the updater has in quarantine"""
+    quarantined_titles = {}
+
+    for hit in es_utils.scroll_documents_by_id(
+            index_updater.index_name, QUARANTINE_DOC_TYPE,
+            CONFIG_DICT['QUARANTINE_MAX_TITLES'],
+            query={'term': {'updater_id': index_updater.id}}):
+        quarantined_title = QuarantinedTitle.from_document(hit['_source'])
+        quarantined_titles[quarantined_title.title_number] = quarantined_title
+
+    with _quarantines_lock:
+        _quarantines_by_updater[index_updater.id] = quarantined_titles
+
+    if quarantined_titles:
+        LOGGER.warning("Updater '{}' has {} title(s) in quarantine".format(
+            index_updater.id, len(quarantined_titles)
+        ))
+
+
+def quarantine_title(index_updater, title, error):
+    """Records the title's failure. Raises the error again when the updater's quarantine is
+    full, for the title to fail its page."""
+    failed_at = datetime.utcnow()
+
+    with _quarantines_lock:
+        quarantined_titles = _quarantines_by_updater.setdefault(index_updater.id, {})
+        previous_attempt = quarantined_titles.get(title.title_number)
+        is_full = len(quarantined_titles) >= CONFIG_DICT['QUARANTINE_MAX_TITLES']
+
+    if previous_attempt is None and is_full:
+        LOGGER.error("Quarantine of updater '{}' is full - failed on title '{}'".format(
+            index_updater.id, title.title_number
+        ))
+        raise error
+
+    if previous_attempt is None:
+        quarantined_title = QuarantinedTitle(
+            index_updater.id, title.title_number, title.last_modified, _describe_error(error),
+            failed_at,
+        )
+    else:
+        quarantined_title = QuarantinedTitle(
+            index_updater.id, title.title_number, title.last_modified, _describe_error(error),
+            previous_attempt.quarantined_at, failed_at, previous_attempt.attempt_count + 1,
+        )
+
+    # saved before the cursor can move past the title
+    es_utils.index_document(
+        index_updater.index_name, QUARANTINE_DOC_TYPE,
+        _get_document_id(index_updater.id, title.title_number), quarantined_title.to_document(),
+    )
+
+    with _quarantines_lock:
+        _quarantines_by_updater.setdefault(index_updater.id, {})[title.title_number] = \
+            quarantined_title
+
+    LOGGER.warning("Quarantined title '{}' (attempt {}). Updater: '{}'".format(
+        title.title_number, quarantined_title.attempt_count, index_updater.id
+    ), exc_info=error)
+
+
+def release_titles(index_updater, title_numbers):
+    for title_number in title_numbers:
+        es_utils.delete_document(
+            index_updater.index_name, QUARANTINE_DOC_TYPE,
+            _get_document_id(index_updater.id, title_number),
+        )
+
+        with _quarantines_lock:
+            _quarantines_by_updater.get(index_updater.id, {}).pop(title_number, None)
+
+    LOGGER.info("Released {} title(s) from quarantine. Updater: '{}'".format(
+        len(title_numbers), index_updater.id
+    ))
+
+
+def is_quarantined(updater_id, title_number):
+    with _quarantines_lock:
+        return title_number in _quarantines_by_updater.get(updater_id, {})
+
+
+def get_quarantined_titles(updater_id):
+    """Titles the updater has in quarantine, in order of title number"""
+    with _quarantines_lock:
+        quarantined_titles = list(_quarantines_by_updater.get(updater_id, {}).values())
+
+    return sorted(quarantined_titles, key=lambda quarantined_title: quarantined_title.title_number)
+
+
+def get_quarantine_status(updater_id):
+    quarantined_titles = get_quarantined_titles(updater_id)
+    return {
+        'count': len(quarantined_titles),
+        'titles': [quarantined_title.to_dict() for quarantined_title in quarantined_titles],
+    }
+
+
+def enqueue_due_retries(index_updater):
+    """Queues a re-sync of the updater's quarantined titles due for a retry"""
+    retry_interval = timedelta(seconds=CONFIG_DICT['QUARANTINE_RETRY_INTERVAL_SECS'])
+
+    if not retry_interval:
+        return
+
+    now = datetime.utcnow()
+
+    with _quarantines_lock:
+        due_titles = [
+            quarantined_title
+            for quarantined_title in _quarantines_by_updater.get(index_updater.id, {}).values()
+            if quarantined_title.retry_at <= now
+        ]
+
+        # retried again after another interval when the re-sync doesn't come to them
+        for quarantined_title in due_titles:
+            quarantined_title.retry_at = now + retry_interval
+
+    if due_titles:
+        resync.enqueue(resync.ResyncJob(index_updater.id, {
+            resync.TITLE_NUMBERS_SELECTOR: [
+                quarantined_title.title_number for quarantined_title in due_titles
+            ],
+        }))
+
+
+def _get_document_id(updater_id, title_number):
+    return '{}-{}'.format(updater_id, title_number)
+
+
+def _describe_error(error):
+    return '{}: {}'.format(type(error).__name__, error)
@@ -0,0 +1,419 @@
+"""Reconciliation of an updater's index with the source database.
+
+The index is scrolled in order of document IDs and the source table is streamed in byte order of
+title numbers. The two streams are merge-joined by title number - document IDs start with the
+title number of their title, which only has letters and digits, so both come in the same order.
+For each title, a digest of the documents the updater would write for it is compared with a
+digest of the documents in the index, and only the titles whose digests differ are looked at
+document by document. Documents that are missing or stale are written again and documents that
+shouldn't be there (orphans) are deleted. Memory use is bounded by a scroll batch, a read batch
+and a chunk of repair actions, whatever the size of the index.
+
+Titles after the updater's cursor, or left to its backfill lane, are skipped - they haven't been
+synchronised yet. With versioned writes, repairs can't undo writes of later changes made while
+the reconciliation runs: documents are written with their title's version and deleted with the
+version of the updater's cursor at the start, so elasticsearch rejects them when the document
+is newer. Only the updater's own index is reconciled, not its extra write targets.
+
+To reconcile the index of a configured updater from the command line:
+
+    python -m service.reconciler property-by-address-v1-updater [--dry-run]
+"""
+import argparse
+from datetime import datetime
+import hashlib
+import json
+import logging
+import threading
+import time
+
+from config import CONFIG_DICT
+from service import date_utils, es_utils, id_filter, quarantine
+from service.database import page_reader
+from service.date_utils import format_date_with_millis
+
+LOGGER = logging.getLogger(__name__)
+
+RECONCILIATION_RUNNING = 'running'
+RECONCILIATION_FINISHED = 'finished'
+RECONCILIATION_CANCELLED = 'cancelled'
+RECONCILIATION_FAILED = 'failed'
+
+
+class ReconciliationInProgressError(Exception):
+    pass
+
+
+class Reconciliation():
+    """Progress of a reconciliation run. Without repair, differences are only counted."""
+
+    def __init__(self, updater_id, repair=True):
+        self.updater_id = updater_id
+        self.repair = repair
+        self.state = RECONCILIATION_RUNNING
+        self.started_at = datetime.now()
+        self.finished_at = None  # type: datetime
+        self.error = None        # type: str
+        self.titles_checked = 0
+        self.titles_skipped = 0
+        self.documents_checked = 0
+        self.missing_count = 0
+        self.stale_count = 0
+        self.orphaned_count = 0
+        self.repaired_count = 0
+        self.failed_repair_count = 0
+        self.failed_title_count = 0
+        self.last_title_number = None  # type: str
+        self._cancel_event = threading.Event()
+
+    @property
+    def is_running(self):
+        return self.state == RECONCILIATION_RUNNING
+
+    @property
+    def is_cancelled(self):
+        return self._cancel_event.is_set()
+
+    def cancel(self):
+        self._cancel_event.set()
+
+    def to_dict(self):
+        return {
+            'state': self.state,
+            'repair': self.repair,
+            'started_at': format_date_with_millis(self.started_at),
+            'finished_at': format_date_with_millis(self.finished_at) if self.finished_at else None,
+            'error': self.error,
+            'titles_checked': self.titles_checked,
+            'titles_skipped': self.titles_skipped,
+            'documents_checked': self.documents_checked,
+            'missing': self.missing_count,
+            'stale': self.stale_count,
+            'orphaned': self.orphaned_count,
+            'repaired': self.repaired_count,
+            'failed_repairs': self.failed_repair_count,
+            'failed_titles': self.failed_title_count,
+            'last_title_number': self.last_title_number,
+        }
+
+
+def reconcile(index_updater, reconciliation):
+    """Reconciles the updater's index with the source, recording progress in the reconciliation"""
+    LOGGER.info("Reconciling index '{}', doc type '{}', of updater '{}' (repair: {})".format(
+        index_updater.index_name, index_updater.doc_type, index_updater.id,
+        reconciliation.repair,
+    ))
+
+    try:
+        _reconcile(index_updater, reconciliation)
+        reconciliation.state = (
+            RECONCILIATION_CANCELLED if reconciliation.is_cancelled else RECONCILIATION_FINISHED
+        )
+        LOGGER.info("Reconciliation of updater '{}' {}: {}".format(
+            index_updater.id, reconciliation.state, json.dumps(reconciliation.to_dict())
+        ))
+    except Exception as e:
+        reconciliation.state = RECONCILIATION_FAILED
+        reconciliation.error = str(e)
+        LOGGER.error("Reconciliation of updater '{}' failed".format(index_updater.id), exc_info=e)
+    finally:
+        reconciliation.finished_at = datetime.now()
+
+
+def merge_by_title_number(source_titles, index_documents):
+    """Merge-joins (title, is_included) pairs and (title_number, documents) pairs, both in
+    order of title numbers. Yields (title_number, (title, is_included) or None, documents)."""
+    source_item = next(source_titles, None)
+    index_item = next(index_documents, None)
+
+    while source_item is not None or index_item is not None:
+        source_title_number = source_item[0].title_number if source_item is not None else None
+
+        if index_item is None or (
+                source_item is not None and source_title_number < index_item[0]):
+            yield source_title_number, source_item, {}
+            source_item = next(source_titles, None)
+        elif source_item is None or index_item[0] < source_title_number:
+            yield index_item[0], None, index_item[1]
+            index_item = next(index_documents, None)
+        else:
+            yield source_title_number, source_item, index_item[1]
+            source_item = next(source_titles, None)
+            index_item = next(index_documents, None)
+
+
+def group_documents_by_title(hits):
+    """Groups search hits in order of document IDs into (title_number, {id: source}) pairs"""
+    title_number = None
+    documents = {}
+
+    for hit in hits:
+        hit_title_number = _get_title_number(hit)
+
+        if hit_title_number != title_number:
+            if title_number is not None:
+                if hit_title_number < title_number:
+                    raise Exception(
+                        "Document '{}' is out of title number order - document IDs have to "
+                        "start with the title number".format(hit['_id'])
+                    )
+
+                yield title_number, documents
+
+            title_number = hit_title_number
+            documents = {}
+
+        documents[hit['_id']] = hit['_source']
+
+    if title_number is not None:
+        yield title_number, documents
+
+
+def get_digest(documents):
+    """Digest of documents by ID, the same whatever order their fields are in"""
+    return hashlib.sha1(
+        json.dumps(sorted(documents.items()), sort_keys=True).encode()
+    ).hexdigest()
+
+
+def _reconcile(index_updater, reconciliation):
+    source_filter = index_updater.get_source_filter()
+    cursor_position = _get_position(
+        index_updater.last_title_modification_date, index_updater.last_updated_title_number
+    )
+    repairer = _Repairer(index_updater, reconciliation, cursor_position)
+    throttle = _Throttle(CONFIG_DICT['RECONCILE_TITLES_PER_SEC'])
+    source_titles = page_reader.stream_titles_by_title_number(source_filter)
+    index_hits = es_utils.scroll_documents_by_id(
+        index_updater.index_name, index_updater.doc_type, CONFIG_DICT['RECONCILE_SCROLL_SIZE']
+    )
+
+    try:
+        merged_titles = merge_by_title_number(source_titles, group_documents_by_title(index_hits))
+
+        for title_number, title_with_filter, documents in merged_titles:
+            if reconciliation.is_cancelled:
+                break
+
+            if title_with_filter is None:
+                # the title may have been added since the source stream started
+                title_with_filter = page_reader.get_title(title_number, source_filter)
+
+            _reconcile_title(
+                index_updater, reconciliation, repairer, cursor_position,
+                title_number, title_with_filter, documents,
+            )
+            throttle.wait()
+
+        repairer.flush()
+    finally:
+        source_titles.close()
+        index_hits.close()
+
+
+def _reconcile_title(index_updater, reconciliation, repairer, cursor_position,
+                     title_number, title_with_filter, documents):
+    reconciliation.last_title_number = title_number
+    reconciliation.documents_checked += len(documents)
+
+    if title_with_filter is not None and \
+            not _is_synchronised(index_updater, title_with_filter[0], cursor_position):
+        reconciliation.titles_skipped += 1
+        return
+
+    # documents of quarantined titles are missing on purpose (see service.quarantine)
+    if quarantine.is_quarantined(index_updater.id, title_number):
+        reconciliation.titles_skipped += 1
+        return
+
+    reconciliation.titles_checked += 1
+    title = title_with_filter[0] if title_with_filter else None
+
+    try:
+        expected_documents = _get_expected_documents(index_updater, title_with_filter)
+    except Exception as e:
+        # one title the updater fails on doesn't stop the reconciliation of the rest
+        reconciliation.failed_title_count += 1
+        LOGGER.warning("Failed to prepare documents of title '{}'. Updater: '{}'".format(
+            title_number, index_updater.id
+        ), exc_info=e)
+        return
+
+    if get_digest(expected_documents) == get_digest(documents):
+        return
+
+    for id, expected_document in sorted(expected_documents.items()):
+        if id not in documents:
+            reconciliation.missing_count += 1
+            repairer.write(title, id, expected_document)
+        elif get_digest({id: expected_document}) != get_digest({id: documents[id]}):
+            reconciliation.stale_count += 1
+            repairer.write(title, id, expected_document)
+
+    for id in sorted(set(documents) - set(expected_documents)):
+        reconciliation.orphaned_count += 1
+        repairer.delete(id)
+
+
+def _get_expected_documents(index_updater, title_with_filter):
+    if title_with_filter is None or not title_with_filter[1]:
+        return {}
+
+    expected_documents = {}
+
+    for action in index_updater.prepare_elasticsearch_actions(title_with_filter[0]):
+        if action['_op_type'] == 'index':
+            expected_documents[action['_id']] = action['_source']
+        elif action['_op_type'] == 'update':
+            expected_documents[action['_id']] = action['doc']
+
+    return expected_documents
+
+
+def _is_synchronised(index_updater, title, cursor_position):
+    position = _get_position(title.last_modified, title.title_number)
+
+    if cursor_position is None or position > cursor_position:
+        return False
+
+    lane = index_updater.backfill_lane
+
+    if lane:
+        lane_position = _get_position(
+            lane.last_title_modification_date, lane.last_updated_title_number
+        )
+        high_water_mark = _get_position(
+            lane.high_water_modification_date, lane.high_water_title_number
+        )
+        return not lane_position < position <= high_water_mark
+
+    return True
+
+
+def _get_position(modification_date, title_number):
+    # cursors loaded from the index have a time zone, titles don't
+    if modification_date is None:
+        return None
+
+    return date_utils.to_epoch_micros(modification_date), title_number or ''
+
+
+def _get_title_number(hit):
+    return hit.get('_source', {}).get('title_number') or hit['_id'].split('-', 1)[0]
+
+
+class _Repairer():
+    """Sends repair actions in chunks of BULK_CHUNK_SIZE, or only counts them without repair"""
+
+    def __init__(self, index_updater, reconciliation, cursor_position):
+        self._index_updater = index_updater
+        self._reconciliation = reconciliation
+        self._delete_version = cursor_position[0] if cursor_position else None
+        self._actions = []  # type: list
+
+    def write(self, title, id, document):
+        updater = self._index_updater
+
+        if updater.versioned_writes:
+            action = es_utils.get_versioned_index_action(
+                updater.index_name, updater.doc_type, document, id,
+                date_utils.to_epoch_micros(title.last_modified),
+                es_utils.EXTERNAL_GTE_VERSION_TYPE,
+            )
+        else:
+            action = es_utils.get_index_action(updater.index_name, updater.doc_type, document, id)
+
+        self._add(action)
+
+    def delete(self, id):
+        updater = self._index_updater
+
+        if updater.versioned_writes and self._delete_version is not None:
+            action = es_utils.get_delete_action(
+                updater.index_name, updater.doc_type, id, self._delete_version,
+                es_utils.EXTERNAL_GTE_VERSION_TYPE,
+            )
+        else:
+            action = es_utils.get_delete_action(updater.index_name, updater.doc_type, id)
+
+        self._add(action)
+
+    def flush(self):
+        if not self._actions:
+            return
+
+        actions, self._actions = self._actions, []
+        id_filter.add_written_ids(self._index_updater, actions)
+        success_count, errors = es_utils.execute_elasticsearch_actions(actions)
+        # newer writes of the live updater win over repairs
+        failed_count = len([error for error in errors if not es_utils.is_version_conflict(error)])
+
+        if failed_count:
+            LOGGER.warning("{} repair(s) failed. Updater: '{}'".format(
+                failed_count, self._index_updater.id
+            ))
+
+        self._reconciliation.repaired_count += success_count
+        self._reconciliation.failed_repair_count += failed_count
+
+    def _add(self, action):
+        if not self._reconciliation.repair:
+            return
+
+        self._actions.append(action)
+
+        if len(self._actions) >= CONFIG_DICT['BULK_CHUNK_SIZE']:
+            self.flush()
+
+
+class _Throttle():
+    """Keeps the rate of titles reconciled under the given number per second (0 - no limit)"""
+
+    def __init__(self, titles_per_sec):
+        self._titles_per_sec = titles_per_sec
+        self._start = time.monotonic()
+        self._count = 0
+
+    def wait(self):
+        if not self._titles_per_sec:
+            return
+
+        self._count += 1
+        delay = self._count / self._titles_per_sec - (time.monotonic() - self._start)
+
+        if delay > 0:
+            time.sleep(delay)
+
+
+def main():
+    from service import backfill_lane, es_status_loader, sync_manager, sync_process
+
+    parser = argparse.ArgumentParser(description="Reconciles an updater's index with the source")
+    parser.add_argument('updater_id', help='ID of a configured updater')
+    parser.add_argument('--dry-run', action='store_true', help='only count the differences')
+    args = parser.parse_args()
+
+    updater_config = sync_manager.get_index_updater_config()
+    if args.updater_id not in updater_config:
+        parser.error("Unknown updater: '{}'".format(args.updater_id))
+
+    index_updater = sync_manager.create_index_updater(
+        args.updater_id, updater_config[args.updater_id]
+    )
+    es_status_loader.load_index_updater_status(index_updater)
+
+    if index_updater.dual_lanes:
+        backfill_lane.load_backfill_lane(index_updater)
+
+    if quarantine.is_enabled():
+        quarantine.load_quarantine(index_updater)
+
+    reconciliation = Reconciliation(index_updater.id, repair=not args.dry_run)
+
+    with sync_process.suspend_id_filters([index_updater.id]):
+        reconcile(index_updater, reconciliation)
+    print(json.dumps(reconciliation.to_dict(), indent=2, sort_keys=True))
+
+
+if __name__ == '__main__':
+    main()
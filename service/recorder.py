@@ -0,0 +1,232 @@
+from datetime import datetime
+import gzip
+import json
+import logging
+import os
+import threading
+from typing import Dict, Tuple
+
+from config import CONFIG_DICT
+from service.database.model import TitleRecord
+
+LOGGER = logging.getLogger(__name__)
+
+PAGE_RECORD_TYPE = 'page'
+ACTIONS_RECORD_TYPE = 'actions'
+SEGMENT_FILE_SUFFIX = '.ndjson.gz'
+RECORD_DATE_FORMAT = '%Y-%m-%dT%H:%M:%S.%f'
+
+
+class SegmentWriter():
+    """Appends JSON records to gzipped NDJSON segment files, starting a new segment once the
+    current one reaches the size limit. Every record is flushed, so an interrupted segment
+    can still be read up to its last complete record. When max_segments is set, the oldest
+    segments beyond it are removed each time a new segment is started."""
+
+    def __init__(self, directory, prefix, max_segment_bytes, max_segments=0):
+        self._directory = directory
+        self._prefix = prefix
+        self._max_segment_bytes = max_segment_bytes
+        self._max_segments = max_segments
+        self._file = None
+        self._segment_bytes = 0
+        self._segment_number = 0
+        self._lock = threading.Lock()
+
+    def write(self, record):
+        line = (json.dumps(record, separators=(',', ':')) + '\n').encode()
+
+        with self._lock:
+            if self._file is None or self._segment_bytes >= self._max_segment_bytes:
+                self._start_segment()
+
+            self._file.write(line)
+            self._file.flush()
+            self._segment_bytes += len(line)
+
+    def close(self):
+        with self._lock:
+            if self._file is not None:
+                self._file.close()
+                self._file = None
+
+    def _start_segment(self):
+        if self._file is not None:
+            self._file.close()
+
+        os.makedirs(self._directory, exist_ok=True)
+        self._segment_number += 1
+        file_name = '{}-{}-{:06d}{}'.format(
+            self._prefix,
+            datetime.utcnow().strftime('%Y%m%dT%H%M%S%f'),
+            self._segment_number,
+            SEGMENT_FILE_SUFFIX,
+        )
+        self._file = gzip.open(os.path.join(self._directory, file_name), 'wb')
+        self._segment_bytes = 0
+        LOGGER.info("Started recording segment '{}'".format(file_name))
+
+        if self._max_segments > 0:
+            self._remove_oldest_segments()
+
+    def _remove_oldest_segments(self):
+        segment_file_names = _get_segment_file_names(self._directory, self._prefix)
+
+        for file_name in segment_file_names[:-self._max_segments]:
+            os.remove(os.path.join(self._directory, file_name))
+            LOGGER.info("Removed recording segment '{}'".format(file_name))
+
+
+_segment_writers = {}  # type: Dict[Tuple[str, str], SegmentWriter]
+_segment_writers_lock = threading.Lock()
+
+
+def is_recording_pages():
+    return bool(CONFIG_DICT['RECORDING_DIR']) and CONFIG_DICT['RECORD_PAGES']
+
+
+def is_recording_actions():
+    return bool(CONFIG_DICT['RECORDING_DIR']) and CONFIG_DICT['RECORD_ACTIONS']
+
+
+class PageRecording():
+    """Collects the titles and actions of a page as they stream through, as configured, and
+    records them once the page is written - a page failing to be written isn't recorded, as it's
+    read again"""
+
+    def __init__(self, index_updater):
+        self.index_updater = index_updater
+        # titles are kept in their serialised form only, so that the originals can be released
+        self._title_dicts = [] if is_recording_pages() else None
+        self._actions = [] if is_recording_actions() else None
+
+    def track_titles(self, titles):
+        if self._title_dicts is None:
+            return titles
+
+        return self._collect_titles(titles)
+
+    def track_actions(self, elasticsearch_actions):
+        if self._actions is None:
+            return elasticsearch_actions
+
+        return self._collect_actions(elasticsearch_actions)
+
+    def record_written(self, data_page):
+        """Records the page, with the cursor of the data page the titles were read from"""
+        if not data_page.title_count:
+            return
+
+        last_modified = format_record_date(data_page.last_modified)
+
+        if self._title_dicts is not None:
+            record = _create_record(
+                PAGE_RECORD_TYPE, self.index_updater, last_modified, data_page.last_title_number
+            )
+            record['titles'] = self._title_dicts
+            _get_segment_writer(self.index_updater.id, PAGE_RECORD_TYPE).write(record)
+
+        if self._actions is not None:
+            record = _create_record(
+                ACTIONS_RECORD_TYPE, self.index_updater, last_modified, data_page.last_title_number
+            )
+            record['actions'] = self._actions
+            _get_segment_writer(self.index_updater.id, ACTIONS_RECORD_TYPE).write(record)
+
+    def _collect_titles(self, titles):
+        for title in titles:
+            self._title_dicts.append(title_to_dict(title))
+            yield title
+
+    def _collect_actions(self, elasticsearch_actions):
+        for action in elasticsearch_actions:
+            self._actions.append(action)
+            yield action
+
+
+def close():
+    with _segment_writers_lock:
+        for writer in _segment_writers.values():
+            writer.close()
+
+        _segment_writers.clear()
+
+
+def read_records(directory, record_type):
+    """Yields records of the given type from all segments in the directory, oldest first"""
+    for file_name in _get_segment_file_names(directory, record_type):
+        yield from _read_segment(os.path.join(directory, file_name))
+
+
+def title_to_dict(title):
+    return {
+        'title_number': title.title_number,
+        'register_data': title.register_data,
+        'last_modified': format_record_date(title.last_modified),
+        'is_deleted': title.is_deleted,
+    }
+
+
+def dict_to_title(title_dict):
+    return TitleRecord(
+        title_dict['title_number'],
+        title_dict['register_data'],
+        parse_record_date(title_dict['last_modified']),
+        title_dict['is_deleted'],
+    )
+
+
+def format_record_date(date):
+    return date.strftime(RECORD_DATE_FORMAT)
+
+
+def parse_record_date(date_string):
+    return datetime.strptime(date_string, RECORD_DATE_FORMAT)
+
+
+def _create_record(record_type, index_updater, last_modified, last_title_number):
+    return {
+        'type': record_type,
+        'updater_id': index_updater.id,
+        'index_name': index_updater.index_name,
+        'doc_type': index_updater.doc_type,
+        'recorded_at': format_record_date(datetime.utcnow()),
+        'cursor': {
+            'last_modified': last_modified,
+            'title_number': last_title_number,
+        },
+    }
+
+
+def _get_segment_writer(updater_id, record_type):
+    with _segment_writers_lock:
+        key = (updater_id, record_type)
+
+        if key not in _segment_writers:
+            _segment_writers[key] = SegmentWriter(
+                os.path.join(CONFIG_DICT['RECORDING_DIR'], updater_id),
+                record_type,
+                CONFIG_DICT['RECORDING_SEGMENT_MAX_BYTES'],
+                CONFIG_DICT['RECORDING_MAX_SEGMENTS'],
+            )
+
+        return _segment_writers[key]
+
+
+def _get_segment_file_names(directory, record_type):
+    # segment names start with their creation time, so they sort oldest first
+    return sorted(
+        file_name for file_name in os.listdir(directory)
+        if file_name.startswith(record_type + '-') and file_name.endswith(SEGMENT_FILE_SUFFIX)
+    )
+
+
+def _read_segment(file_path):
+    try:
+        with gzip.open(file_path, 'rt') as file:
+            for line in file:
+                if line.endswith('\n'):
+                    yield json.loads(line)
+    except EOFError:
+        # the segment was still being written when the recording stopped
+        LOGGER.warning("Recording segment '{}' is incomplete".format(file_path))
@@ -0,0 +1,111 @@
+"""Replays recordings made by the synchroniser straight into elasticsearch, without touching
+the source database.
+
+Recorded bulk actions are sent as they are:
+
+    python -m service.replay actions --recording-dir /recordings/property-by-address-v1-updater
+
+Recorded source pages are run through an updater first, which doesn't have to be the one
+that made the recording:
+
+    python -m service.replay pages --recording-dir /recordings/property-by-address-v1-updater \\
+        --updater-id property-by-postcode-v3-updater
+"""
+import argparse
+import logging
+
+from service import es_utils, recorder, sync_manager, sync_process
+from service.updaters import base as updater_base
+
+LOGGER = logging.getLogger(__name__)
+
+
+class _CursorTracker():
+    """Remembers the cursor of the latest record passed through it"""
+
+    def __init__(self, records):
+        self._records = records
+        self.cursor = None
+        self.record_count = 0
+
+    def __iter__(self):
+        for record in self._records:
+            yield record
+            self.cursor = record['cursor']
+            self.record_count += 1
+
+
+def replay_actions(recording_dir):
+    records = _CursorTracker(recorder.read_records(recording_dir, recorder.ACTIONS_RECORD_TYPE))
+    actions = (action for record in records for action in record['actions'])
+
+    success_count, errors = es_utils.execute_elasticsearch_actions(actions)
+    return _format_result(records, success_count, errors)
+
+
+def replay_pages(recording_dir, index_updater):
+    records = _CursorTracker(recorder.read_records(recording_dir, recorder.PAGE_RECORD_TYPE))
+    titles = (recorder.dict_to_title(title) for record in records for title in record['titles'])
+    actions = updater_base.stream_actions(index_updater, titles)
+
+    success_count, errors = es_utils.execute_elasticsearch_actions(actions)
+    return _format_result(records, success_count, errors)
+
+
+def _format_result(records, success_count, errors):
+    return {
+        'record_count': records.record_count,
+        'success_count': success_count,
+        'error_count': len(errors),
+        'cursor': records.cursor,
+    }
+
+
+def _create_updater(updater_id, index_name, doc_type):
+    index_info = dict(sync_manager.get_index_updater_config().get(updater_id, {}))
+
+    if index_name:
+        index_info['index_name'] = index_name
+    if doc_type:
+        index_info['doc_type'] = doc_type
+
+    if 'index_name' not in index_info or 'doc_type' not in index_info:
+        raise Exception(
+            "Index name and doc type are needed for updater '{}'".format(updater_id)
+        )
+
+    index_updater = sync_manager.create_index_updater(updater_id, index_info)
+    es_utils.ensure_mapping_exists(
+        index_updater.index_name, index_updater.doc_type, index_updater.get_mapping()
+    )
+    return index_updater
+
+
+def main():
+    parser = argparse.ArgumentParser(description='Replays synchroniser recordings')
+    parser.add_argument(
+        'mode', choices=[recorder.ACTIONS_RECORD_TYPE, recorder.PAGE_RECORD_TYPE + 's']
+    )
+    parser.add_argument('--recording-dir', required=True)
+    parser.add_argument('--updater-id', help='updater to run recorded pages through')
+    parser.add_argument('--index-name', help='overrides the index name from the updater config')
+    parser.add_argument('--doc-type', help='overrides the doc type from the updater config')
+    args = parser.parse_args()
+
+    if args.mode != recorder.ACTIONS_RECORD_TYPE and not args.updater_id:
+        parser.error('--updater-id is required when replaying pages')
+
+    # recordings may be replayed into the index of any updater
+    with sync_process.suspend_id_filters(sync_manager.get_index_updater_config().keys()):
+        if args.mode == recorder.ACTIONS_RECORD_TYPE:
+            result = replay_actions(args.recording_dir)
+        else:
+            index_updater = _create_updater(args.updater_id, args.index_name, args.doc_type)
+            result = replay_pages(args.recording_dir, index_updater)
+
+    LOGGER.info('Replay finished: {}'.format(result))
+    print(result)
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,307 @@
+"""Targeted re-syncs of selected titles, without moving the updaters' cursors.
+
+A re-sync selects titles in one of three ways:
+
+    {"title_numbers": ["DN1", "DN2"]}
+    {"title_number_range": {"from": "DN1", "to": "DN9"}}
+    {"modified_window": {"from": "2015-04-20T00:00:00", "to": "2015-04-21T00:00:00"}}
+
+Ranges and windows include both ends, and dates without an offset are taken to be UTC. Titles
+are read from the primary database with indexed queries - title numbers are looked up by the
+primary key, title number ranges are range scans of the primary key and modification windows
+are range scans of the page index. They're turned into actions and written the same way as the
+pages of the updater (see service.synchroniser), ahead of its next page, but the updater's
+cursor is left where it is. Versioned writes replace documents with the same version, so that a
+re-sync rewrites documents whatever they hold, but never replaces a newer document. Titles
+that aren't in the source any more are left alone.
+
+Re-syncs are queued per updater and run by its sync thread, between pages. To run one in the
+foreground from the command line instead, or to leave it to the sync process (--enqueue):
+
+    python -m service.resync property-by-address-v1-updater --titles DN1 DN2 [--enqueue]
+"""
+import argparse
+from collections import deque
+from datetime import datetime
+import json
+import logging
+import threading
+from typing import Dict
+
+from service import date_utils, es_utils
+from service.database import page_reader
+from service.date_utils import format_date_with_millis
+
+LOGGER = logging.getLogger(__name__)
+
+TITLE_NUMBERS_SELECTOR = 'title_numbers'
+TITLE_NUMBER_RANGE_SELECTOR = 'title_number_range'
+MODIFIED_WINDOW_SELECTOR = 'modified_window'
+SELECTORS = (TITLE_NUMBERS_SELECTOR, TITLE_NUMBER_RANGE_SELECTOR, MODIFIED_WINDOW_SELECTOR)
+
+RESYNC_PENDING = 'pending'
+RESYNC_RUNNING = 'running'
+RESYNC_FINISHED = 'finished'
+RESYNC_FAILED = 'failed'
+
+# re-syncs that ended are kept for the status, up to this many per updater
+ENDED_JOB_HISTORY = 10
+
+
+class InvalidResyncRequestError(Exception):
+    pass
+
+
+class ResyncJob():
+    """A re-sync of the titles chosen by the selector - a dict with one of SELECTORS as its key -
+    using one updater, with its progress"""
+
+    def __init__(self, updater_id, selector):
+        self.updater_id = updater_id
+        self.selector_type, self._selection = parse_selector(selector)
+        self.selector = selector
+        self.state = RESYNC_PENDING
+        self.requested_at = datetime.now()
+        self.started_at = None   # type: datetime
+        self.finished_at = None  # type: datetime
+        self.error = None        # type: str
+        self.title_count = 0
+        self.failed_action_count = 0
+        self.is_exhausted = False
+        # position of the next page - an offset into the title numbers, the last title number
+        # of a range or the last (last_modified, title_number) of a window
+        self._position = None
+
+    @property
+    def is_ended(self):
+        return self.state in (RESYNC_FINISHED, RESYNC_FAILED)
+
+    def start(self):
+        self.state = RESYNC_RUNNING
+        self.started_at = datetime.now()
+
+    def finish(self, error=None):
+        self.state = RESYNC_FAILED if error else RESYNC_FINISHED
+        self.error = str(error) if error else None
+        self.finished_at = datetime.now()
+
+    def read_next_page(self, page_size, source_filter=None):
+        """Titles of the next page, read with an indexed query"""
+        if self.selector_type == TITLE_NUMBERS_SELECTOR:
+            return page_reader.stream_titles_with_numbers(
+                self.get_page_title_numbers(page_size), source_filter
+            )
+
+        if self.selector_type == TITLE_NUMBER_RANGE_SELECTOR:
+            first_title_number, last_title_number = self._selection
+            return page_reader.stream_title_number_range_page(
+                first_title_number, last_title_number, self._position, page_size, source_filter
+            )
+
+        modified_from, modified_to = self._selection
+        # no title number sorts before the empty one, so the window starts at modified_from
+        last_modified, last_title_number = self._position or (modified_from, '')
+        return page_reader.stream_modified_window_page(
+            last_title_number, last_modified, page_size, modified_to, source_filter
+        )
+
+    def get_page_title_numbers(self, page_size):
+        """Title numbers the next page selects, or None when the selector isn't a list of them"""
+        if self.selector_type != TITLE_NUMBERS_SELECTOR:
+            return None
+
+        offset = self._position or 0
+        return self._selection[offset:offset + page_size]
+
+    def advance(self, data_page, page_size):
+        """Moves past a page read with read_next_page, once it's written"""
+        self.title_count += data_page.title_count
+
+        if self.selector_type == TITLE_NUMBERS_SELECTOR:
+            self._position = (self._position or 0) + page_size
+            self.is_exhausted = self._position >= len(self._selection)
+        else:
+            if self.selector_type == TITLE_NUMBER_RANGE_SELECTOR:
+                self._position = data_page.last_title_number
+            else:
+                self._position = (data_page.last_modified, data_page.last_title_number)
+
+            self.is_exhausted = data_page.title_count < page_size
+
+    def to_dict(self):
+        return {
+            'state': self.state,
+            'selector': self.selector,
+            'requested_at': format_date_with_millis(self.requested_at),
+            'started_at': format_date_with_millis(self.started_at) if self.started_at else None,
+            'finished_at': format_date_with_millis(self.finished_at) if self.finished_at else None,
+            'error': self.error,
+            'titles': self.title_count,
+            'failed_actions': self.failed_action_count,
+        }
+
+
+def parse_selector(selector):
+    """(selector type, selection) of a selector dict. Raises InvalidResyncRequestError when
+    the selector is invalid."""
+    if not isinstance(selector, dict):
+        raise InvalidResyncRequestError('The selector must be an object')
+
+    selector_types = [selector_type for selector_type in SELECTORS if selector_type in selector]
+    if len(selector_types) != 1:
+        raise InvalidResyncRequestError('Exactly one of {} is required'.format(
+            ', '.join(SELECTORS)
+        ))
+
+    selector_type = selector_types[0]
+    selection = selector[selector_type]
+
+    if selector_type == TITLE_NUMBERS_SELECTOR:
+        if not isinstance(selection, list) or not selection or \
+                not all(isinstance(title_number, str) for title_number in selection):
+            raise InvalidResyncRequestError('{} must be a list of title numbers'.format(
+                TITLE_NUMBERS_SELECTOR
+            ))
+
+        return selector_type, sorted(set(selection))
+
+    if not isinstance(selection, dict) or set(selection) != {'from', 'to'} or \
+            not all(isinstance(bound, str) for bound in selection.values()):
+        raise InvalidResyncRequestError("{} must have 'from' and 'to' strings".format(
+            selector_type
+        ))
+
+    if selector_type == TITLE_NUMBER_RANGE_SELECTOR:
+        bounds = (selection['from'], selection['to'])
+    else:
+        try:
+            bounds = (
+                date_utils.string_to_naive_utc_date(selection['from']),
+                date_utils.string_to_naive_utc_date(selection['to']),
+            )
+        except ValueError as e:
+            raise InvalidResyncRequestError('Invalid date in {}: {}'.format(selector_type, e))
+
+    if bounds[0] > bounds[1]:
+        raise InvalidResyncRequestError("{} ends before it starts".format(selector_type))
+
+    return selector_type, bounds
+
+
+def replace_equal_versions(elasticsearch_actions):
+    """Lets versioned actions replace documents with the same version, which elasticsearch
+    would otherwise reject as stale"""
+    for action in elasticsearch_actions:
+        if '_version_type' in action:
+            action['_version_type'] = es_utils.EXTERNAL_GTE_VERSION_TYPE
+
+        yield action
+
+
+class _ResyncQueue():
+    """Re-syncs of an updater - waiting, running or recently ended - in the order requested"""
+
+    def __init__(self):
+        self.jobs = deque()  # type: deque
+
+    def take_next_job(self):
+        pending_job = next((job for job in self.jobs if job.state == RESYNC_PENDING), None)
+
+        if pending_job:
+            pending_job.start()
+
+        return pending_job
+
+    def forget_old_jobs(self):
+        ended_jobs = [job for job in self.jobs if job.is_ended]
+
+        for job in ended_jobs[:-ENDED_JOB_HISTORY]:
+            self.jobs.remove(job)
+
+
+_queues = {}  # type: Dict[str, _ResyncQueue]
+_queues_lock = threading.Lock()
+
+
+def enqueue(job):
+    with _queues_lock:
+        queue = _queues.setdefault(job.updater_id, _ResyncQueue())
+        queue.forget_old_jobs()
+        queue.jobs.append(job)
+
+    LOGGER.info("Queued re-sync for updater '{}': {}".format(
+        job.updater_id, json.dumps(job.selector)
+    ))
+
+
+def take_next_job(updater_id):
+    """Oldest pending re-sync of the updater, marked as running - or None"""
+    with _queues_lock:
+        queue = _queues.get(updater_id)
+        return queue.take_next_job() if queue else None
+
+
+def has_pending_jobs(updater_id):
+    with _queues_lock:
+        queue = _queues.get(updater_id)
+        return bool(queue) and any(job.state == RESYNC_PENDING for job in queue.jobs)
+
+
+def get_jobs(updater_id):
+    """Re-syncs of the updater that are waiting, running or recently ended"""
+    with _queues_lock:
+        queue = _queues.get(updater_id)
+        return list(queue.jobs) if queue else []
+
+
+def main():
+    from service import sync_manager, sync_process, synchroniser
+
+    parser = argparse.ArgumentParser(description='Re-syncs selected titles')
+    parser.add_argument('updater_ids', nargs='+', metavar='updater_id',
+                        help='ID of a configured updater')
+    selector_group = parser.add_mutually_exclusive_group(required=True)
+    selector_group.add_argument('--titles', nargs='+', metavar='TITLE_NUMBER')
+    selector_group.add_argument('--title-range', nargs=2, metavar=('FROM', 'TO'))
+    selector_group.add_argument('--modified-window', nargs=2, metavar=('FROM', 'TO'),
+                                help='ISO 8601 dates - UTC when given without an offset')
+    parser.add_argument('--enqueue', action='store_true',
+                        help='leave the re-sync to the sync process (SYNC_MODE=external)')
+    args = parser.parse_args()
+
+    if args.titles:
+        selector = {TITLE_NUMBERS_SELECTOR: args.titles}
+    elif args.title_range:
+        selector = {TITLE_NUMBER_RANGE_SELECTOR: dict(zip(('from', 'to'), args.title_range))}
+    else:
+        selector = {MODIFIED_WINDOW_SELECTOR: dict(zip(('from', 'to'), args.modified_window))}
+
+    updater_config = sync_manager.get_index_updater_config()
+    for updater_id in args.updater_ids:
+        if updater_id not in updater_config:
+            parser.error("Unknown updater: '{}'".format(updater_id))
+
+    try:
+        parse_selector(selector)
+    except InvalidResyncRequestError as e:
+        parser.error(str(e))
+
+    if args.enqueue:
+        sync_process.send_command(
+            sync_process.ENQUEUE_RESYNC_COMMAND, updater_ids=args.updater_ids, selector=selector
+        )
+        return
+
+    with sync_process.suspend_id_filters(args.updater_ids):
+        for updater_id in args.updater_ids:
+            index_updater = sync_manager.create_index_updater(
+                updater_id, updater_config[updater_id]
+            )
+            job = ResyncJob(updater_id, selector)
+            job.start()
+            synchroniser.run_resync_job(index_updater, job)
+            print(json.dumps(dict(job.to_dict(), updater=updater_id), indent=2, sort_keys=True))
+
+
+if __name__ == '__main__':
+    main()
@@ -1,17 +1,23 @@
+import hmac
 import json
 import logging
-from flask import Response  # type: ignore
+from flask import Response, request  # type: ignore
 
 from config import CONFIG_DICT
-from service import sync_manager, app, es_utils
+from service import sync_manager, app, es_utils, profiler, reconciler, status as sync_status
+from service import freshness, resync, sync_process
 from service.database import page_reader
-from service.date_utils import format_date_with_millis
 
 
 LOGGER = logging.getLogger(__name__)
 
 INTERNAL_SERVER_ERROR_RESPONSE_BODY = json.dumps({'error': 'Internal server error'})
 APPLICATION_JSON_TYPE = 'application/json'
+TEXT_PLAIN_TYPE = 'text/plain'
+PROMETHEUS_TEXT_TYPE = 'text/plain; version=0.0.4'
+PROFILING_TOKEN_HEADER = 'X-Profiling-Token'
+ADMIN_TOKEN_HEADER = 'X-Admin-Token'
+DEFAULT_PROFILING_SECS = 10
 
 
 @app.errorhandler(Exception)
@@ -46,42 +52,211 @@ def healthcheck():
 
 @app.route('/status', methods=['GET'])
 def status():
-    status_info = _get_status_of_all_updaters()
-    return _json_response(json.dumps(status_info))
+    if sync_process.is_external():
+        status_info = sync_status.read_status_file()
 
+        if status_info is None:
+            return _json_error_response('The sync process has not reported its status yet', 503)
+    else:
+        status_info = sync_status.get_sync_status()
+
+    return _json_response(json.dumps(status_info))
 
-def _json_response(body, status=200):
-    return Response(body, status=status, mimetype=APPLICATION_JSON_TYPE)
 
+@app.route('/metrics', methods=['GET'])
+def metrics():
+    if sync_process.is_external():
+        freshness_snapshot = sync_status.read_freshness_snapshot_file()
 
-def _get_status_of_all_updaters():
-    updaters = sync_manager.get_index_updaters()
-    updater_status_info = {updater.id: _get_updater_status(updater) for updater in updaters}
-    return {
-        'polling_interval': app.config['POLLING_INTERVAL_SECS'],
-        'status': updater_status_info,
-    }
-
-
-def _get_updater_status(updater):
-    return {
-        'last_successful_sync_time': _format_optional_date(updater.last_successful_sync_time),
-        'last_unsuccessful_sync_time': _format_optional_date(updater.last_unsuccessful_sync_time),
-        'last_title_modification_date': _format_optional_date(
-            updater.last_title_modification_date
-        ),
-        'last_title_number': updater.last_updated_title_number,
-        'is_busy': sync_manager.is_index_updater_busy(updater),
-        'index_name': updater.index_name,
-        'doc_type': updater.doc_type,
-    }
-
-
-def _format_optional_date(date):
-    if date:
-        return format_date_with_millis(date)
+        if freshness_snapshot is None:
+            return _json_error_response('The sync process has not reported its status yet', 503)
     else:
-        return None
+        freshness_snapshot = freshness.get_snapshot()
+
+    return Response(
+        freshness.format_metrics(freshness_snapshot), status=200, content_type=PROMETHEUS_TEXT_TYPE
+    )
+
+
+@app.route('/debug/profile', methods=['GET'])
+def profile():
+    """Samples the sync threads for a while and returns their stacks in collapsed format"""
+    # the sync process is profiled with PROFILING_SIGNAL instead
+    if not CONFIG_DICT['PROFILING_TOKEN'] or sync_process.is_external():
+        return _json_error_response('Not found', 404)
+
+    token = request.headers.get(PROFILING_TOKEN_HEADER, '')
+    if not hmac.compare_digest(token.encode(), CONFIG_DICT['PROFILING_TOKEN'].encode()):
+        return _json_error_response('Forbidden', 403)
+
+    updater_id = request.args.get('updater')
+    updater_ids = [updater.id for updater in sync_manager.get_index_updaters()]
+    if updater_id and updater_id not in updater_ids:
+        return _json_error_response("Unknown updater: '{}'".format(updater_id), 404)
+
+    try:
+        seconds = int(request.args.get('seconds', DEFAULT_PROFILING_SECS))
+    except ValueError:
+        return _json_error_response('Invalid number of seconds', 400)
+
+    max_seconds = _get_max_profiling_secs()
+    if not 0 < seconds <= max_seconds:
+        return _json_error_response(
+            'Number of seconds must be between 1 and {}'.format(max_seconds), 400
+        )
+
+    try:
+        collapsed_stacks = profiler.profile_sync_threads(
+            lambda: sync_manager.get_sync_threads(updater_id), seconds
+        )
+    except profiler.ProfilingInProgressError as e:
+        return _json_error_response(str(e), 409)
+
+    return Response(collapsed_stacks, status=200, mimetype=TEXT_PLAIN_TYPE)
+
+
+def _get_max_profiling_secs():
+    """Longest profile the endpoint takes - it samples within the request, and gunicorn kills a
+    worker busy with a request for longer than its timeout, along with the worker's sync threads"""
+    return min(
+        CONFIG_DICT['PROFILING_MAX_SECS'],
+        CONFIG_DICT['WORKER_TIMEOUT_SECS'] - CONFIG_DICT['PROFILING_TIMEOUT_MARGIN_SECS'],
+    )
+
+
+@app.route('/reconciliation/<updater_id>', methods=['GET', 'POST', 'DELETE'])
+def reconciliation(updater_id):
+    """Starts (POST), cancels (DELETE) or shows (GET) the reconciliation of the updater's index
+    with the source. With repair=false, differences are only counted."""
+    error_response = _check_admin_token()
+    if error_response:
+        return error_response
+
+    if updater_id not in _get_updater_ids():
+        return _json_error_response("Unknown updater: '{}'".format(updater_id), 404)
+
+    if sync_process.is_external():
+        return _pass_reconciliation_request_on(updater_id)
+
+    if request.method == 'POST':
+        repair = request.args.get('repair', 'true').lower() != 'false'
+
+        try:
+            updater_reconciliation = sync_manager.start_reconciliation(updater_id, repair)
+        except reconciler.ReconciliationInProgressError as e:
+            return _json_error_response(str(e), 409)
+
+        return _json_response(json.dumps(updater_reconciliation.to_dict()), status=202)
+
+    updater_reconciliation = sync_manager.get_reconciliation(updater_id)
+    if not updater_reconciliation:
+        return _json_error_response(
+            "Updater '{}' hasn't been reconciled".format(updater_id), 404
+        )
+
+    if request.method == 'DELETE':
+        updater_reconciliation.cancel()
+
+    return _json_response(json.dumps(updater_reconciliation.to_dict()))
+
+
+def _pass_reconciliation_request_on(updater_id):
+    """Leaves reconciliation requests to the sync process, which reports on them in its status"""
+    if request.method == 'POST':
+        repair = request.args.get('repair', 'true').lower() != 'false'
+        sync_process.send_command(
+            sync_process.START_RECONCILIATION_COMMAND, updater_id=updater_id, repair=repair
+        )
+        return _json_response(json.dumps({'state': 'requested'}), status=202)
+
+    if request.method == 'DELETE':
+        sync_process.send_command(
+            sync_process.CANCEL_RECONCILIATION_COMMAND, updater_id=updater_id
+        )
+        return _json_response(json.dumps({'state': 'cancel_requested'}), status=202)
+
+    status_info = sync_status.read_status_file() or {}
+    updater_status = status_info.get('status', {}).get(updater_id, {})
+
+    if 'reconciliation' not in updater_status:
+        return _json_error_response(
+            "Updater '{}' hasn't been reconciled".format(updater_id), 404
+        )
+
+    return _json_response(json.dumps(updater_status['reconciliation']))
+
+
+@app.route('/resync', methods=['POST'])
+def resync_titles():
+    """Queues a re-sync of selected titles for the given updaters, ahead of their next pages.
+    The body has the updater IDs as 'updaters' and a selector (see service.resync)."""
+    error_response = _check_admin_token()
+    if error_response:
+        return error_response
+
+    request_body = request.get_json(force=True, silent=True)
+    if not isinstance(request_body, dict):
+        return _json_error_response('The request body must be a JSON object', 400)
+
+    updater_ids = request_body.get('updaters')
+    if not isinstance(updater_ids, list) or not updater_ids:
+        return _json_error_response("'updaters' must be a list of updater IDs", 400)
+
+    unknown_updater_ids = [
+        updater_id for updater_id in updater_ids if updater_id not in _get_updater_ids()
+    ]
+    if unknown_updater_ids:
+        return _json_error_response('Unknown updater(s): {}'.format(
+            ', '.join(map(str, unknown_updater_ids))
+        ), 404)
+
+    selector = {key: value for key, value in request_body.items() if key != 'updaters'}
+
+    try:
+        resync.parse_selector(selector)
+
+        if sync_process.is_external():
+            # the sync process reports on the re-syncs in its status
+            sync_process.send_command(
+                sync_process.ENQUEUE_RESYNC_COMMAND, updater_ids=updater_ids, selector=selector
+            )
+            return _json_response(json.dumps({'state': 'requested'}), status=202)
+
+        jobs = sync_manager.enqueue_resync(updater_ids, selector)
+    except resync.InvalidResyncRequestError as e:
+        return _json_error_response(str(e), 400)
+
+    return _json_response(
+        json.dumps({job.updater_id: job.to_dict() for job in jobs}), status=202
+    )
+
+
+def _get_updater_ids():
+    # with an external sync process, this process has no updaters of its own
+    if sync_process.is_external():
+        return list(sync_manager.get_index_updater_config())
+
+    return [updater.id for updater in sync_manager.get_index_updaters()]
+
+
+def _check_admin_token():
+    """Error response when admin endpoints are disabled or the token is invalid, else None"""
+    if not CONFIG_DICT['ADMIN_TOKEN']:
+        return _json_error_response('Not found', 404)
+
+    token = request.headers.get(ADMIN_TOKEN_HEADER, '')
+    if not hmac.compare_digest(token.encode(), CONFIG_DICT['ADMIN_TOKEN'].encode()):
+        return _json_error_response('Forbidden', 403)
+
+    return None
+
+
+def _json_error_response(error_message, status):
+    return _json_response(json.dumps({'error': error_message}), status=status)
+
+
+def _json_response(body, status=200):
+    return Response(body, status=status, mimetype=APPLICATION_JSON_TYPE)
 
 
 def _check_postgresql_connection():
@@ -107,5 +282,5 @@ def _check_elasticsearch_connection():
         return ['Problem talking to elasticsearch: {0}'.format(str(e))]
 
 
-if not CONFIG_DICT.get('TESTING', False):
+if not CONFIG_DICT.get('TESTING', False) and not sync_process.is_external():
     sync_manager.start()
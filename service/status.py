@@ -0,0 +1,188 @@
+"""Status of the synchronisation, built by the process running it.
+
+When synchronisation runs in a process of its own (SYNC_MODE=external), that process writes its
+status to a file every SYNC_STATUS_INTERVAL_SECS, which the web workers read instead of building
+it. The file is replaced atomically, so readers never see a partly written one.
+"""
+import json
+import os
+import tempfile
+import time
+
+from config import CONFIG_DICT
+from service import es_utils, freshness, id_filter, quarantine, sync_manager
+from service.database import read_source
+from service.date_utils import format_date_with_millis
+
+# the sync process counts as stalled when its status is older than this many intervals
+STALE_STATUS_INTERVALS = 3
+
+
+def write_status_file(status_info, file_path=None, freshness_snapshot=None):
+    file_path = file_path or CONFIG_DICT['SYNC_STATUS_FILE_PATH']
+    file_content = {
+        'written_at': time.time(),
+        'pid': os.getpid(),
+        'status': status_info,
+        'freshness': freshness_snapshot or {},
+    }
+    file_descriptor, temp_file_path = tempfile.mkstemp(
+        dir=os.path.dirname(os.path.abspath(file_path)), prefix='.sync-status-'
+    )
+
+    try:
+        with os.fdopen(file_descriptor, 'w') as file:
+            json.dump(file_content, file)
+
+        os.replace(temp_file_path, file_path)
+    except Exception:
+        os.unlink(temp_file_path)
+        raise
+
+
+def read_status_file(file_path=None):
+    """Status written by the sync process with details of the process itself, or None when
+    there's no status file yet"""
+    file_content = _read_status_file_content(file_path)
+
+    if file_content is None:
+        return None
+
+    status_age_secs = time.time() - file_content['written_at']
+    status_info = file_content['status']
+    status_info['sync_process'] = {
+        'pid': file_content['pid'],
+        'status_age_secs': round(status_age_secs, 3),
+        'is_stalled': (
+            status_age_secs > STALE_STATUS_INTERVALS * CONFIG_DICT['SYNC_STATUS_INTERVAL_SECS']
+        ),
+    }
+    return status_info
+
+
+def read_freshness_snapshot_file(file_path=None):
+    """Freshness histograms written by the sync process (see service.freshness), or None when
+    there's no status file yet"""
+    file_content = _read_status_file_content(file_path)
+    return file_content.get('freshness', {}) if file_content is not None else None
+
+
+def _read_status_file_content(file_path=None):
+    file_path = file_path or CONFIG_DICT['SYNC_STATUS_FILE_PATH']
+
+    try:
+        with open(file_path, 'rt') as file:
+            return json.load(file)
+    except FileNotFoundError:
+        return None
+
+
+def get_sync_status():
+    """Status of the updaters and of what they share, as returned by the status endpoint"""
+    updaters = sync_manager.get_index_updaters()
+    updater_status_info = {updater.id: _get_updater_status(updater) for updater in updaters}
+    status_info = {
+        'polling_interval': CONFIG_DICT['POLLING_INTERVAL_SECS'],
+        'status': updater_status_info,
+    }
+
+    if read_source.is_replica_configured():
+        status_info['read_replica'] = _get_read_replica_status()
+
+    bulk_budgets = es_utils.get_bulk_budgets()
+    if bulk_budgets:
+        status_info['bulk_budgets'] = {
+            uri: _get_bulk_budget_status(budget) for uri, budget in bulk_budgets.items()
+        }
+
+    return status_info
+
+
+def _get_bulk_budget_status(budget):
+    return {
+        'chunk_size': budget.chunk_size,
+        'concurrency_limit': budget.concurrency_limit,
+        'in_flight': budget.in_flight,
+        'latency_ms': budget.latency_ms,
+        'rejection_rate': budget.rejection_rate,
+        'rejected_actions': budget.rejected_action_count,
+    }
+
+
+def _get_read_replica_status():
+    replica_check = read_source.get_last_replica_check()
+
+    if not replica_check:
+        return {'last_check_time': None, 'lag_secs': None, 'reading_from': None, 'error': None}
+
+    return {
+        'last_check_time': format_date_with_millis(replica_check.checked_at),
+        'lag_secs': replica_check.lag_secs,
+        'reading_from': replica_check.source_name,
+        'error': replica_check.error,
+    }
+
+
+def _get_updater_status(updater):
+    updater_status = {
+        'last_successful_sync_time': _format_optional_date(updater.last_successful_sync_time),
+        'last_unsuccessful_sync_time': _format_optional_date(updater.last_unsuccessful_sync_time),
+        'last_title_modification_date': _format_optional_date(
+            updater.last_title_modification_date
+        ),
+        'last_title_number': updater.last_updated_title_number,
+        'is_busy': sync_manager.is_index_updater_busy(updater),
+        'index_name': updater.index_name,
+        'doc_type': updater.doc_type,
+    }
+
+    updater_reconciliation = sync_manager.get_reconciliation(updater.id)
+    if updater_reconciliation:
+        updater_status['reconciliation'] = updater_reconciliation.to_dict()
+
+    freshness_snapshot = freshness.get_updater_snapshot(updater.id)
+    if freshness_snapshot:
+        updater_status['freshness'] = freshness.get_freshness_status(freshness_snapshot)
+
+    updater_id_filter = id_filter.get_filter(updater.id)
+    if updater_id_filter:
+        updater_status['delete_filter'] = updater_id_filter.to_dict()
+
+    if quarantine.is_enabled():
+        updater_status['quarantine'] = quarantine.get_quarantine_status(updater.id)
+
+    resync_jobs = sync_manager.get_resync_jobs(updater.id)
+    if resync_jobs:
+        updater_status['resync'] = [job.to_dict() for job in resync_jobs]
+
+    lease_manager = sync_manager.get_lease_manager()
+    if lease_manager:
+        updater_status['owner'] = lease_manager.get_owner(updater.id)
+
+    write_targets = list(updater.write_targets)
+    if write_targets:
+        updater_status['write_targets'] = [
+            _get_write_target_status(write_target) for write_target in write_targets
+        ]
+
+    return updater_status
+
+
+def _get_write_target_status(write_target):
+    return {
+        'index_name': write_target.index_name,
+        'doc_type': write_target.doc_type,
+        'elasticsearch_uri': write_target.elasticsearch_uri,
+        'last_title_modification_date': _format_optional_date(
+            write_target.last_title_modification_date
+        ),
+        'last_title_number': write_target.last_updated_title_number,
+        'pending_pages': write_target.pending_page_count,
+    }
+
+
+def _format_optional_date(date):
+    if date:
+        return format_date_with_millis(date)
+    else:
+        return None
@@ -2,13 +2,29 @@ from apscheduler.schedulers.background import BackgroundScheduler  # type: ignor
 from flask import json                                             # type: ignore
 import logging
 import threading
+import time
 from typing import Dict
 
 from config import CONFIG_DICT
+from service import db, read_replica_db
+from service import async_engine
+from service import backfill_lane
 from service import synchroniser
 from service import es_status_loader
 from service import es_utils
+from service import id_filter
+from service import leases
+from service import profiler
+from service import quarantine
+from service import reconciler
+from service import recorder
+from service import resync
+from service.database import indexes as source_indexes
+from service.database import page_reader
+from service.database import read_source
+from service.write_target import WriteTarget
 from service.updaters.property_by_address_updater_v1 import PropertyByAddressUpdaterV1
+from service.updaters.property_by_address_updater_v2 import PropertyByAddressUpdaterV2
 from service.updaters.property_by_postcode_updater_v3 import PropertyByPostcodeUpdaterV3
 
 
@@ -20,6 +36,14 @@ updater_status_lock = threading.RLock()
 _updater_statuses = None  # type: Dict[str, str]
 _index_updaters = None    # type: Dict[str, Dict[str, str]]
 _polling_interval_in_secs = CONFIG_DICT['POLLING_INTERVAL_SECS']
+_sync_threads = {}        # type: Dict[str, threading.Thread]
+_async_engine = None      # type: async_engine.AsyncSyncEngine
+_lease_manager = None     # type: leases.LeaseManager
+_reconciliations = {}     # type: Dict[str, reconciler.Reconciliation]
+_is_stopped = False
+
+ASYNC_SYNC_ENGINE = 'async'
+SHUTDOWN_POLL_INTERVAL_SECS = 0.1
 
 scheduler = BackgroundScheduler()
 
@@ -28,6 +52,7 @@ scheduler = BackgroundScheduler()
 def start():
     global _updater_statuses
     global _index_updaters
+    global _lease_manager
 
     LOGGER.info("Scheduling index synchronisation to take place every {} seconds".format(
         _polling_interval_in_secs
@@ -35,20 +60,184 @@ def start():
 
     indexes = _get_index_data_from_config()
     _updater_statuses = {updater_id: UPDATER_STATUS_IDLE for updater_id in indexes}
-    _index_updaters = [_get_updater(updater_id, indexes[updater_id]) for updater_id in indexes]
+    _index_updaters = [
+        create_index_updater(updater_id, indexes[updater_id]) for updater_id in indexes
+    ]
+
+    if CONFIG_DICT['LEASES_ENABLED']:
+        # updaters are prepared when this instance takes over their leases
+        _lease_manager = leases.create_lease_manager(
+            [updater.id for updater in _index_updaters],
+            is_busy=lambda updater_id: _updater_statuses[updater_id] == UPDATER_STATUS_BUSY,
+            on_acquired=_prepare_index_updater_with_id_for_use,
+        )
+        synchroniser.set_lease_check(_lease_manager.owns)
+    else:
+        for updater in _index_updaters:
+            _prepare_index_updater_for_use(updater)
+
+    if CONFIG_DICT['SYNC_ENGINE'] == ASYNC_SYNC_ENGINE:
+        _start_async_engine(_index_updaters)
+
+    _check_page_query_plans(_index_updaters)
 
-    for updater in _index_updaters:
-        _prepare_index_updater_for_use(updater)
+    if _lease_manager:
+        LOGGER.info("Running as instance '{}' of the service".format(_lease_manager.instance_id))
+        refresh_leases()
+        _schedule_lease_refresh()
 
     _schedule_data_synchronisation()
+    profiler.install_signal_handler(get_sync_threads)
 
     LOGGER.info('Index synchronisation scheduled')
 
 
+def stop(timeout_secs=None):
+    """Shuts the synchronisation down, so that a restart has at most a page per updater to redo.
+
+    Stops scheduling synchronisations and has the running ones stop after the page they're on,
+    waiting up to timeout_secs (SHUTDOWN_TIMEOUT_SECS by default) for them. Then it makes sure
+    what the next start infers the updaters' positions from is saved - the indexes refreshed,
+    recordings closed and the leases of stopped updaters released - and closes the write targets'
+    threads and the database and elasticsearch connection pools. Sync threads still running are
+    daemon threads, so they don't hold the process up. Returns whether all synchronisations
+    stopped in time."""
+    global _is_stopped
+
+    with updater_status_lock:
+        if _is_stopped:
+            return True
+
+        _is_stopped = True
+
+    timeout_secs = CONFIG_DICT['SHUTDOWN_TIMEOUT_SECS'] if timeout_secs is None else timeout_secs
+    deadline = time.monotonic() + timeout_secs
+    LOGGER.info('Stopping index synchronisation, waiting up to {}s for the pages in flight'.format(
+        timeout_secs
+    ))
+
+    if scheduler.running:
+        scheduler.shutdown(wait=False)
+
+    synchroniser.request_stop()
+
+    if _async_engine:
+        _async_engine.request_stop()
+
+    with updater_status_lock:
+        reconciliations = list(_reconciliations.values())
+
+    for reconciliation in reconciliations:
+        if reconciliation.is_running:
+            reconciliation.cancel()
+
+    is_stopped_in_time = _wait_until_idle(deadline)
+
+    if is_stopped_in_time:
+        LOGGER.info('All synchronisations stopped')
+    else:
+        LOGGER.warning('Synchronisation of updater(s) {} didn\'t stop in {}s'.format(
+            _get_busy_updater_ids(), timeout_secs
+        ))
+
+    _flush_checkpoints()
+    _close_pools()
+    LOGGER.info('Index synchronisation stopped')
+    return is_stopped_in_time
+
+
 def get_index_updaters():
     return _index_updaters
 
 
+def get_index_updater_config():
+    return _get_index_data_from_config()
+
+
+def get_sync_threads(updater_id=None):
+    """Running sync threads - of all updaters, or just the one with the given ID.
+    With the async engine, all updaters share the engine's thread."""
+    if _async_engine:
+        return [_async_engine.thread] if _async_engine.thread.is_alive() else []
+
+    with updater_status_lock:
+        return [
+            thread for thread_updater_id, thread in _sync_threads.items()
+            if thread.is_alive() and updater_id in (None, thread_updater_id)
+        ]
+
+
+def get_lease_manager():
+    """Lease manager of this instance, or None when updaters aren't distributed with leases"""
+    return _lease_manager
+
+
+def refresh_leases():
+    try:
+        _lease_manager.refresh()
+    except Exception as e:
+        LOGGER.error('An error occurred when refreshing the updater leases', exc_info=e)
+
+
+def start_reconciliation(updater_id, repair=True):
+    """Starts reconciling the updater's index with the source on a thread of its own.
+    Returns the reconciliation, to follow its progress."""
+    index_updater = next(updater for updater in _index_updaters if updater.id == updater_id)
+
+    with updater_status_lock:
+        previous_reconciliation = _reconciliations.get(updater_id)
+
+        if previous_reconciliation and previous_reconciliation.is_running:
+            raise reconciler.ReconciliationInProgressError(
+                "Updater '{}' is already being reconciled".format(updater_id)
+            )
+
+        reconciliation = reconciler.Reconciliation(updater_id, repair)
+        _reconciliations[updater_id] = reconciliation
+
+    t = threading.Thread(
+        target=reconciler.reconcile,
+        args=(index_updater, reconciliation),
+        name='reconcile-{}'.format(updater_id),
+    )
+    t.daemon = True
+    t.start()
+    return reconciliation
+
+
+def get_reconciliation(updater_id):
+    """Latest reconciliation of the updater's index, or None when there wasn't any"""
+    with updater_status_lock:
+        return _reconciliations.get(updater_id)
+
+
+def enqueue_resync(updater_ids, selector):
+    """Queues a re-sync of the titles the selector chooses for each of the updaters, to be run
+    ahead of their next pages. Returns the queued jobs."""
+    if _async_engine:
+        raise resync.InvalidResyncRequestError("Re-syncs aren't run by the async sync engine")
+
+    known_updater_ids = [updater.id for updater in _index_updaters]
+    unknown_updater_ids = [
+        updater_id for updater_id in updater_ids if updater_id not in known_updater_ids
+    ]
+    if unknown_updater_ids:
+        raise resync.InvalidResyncRequestError('Unknown updater(s): {}'.format(
+            ', '.join(unknown_updater_ids)
+        ))
+
+    jobs = [resync.ResyncJob(updater_id, selector) for updater_id in updater_ids]
+
+    for job in jobs:
+        resync.enqueue(job)
+
+    return jobs
+
+
+def get_resync_jobs(updater_id):
+    return resync.get_jobs(updater_id)
+
+
 def is_index_updater_busy(index_updater):
     with updater_status_lock:
         return _updater_statuses[index_updater.id] == UPDATER_STATUS_BUSY
@@ -56,11 +245,16 @@ def is_index_updater_busy(index_updater):
 
 # method to be scheduled - synchronisation of all indexes
 def synchronise_es_indexes_with_source():
+    if synchroniser.is_stop_requested():
+        return
+
     LOGGER.info('Starting index synchronisation')
 
     try:
         for index_updater in _index_updaters:
-            if not is_index_updater_busy(index_updater):
+            if _lease_manager and not _lease_manager.owns(index_updater.id):
+                _trigger_resync_of_updater_run_elsewhere(index_updater)
+            elif not is_index_updater_busy(index_updater):
                 _trigger_index_synchronisation(index_updater)
             else:
                 LOGGER.info("Updater '{}' is busy - skipping".format(index_updater.id))
@@ -70,9 +264,165 @@ def synchronise_es_indexes_with_source():
         LOGGER.error('An error occurred when starting index synchronisation', exc_info=e)
 
 
+def _wait_until_idle(deadline):
+    for thread in get_sync_threads():
+        thread.join(max(deadline - time.monotonic(), 0))
+
+    # the async engine's synchronisations are only known by the statuses of their updaters
+    while _get_busy_updater_ids() and time.monotonic() < deadline:
+        time.sleep(SHUTDOWN_POLL_INTERVAL_SECS)
+
+    return not _get_busy_updater_ids()
+
+
+def _get_busy_updater_ids():
+    with updater_status_lock:
+        return sorted(
+            updater_id for updater_id, status in (_updater_statuses or {}).items()
+            if status == UPDATER_STATUS_BUSY
+        )
+
+
+def _flush_checkpoints():
+    """Makes the last pages written visible to the search the next start infers the positions
+    of the updaters from, and hands the leases of stopped updaters over"""
+    busy_updater_ids = _get_busy_updater_ids()
+
+    for updater in _index_updaters or []:
+        if updater.id in busy_updater_ids:
+            continue
+
+        indexes = [
+            (write_target.index_name, write_target.client)
+            for write_target in updater.write_targets
+        ] or [(updater.index_name, None)]
+
+        for index_name, client in indexes:
+            try:
+                es_utils.refresh_index(index_name, client)
+            except Exception as e:
+                LOGGER.error("Failed to refresh index '{}' of updater '{}'".format(
+                    index_name, updater.id
+                ), exc_info=e)
+
+    recorder.close()
+
+    if _lease_manager:
+        try:
+            _lease_manager.release_idle()
+        except Exception as e:
+            LOGGER.error('Failed to release the updater leases', exc_info=e)
+
+
+def _close_pools():
+    if _async_engine:
+        _async_engine.stop()
+
+    _close_write_targets()
+
+    db.dispose()
+
+    if read_replica_db is not None:
+        read_replica_db.dispose()
+
+    es_utils.close_clients()
+
+
+def _close_write_targets():
+    busy_updater_ids = _get_busy_updater_ids()
+
+    for updater in _index_updaters or []:
+        for write_target in updater.write_targets:
+            # the pages of an updater still writing aren't waited for
+            write_target.close(wait=updater.id not in busy_updater_ids)
+
+
 def _prepare_index_updater_for_use(updater):
     _ensure_mapping_exists(updater)
-    es_status_loader.load_index_updater_status(updater)
+
+    if updater.write_targets:
+        for write_target in updater.write_targets:
+            es_status_loader.load_write_target_status(write_target)
+
+        synchroniser.rewind_to_slowest_write_target(updater)
+    else:
+        es_status_loader.load_index_updater_status(updater)
+
+    if updater.dual_lanes:
+        backfill_lane.load_backfill_lane(updater)
+        synchroniser.skip_to_backfill_high_water_mark(updater)
+
+    if quarantine.is_enabled():
+        quarantine.load_quarantine(updater)
+
+    # another instance may have written to the index since the filter was built - it's built
+    # again by the updater's next synchronisation, as scrolling the index here would hold up
+    # the renewal of the leases when the updater is taken over
+    id_filter.drop_filter(updater.id)
+
+
+def _prepare_index_updater_with_id_for_use(updater_id):
+    # reloads the updater's status, as another instance may have run it since this one last did
+    updater = next(updater for updater in _index_updaters if updater.id == updater_id)
+
+    # a synchronisation from before the lease was lost stops at its next page, as the lease
+    # isn't held - its cursor mustn't be changed under it until then
+    if is_index_updater_busy(updater):
+        raise Exception("Updater '{}' is still synchronising since its lease was lost".format(
+            updater_id
+        ))
+
+    _prepare_index_updater_for_use(updater)
+
+
+def _check_page_query_plans(index_updaters):
+    """Warns about page queries Postgres won't serve with an index range scan, on each database
+    pages may be read from - the read replica has its own statistics and settings"""
+    source_filters = [None] + source_indexes.get_source_filters(index_updaters)
+
+    for source_name, engine in read_source.get_source_engines():
+        for source_filter in source_filters:
+            _check_page_query_plan(source_name, engine, source_filter)
+
+
+def _check_page_query_plan(source_name, engine, source_filter):
+    filter_name = source_filter.name if source_filter else 'none'
+
+    try:
+        query_plan = page_reader.get_page_query_plan(source_filter, engine)
+    except Exception as e:
+        LOGGER.warning("Failed to check the page query plan (database: '{}', source filter: "
+                       "'{}')".format(source_name, filter_name), exc_info=e)
+        return
+
+    if not page_reader.uses_index_range_scan(query_plan):
+        LOGGER.warning(
+            "The page query (database: '{}', source filter: '{}') won't be served with an "
+            "index range scan - check that index '{}' exists (python -m "
+            "service.database.indexes). Plan: {}".format(
+                source_name, filter_name, source_indexes.PAGE_INDEX_NAME, json.dumps(query_plan)
+            )
+        )
+
+
+def _get_write_targets(index_info):
+    """The updater's own index followed by the extra write targets from the config, if any"""
+    extra_targets_info = index_info.get('write_targets', [])
+
+    if not extra_targets_info:
+        return []
+
+    own_target = WriteTarget(index_info['index_name'], index_info['doc_type'])
+    extra_targets = [
+        WriteTarget(
+            target_info['index_name'],
+            target_info.get('doc_type', index_info['doc_type']),
+            target_info.get('elasticsearch_uri'),
+        )
+        for target_info in extra_targets_info
+    ]
+
+    return [own_target] + extra_targets
 
 
 def _schedule_data_synchronisation():
@@ -85,7 +435,15 @@ def _schedule_data_synchronisation():
     scheduler.start()
 
 
-def _get_updater(updater_id, index_info):
+def _schedule_lease_refresh():
+    scheduler.add_job(
+        refresh_leases,
+        'interval',
+        seconds=CONFIG_DICT['LEASE_REFRESH_INTERVAL_SECS']
+    )
+
+
+def create_index_updater(updater_id, index_info):
     """Gets and instance of the right elasticsearch updater, based on the ID"""
 
     index_name = index_info['index_name']
@@ -95,7 +453,9 @@ def _get_updater(updater_id, index_info):
         'property-by-postcode-v3-updater':
             lambda: PropertyByPostcodeUpdaterV3(index_name, doc_type),
         'property-by-address-v1-updater':
-            lambda: PropertyByAddressUpdaterV1(index_name, doc_type)
+            lambda: PropertyByAddressUpdaterV1(index_name, doc_type),
+        'property-by-address-v2-updater':
+            lambda: PropertyByAddressUpdaterV2(index_name, doc_type),
     }
 
     creator = updater_creators.get(updater_id)
@@ -104,6 +464,12 @@ def _get_updater(updater_id, index_info):
         LOGGER.info("Creating index updater '{}'".format(updater_id))
         updater = creator()
         updater.id = updater_id
+        updater.versioned_writes = index_info.get('versioned_writes', False)
+        updater.write_targets = _get_write_targets(index_info)
+        updater.max_target_lag_pages = index_info.get('max_target_lag_pages', 1)
+        updater.dual_lanes = index_info.get('dual_lanes', False)
+        updater.backfill_threshold_secs = index_info.get('backfill_threshold_secs', 3600)
+        _validate_dual_lanes(updater)
         LOGGER.info("Created index updater '{}'".format(updater_id))
         return updater
     else:
@@ -111,22 +477,87 @@ def _get_updater(updater_id, index_info):
         raise Exception(error_msg.format(updater_id))
 
 
+def _validate_dual_lanes(updater):
+    if not updater.dual_lanes:
+        return
+
+    # without external versions, a backfill write could replace a newer document
+    if not updater.versioned_writes:
+        raise Exception("Updater '{}' can only use dual lanes with versioned writes".format(
+            updater.id
+        ))
+
+    if updater.write_targets:
+        raise Exception("Updater '{}' can't use dual lanes with write targets".format(updater.id))
+
+
+def _start_async_engine(index_updaters):
+    global _async_engine
+
+    for updater in index_updaters:
+        async_engine.validate_index_updater(updater)
+
+    _async_engine = async_engine.create_engine(
+        owns=_lease_manager.owns if _lease_manager else None
+    )
+    _async_engine.start()
+    LOGGER.info('Started the async sync engine')
+
+
 def _trigger_index_synchronisation(index_updater):
     LOGGER.info("Starting data synchronisation using updater '{}'".format(index_updater.id))
 
+    if _async_engine:
+        _update_index_updater_status(index_updater, busy=True)
+        future = _async_engine.submit(index_updater)
+        future.add_done_callback(
+            lambda future: _update_index_updater_status(index_updater, busy=False)
+        )
+        return
+
+    t = threading.Thread(
+        target=_synchronise_index_with_source,
+        args=(index_updater,),
+        name='sync-{}'.format(index_updater.id),
+    )
+    t.daemon = True
+
+    with updater_status_lock:
+        _sync_threads[index_updater.id] = t
+
+    t.start()
+
+
+def _trigger_resync_of_updater_run_elsewhere(index_updater):
+    """Runs the re-syncs queued here for an updater another instance runs. They don't touch
+    its cursor, so they can be run by any instance."""
+    if is_index_updater_busy(index_updater) or not resync.has_pending_jobs(index_updater.id):
+        LOGGER.debug("Updater '{}' is run by another instance - skipping".format(
+            index_updater.id
+        ))
+        return
+
+    LOGGER.info("Re-syncing titles using updater '{}', run by another instance".format(
+        index_updater.id
+    ))
     t = threading.Thread(
         target=_synchronise_index_with_source,
-        args=(index_updater,)
+        args=(index_updater, synchroniser.run_pending_resync_jobs),
+        name='resync-{}'.format(index_updater.id),
     )
     t.daemon = True
+
+    with updater_status_lock:
+        _sync_threads[index_updater.id] = t
+
     t.start()
 
 
-def _synchronise_index_with_source(index_updater):
+def _synchronise_index_with_source(index_updater, synchronise=None):
     _update_index_updater_status(index_updater, busy=True)
 
     try:
-        synchroniser.synchronise_index_with_source(index_updater)
+        (synchronise or synchroniser.synchronise_index_with_source)(index_updater)
     except Exception as e:
         LOGGER.error(
             "An error occurred when updating elasticsearch using updater '{}'".format(
@@ -151,9 +582,22 @@ def _ensure_mapping_exists(index_updater):
         index_updater.id
     ))
 
-    es_utils.ensure_mapping_exists(
-        index_updater.index_name, index_updater.doc_type, index_updater.get_mapping()
-    )
+    if index_updater.write_targets:
+        for write_target in index_updater.write_targets:
+            es_utils.ensure_mapping_exists(
+                write_target.index_name, write_target.doc_type, index_updater.get_mapping(),
+                write_target.client,
+            )
+    else:
+        es_utils.ensure_mapping_exists(
+            index_updater.index_name, index_updater.doc_type, index_updater.get_mapping()
+        )
+
+    if index_updater.dual_lanes:
+        backfill_lane.ensure_mapping_exists(index_updater)
+
+    if quarantine.is_enabled():
+        quarantine.ensure_mapping_exists(index_updater)
 
 
 def _get_index_data_from_config():
@@ -0,0 +1,184 @@
+"""Dedicated process running the synchronisation, away from the web workers.
+
+With SYNC_MODE set to 'external', the web workers don't synchronise anything. This process does,
+writing its status to the status file (see service.status) for them to serve. Requests the web
+workers can't handle themselves, like starting a reconciliation, are passed on as command files
+in SYNC_COMMAND_DIR, which this process picks up in the order they were written. So are the
+suspensions of ID filters by the commands writing to the indexes from processes of their own.
+
+    python -m service.sync_process
+
+It can also be started and stopped by the gunicorn master (see gunicorn_settings.py).
+"""
+from contextlib import contextmanager
+import json
+import logging
+import os
+import signal
+import tempfile
+import threading
+import time
+import uuid
+
+from config import CONFIG_DICT
+from service import freshness, id_filter, status, sync_manager
+
+LOGGER = logging.getLogger(__name__)
+
+EMBEDDED_SYNC_MODE = 'embedded'
+EXTERNAL_SYNC_MODE = 'external'
+
+START_RECONCILIATION_COMMAND = 'start_reconciliation'
+CANCEL_RECONCILIATION_COMMAND = 'cancel_reconciliation'
+ENQUEUE_RESYNC_COMMAND = 'enqueue_resync'
+SUSPEND_ID_FILTERS_COMMAND = 'suspend_id_filters'
+RESUME_ID_FILTERS_COMMAND = 'resume_id_filters'
+ID_FILTER_COMMANDS = {SUSPEND_ID_FILTERS_COMMAND, RESUME_ID_FILTERS_COMMAND}
+COMMAND_FILE_SUFFIX = '.json'
+# how many status intervals a command waits for the sync process to suspend ID filters
+ID_FILTER_SUSPENSION_WAIT_INTERVALS = 3
+COMMAND_POLL_INTERVAL_SECS = 0.2
+
+
+def is_external():
+    """Tells whether synchronisation runs in the sync process rather than in the web workers"""
+    return CONFIG_DICT['SYNC_MODE'] == EXTERNAL_SYNC_MODE
+
+
+def send_command(command, **arguments):
+    """Leaves a command for the sync process. Command files are named after the time they were
+    written, so that they're processed in order. Returns the path of the command file."""
+    command_dir = CONFIG_DICT['SYNC_COMMAND_DIR']
+    os.makedirs(command_dir, exist_ok=True)
+    file_name = '{:020d}-{}{}'.format(time.time_ns(), uuid.uuid4().hex, COMMAND_FILE_SUFFIX)
+    file_descriptor, temp_file_path = tempfile.mkstemp(dir=command_dir, prefix='.command-')
+
+    with os.fdopen(file_descriptor, 'w') as file:
+        json.dump({'command': command, 'arguments': arguments}, file)
+
+    # the sync process only looks at complete files
+    command_file_path = os.path.join(command_dir, file_name)
+    os.replace(temp_file_path, command_file_path)
+    return command_file_path
+
+
+def wait_for_command(command_file_path, timeout_secs):
+    """Waits for the sync process to process the command. Returns whether it did in time."""
+    deadline = time.monotonic() + timeout_secs
+
+    while os.path.exists(command_file_path):
+        if time.monotonic() >= deadline:
+            return False
+
+        time.sleep(COMMAND_POLL_INTERVAL_SECS)
+
+    return True
+
+
+@contextmanager
+def suspend_id_filters(updater_ids):
+    """Has the sync process suspend the ID filters of the updaters (see service.id_filter) while
+    the caller writes to their indexes, so that the deletes of the documents it writes aren't
+    dropped"""
+    if not is_external() or not CONFIG_DICT['DELETE_FILTER_ENABLED']:
+        yield
+        return
+
+    updater_ids = list(updater_ids)
+    command_file_path = send_command(SUSPEND_ID_FILTERS_COMMAND, updater_ids=updater_ids)
+    timeout_secs = ID_FILTER_SUSPENSION_WAIT_INTERVALS * CONFIG_DICT['SYNC_STATUS_INTERVAL_SECS']
+
+    # the sync process processes the command before building any filter when it starts
+    if not wait_for_command(command_file_path, timeout_secs):
+        LOGGER.warning('The sync process has not suspended the ID filters within {}s - '
+                       'it may not be running'.format(timeout_secs))
+
+    try:
+        yield
+    finally:
+        send_command(RESUME_ID_FILTERS_COMMAND, updater_ids=updater_ids)
+
+
+def process_pending_commands(command_names=None):
+    """Processes the commands left for the sync process - or only the ones with the given
+    names, leaving the others for later"""
+    command_dir = CONFIG_DICT['SYNC_COMMAND_DIR']
+
+    if not os.path.isdir(command_dir):
+        return
+
+    command_handlers = {
+        START_RECONCILIATION_COMMAND: sync_manager.start_reconciliation,
+        CANCEL_RECONCILIATION_COMMAND: _cancel_reconciliation,
+        ENQUEUE_RESYNC_COMMAND: sync_manager.enqueue_resync,
+        SUSPEND_ID_FILTERS_COMMAND: id_filter.suspend_filters,
+        RESUME_ID_FILTERS_COMMAND: id_filter.resume_filters,
+    }
+
+    for file_name in sorted(os.listdir(command_dir)):
+        if not file_name.endswith(COMMAND_FILE_SUFFIX) or file_name.startswith('.'):
+            continue
+
+        file_path = os.path.join(command_dir, file_name)
+
+        try:
+            with open(file_path, 'rt') as file:
+                command = json.load(file)
+
+            if command_names is not None and command['command'] not in command_names:
+                continue
+
+            LOGGER.info('Processing command: {}'.format(json.dumps(command)))
+            command_handlers[command['command']](**command['arguments'])
+        except Exception as e:
+            LOGGER.error("Failed to process command file '{}'".format(file_name), exc_info=e)
+
+        os.unlink(file_path)
+
+
+def run(stop_event):
+    """Runs the synchronisation until the event is set, writing its status and processing
+    commands every SYNC_STATUS_INTERVAL_SECS"""
+    LOGGER.info('Starting the sync process')
+    # commands writing to the indexes may have been waiting for the process to start
+    process_pending_commands(ID_FILTER_COMMANDS)
+    sync_manager.start()
+
+    while not stop_event.is_set():
+        process_pending_commands()
+
+        try:
+            status.write_status_file(
+                status.get_sync_status(), freshness_snapshot=freshness.get_snapshot()
+            )
+        except Exception as e:
+            LOGGER.error('Failed to write the sync status file', exc_info=e)
+
+        stop_event.wait(CONFIG_DICT['SYNC_STATUS_INTERVAL_SECS'])
+
+    # lets the pages in flight finish, so that a restart doesn't have to redo them
+    sync_manager.stop()
+    LOGGER.info('Stopped the sync process')
+
+
+def _cancel_reconciliation(updater_id):
+    reconciliation = sync_manager.get_reconciliation(updater_id)
+
+    if reconciliation:
+        reconciliation.cancel()
+
+
+def main():
+    stop_event = threading.Event()
+
+    def handle_stop_signal(signal_number, frame):
+        LOGGER.info('Received signal {} - stopping the sync process'.format(signal_number))
+        stop_event.set()
+
+    signal.signal(signal.SIGTERM, handle_stop_signal)
+    signal.signal(signal.SIGINT, handle_stop_signal)
+    run(stop_event)
+
+
+if __name__ == '__main__':
+    main()
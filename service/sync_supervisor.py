@@ -0,0 +1,83 @@
+"""Keeps one sync process running on behalf of the gunicorn master.
+
+The process is started with the same interpreter and environment as gunicorn, and started again
+after SYNC_PROCESS_RESTART_DELAY_SECS whenever it exits on its own.
+"""
+import logging
+import subprocess
+import sys
+import threading
+
+from config import CONFIG_DICT
+
+LOGGER = logging.getLogger(__name__)
+
+SYNC_PROCESS_COMMAND = [sys.executable, '-m', 'service.sync_process']
+
+
+class SyncProcessSupervisor():
+
+    def __init__(self, command=None):
+        self._command = command or SYNC_PROCESS_COMMAND
+        self._process = None  # type: subprocess.Popen
+        self._stop_event = threading.Event()
+        # held while the process is being started or stopped, so that it isn't both at once
+        self._lock = threading.Lock()
+        self._watcher = None  # type: threading.Thread
+
+    @property
+    def pid(self):
+        return self._process.pid if self._process else None
+
+    def start(self):
+        self._stop_event.clear()
+        self._start_process()
+        self._watcher = threading.Thread(target=self._watch, name='sync-process-supervisor')
+        self._watcher.daemon = True
+        self._watcher.start()
+
+    def stop(self, timeout_secs=None):
+        """Asks the sync process to stop, killing it when it doesn't within the timeout"""
+        self._stop_event.set()
+        timeout_secs = timeout_secs or CONFIG_DICT['SYNC_PROCESS_STOP_TIMEOUT_SECS']
+
+        with self._lock:
+            if self._process and self._process.poll() is None:
+                LOGGER.info('Stopping the sync process (pid {})'.format(self._process.pid))
+                self._process.terminate()
+
+                try:
+                    self._process.wait(timeout_secs)
+                except subprocess.TimeoutExpired:
+                    LOGGER.warning('The sync process did not stop in {}s - killing it'.format(
+                        timeout_secs
+                    ))
+                    self._process.kill()
+                    self._process.wait()
+
+        if self._watcher:
+            self._watcher.join()
+
+    def _start_process(self):
+        self._process = subprocess.Popen(self._command)
+        LOGGER.info('Started the sync process (pid {})'.format(self._process.pid))
+
+    def _watch(self):
+        while not self._stop_event.is_set():
+            return_code = self._process.wait()
+
+            if self._stop_event.is_set():
+                return
+
+            LOGGER.error('The sync process exited with code {} - restarting it in {}s'.format(
+                return_code, CONFIG_DICT['SYNC_PROCESS_RESTART_DELAY_SECS']
+            ))
+
+            if self._stop_event.wait(CONFIG_DICT['SYNC_PROCESS_RESTART_DELAY_SECS']):
+                return
+
+            with self._lock:
+                if self._stop_event.is_set():
+                    return
+
+                self._start_process()
@@ -1,17 +1,68 @@
 from datetime import datetime
-import itertools
 import logging
+import threading
 from config import CONFIG_DICT
+from service import backfill_lane
+from service import date_utils
 from service import es_status_loader
 from service import es_utils
+from service import freshness
+from service import id_filter
+from service import leases
+from service import quarantine
+from service import recorder
+from service import resync
+from service.database import copy_reader
+from service.database import page_reader
+from service.updaters import base as updater_base
 
 
 LOGGER = logging.getLogger(__name__)
 
 page_size = CONFIG_DICT['PAGE_SIZE']
 
+# set on shutdown - synchronisations stop after the page they're on (see request_stop)
+_stop_requested = threading.Event()
+
+# set when updaters are distributed with leases (see set_lease_check)
+_lease_check = None
+
+
+class SynchronisationStoppedError(Exception):
+    pass
+
+
+def request_stop():
+    """Has every synchronisation stop once the page it's on is written, leaving the updater's
+    cursor on it, and none start - for a shutdown"""
+    _stop_requested.set()
+
+
+def is_stop_requested():
+    return _stop_requested.is_set()
+
+
+def set_lease_check(owns):
+    """Has synchronisations check that this instance still holds the updater's lease, with the
+    given function of the updater ID, before each page that moves the updater's cursor"""
+    global _lease_check
+    _lease_check = owns
+
+
+def _ensure_lease_held(index_updater):
+    # another instance may be running the updater since the lease was lost
+    if _lease_check is not None and not _lease_check(index_updater.id):
+        raise leases.LeaseLostError("Lost the lease of updater '{}' - stopping its synchronisation"
+                                    .format(index_updater.id))
+
 
 def synchronise_index_with_source(index_updater):
+    if is_stop_requested():
+        LOGGER.info("Updater '{}' - not synchronising, as the service is stopping".format(
+            index_updater.id
+        ))
+        return
+
     LOGGER.info(
         "Synchronising index '{}' with source data, doc type '{}', using updater '{}'".format(
             index_updater.index_name, index_updater.doc_type, index_updater.id
@@ -19,7 +70,19 @@ def synchronise_index_with_source(index_updater):
     )
 
     try:
-        _bring_index_up_to_date(index_updater)
+        id_filter.ensure_filter_current(index_updater)
+
+        # the pages of the synchronisation are all read with the same connection
+        with page_reader.dedicated_page_connections():
+            quarantine.enqueue_due_retries(index_updater)
+            run_pending_resync_jobs(index_updater)
+
+            if list(index_updater.write_targets):
+                _bring_write_targets_up_to_date(index_updater)
+            elif index_updater.dual_lanes:
+                _bring_index_up_to_date_in_lanes(index_updater)
+            else:
+                _bring_index_up_to_date(index_updater)
 
         LOGGER.info("Updater '{}' - finished synchronising index '{}', doc type '{}'".format(
             index_updater.id, index_updater.index_name, index_updater.doc_type
@@ -36,7 +99,13 @@ def _bring_index_up_to_date(index_updater):
     is_up_to_date_with_source = False
 
     try:
-        while not is_up_to_date_with_source:
+        if CONFIG_DICT['COPY_BOOTSTRAP_ENABLED'] and \
+                index_updater.last_title_modification_date == datetime.min:
+            bootstrap_index(index_updater)
+
+        while not is_up_to_date_with_source and not is_stop_requested():
+            # re-syncs are run ahead of the rest of the pages
+            run_pending_resync_jobs(index_updater)
             sync_time = datetime.now()
             data_page, errors = _populate_index_with_data_page(index_updater)
 
@@ -48,13 +117,13 @@ def _bring_index_up_to_date(index_updater):
             # I've found 'not found' on deletions and 'conflict' on insert/updates, but they were
             # only informational - the updates took place
 
-            if data_page:
+            if data_page.title_count:
                 LOGGER.info("Updated elasticsearch with page of data. Updater: '{}'".format(
                     index_updater.id
                 ))
                 _update_index_updater_status(index_updater, data_page)
 
-            if len(data_page) < page_size:
+            if data_page.title_count < page_size:
                 LOGGER.info("Updater '{}' is up to date with source data store".format(
                     index_updater.id
                 ))
@@ -64,41 +133,402 @@ def _bring_index_up_to_date(index_updater):
         raise e
 
 
-def _update_index_updater_status(index_updater, data_page):
-    latest_title = data_page[-1]
-    index_updater.last_title_modification_date = latest_title.last_modified
-    index_updater.last_updated_title_number = latest_title.title_number
-    LOGGER.info("Updated sync status for updater '{}'. Last modified date: '{}'".format(
-        index_updater.id, latest_title.last_modified
+def bootstrap_index(index_updater):
+    """Loads all the titles of the updater with a single COPY instead of page by page (see
+    service.database.copy_reader) and moves its cursor to the last of them, for the pages to
+    carry on from. Meant for empty indexes. Returns the number of titles loaded."""
+    LOGGER.info("Bootstrapping index '{}', doc type '{}', using updater '{}'".format(
+        index_updater.index_name, index_updater.doc_type, index_updater.id
+    ))
+    sync_time = datetime.now()
+    _ensure_lease_held(index_updater)
+    data_page = _DataPage(_until_stop_requested(
+        copy_reader.stream_titles_with_copy(index_updater.get_source_filter())
     ))
+    page_quarantine = quarantine.create_page_quarantine(index_updater)
+    elasticsearch_actions = _prepare_elasticsearch_actions(
+        data_page, index_updater, page_quarantine
+    )
+    success_count, errors = es_utils.execute_elasticsearch_actions(elasticsearch_actions)
+    _release_recovered_titles(page_quarantine)
 
+    LOGGER.info("Bootstrapped {} title(s). Updater: '{}'".format(
+        data_page.title_count, index_updater.id
+    ))
+    _log_stale_writes(index_updater, errors)
+    index_updater.last_successful_sync_time = sync_time
+    # the lease may have lapsed while the whole source was loaded
+    _ensure_lease_held(index_updater)
 
-def _populate_index_with_data_page(index_updater):
-    data_page = _retrieve_source_data_page(index_updater)
+    if data_page.title_count:
+        _update_index_updater_status(index_updater, data_page)
 
-    if data_page:
-        elasticsearch_actions = _prepare_elasticsearch_actions(data_page, index_updater)
+    return data_page.title_count
 
-        success_count, errors = es_utils.execute_elasticsearch_actions(elasticsearch_actions)
-        return data_page, errors
-    else:
-        return [], []
 
+def _until_stop_requested(titles):
+    """Passes the titles through until a stop is requested - the cursor then ends up on the last
+    title passed, which the bulk helper writes with the rest of its chunk"""
+    try:
+        for title in titles:
+            if is_stop_requested():
+                LOGGER.info('Stopping the bootstrap, as the service is stopping')
+                return
+
+            yield title
+    finally:
+        # ends the COPY rather than reading the rest of its output
+        if hasattr(titles, 'close'):
+            titles.close()
+
+
+def _bring_index_up_to_date_in_lanes(index_updater):
+    """Catches up with recent changes (the live lane) and then, while there's a backfill lane,
+    takes turns between a page of backfill and catching up with recent changes again, so that
+    recent changes never wait for more than a page of backfill"""
+    _ensure_status_loaded(index_updater)
 
-def _retrieve_source_data_page(index_updater):
-    LOGGER.info("Retrieving page of source data. Updater: '{}', page size: {}".format(
-        index_updater.id, page_size
+    if index_updater.backfill_lane is None and _is_far_behind_source(index_updater):
+        _start_backfill_lane(index_updater)
+
+    _bring_index_up_to_date(index_updater)
+
+    while index_updater.backfill_lane is not None and not is_stop_requested():
+        sync_time = datetime.now()
+
+        try:
+            _populate_index_with_backfill_page(index_updater)
+        except Exception as e:
+            index_updater.last_unsuccessful_sync_time = sync_time
+            raise e
+
+        _bring_index_up_to_date(index_updater)
+
+
+def skip_to_backfill_high_water_mark(index_updater):
+    """Moves the updater's cursor up to its backfill lane's high-water mark, which it may be
+    behind when the cursor was inferred from the index before the live lane wrote anything"""
+    lane = index_updater.backfill_lane
+
+    if lane is None:
+        return
+
+    cursor = (
+        date_utils.to_epoch_micros(index_updater.last_title_modification_date),
+        index_updater.last_updated_title_number,
+    )
+    high_water_mark = (
+        date_utils.to_epoch_micros(lane.high_water_modification_date),
+        lane.high_water_title_number,
+    )
+
+    if cursor < high_water_mark:
+        index_updater.last_title_modification_date = lane.high_water_modification_date
+        index_updater.last_updated_title_number = lane.high_water_title_number
+
+
+def _is_far_behind_source(index_updater):
+    cursor_age_micros = (
+        date_utils.to_epoch_micros(datetime.utcnow()) -
+        date_utils.to_epoch_micros(index_updater.last_title_modification_date)
+    )
+
+    return cursor_age_micros > index_updater.backfill_threshold_secs * 1000000
+
+
+def _start_backfill_lane(index_updater):
+    high_water_mark = index_updater.get_latest_source_position()
+
+    if high_water_mark is None:
+        return
+
+    high_water_modification_date, high_water_title_number = high_water_mark
+    index_updater.backfill_lane = backfill_lane.BackfillLane(
+        index_updater.last_title_modification_date,
+        index_updater.last_updated_title_number,
+        high_water_modification_date,
+        high_water_title_number,
+    )
+    backfill_lane.save_backfill_lane(index_updater)
+
+    # the live lane carries on from the high-water mark
+    index_updater.last_title_modification_date = high_water_modification_date
+    index_updater.last_updated_title_number = high_water_title_number
+    LOGGER.info("Updater '{}' started a backfill lane from '{}' up to '{}'".format(
+        index_updater.id,
+        index_updater.backfill_lane.last_title_modification_date,
+        high_water_modification_date,
     ))
 
-    data_page = index_updater.get_next_source_data_page(page_size)
 
-    LOGGER.info("Retrieved {} title(s). Updater: '{}'".format(
-        len(data_page), index_updater.id)
+def _populate_index_with_backfill_page(index_updater):
+    lane = index_updater.backfill_lane
+    data_page, errors = _populate_index_with_data_page(index_updater, lane)
+
+    if data_page.title_count:
+        lane.last_title_modification_date = data_page.last_modified
+        lane.last_updated_title_number = data_page.last_title_number
+
+    if data_page.title_count < page_size:
+        # the live lane's cursor is the only one left
+        backfill_lane.delete_backfill_lane(index_updater)
+        index_updater.backfill_lane = None
+        LOGGER.info("Updater '{}' finished its backfill lane".format(index_updater.id))
+    elif data_page.title_count:
+        backfill_lane.save_backfill_lane(index_updater)
+        LOGGER.info("Updated sync status of backfill lane for updater '{}'. "
+                    "Last modified date: '{}'".format(index_updater.id, data_page.last_modified))
+
+
+def _bring_write_targets_up_to_date(index_updater):
+    """Reads the source once and writes the same actions to all the updater's write targets.
+    The updater's cursor is the read position - on failure, it's moved back to the checkpoint
+    of the slowest target, so that no target misses a page."""
+    sync_time = datetime.now()
+    _ensure_write_target_statuses_loaded(index_updater)
+    write_targets = index_updater.write_targets
+    is_up_to_date_with_source = False
+
+    for write_target in write_targets:
+        write_target.reset()
+
+    try:
+        while not is_up_to_date_with_source and not is_stop_requested():
+            sync_time = datetime.now()
+            data_page = _submit_data_page_to_write_targets(index_updater)
+
+            if data_page.title_count:
+                _update_index_updater_status(index_updater, data_page)
+
+            if data_page.title_count < page_size:
+                LOGGER.info("Updater '{}' has read all source data".format(index_updater.id))
+                is_up_to_date_with_source = True
+
+        for write_target in write_targets:
+            write_target.wait_until_lag_at_most(0)
+
+        index_updater.last_successful_sync_time = sync_time
+    except Exception as e:
+        index_updater.last_unsuccessful_sync_time = sync_time
+        _wait_for_pending_pages(write_targets)
+        rewind_to_slowest_write_target(index_updater)
+        raise e
+
+
+def rewind_to_slowest_write_target(index_updater):
+    slowest_target = min(
+        index_updater.write_targets,
+        key=lambda write_target: (
+            date_utils.to_epoch_micros(write_target.last_title_modification_date),
+            write_target.last_updated_title_number,
+        )
     )
 
+    index_updater.last_title_modification_date = slowest_target.last_title_modification_date
+    index_updater.last_updated_title_number = slowest_target.last_updated_title_number
+    LOGGER.info("Updater '{}' continues from the checkpoint of target '{}': '{}'".format(
+        index_updater.id, slowest_target.id, slowest_target.last_title_modification_date
+    ))
+
+
+def _submit_data_page_to_write_targets(index_updater):
+    _ensure_lease_held(index_updater)
+    page_freshness = freshness.PageFreshness(index_updater.id)
+    data_page = _retrieve_source_data_page(index_updater)
+    page_recording = recorder.PageRecording(index_updater)
+    titles = page_recording.track_titles(page_freshness.track_titles(data_page))
+    page_quarantine = quarantine.create_page_quarantine(index_updater)
+    elasticsearch_actions = _prepare_elasticsearch_actions(titles, index_updater, page_quarantine)
+
+    # The actions are built once and shared by all targets, so they're held for as long as
+    # the slowest target needs them
+    elasticsearch_actions = list(
+        page_recording.track_actions(page_freshness.track_actions(elasticsearch_actions))
+    )
+
+    if data_page.title_count:
+        for write_target in index_updater.write_targets:
+            write_target.wait_until_lag_at_most(index_updater.max_target_lag_pages - 1)
+            write_target.submit_page(
+                elasticsearch_actions, data_page.last_modified, data_page.last_title_number,
+                page_freshness,
+            )
+
+    # a page failing to be written is read again, after the cursor is rewound to the target -
+    # and recorded again, the targets writing it later on threads of their own
+    _release_recovered_titles(page_quarantine)
+    page_recording.record_written(data_page)
+    LOGGER.info("Submitted {} title(s) to write targets. Updater: '{}'".format(
+        data_page.title_count, index_updater.id
+    ))
     return data_page
 
 
+def _wait_for_pending_pages(write_targets):
+    for write_target in write_targets:
+        try:
+            write_target.wait_until_lag_at_most(0)
+        except Exception as e:
+            LOGGER.error("Failed to write to target '{}'".format(write_target.id), exc_info=e)
+
+
+def _ensure_write_target_statuses_loaded(index_updater):
+    if index_updater.last_title_modification_date is None:
+        for write_target in index_updater.write_targets:
+            es_status_loader.load_write_target_status(write_target)
+
+        rewind_to_slowest_write_target(index_updater)
+
+
+class _DataPage():
+    """Streams the titles of a page through, keeping only their count and the position
+    of the latest one, so that titles can be released as soon as they're turned into actions"""
+
+    def __init__(self, titles):
+        self._titles = titles
+        self.title_count = 0
+        self.last_modified = None
+        self.last_title_number = None
+
+    def __iter__(self):
+        try:
+            for title in self._titles:
+                self.title_count += 1
+                self.last_modified = title.last_modified
+                self.last_title_number = title.title_number
+                yield title
+        finally:
+            # releases the database session when the page isn't read to the end
+            if hasattr(self._titles, 'close'):
+                self._titles.close()
+
+
+def _update_index_updater_status(index_updater, data_page):
+    index_updater.last_title_modification_date = data_page.last_modified
+    index_updater.last_updated_title_number = data_page.last_title_number
+    LOGGER.info("Updated sync status for updater '{}'. Last modified date: '{}'".format(
+        index_updater.id, data_page.last_modified
+    ))
+
+
+def _populate_index_with_data_page(index_updater, lane=None):
+    _ensure_lease_held(index_updater)
+    page_freshness = freshness.PageFreshness(index_updater.id)
+    data_page = _retrieve_source_data_page(index_updater, lane)
+    page_recording = recorder.PageRecording(index_updater)
+    titles = page_recording.track_titles(page_freshness.track_titles(data_page))
+    page_quarantine = quarantine.create_page_quarantine(index_updater)
+    elasticsearch_actions = _prepare_elasticsearch_actions(titles, index_updater, page_quarantine)
+    elasticsearch_actions = page_recording.track_actions(
+        page_freshness.track_actions(elasticsearch_actions)
+    )
+
+    # The page is read, transformed and sent in chunks while elasticsearch consumes the actions
+    success_count, errors = es_utils.execute_elasticsearch_actions(elasticsearch_actions)
+    page_freshness.record_acknowledged(errors)
+    _release_recovered_titles(page_quarantine)
+    page_recording.record_written(data_page)
+
+    LOGGER.info("Processed {} title(s). Updater: '{}'".format(
+        data_page.title_count, index_updater.id
+    ))
+    _log_stale_writes(index_updater, errors)
+    return data_page, errors
+
+
+def run_pending_resync_jobs(index_updater):
+    """Runs the re-syncs queued for the updater, one after another (see service.resync)"""
+    while not is_stop_requested():
+        job = resync.take_next_job(index_updater.id)
+
+        if job is None:
+            return
+
+        run_resync_job(index_updater, job)
+
+
+def run_resync_job(index_updater, job):
+    """Reads the titles the re-sync selects page by page, and writes their actions the same way
+    the updater's pages are written - to all its write targets, if it has any. The updater's
+    cursor isn't moved. Failures are recorded in the job."""
+    LOGGER.info("Re-syncing titles using updater '{}'. Selector: {}".format(
+        index_updater.id, job.selector
+    ))
+
+    try:
+        while not job.is_exhausted:
+            if is_stop_requested():
+                raise SynchronisationStoppedError(
+                    'Stopped after {} title(s), as the service is stopping'.format(job.title_count)
+                )
+
+            data_page = _DataPage(job.read_next_page(page_size, index_updater.get_source_filter()))
+            page_quarantine = quarantine.create_page_quarantine(index_updater)
+            elasticsearch_actions = resync.replace_equal_versions(
+                _prepare_elasticsearch_actions(data_page, index_updater, page_quarantine)
+            )
+            errors = _write_resync_actions(index_updater, elasticsearch_actions)
+            _release_recovered_titles(page_quarantine)
+
+            # a quarantined title the retry doesn't find would be retried forever
+            page_title_numbers = job.get_page_title_numbers(page_size)
+            if page_quarantine is not None and page_title_numbers:
+                page_quarantine.release_missing(page_title_numbers)
+
+            _log_stale_writes(index_updater, errors)
+            job.failed_action_count += len(
+                [error for error in errors if not es_utils.is_version_conflict(error)]
+            )
+            job.advance(data_page, page_size)
+
+        job.finish()
+        LOGGER.info("Re-synced {} title(s) using updater '{}'".format(
+            job.title_count, index_updater.id
+        ))
+    except Exception as e:
+        job.finish(error=e)
+        LOGGER.error("Failed to re-sync titles using updater '{}'".format(index_updater.id),
+                     exc_info=e)
+
+
+def _write_resync_actions(index_updater, elasticsearch_actions):
+    write_targets = list(index_updater.write_targets)
+
+    if not write_targets:
+        _, errors = es_utils.execute_elasticsearch_actions(elasticsearch_actions)
+        return errors
+
+    # the page's actions are written to one target after another, so they're all held
+    elasticsearch_actions = list(elasticsearch_actions)
+    errors = []
+
+    for write_target in write_targets:
+        _, target_errors = write_target.write_actions(elasticsearch_actions)
+        errors.extend(target_errors)
+
+    return errors
+
+
+def _log_stale_writes(index_updater, errors):
+    stale_write_count = len([error for error in errors if es_utils.is_version_conflict(error)])
+
+    if stale_write_count:
+        LOGGER.info("Elasticsearch rejected {} stale write(s). Updater: '{}'".format(
+            stale_write_count, index_updater.id
+        ))
+
+
+def _retrieve_source_data_page(index_updater, lane=None):
+    LOGGER.info("Retrieving page of source data. Updater: '{}', page size: {}".format(
+        index_updater.id, page_size
+    ))
+
+    if lane is None:
+        return _DataPage(index_updater.get_next_source_data_page(page_size))
+    else:
+        return _DataPage(index_updater.get_next_source_data_page(page_size, lane))
+
+
 def _ensure_status_loaded(index_updater):
     if index_updater.last_title_modification_date is None:
         error_msg = "Unknown index update status for index '{}', doc type '{}', updater '{}'"
@@ -108,14 +538,22 @@ def _ensure_status_loaded(index_updater):
         es_status_loader.load_index_updater_status(index_updater)
 
 
-def _prepare_elasticsearch_actions(data_page, index_updater):
+def _prepare_elasticsearch_actions(titles, index_updater, page_quarantine=None):
+    """Actions of the titles. With a page quarantine, titles the updater fails on are
+    quarantined and left out (see service.quarantine)."""
     LOGGER.info("Preparing elasticsearch actions. Updater: '{}'".format(index_updater.id))
+    on_title_error = None
 
-    elasticsearch_action_lists = [
-        index_updater.prepare_elasticsearch_actions(title) for title in data_page
-    ]
+    if page_quarantine is not None:
+        titles = page_quarantine.track_titles(titles)
+        on_title_error = page_quarantine.on_title_error
+
+    # in batches, for updaters that prepare the actions of a whole batch at once
+    return id_filter.filter_actions(index_updater, updater_base.stream_actions(
+        index_updater, titles, on_title_error=on_title_error
+    ))
 
-    elasticsearch_actions = list(itertools.chain.from_iterable(elasticsearch_action_lists))
 
-    LOGGER.info("Updating elasticsearch with data page. Updater: '{}'".format(index_updater.id))
-    return elasticsearch_actions
+def _release_recovered_titles(page_quarantine):
+    if page_quarantine is not None:
+        page_quarantine.release_recovered()
@@ -2,7 +2,15 @@ from abc import ABCMeta, abstractmethod
 
 # TODO: descriptions
 from datetime import datetime
+import itertools
 import logging
+from typing import List
+from config import CONFIG_DICT
+from service import date_utils
+from service import es_utils
+from service.backfill_lane import BackfillLane
+from service.database import page_reader
+from service.write_target import WriteTarget
 
 LOGGER = logging.getLogger(__name__)
 
@@ -19,6 +27,12 @@ class AbstractIndexUpdater():
     _last_unsuccessful_sync_time = None   # type: datetime
     _last_title_modification_date = None  # type: datetime
     _last_updated_title_number = None     # type: str
+    _versioned_writes = False             # type: bool
+    _write_targets = None                 # type: List[WriteTarget]
+    _max_target_lag_pages = 1             # type: int
+    _dual_lanes = False                   # type: bool
+    _backfill_threshold_secs = 3600       # type: int
+    _backfill_lane = None                 # type: BackfillLane
 
     @property
     def id(self):
@@ -68,18 +82,187 @@ class AbstractIndexUpdater():
     def last_updated_title_number(self, value):
         self._last_updated_title_number = value
 
+    @property
+    def versioned_writes(self):
+        """When set, documents are written with plain index operations and external versions
+        derived from the title's modification date, instead of doc_as_upsert updates"""
+        return self._versioned_writes
+
+    @versioned_writes.setter
+    def versioned_writes(self, value):
+        self._versioned_writes = value
+
+    @property
+    def write_targets(self):
+        """Places the documents are written to, when there's more than just the updater's index.
+        An empty list means documents are only written to the updater's index."""
+        return self._write_targets or []
+
+    @write_targets.setter
+    def write_targets(self, value):
+        self._write_targets = value
+
+    @property
+    def max_target_lag_pages(self):
+        """How many pages a write target can fall behind before the updater waits for it"""
+        return self._max_target_lag_pages
+
+    @max_target_lag_pages.setter
+    def max_target_lag_pages(self, value):
+        self._max_target_lag_pages = value
+
+    @property
+    def dual_lanes(self):
+        """When set, an updater that falls behind by more than backfill_threshold_secs leaves
+        the titles up to the latest one to a backfill lane and carries on with recent changes"""
+        return self._dual_lanes
+
+    @dual_lanes.setter
+    def dual_lanes(self, value):
+        self._dual_lanes = value
+
+    @property
+    def backfill_threshold_secs(self):
+        return self._backfill_threshold_secs
+
+    @backfill_threshold_secs.setter
+    def backfill_threshold_secs(self, value):
+        self._backfill_threshold_secs = value
+
+    @property
+    def backfill_lane(self):
+        """Backfill lane in progress, if any"""
+        return self._backfill_lane
+
+    @backfill_lane.setter
+    def backfill_lane(self, value):
+        self._backfill_lane = value
+
     def __init__(self, index_name, doc_type):
         self._index_name = index_name
         self._doc_type = doc_type
 
     @abstractmethod
-    def get_next_source_data_page(self, page_size):
+    def get_next_source_data_page(self, page_size, backfill_lane=None):
+        """Next page of titles after the updater's cursor or, when a backfill lane is given,
+        after the lane's position and up to its high-water mark"""
         return []
 
     @abstractmethod
     def prepare_elasticsearch_actions(self, title):
         return []
 
+    def prepare_page_actions(self, titles):
+        """Actions of a batch of a page's titles - a list of the actions of each title, in the
+        same order. Updaters can override it to do their work once for the whole batch rather
+        than title by title. By default, it calls prepare_elasticsearch_actions for each title."""
+        return [self.prepare_elasticsearch_actions(title) for title in titles]
+
     @abstractmethod
     def get_mapping(self):
         pass
+
+    def get_latest_source_position(self):
+        """(last_modified, title_number) of the latest title this updater would read, or None"""
+        return page_reader.get_latest_title_position(self.get_source_filter())
+
+    def get_source_filter(self):
+        """Condition titles have to meet to be read by this updater (see page_reader.SourceFilter).
+        None means all titles are read."""
+        return None
+
+    def _get_high_water_mark(self, backfill_lane):
+        if backfill_lane is None:
+            return None
+
+        return (backfill_lane.high_water_modification_date, backfill_lane.high_water_title_number)
+
+    def _get_write_action(self, title, document, id, version=None):
+        if self.versioned_writes:
+            if version is None:
+                version = date_utils.to_epoch_micros(title.last_modified)
+
+            return es_utils.get_versioned_index_action(
+                self.index_name, self.doc_type, document, id, version
+            )
+        else:
+            return es_utils.get_upsert_action(self.index_name, self.doc_type, document, id)
+
+    def _get_delete_action(self, title, id, version=None):
+        if self.versioned_writes:
+            if version is None:
+                version = date_utils.to_epoch_micros(title.last_modified)
+
+            return es_utils.get_delete_action(self.index_name, self.doc_type, id, version)
+        else:
+            return es_utils.get_delete_action(self.index_name, self.doc_type, id)
+
+
+class PageDate():
+    """A modification date shared by titles of a batch, with what's derived from it"""
+
+    def __init__(self, last_modified):
+        self.entry_datetime = date_utils.format_date_with_millis(last_modified)
+        self.version = date_utils.to_epoch_micros(last_modified)
+
+
+def get_page_dates(titles):
+    """PageDate of each distinct modification date of the titles - titles of a page often share
+    them, after bulk changes"""
+    return {
+        last_modified: PageDate(last_modified)
+        for last_modified in set(title.last_modified for title in titles)
+    }
+
+
+def implements_page_actions(index_updater):
+    """Tells whether the updater's class has a prepare_page_actions of its own"""
+    page_actions_method = getattr(type(index_updater), 'prepare_page_actions', None)
+    return page_actions_method is not None and \
+        page_actions_method is not AbstractIndexUpdater.prepare_page_actions
+
+
+def stream_actions(index_updater, titles, batch_size=None, on_title_error=None):
+    """Yields the actions of the titles. Updaters implementing prepare_page_actions get the
+    titles in batches of batch_size (READ_BATCH_SIZE by default), so that no more than a batch
+    is held in memory at a time - the others get them one by one.
+
+    With on_title_error, a title the updater fails on is passed to it with the error and left
+    out, rather than failing the rest - a failed batch is prepared again title by title."""
+    if not implements_page_actions(index_updater):
+        for title in titles:
+            for action in _prepare_title_actions(index_updater, title, on_title_error):
+                yield action
+
+        return
+
+    titles = iter(titles)
+    batch_size = batch_size or CONFIG_DICT['READ_BATCH_SIZE']
+
+    for batch in iter(lambda: list(itertools.islice(titles, batch_size)), []):
+        for actions in _prepare_batch_actions(index_updater, batch, on_title_error):
+            for action in actions:
+                yield action
+
+
+def _prepare_batch_actions(index_updater, titles, on_title_error):
+    if on_title_error is None:
+        return index_updater.prepare_page_actions(titles)
+
+    try:
+        return index_updater.prepare_page_actions(titles)
+    except Exception:
+        return [
+            _prepare_title_actions(index_updater, title, on_title_error) for title in titles
+        ]
+
+
+def _prepare_title_actions(index_updater, title, on_title_error):
+    if on_title_error is None:
+        return index_updater.prepare_elasticsearch_actions(title)
+
+    try:
+        return index_updater.prepare_elasticsearch_actions(title)
+    except Exception as e:
+        on_title_error(title, e)
+        return []
@@ -1,32 +1,55 @@
 import logging
 import re
 from service import date_utils
-from service.database.page_reader import get_next_data_page
-from service import es_utils
-from service.updaters.base import AbstractIndexUpdater
+from service.updaters.base import AbstractIndexUpdater, get_page_dates
 from service.database import page_reader
 
 LOGGER = logging.getLogger(__name__)
+ADDRESS_PUNCTUATION_REGEX = re.compile('[,()]')
+WHITESPACE_REGEX = re.compile('\\s+')
+# joins the strings of a batch, for the regexes to go over them in one pass - Postgres can't
+# store it in JSON strings, so it can't be part of an address
+BATCH_SEPARATOR = '\x00'
 
 
 class PropertyByAddressUpdaterV1(AbstractIndexUpdater):
     """elasticsearch data updater for property_by_address doc type in version 1"""
 
-    def get_next_source_data_page(self, page_size):
-        source_data_page = page_reader.get_next_data_page(
-            self.last_updated_title_number,
-            self.last_title_modification_date,
+    def get_next_source_data_page(self, page_size, backfill_lane=None):
+        position = backfill_lane or self
+
+        source_data_page = page_reader.stream_next_data_page(
+            position.last_updated_title_number,
+            position.last_title_modification_date,
             page_size,
+            self.get_source_filter(),
+            self._get_high_water_mark(backfill_lane),
         )
 
         return source_data_page
 
+    def get_source_filter(self):
+        # titles without an address string can't be indexed by address
+        return page_reader.ADDRESS_PRESENT_FILTER
+
     def prepare_elasticsearch_actions(self, title):
         if title.is_deleted:
             return self._prepare_delete_actions(title)
         else:
             return self._prepare_upsert_actions(title)
 
+    def prepare_page_actions(self, titles):
+        page_dates = get_page_dates(titles)
+        address_strings = _split_batch(ADDRESS_PUNCTUATION_REGEX.sub('', _join_batch(
+            self._get_raw_address_string(title) for title in titles
+        )).lower(), len(titles))
+        ids = self._get_document_ids(titles, address_strings)
+
+        return [
+            self._prepare_title_actions(title, address_string, id, page_dates[title.last_modified])
+            for title, address_string, id in zip(titles, address_strings, ids)
+        ]
+
     def get_mapping(self):
         return {
             'properties': {
@@ -38,9 +61,21 @@ class PropertyByAddressUpdaterV1(AbstractIndexUpdater):
             }
         }
 
+    def _prepare_title_actions(self, title, address_string, id, page_date):
+        if title.is_deleted:
+            return [self._get_delete_action(title, id, page_date.version)]
+
+        document = {
+            'title_number': title.title_number,
+            'entry_datetime': page_date.entry_datetime,
+            'address_string': address_string,
+        }
+
+        return [self._get_write_action(title, document, id, page_date.version)]
+
     def _prepare_delete_actions(self, title):
         id = self._get_document_id(title.title_number, self._get_address_string(title))
-        return [es_utils.get_delete_action(self.index_name, self.doc_type, id)]
+        return [self._get_delete_action(title, id)]
 
     def _prepare_upsert_actions(self, title):
         address_string = self._get_address_string(title)
@@ -53,14 +88,37 @@ class PropertyByAddressUpdaterV1(AbstractIndexUpdater):
             'address_string': address_string,
         }
 
-        return [es_utils.get_upsert_action(self.index_name, self.doc_type, document, id)]
+        return [self._get_write_action(title, document, id)]
+
+    def _get_document_ids(self, titles, address_strings):
+        """IDs of the documents of a batch of titles, with their normalised address strings"""
+        # only the addresses are upper-cased, as they are title by title
+        upper_address_strings = _split_batch(
+            _join_batch(address_strings).upper(), len(address_strings)
+        )
+        return _split_batch(WHITESPACE_REGEX.sub('_', _join_batch(
+            '{}-{}'.format(title.title_number, address_string)
+            for title, address_string in zip(titles, upper_address_strings)
+        )), len(titles))
 
     def _get_document_id(self, title_number, address_string):
         id = '{}-{}'.format(title_number, address_string.upper())
-        normalised_id = re.sub('\\s+', '_', id)
+        normalised_id = WHITESPACE_REGEX.sub('_', id)
         return normalised_id
 
     def _get_address_string(self, title):
-        address_string = title.register_data['address']['address_string']
-        normalised_address_string = re.sub('[,()]', '', address_string).lower()
+        address_string = self._get_raw_address_string(title)
+        normalised_address_string = ADDRESS_PUNCTUATION_REGEX.sub('', address_string).lower()
         return normalised_address_string
+
+    def _get_raw_address_string(self, title):
+        return title.register_data['address']['address_string']
+
+
+def _join_batch(strings):
+    return BATCH_SEPARATOR.join(strings)
+
+
+def _split_batch(joined_strings, count):
+    # an empty batch joins into an empty string too, like a batch of one empty string
+    return joined_strings.split(BATCH_SEPARATOR) if count else []
@@ -0,0 +1,38 @@
+import hashlib
+import logging
+from service.updaters.property_by_address_updater_v1 import PropertyByAddressUpdaterV1
+
+LOGGER = logging.getLogger(__name__)
+# 64 bits of hash - the IDs of a title's documents only have to differ from one another
+ID_HASH_BYTES = 8
+
+
+class PropertyByAddressUpdaterV2(PropertyByAddressUpdaterV1):
+    """elasticsearch data updater for property_by_address doc type in version 2 - the documents
+    of version 1 with compact IDs. Version 1 IDs hold the whole normalised address, so they're as
+    long as it is. Version 2 IDs are the title number and a fixed-length hash of the version 1 ID,
+    which stays the same as long as the normalised address does.
+
+    Indexes written by version 1 can be moved over to the new IDs with service.id_migration."""
+
+    def get_legacy_document_id(self, title_number, address_string):
+        """Version 1 ID of the document"""
+        return super()._get_document_id(title_number, address_string)
+
+    def _get_document_id(self, title_number, address_string):
+        return get_compact_document_id(
+            title_number, self.get_legacy_document_id(title_number, address_string)
+        )
+
+    def _get_document_ids(self, titles, address_strings):
+        legacy_ids = super()._get_document_ids(titles, address_strings)
+
+        return [
+            get_compact_document_id(title.title_number, legacy_id)
+            for title, legacy_id in zip(titles, legacy_ids)
+        ]
+
+
+def get_compact_document_id(title_number, legacy_id):
+    id_hash = hashlib.blake2b(legacy_id.encode('utf-8'), digest_size=ID_HASH_BYTES).hexdigest()
+    return '{}-{}'.format(title_number, id_hash)
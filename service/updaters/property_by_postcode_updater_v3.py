@@ -1,32 +1,53 @@
 import logging
 import re
 from service import date_utils
-from service import es_utils
 from service.database import page_reader
-from service.updaters.base import AbstractIndexUpdater
+from service.updaters.base import AbstractIndexUpdater, get_page_dates
 
 LOGGER = logging.getLogger(__name__)
 POSTCODE_REGEX = r'[A-Z]{1,2}[0-9R][0-9A-Z]? [0-9][A-Z]{2}'
+SOURCE_FILTER = page_reader.get_postcode_present_or_address_matches_filter(POSTCODE_REGEX)
+COMPILED_POSTCODE_REGEX = re.compile(POSTCODE_REGEX)
+NUMBER_REGEX = re.compile(r'\d+')
+WHITESPACE_REGEX = re.compile('\\s+')
 
 
 class PropertyByPostcodeUpdaterV3(AbstractIndexUpdater):
     """elasticsearch data updater for property_by_postcode doc type in version 3"""
 
-    def get_next_source_data_page(self, page_size):
-        source_data_page = page_reader.get_next_data_page(
-            self.last_updated_title_number,
-            self.last_title_modification_date,
+    def get_next_source_data_page(self, page_size, backfill_lane=None):
+        position = backfill_lane or self
+
+        source_data_page = page_reader.stream_next_data_page(
+            position.last_updated_title_number,
+            position.last_title_modification_date,
             page_size,
+            self.get_source_filter(),
+            self._get_high_water_mark(backfill_lane),
         )
 
         return source_data_page
 
+    def get_source_filter(self):
+        # titles that produce no postcodes in _get_postcodes can't be indexed by postcode
+        return SOURCE_FILTER
+
     def prepare_elasticsearch_actions(self, title):
         if title.is_deleted:
             return self._prepare_delete_actions(title)
         else:
             return self._prepare_upsert_actions(title)
 
+    def prepare_page_actions(self, titles):
+        page_dates = get_page_dates(titles)
+
+        return [
+            self._prepare_delete_actions(title, page_dates[title.last_modified])
+            if title.is_deleted else
+            self._prepare_upsert_actions(title, page_dates[title.last_modified])
+            for title in titles
+        ]
+
     def get_mapping(self):
         return {
             'properties': {
@@ -41,35 +62,51 @@ class PropertyByPostcodeUpdaterV3(AbstractIndexUpdater):
             }
         }
 
-    def _prepare_delete_actions(self, title):
+    def _prepare_delete_actions(self, title, page_date=None):
+        """Actions of a deleted title - page_date, when given, is the PageDate of its
+        modification date, shared with other titles of a page"""
+        version = page_date.version if page_date else None
+
         def get_action(postcode):
             normalised_postcode = self._normalise_postcode(postcode)
             id = self._get_document_id(title.title_number, normalised_postcode)
-            return es_utils.get_delete_action(self.index_name, self.doc_type, id)
+            return self._get_delete_action(title, id, version)
 
         return [get_action(postcode) for postcode in self._get_postcodes(title.register_data)]
 
-    def _prepare_upsert_actions(self, title):
+    def _prepare_upsert_actions(self, title, page_date=None):
+        """Actions of a title - page_date, when given, is the PageDate of its modification
+        date, shared with other titles of a page"""
+        postcodes = self._get_postcodes(title.register_data)
+
+        # the same for all the title's postcodes
+        address = title.register_data['address']
+        address_string = address['address_string']
+        house_no = address.get('house_no', None)
+        house_number_or_first_number = self._get_house_number_or_first_number(address_string,
+                                                                              house_no)
+        normalised_address_string = self._normalise_address_string(address_string)
+        entry_datetime = (
+            page_date.entry_datetime if page_date
+            else date_utils.format_date_with_millis(title.last_modified)
+        )
+        version = page_date.version if page_date else None
+
         def get_action(postcode):
             normalised_postcode = self._normalise_postcode(postcode)
-            address = title.register_data['address']
-            address_string = address['address_string']
             id = self._get_document_id(title.title_number, normalised_postcode)
-            house_no = address.get('house_no', None)
-            house_number_or_first_number = self._get_house_number_or_first_number(address_string,
-                                                                                  house_no)
 
             document = {
                 'title_number': title.title_number,
-                'entry_datetime': date_utils.format_date_with_millis(title.last_modified),
+                'entry_datetime': entry_datetime,
                 'postcode': normalised_postcode,
                 'house_number_or_first_number': house_number_or_first_number,
-                'address_string': self._normalise_address_string(address_string),
+                'address_string': normalised_address_string,
             }
 
-            return es_utils.get_upsert_action(self.index_name, self.doc_type, document, id)
+            return self._get_write_action(title, document, id, version)
 
-        return [get_action(postcode) for postcode in self._get_postcodes(title.register_data)]
+        return [get_action(postcode) for postcode in postcodes]
 
     def _get_house_number_or_first_number(self, address_string, house_no):
         if house_no and house_no.isdigit():
@@ -91,17 +128,17 @@ class PropertyByPostcodeUpdaterV3(AbstractIndexUpdater):
 
         address_str = address_dict.get('address_string', None)
         if address_str:
-            postcodes = re.findall(POSTCODE_REGEX, address_str)
+            postcodes = COMPILED_POSTCODE_REGEX.findall(address_str)
             return postcodes
         return None
 
     def _first_number_not_in_postcode(self, address_string):
-        address_without_postcodes = re.sub(POSTCODE_REGEX, '', address_string)
-        numbers = re.findall(r'\d+', address_without_postcodes)
+        address_without_postcodes = COMPILED_POSTCODE_REGEX.sub('', address_string)
+        numbers = NUMBER_REGEX.findall(address_without_postcodes)
         if numbers:
             return int(numbers[0])
         else:
             return None
 
     def _normalise_postcode(self, postcode):
-        return re.sub('\\s+', '', postcode)
+        return WHITESPACE_REGEX.sub('', postcode)
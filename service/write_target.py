@@ -0,0 +1,103 @@
+from collections import deque
+from concurrent.futures import ThreadPoolExecutor
+import logging
+import threading
+
+from service import es_utils
+
+LOGGER = logging.getLogger(__name__)
+
+
+class WriteTargetFailedError(Exception):
+    pass
+
+
+class WriteTarget():
+    """One of the places an updater writes its documents to - an index and doc type in a cluster.
+
+    Pages of actions are written on the target's own thread, in the order they were submitted,
+    so that a slow target doesn't hold back the others. Each target has its own checkpoint,
+    which only moves once a page has been written to it. After a failure, the target refuses
+    the rest of the pages until it's reset, so its checkpoint never skips a page.
+    """
+
+    def __init__(self, index_name, doc_type, elasticsearch_uri=None):
+        self.index_name = index_name
+        self.doc_type = doc_type
+        self.elasticsearch_uri = elasticsearch_uri
+        self.client = es_utils.get_client(elasticsearch_uri)
+        self.last_title_modification_date = None
+        self.last_updated_title_number = None
+        self._executor = ThreadPoolExecutor(max_workers=1)
+        self._pending_pages = deque()  # type: deque
+        self._failed = threading.Event()
+
+    @property
+    def id(self):
+        return '{}/{}/{}'.format(
+            self.elasticsearch_uri or 'default', self.index_name, self.doc_type
+        )
+
+    @property
+    def pending_page_count(self):
+        return len(self._pending_pages)
+
+    def reset(self):
+        self._pending_pages.clear()
+        self._failed.clear()
+
+    def submit_page(self, elasticsearch_actions, last_modified, last_title_number,
+                    page_freshness=None):
+        future = self._executor.submit(
+            self._write_page, elasticsearch_actions, last_modified, last_title_number,
+            page_freshness,
+        )
+        self._pending_pages.append(future)
+
+    def wait_until_lag_at_most(self, max_pending_pages):
+        """Waits for the oldest pages until no more than the given number is pending.
+        Raises the error of any page that failed."""
+        while self._pending_pages and (
+                len(self._pending_pages) > max_pending_pages or self._pending_pages[0].done()):
+            self._pending_pages.popleft().result()
+
+    def close(self, wait=True):
+        """Shuts the target's thread down once the pages submitted are written - or right away,
+        without wait"""
+        self._executor.shutdown(wait=wait)
+
+    def write_actions(self, elasticsearch_actions):
+        """Writes the actions on the calling thread, without moving the target's checkpoint"""
+        return es_utils.execute_elasticsearch_actions(
+            self._retarget(elasticsearch_actions), self.client
+        )
+
+    def _write_page(self, elasticsearch_actions, last_modified, last_title_number,
+                    page_freshness=None):
+        if self._failed.is_set():
+            raise WriteTargetFailedError(
+                "Skipped page - an earlier page failed. Target: '{}'".format(self.id)
+            )
+
+        try:
+            success_count, errors = es_utils.execute_elasticsearch_actions(
+                self._retarget(elasticsearch_actions), self.client
+            )
+        except Exception:
+            self._failed.set()
+            raise
+
+        if page_freshness:
+            # each target's acknowledgements count, as each is searched on its own
+            page_freshness.record_acknowledged(errors)
+
+        self.last_title_modification_date = last_modified
+        self.last_updated_title_number = last_title_number
+        LOGGER.info("Wrote page to target '{}'. Last modified date: '{}'".format(
+            self.id, last_modified
+        ))
+        return errors
+
+    def _retarget(self, elasticsearch_actions):
+        for action in elasticsearch_actions:
+            yield dict(action, _index=self.index_name, _type=self.doc_type)
@@ -0,0 +1,336 @@
+import asyncio
+from datetime import datetime
+import json
+import threading
+import mock
+import pytest
+from config import CONFIG_DICT
+from service import async_engine
+from service.database import page_reader
+from service.database.model import TitleRecord
+
+
+def _create_updater(updater_id='updater1'):
+    updater = mock.MagicMock()
+    updater.id = updater_id
+    updater.last_title_modification_date = datetime(2015, 1, 1)
+    updater.last_updated_title_number = ''
+    updater.prepare_elasticsearch_actions.side_effect = lambda title: [
+        {'_op_type': 'index', '_index': 'index', '_type': 'doctype', '_id': title.title_number,
+         '_source': {'title_number': title.title_number}}
+    ]
+    return updater
+
+
+def _create_title(number):
+    return TitleRecord('TTL{}'.format(number), {}, datetime(2015, 4, 20, 0, 0, number), False)
+
+
+class TestAsyncEngine:
+
+    def test_synchronise_index_with_source_reads_pages_until_short_page(self):
+        pages = [[_create_title(1), _create_title(2)], [_create_title(3)]]
+        executed_action_lists = []
+
+        async def fetch_page(index_updater, page_size):
+            return pages.pop(0)
+
+        async def execute_bulk(actions, elasticsearch_uri):
+            executed_action_lists.append(actions)
+            return len(actions), []
+
+        updater = _create_updater()
+        engine = async_engine.AsyncSyncEngine(fetch_page, execute_bulk, page_size=2)
+
+        asyncio.run(engine.synchronise_index_with_source(updater))
+
+        assert [[action['_id'] for action in actions] for actions in executed_action_lists] == [
+            ['TTL1', 'TTL2'], ['TTL3']
+        ]
+        assert updater.last_updated_title_number == 'TTL3'
+        assert updater.last_title_modification_date == datetime(2015, 4, 20, 0, 0, 3)
+
+    def test_synchronise_index_with_source_keeps_cursor_when_bulk_fails(self):
+        async def fetch_page(index_updater, page_size):
+            return [_create_title(1)]
+
+        async def execute_bulk(actions, elasticsearch_uri):
+            raise Exception('Intentionally raised test exception')
+
+        updater = _create_updater()
+        engine = async_engine.AsyncSyncEngine(fetch_page, execute_bulk, page_size=2)
+
+        asyncio.run(engine.synchronise_index_with_source(updater))
+
+        assert updater.last_updated_title_number == ''
+        assert isinstance(updater.last_unsuccessful_sync_time, datetime)
+
+    def test_synchronise_index_with_source_keeps_cursor_when_bulk_has_errors(self):
+        async def fetch_page(index_updater, page_size):
+            return [_create_title(1), _create_title(2)]
+
+        async def execute_bulk(actions, elasticsearch_uri):
+            return 1, [{'index': {'_id': 'TTL2', 'status': 400, 'error': 'MapperParsing'}}]
+
+        updater = _create_updater()
+        engine = async_engine.AsyncSyncEngine(fetch_page, execute_bulk, page_size=5)
+
+        asyncio.run(engine.synchronise_index_with_source(updater))
+
+        assert updater.last_updated_title_number == ''
+        assert isinstance(updater.last_unsuccessful_sync_time, datetime)
+
+    def test_synchronise_index_with_source_ignores_stale_writes_and_missing_deletes(self):
+        async def fetch_page(index_updater, page_size):
+            return [_create_title(1), _create_title(2)]
+
+        async def execute_bulk(actions, elasticsearch_uri):
+            return 0, [
+                {'index': {'_id': 'TTL1', 'status': 409}},
+                {'delete': {'_id': 'TTL2', 'status': 404}},
+            ]
+
+        updater = _create_updater()
+        engine = async_engine.AsyncSyncEngine(fetch_page, execute_bulk, page_size=5)
+
+        asyncio.run(engine.synchronise_index_with_source(updater))
+
+        assert updater.last_updated_title_number == 'TTL2'
+
+    @pytest.mark.parametrize('setting, value', [
+        ('DELETE_FILTER_ENABLED', True),
+        ('QUARANTINE_ENABLED', True),
+        ('RECORDING_DIR', '/tmp/recordings'),
+    ])
+    def test_validate_index_updater_rejects_unsupported_settings(self, setting, value):
+        updater = _create_updater()
+        updater.write_targets = []
+        updater.dual_lanes = False
+
+        with mock.patch.dict(CONFIG_DICT, {setting: value, 'READ_REPLICA_DATABASE_URI': ''}):
+            with pytest.raises(Exception) as e:
+                async_engine.validate_index_updater(updater)
+
+        assert setting in str(e.value)
+
+    def test_synchronise_index_with_source_stops_when_lease_lost(self):
+        pages = [[_create_title(1)], [_create_title(2)]]
+        executed_action_lists = []
+        lease_checks = iter([True, False])
+
+        async def fetch_page(index_updater, page_size):
+            return pages.pop(0)
+
+        async def execute_bulk(actions, elasticsearch_uri):
+            executed_action_lists.append(actions)
+            return len(actions), []
+
+        updater = _create_updater()
+        engine = async_engine.AsyncSyncEngine(
+            fetch_page, execute_bulk, page_size=1, owns=lambda updater_id: next(lease_checks)
+        )
+
+        asyncio.run(engine.synchronise_index_with_source(updater))
+
+        assert [[action['_id'] for action in actions] for actions in executed_action_lists] == [
+            ['TTL1']
+        ]
+        assert updater.last_updated_title_number == 'TTL1'
+
+    def test_fetches_of_all_updaters_are_limited_together(self):
+        running_fetches = []
+        max_running_fetches = []
+
+        async def fetch_page(index_updater, page_size):
+            running_fetches.append(index_updater.id)
+            max_running_fetches.append(len(running_fetches))
+            await asyncio.sleep(0.01)
+            running_fetches.remove(index_updater.id)
+            return []
+
+        async def execute_bulk(actions, elasticsearch_uri):
+            return 0, []
+
+        engine = async_engine.AsyncSyncEngine(
+            fetch_page, execute_bulk, page_size=2, max_concurrent_fetches=2
+        )
+        updaters = [_create_updater('updater{}'.format(i)) for i in range(5)]
+
+        async def synchronise_all():
+            await asyncio.gather(*[engine.synchronise_index_with_source(u) for u in updaters])
+
+        asyncio.run(synchronise_all())
+
+        assert max(max_running_fetches) == 2
+        assert len(max_running_fetches) == 5
+
+    def test_submit_synchronises_updater_on_engine_thread(self):
+        async def fetch_page(index_updater, page_size):
+            return [_create_title(1)]
+
+        async def execute_bulk(actions, elasticsearch_uri):
+            return 1, []
+
+        updater = _create_updater()
+        engine = async_engine.AsyncSyncEngine(fetch_page, execute_bulk, page_size=2)
+        engine.start()
+
+        try:
+            engine.submit(updater).result(5)
+        finally:
+            engine.stop()
+
+        assert updater.last_updated_title_number == 'TTL1'
+
+    def test_stop_closes_io_on_event_loop_before_stopping_it(self):
+        closing_threads = []
+
+        async def close_io():
+            closing_threads.append(threading.current_thread().name)
+
+        engine = async_engine.AsyncSyncEngine(None, None, close_io=close_io)
+        engine.start()
+        engine.stop()
+
+        assert closing_threads == ['sync-async-engine']
+        assert not engine.thread.is_alive()
+
+    def test_stop_stops_event_loop_when_io_fails_to_close(self):
+        async def close_io():
+            raise Exception('Intentionally raised test exception')
+
+        engine = async_engine.AsyncSyncEngine(None, None, close_io=close_io)
+        engine.start()
+        engine.stop()
+
+        assert not engine.thread.is_alive()
+
+    def test_get_page_sql_contains_source_filter_condition(self):
+        sql = async_engine.get_page_sql(page_reader.ADDRESS_PRESENT_FILTER)
+
+        assert sql == (
+            'SELECT title_number, register_data, last_modified, is_deleted '
+            'FROM title_register_data '
+            'WHERE (last_modified, title_number) > ($1, $2) '
+            "AND ((register_data #>> '{address,address_string}') IS NOT NULL) "
+            'ORDER BY last_modified, title_number LIMIT $3'
+        )
+
+    def test_get_bulk_body_and_result(self):
+        actions = [
+            {'_op_type': 'delete', '_index': 'index', '_type': 'doctype', '_id': 'id1'},
+            {'_op_type': 'index', '_index': 'index', '_type': 'doctype', '_id': 'id2',
+             '_source': {'a': 1}},
+        ]
+
+        body = async_engine.get_bulk_body(actions)
+        result = async_engine.get_bulk_result({'items': [
+            {'delete': {'_id': 'id1', 'status': 404}}, {'index': {'_id': 'id2', 'status': 201}}
+        ]})
+
+        assert [json.loads(line) for line in body.splitlines()] == [
+            {'delete': {'_index': 'index', '_type': 'doctype', '_id': 'id1'}},
+            {'index': {'_index': 'index', '_type': 'doctype', '_id': 'id2'}},
+            {'a': 1},
+        ]
+        assert result == (1, [{'delete': {'_id': 'id1', 'status': 404}}])
+
+    def test_create_engine_creates_engine_with_asyncpg_and_aiohttp(self):
+        with mock.patch.dict('sys.modules', {'asyncpg': mock.MagicMock(),
+                                             'aiohttp': mock.MagicMock()}):
+            engine = async_engine.create_engine()
+
+        assert isinstance(engine, async_engine.AsyncSyncEngine)
+
+    def test_create_engine_fails_without_asyncpg(self):
+        with mock.patch.dict('sys.modules', {'asyncpg': None, 'aiohttp': mock.MagicMock()}):
+            with pytest.raises(Exception) as e:
+                async_engine.create_engine()
+
+        assert 'requires the asyncpg and aiohttp packages' in str(e.value)
+
+    def test_aiohttp_bulk_executor_returns_bulk_result(self):
+        class Response():
+            async def json(self):
+                return {'items': [
+                    {'index': {'_id': 'id1', 'status': 201}},
+                    {'index': {'_id': 'id2', 'status': 409}},
+                ]}
+
+            def raise_for_status(self):
+                pass
+
+        class ResponseContext():
+            async def __aenter__(self):
+                return Response()
+
+            async def __aexit__(self, *exc_info):
+                return False
+
+        response_context = ResponseContext()
+        aiohttp = mock.MagicMock()
+        aiohttp.ClientSession.return_value.post.return_value = response_context
+        actions = [{'_op_type': 'index', '_index': 'index', '_type': 'doctype', '_id': 'id1',
+                    '_source': {'a': 1}}]
+
+        closed_sessions = []
+
+        async def close():
+            closed_sessions.append(aiohttp.ClientSession.return_value)
+
+        aiohttp.ClientSession.return_value.close = close
+
+        with mock.patch.dict('sys.modules', {'aiohttp': aiohttp}):
+            execute_bulk, close_session = async_engine.create_aiohttp_bulk_executor()
+
+        async def execute_bulk_and_close_session():
+            result = await execute_bulk(actions, 'http://localhost:9200/')
+            await close_session()
+            await close_session()
+            return result
+
+        result = asyncio.run(execute_bulk_and_close_session())
+
+        assert result == (1, [{'index': {'_id': 'id2', 'status': 409}}])
+        aiohttp.ClientSession.return_value.post.assert_called_once_with(
+            'http://localhost:9200/_bulk', data=async_engine.get_bulk_body(actions).encode(),
+            headers={'Content-Type': 'application/x-ndjson'},
+        )
+        assert closed_sessions == [aiohttp.ClientSession.return_value]
+
+    def test_asyncpg_page_fetcher_reads_titles_and_closes_pool(self):
+        class Pool():
+            is_closed = False
+
+            async def fetch(self, sql, last_modified, title_number, page_size):
+                return [{'title_number': 'TTL1', 'register_data': '{"a": 1}',
+                         'last_modified': datetime(2015, 4, 20), 'is_deleted': False}]
+
+            async def close(self):
+                self.is_closed = True
+
+        pool = Pool()
+
+        async def create_pool(dsn, max_size):
+            return pool
+
+        asyncpg = mock.MagicMock()
+        asyncpg.create_pool = create_pool
+        updater = _create_updater()
+
+        with mock.patch.dict('sys.modules', {'asyncpg': asyncpg}):
+            fetch_page, close_pool = async_engine.create_asyncpg_page_fetcher(
+                'postgresql+psycopg2://localhost/db', 2
+            )
+
+        async def fetch_page_and_close_pool():
+            titles = await fetch_page(updater, 10)
+            await close_pool()
+            return titles
+
+        titles = asyncio.run(fetch_page_and_close_pool())
+
+        assert [(title.title_number, title.register_data) for title in titles] == [
+            ('TTL1', {'a': 1})
+        ]
+        assert pool.is_closed
@@ -0,0 +1,59 @@
+from datetime import datetime
+import mock
+from service import backfill_lane
+from service.backfill_lane import BackfillLane
+
+
+def _create_updater():
+    updater = mock.MagicMock()
+    updater.index_name = 'index1'
+    updater.id = 'updater1'
+    updater.backfill_lane = None
+    return updater
+
+
+class TestBackfillLane:
+
+    def test_from_dict_restores_lane_converted_to_dict(self):
+        lane = BackfillLane(datetime.min, '', datetime(2015, 4, 20, 10, 11, 12, 345678), 'TTL9')
+
+        result = BackfillLane.from_dict(lane.to_dict())
+
+        assert result.last_title_modification_date == datetime.min
+        assert result.last_updated_title_number == ''
+        assert result.high_water_modification_date == datetime(2015, 4, 20, 10, 11, 12, 345678)
+        assert result.high_water_title_number == 'TTL9'
+
+    @mock.patch('service.es_utils.index_document')
+    def test_save_backfill_lane_indexes_lane_under_updater_id(self, mock_index_document):
+        updater = _create_updater()
+        updater.backfill_lane = BackfillLane(
+            datetime(2015, 4, 20), 'TTL1', datetime(2015, 5, 20), 'TTL9'
+        )
+
+        backfill_lane.save_backfill_lane(updater)
+
+        mock_index_document.assert_called_once_with(
+            'index1', 'sync_backfill_lane', 'updater1', updater.backfill_lane.to_dict()
+        )
+
+    @mock.patch('service.es_utils.get_document', return_value=None)
+    def test_load_backfill_lane_sets_no_lane_when_none_saved(self, mock_get_document):
+        updater = _create_updater()
+        updater.backfill_lane = 'lane'
+
+        backfill_lane.load_backfill_lane(updater)
+
+        assert updater.backfill_lane is None
+        mock_get_document.assert_called_once_with('index1', 'sync_backfill_lane', 'updater1')
+
+    def test_load_backfill_lane_restores_saved_lane(self):
+        lane = BackfillLane(datetime(2015, 4, 20), 'TTL1', datetime(2015, 5, 20), 'TTL9')
+        lane_dict = lane.to_dict()
+        updater = _create_updater()
+
+        with mock.patch('service.es_utils.get_document', return_value=lane_dict):
+            backfill_lane.load_backfill_lane(updater)
+
+        assert updater.backfill_lane.last_updated_title_number == 'TTL1'
+        assert updater.backfill_lane.high_water_modification_date == datetime(2015, 5, 20)
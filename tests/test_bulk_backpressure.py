@@ -0,0 +1,144 @@
+import threading
+import mock
+import pytest
+from elasticsearch import TransportError  # type: ignore
+from config import CONFIG_DICT
+from service import bulk_backpressure
+
+TEST_CONFIG = {
+    'BULK_CHUNK_SIZE': 4,
+    'BULK_MIN_CHUNK_SIZE': 1,
+    'BULK_MAX_CHUNK_SIZE': 8,
+    'BULK_CHUNK_SIZE_STEP': 2,
+    'BULK_MAX_CONCURRENCY': 4,
+    'BULK_TARGET_LATENCY_MS': 60000,
+    'BULK_MAX_RETRIES': 2,
+    'BULK_RETRY_BACKOFF_MS': 0,
+}
+
+
+@pytest.fixture(autouse=True)
+def test_config():
+    with mock.patch.dict(CONFIG_DICT, TEST_CONFIG), \
+            mock.patch.dict(bulk_backpressure._budgets_by_client, clear=True):
+        yield
+
+
+def _create_actions(count):
+    return [
+        {'_op_type': 'delete', '_index': 'index', '_type': 'doctype', '_id': str(i)}
+        for i in range(count)
+    ]
+
+
+def _get_response(bulk_body, rejected_ids=(), failed_ids=()):
+    items = []
+
+    for action in bulk_body:
+        id = action['delete']['_id']
+        status = 429 if id in rejected_ids else 404 if id in failed_ids else 200
+        items.append({'delete': {'_id': id, 'status': status}})
+
+    return {'items': items}
+
+
+def _get_ids(bulk_body):
+    return [action['delete']['_id'] for action in bulk_body]
+
+
+class TestBulkBackpressure:
+
+    def test_execute_bulk_sends_chunks_of_budget_size_and_returns_results(self):
+        client = mock.MagicMock()
+        client.bulk.side_effect = lambda body: _get_response(body, failed_ids=['3'])
+
+        success_count, errors = bulk_backpressure.execute_bulk(client, iter(_create_actions(10)))
+
+        assert [len(call[1][0]) for call in client.bulk.mock_calls] == [4, 6]
+        assert success_count == 9
+        assert errors == [{'delete': {'_id': '3', 'status': 404}}]
+
+    def test_execute_bulk_resends_only_rejected_actions_and_halves_budget(self):
+        client = mock.MagicMock()
+        client.bulk.side_effect = [
+            _get_response(_get_ids_body(['0', '1', '2', '3']), rejected_ids=['1', '3']),
+            _get_response(_get_ids_body(['1', '3'])),
+        ]
+
+        success_count, errors = bulk_backpressure.execute_bulk(client, _create_actions(4))
+
+        assert _get_ids(client.bulk.mock_calls[1][1][0]) == ['1', '3']
+        assert (success_count, errors) == (4, [])
+        budget = bulk_backpressure.get_budget(client)
+        assert budget.concurrency_limit == 2
+        assert budget.rejected_action_count == 2
+
+    def test_execute_bulk_raises_when_actions_still_rejected_after_retries(self):
+        client = mock.MagicMock()
+        client.bulk.side_effect = lambda body: _get_response(body, rejected_ids=['0'])
+
+        with pytest.raises(bulk_backpressure.BulkRejectedError):
+            bulk_backpressure.execute_bulk(client, _create_actions(2))
+
+        assert len(client.bulk.mock_calls) == 3
+
+    def test_execute_bulk_retries_rejected_request(self):
+        client = mock.MagicMock()
+        client.bulk.side_effect = [
+            TransportError(429, 'es_rejected_execution_exception'),
+            _get_response(_get_ids_body(['0', '1'])),
+        ]
+
+        assert bulk_backpressure.execute_bulk(client, _create_actions(2)) == (2, [])
+        assert bulk_backpressure.get_budget(client).concurrency_limit == 2
+        assert bulk_backpressure.get_budget(client).rejected_action_count == 2
+
+    def test_execute_bulk_raises_errors_other_than_rejections(self):
+        client = mock.MagicMock()
+        client.bulk.side_effect = TransportError(500, 'Intentionally raised test exception')
+
+        with pytest.raises(TransportError):
+            bulk_backpressure.execute_bulk(client, _create_actions(2))
+
+        assert len(client.bulk.mock_calls) == 1
+
+    def test_budget_grows_additively_up_to_limits(self):
+        budget = bulk_backpressure.BulkBudget()
+        budget.record_rejected_request(1)
+
+        assert (budget.concurrency_limit, budget.chunk_size) == (2, 2)
+
+        for _ in range(6):
+            budget.record_response(0.01, 1, 0)
+
+        assert (budget.concurrency_limit, budget.chunk_size) == (4, 8)
+
+    def test_budget_halves_chunk_size_only_when_requests_are_slow(self):
+        budget = bulk_backpressure.BulkBudget()
+
+        budget.record_response(61, 4, 0)
+
+        assert (budget.concurrency_limit, budget.chunk_size) == (4, 2)
+
+    def test_budget_limits_requests_in_flight(self):
+        budget = bulk_backpressure.BulkBudget()
+        budget.record_rejected_request(1)
+        budget.record_rejected_request(1)
+        budget.acquire()
+        acquired = threading.Event()
+
+        def acquire():
+            budget.acquire()
+            acquired.set()
+
+        thread = threading.Thread(target=acquire)
+        thread.start()
+
+        assert not acquired.wait(0.1)
+        budget.release()
+        assert acquired.wait(5)
+        thread.join()
+
+
+def _get_ids_body(ids):
+    return [{'delete': {'_id': id}} for id in ids]
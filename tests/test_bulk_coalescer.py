@@ -0,0 +1,126 @@
+import threading
+import time
+import mock
+import pytest
+from elasticsearch import TransportError  # type: ignore
+from config import CONFIG_DICT
+from service import bulk_backpressure, es_utils
+from service.bulk_coalescer import BulkCoalescer
+
+TEST_CONFIG = {
+    'BULK_CHUNK_SIZE': 10,
+    'BULK_MIN_CHUNK_SIZE': 1,
+    'BULK_MAX_CHUNK_SIZE': 10,
+    'BULK_CHUNK_SIZE_STEP': 0,
+    'BULK_MAX_CONCURRENCY': 4,
+    'BULK_TARGET_LATENCY_MS': 60000,
+    'BULK_MAX_RETRIES': 0,
+    'BULK_RETRY_BACKOFF_MS': 0,
+}
+
+
+@pytest.fixture(autouse=True)
+def test_config():
+    with mock.patch.dict(CONFIG_DICT, TEST_CONFIG), \
+            mock.patch.dict(bulk_backpressure._budgets_by_client, clear=True):
+        yield
+
+
+def _create_actions(prefix, count):
+    return [
+        {'_op_type': 'delete', '_index': 'index', '_type': 'doctype', '_id': prefix + str(i)}
+        for i in range(count)
+    ]
+
+
+def _get_response(bulk_body, failed_ids=()):
+    items = []
+
+    for action in bulk_body:
+        id = action['delete']['_id']
+        items.append({'delete': {'_id': id, 'status': 404 if id in failed_ids else 200}})
+
+    return {'items': items}
+
+
+def _execute_concurrently(coalescer, action_lists):
+    """Results of writing the lists of actions from threads of their own, started together"""
+    results = [None] * len(action_lists)
+
+    def execute(position):
+        try:
+            results[position] = coalescer.execute(iter(action_lists[position]))
+        except Exception as e:
+            results[position] = e
+
+    threads = [
+        threading.Thread(target=execute, args=(position,))
+        for position in range(len(action_lists))
+    ]
+
+    for thread in threads:
+        thread.start()
+
+    for thread in threads:
+        thread.join()
+
+    return results
+
+
+class TestBulkCoalescer:
+
+    def test_execute_combines_chunks_of_writers_into_one_request(self):
+        client = mock.MagicMock()
+        client.bulk.side_effect = lambda body: _get_response(body, failed_ids=['b1'])
+        coalescer = BulkCoalescer(client, max_wait_secs=0.5)
+
+        results = _execute_concurrently(
+            coalescer, [_create_actions('a', 3), _create_actions('b', 2)]
+        )
+
+        assert client.bulk.call_count == 1
+        assert len(client.bulk.call_args[0][0]) == 5
+        assert results[0] == (3, [])
+        assert results[1] == (1, [{'delete': {'_id': 'b1', 'status': 404}}])
+
+    def test_execute_sends_chunk_of_full_size_without_waiting(self):
+        client = mock.MagicMock()
+        client.bulk.side_effect = lambda body: _get_response(body)
+        coalescer = BulkCoalescer(client, max_wait_secs=60)
+        start = time.monotonic()
+
+        success_count, errors = coalescer.execute(iter(_create_actions('a', 10)))
+
+        assert time.monotonic() - start < 30
+        assert success_count == 10
+
+    def test_execute_sends_chunks_one_by_one_when_combined_request_fails(self):
+        client = mock.MagicMock()
+
+        def bulk(body):
+            if any(action['delete']['_id'] == 'b0' for action in body):
+                raise TransportError(400, 'Intentionally raised test exception')
+
+            return _get_response(body)
+
+        client.bulk.side_effect = bulk
+        coalescer = BulkCoalescer(client, max_wait_secs=0.5)
+
+        results = _execute_concurrently(
+            coalescer, [_create_actions('a', 3), _create_actions('b', 2)]
+        )
+
+        assert results[0] == (3, [])
+        assert isinstance(results[1], TransportError)
+
+    def test_execute_elasticsearch_actions_uses_coalescer_of_client_when_enabled(self):
+        client = mock.MagicMock()
+        client.bulk.side_effect = lambda body: _get_response(body)
+
+        with mock.patch.dict(CONFIG_DICT, {'BULK_COALESCING_ENABLED': True}), \
+                mock.patch.dict(es_utils._coalescers_by_client, clear=True):
+            result = es_utils.execute_elasticsearch_actions(_create_actions('a', 2), client)
+            coalescer = es_utils._coalescers_by_client[client]
+
+        assert result == (2, [])
+        assert coalescer.request_count == 1
@@ -0,0 +1,131 @@
+from datetime import datetime
+import mock
+import pytest
+from config import CONFIG_DICT
+from service import synchroniser
+from service.database import copy_reader, page_reader
+from service.database.model import TitleRecord
+
+COPY_OUTPUT = (
+    'TTL1,"{""address"": {""address_string"": ""1 Rue Côte""}}",2015-04-20 10:11:12.345678,f\n'
+    'TTL2,\\N,2015-04-20 10:11:13,t\n'
+).encode('utf-8')
+
+
+def _create_engine(copy_output, chunk_size=7):
+    """Engine whose COPY writes the output to the stream in chunks of the given size"""
+    engine = mock.MagicMock()
+    connection = engine.raw_connection.return_value
+
+    def execute(sql, stream=None):
+        if stream is not None:
+            for position in range(0, len(copy_output), chunk_size):
+                stream.write(copy_output[position:position + chunk_size])
+
+    connection.cursor.return_value.execute.side_effect = execute
+    return engine
+
+
+class TestCopyReader:
+
+    @mock.patch.object(copy_reader, 'COPY_CHUNK_BYTES', 10)
+    def test_stream_titles_with_copy_parses_copy_output_in_any_chunks(self):
+        engine = _create_engine(COPY_OUTPUT)
+
+        titles = list(copy_reader.stream_titles_with_copy(engine=engine))
+
+        assert titles == [
+            TitleRecord(
+                'TTL1', {'address': {'address_string': '1 Rue Côte'}},
+                datetime(2015, 4, 20, 10, 11, 12, 345678), False,
+            ),
+            TitleRecord('TTL2', None, datetime(2015, 4, 20, 10, 11, 13), True),
+        ]
+        engine.raw_connection.return_value.close.assert_called_once_with()
+        assert not engine.raw_connection.return_value.invalidate.called
+
+    def test_stream_titles_with_copy_invalidates_connection_when_not_read_to_end(self):
+        engine = _create_engine(COPY_OUTPUT * 1000)
+
+        with mock.patch.object(copy_reader, 'COPY_QUEUE_CHUNKS', 1):
+            titles = copy_reader.stream_titles_with_copy(engine=engine)
+            next(titles)
+            titles.close()
+
+        engine.raw_connection.return_value.invalidate.assert_called_once_with()
+
+    def test_stream_titles_with_copy_raises_error_of_copy(self):
+        engine = _create_engine(b'')
+        engine.raw_connection.return_value.cursor.return_value.execute.side_effect = \
+            Exception('Intentionally raised test exception')
+
+        with pytest.raises(Exception) as e:
+            list(copy_reader.stream_titles_with_copy(engine=engine))
+
+        assert str(e.value) == 'Intentionally raised test exception'
+
+    def test_iterate_lines_keeps_lines_and_characters_split_across_chunks_whole(self):
+        text = 'TTL1,Côte\nTTL2,"a\nb"\nTTL3'.encode('utf-8')
+        chunks = [text[position:position + 1] for position in range(len(text))]
+
+        assert list(copy_reader.iterate_lines(chunks)) == \
+            ['TTL1,Côte\n', 'TTL2,"a\n', 'b"\n', 'TTL3']
+
+    def test_get_copy_sql_filters_and_orders_titles_like_pages(self):
+        sql = copy_reader.get_copy_sql(page_reader.ADDRESS_PRESENT_FILTER)
+
+        assert 'WHERE ({})'.format(page_reader.ADDRESS_PRESENT_FILTER.condition) in sql
+        assert 'ORDER BY last_modified, title_number' in sql
+
+
+class TestBootstrapIndex:
+
+    def _create_updater(self):
+        updater = mock.MagicMock()
+        updater.prepare_elasticsearch_actions.side_effect = lambda title: [title.title_number]
+        return updater
+
+    @mock.patch('service.es_utils.execute_elasticsearch_actions')
+    def test_bootstrap_index_writes_all_titles_and_moves_cursor_to_last(
+            self, mock_execute_actions):
+        mock_execute_actions.side_effect = lambda actions: (len(list(actions)), [])
+        updater = self._create_updater()
+        titles = [
+            TitleRecord('TTL1', {}, datetime(2015, 4, 20), False),
+            TitleRecord('TTL2', {}, datetime(2015, 4, 21), False),
+        ]
+
+        with mock.patch.object(
+                copy_reader, 'stream_titles_with_copy', return_value=iter(titles)
+        ) as mock_stream_titles:
+            assert synchroniser.bootstrap_index(updater) == 2
+
+        mock_stream_titles.assert_called_once_with(updater.get_source_filter())
+        assert updater.last_title_modification_date == datetime(2015, 4, 21)
+        assert updater.last_updated_title_number == 'TTL2'
+
+    @mock.patch('service.es_utils.execute_elasticsearch_actions', return_value=(0, []))
+    def test_bring_index_up_to_date_bootstraps_empty_index_when_enabled(
+            self, mock_execute_actions):
+        updater = self._create_updater()
+        updater.last_title_modification_date = datetime.min
+        updater.get_next_source_data_page.return_value = iter([])
+
+        with mock.patch.dict(CONFIG_DICT, {'COPY_BOOTSTRAP_ENABLED': True}), \
+                mock.patch.object(synchroniser, 'bootstrap_index') as mock_bootstrap_index:
+            synchroniser._bring_index_up_to_date(updater)
+
+        mock_bootstrap_index.assert_called_once_with(updater)
+        assert updater.get_next_source_data_page.called
+
+    @mock.patch('service.es_utils.execute_elasticsearch_actions', return_value=(0, []))
+    def test_bring_index_up_to_date_pages_through_index_with_titles(self, mock_execute_actions):
+        updater = self._create_updater()
+        updater.last_title_modification_date = datetime(2015, 4, 20)
+        updater.get_next_source_data_page.return_value = iter([])
+
+        with mock.patch.dict(CONFIG_DICT, {'COPY_BOOTSTRAP_ENABLED': True}), \
+                mock.patch.object(synchroniser, 'bootstrap_index') as mock_bootstrap_index:
+            synchroniser._bring_index_up_to_date(updater)
+
+        assert not mock_bootstrap_index.called
@@ -0,0 +1,30 @@
+from datetime import datetime, timedelta, timezone
+from service import date_utils
+
+
+class TestDateUtils:
+
+    def test_format_date_with_millis_returns_date_with_millis_and_zone(self):
+        date = datetime(2015, 4, 20, 12, 23, 34, 123456)
+        assert date_utils.format_date_with_millis(date) == '2015-04-20T12:23:34.123+0000'
+
+    def test_to_epoch_micros_treats_naive_date_as_utc(self):
+        date = datetime(2015, 4, 20, 12, 23, 34, 5)
+        assert date_utils.to_epoch_micros(date) == 1429532614000005
+
+    def test_to_epoch_micros_converts_aware_date_to_utc(self):
+        date = datetime(2015, 4, 20, 13, 23, 34, 5, timezone(timedelta(hours=1)))
+        assert date_utils.to_epoch_micros(date) == 1429532614000005
+
+    def test_to_epoch_micros_grows_with_the_date(self):
+        date = datetime(2015, 4, 20, 12, 23, 34)
+        later_date = date + timedelta(microseconds=1)
+        assert date_utils.to_epoch_micros(later_date) - date_utils.to_epoch_micros(date) == 1
+
+    def test_string_to_naive_utc_date_converts_offset_to_utc(self):
+        date = date_utils.string_to_naive_utc_date('2015-04-20T13:23:34+01:00')
+        assert date == datetime(2015, 4, 20, 12, 23, 34)
+
+    def test_string_to_naive_utc_date_treats_date_without_offset_as_utc(self):
+        date = date_utils.string_to_naive_utc_date('2015-04-20T12:23:34')
+        assert date == datetime(2015, 4, 20, 12, 23, 34)
@@ -28,7 +28,9 @@ class TestEsStatusLoader:
             'size': 1
         }
 
-        mock_search.assert_called_once_with(expected_search_query, index_name, doc_type)
+        mock_search.assert_called_once_with(
+            expected_search_query, index_name, doc_type, client=None
+        )
 
     def test_load_index_update_status_returns_last_title_info(self):
         entry_datetime_string = '2015-04-20T11:23:34.000+00'
@@ -1,4 +1,5 @@
 import mock
+from config import CONFIG_DICT
 from service import es_utils
 
 # TODO: partly to be replaced by proper integration tests
@@ -45,17 +46,17 @@ class TestEsUtils:
             index=index_name, doc_type=doc_type, body=mapping
         )
 
-    @mock.patch('service.es_utils.bulk')
-    def test_execute_elasticsearch_actions_executes_all_given_actions(self, mock_bulk):
+    @mock.patch('service.bulk_backpressure.execute_bulk')
+    def test_execute_elasticsearch_actions_executes_all_given_actions(self, mock_execute_bulk):
         actions = [{'action1': '1', 'action2': '2'}]
         es_utils.execute_elasticsearch_actions(actions)
 
-        mock_bulk.assert_called_once_with(es_utils.elasticsearch_client, actions)
+        mock_execute_bulk.assert_called_once_with(es_utils.elasticsearch_client, actions)
 
     def test_execute_elasticsearch_actions_returns_execution_result(self):
         expected_result = (123, ['error1'])
 
-        with mock.patch('service.es_utils.bulk', return_value=expected_result):
+        with mock.patch('service.bulk_backpressure.execute_bulk', return_value=expected_result):
             result = es_utils.execute_elasticsearch_actions([])
 
             assert result == expected_result
@@ -82,6 +83,43 @@ class TestEsUtils:
 
             assert result == hits
 
+    def test_scroll_documents_by_id_yields_hits_of_all_batches_and_clears_scroll(self):
+        mock_client = mock.MagicMock()
+        mock_client.search.return_value = {'_scroll_id': 's1', 'hits': {'hits': [{'_id': 'a'}]}}
+        mock_client.scroll.side_effect = [
+            {'_scroll_id': 's2', 'hits': {'hits': [{'_id': 'b'}]}},
+            {'_scroll_id': 's3', 'hits': {'hits': []}},
+        ]
+
+        result = list(es_utils.scroll_documents_by_id('index1', 'doctype1', 10, mock_client))
+
+        assert result == [{'_id': 'a'}, {'_id': 'b'}]
+        assert mock_client.search.call_args[1]['body']['sort'] == [{'_uid': 'asc'}]
+        assert mock_client.scroll.mock_calls == [
+            mock.call(scroll_id='s1', scroll='5m'), mock.call(scroll_id='s2', scroll='5m')
+        ]
+        mock_client.clear_scroll.assert_called_once_with(scroll_id='s2', ignore=[404])
+        assert 'version' not in mock_client.search.call_args[1]['body']
+
+    def test_scroll_documents_by_id_asks_for_versions_when_told_to(self):
+        mock_client = mock.MagicMock()
+        mock_client.search.return_value = {'_scroll_id': 's1', 'hits': {'hits': []}}
+
+        list(es_utils.scroll_documents_by_id('index1', 'doctype1', 10, mock_client, True))
+
+        assert mock_client.search.call_args[1]['body']['version'] is True
+
+    def test_get_create_action_returns_action_with_the_right_content(self):
+        result = es_utils.get_create_action('index_name1', 'doc_type1', {'doc': 'body1'}, 'id1')
+
+        assert result == {
+            '_op_type': 'create',
+            '_index': 'index_name1',
+            '_type': 'doc_type1',
+            '_id': 'id1',
+            '_source': {'doc': 'body1'},
+        }
+
     def test_get_upsert_action_returns_action_with_the_right_content(self):
         result = es_utils.get_upsert_action('idx_name1', 'doc_type1', {'doc': 'body1'}, 'id1')
 
@@ -103,3 +141,34 @@ class TestEsUtils:
             '_type': 'doc_type1',
             '_id': 'id1',
         }
+
+    def test_get_versioned_index_action_returns_action_with_the_right_content(self):
+        result = es_utils.get_versioned_index_action(
+            'idx_name1', 'doc_type1', {'doc': 'body1'}, 'id1', 1429532614000005
+        )
+
+        assert result == {
+            '_op_type': 'index',
+            '_index': 'idx_name1',
+            '_type': 'doc_type1',
+            '_id': 'id1',
+            '_version': 1429532614000005,
+            '_version_type': 'external',
+            '_source': {'doc': 'body1'},
+        }
+
+    def test_get_delete_action_returns_versioned_action_when_version_given(self):
+        result = es_utils.get_delete_action('index_name1', 'doc_type1', 'id1', 123)
+
+        assert result == {
+            '_op_type': 'delete',
+            '_index': 'index_name1',
+            '_type': 'doc_type1',
+            '_id': 'id1',
+            '_version': 123,
+            '_version_type': 'external',
+        }
+
+    def test_is_version_conflict_recognises_conflict_errors(self):
+        assert es_utils.is_version_conflict({'index': {'_id': 'id1', 'status': 409}})
+        assert not es_utils.is_version_conflict({'delete': {'_id': 'id1', 'status': 404}})
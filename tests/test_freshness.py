@@ -0,0 +1,109 @@
+from collections import namedtuple
+from datetime import datetime, timedelta
+import mock
+import pytest
+from freezegun import freeze_time
+from service import freshness
+
+MockTitle = namedtuple('MockTitle', ['title_number', 'last_modified'])
+
+FROZEN_NOW = datetime(2015, 4, 30, 12, 0, 0)
+
+
+@pytest.fixture(autouse=True)
+def clear_histograms():
+    with mock.patch.dict(freshness._histograms_by_updater, clear=True):
+        yield
+
+
+def _stream_page(page_freshness, titles, actions_per_title=1):
+    tracked_titles = page_freshness.track_titles(titles)
+    actions = (
+        {'_id': '{}-{}'.format(title.title_number, number)}
+        for title in tracked_titles for number in range(actions_per_title)
+    )
+    return list(page_freshness.track_actions(actions))
+
+
+class TestFreshness:
+
+    def test_histogram_estimates_percentiles_within_buckets(self):
+        histogram = freshness.Histogram()
+
+        for value in range(1, 101):
+            histogram.observe(value / 100)
+
+        percentiles = freshness.get_percentiles(histogram.to_dict())
+
+        assert 0.25 <= percentiles['p50_secs'] <= 0.5
+        assert 0.5 <= percentiles['p95_secs'] <= 1
+        assert percentiles['p99_secs'] <= 1
+
+    def test_histogram_percentile_beyond_last_bound_ends_at_largest_value(self):
+        histogram = freshness.Histogram()
+        histogram.observe(200000, count=10)
+
+        assert freshness.get_percentiles(histogram.to_dict())['p99_secs'] <= 200000
+
+    def test_percentiles_are_none_when_nothing_observed(self):
+        assert freshness.get_percentiles(freshness.Histogram().to_dict()) == {
+            'p50_secs': None, 'p95_secs': None, 'p99_secs': None,
+        }
+
+    def test_record_acknowledged_records_delays_from_last_modified_of_titles(self):
+        with freeze_time(FROZEN_NOW):
+            page_freshness = freshness.PageFreshness('updater1')
+            titles = [
+                MockTitle('TTL1', FROZEN_NOW - timedelta(seconds=20)),
+                MockTitle('TTL2', FROZEN_NOW - timedelta(seconds=20)),
+            ]
+            _stream_page(page_freshness, titles, actions_per_title=2)
+            page_freshness.record_acknowledged([])
+
+        histograms = freshness.get_updater_snapshot('updater1')
+        assert histograms[freshness.TOTAL]['count'] == 4
+        assert histograms[freshness.POLLING_WAIT_STAGE]['sum'] == pytest.approx(80)
+        assert histograms[freshness.TOTAL]['sum'] >= 80
+        for stage in [freshness.FETCH_STAGE, freshness.TRANSFORM_STAGE, freshness.BULK_STAGE]:
+            assert histograms[stage]['count'] == 4
+
+    def test_record_acknowledged_leaves_out_failed_actions(self):
+        page_freshness = freshness.PageFreshness('updater1')
+        titles = [MockTitle('TTL{}'.format(i), datetime(2015, 4, 20)) for i in range(4)]
+        _stream_page(page_freshness, titles)
+
+        page_freshness.record_acknowledged([{'index': {'_id': 'TTL1-0', 'status': 500}}])
+
+        assert freshness.get_updater_snapshot('updater1')[freshness.TOTAL]['count'] == 3
+
+    def test_record_acknowledged_records_nothing_when_all_actions_failed(self):
+        page_freshness = freshness.PageFreshness('updater1')
+        _stream_page(page_freshness, [MockTitle('TTL1', datetime(2015, 4, 20))])
+
+        page_freshness.record_acknowledged([{'index': {'_id': 'TTL1-0', 'status': 500}}])
+
+        assert freshness.get_updater_snapshot('updater1') is None
+
+    def test_get_freshness_status_returns_percentiles_of_total_and_stages(self):
+        histograms = freshness.get_histograms('updater1')
+        histograms[freshness.TOTAL].observe(3)
+
+        status = freshness.get_freshness_status(freshness.get_updater_snapshot('updater1'))
+
+        assert status['count'] == 1
+        assert 2.5 <= status['p50_secs'] <= 3
+        assert set(status['stages']) == set(freshness.STAGES)
+        assert status['stages'][freshness.BULK_STAGE]['p99_secs'] is None
+
+    def test_format_metrics_writes_cumulative_buckets_of_each_updater(self):
+        freshness.get_histograms('updater1')[freshness.TOTAL].observe(0.3, count=2)
+        freshness.get_histograms('updater1')[freshness.TOTAL].observe(7)
+
+        lines = freshness.format_metrics(freshness.get_snapshot()).splitlines()
+
+        assert 'sync_freshness_seconds_bucket{updater="updater1",le="0.25"} 0' in lines
+        assert 'sync_freshness_seconds_bucket{updater="updater1",le="0.5"} 2' in lines
+        assert 'sync_freshness_seconds_bucket{updater="updater1",le="10"} 3' in lines
+        assert 'sync_freshness_seconds_bucket{updater="updater1",le="+Inf"} 3' in lines
+        assert 'sync_freshness_seconds_count{updater="updater1"} 3' in lines
+        assert 'sync_freshness_stage_seconds_count{stage="bulk",updater="updater1"} 0' in lines
@@ -0,0 +1,191 @@
+from datetime import datetime
+import mock
+import pytest
+from config import CONFIG_DICT
+from service import id_filter, synchroniser
+from service.database.model import TitleRecord
+from service.updaters.property_by_address_updater_v1 import PropertyByAddressUpdaterV1
+
+TEST_CONFIG = {
+    'DELETE_FILTER_ENABLED': True,
+    'DELETE_FILTER_FALSE_POSITIVE_RATE': 0.01,
+    'DELETE_FILTER_MIN_CAPACITY': 1000,
+    'DELETE_FILTER_SCROLL_SIZE': 100,
+    'SYNC_MODE': 'external',
+}
+
+
+@pytest.fixture(autouse=True)
+def test_config():
+    with mock.patch.dict(CONFIG_DICT, TEST_CONFIG), \
+            mock.patch.dict(id_filter._filters_by_updater, clear=True), \
+            mock.patch.dict(id_filter._suspension_counts_by_updater, clear=True), \
+            mock.patch('service.es_utils.refresh_index') as mock_refresh_index:
+        yield mock_refresh_index
+
+
+def _create_updater():
+    updater = PropertyByAddressUpdaterV1('index1', 'doctype1')
+    updater.id = 'updater1'
+    return updater
+
+
+def _build_filter(updater, ids):
+    with mock.patch('service.es_utils.count_documents', return_value=len(ids)), \
+            mock.patch('service.es_utils.scroll_document_ids', return_value=iter(ids)):
+        id_filter.build_filter(updater)
+
+    return id_filter.get_filter(updater.id)
+
+
+def _delete_action(id):
+    return {'_op_type': 'delete', '_index': 'index1', '_type': 'doctype1', '_id': id}
+
+
+def _index_action(id):
+    return {'_op_type': 'index', '_index': 'index1', '_type': 'doctype1', '_id': id, '_source': {}}
+
+
+class TestBloomFilter:
+
+    def test_bloom_filter_contains_every_id_added(self):
+        bloom_filter = id_filter.BloomFilter(1000, 0.01)
+        ids = ['TTL{}-ADDRESS'.format(number) for number in range(1000)]
+
+        for id in ids:
+            bloom_filter.add(id)
+
+        assert all(id in bloom_filter for id in ids)
+        assert bloom_filter.id_count == 1000
+        assert not bloom_filter.is_saturated
+
+    def test_bloom_filter_false_positive_rate_is_close_to_configured_rate(self):
+        bloom_filter = id_filter.BloomFilter(10000, 0.01)
+
+        for number in range(10000):
+            bloom_filter.add('TTL{}'.format(number))
+
+        false_positive_count = len(
+            [number for number in range(10000) if 'OTHER{}'.format(number) in bloom_filter]
+        )
+        assert false_positive_count < 200
+
+
+class TestIdFilter:
+
+    def test_filter_actions_drops_deletes_of_ids_never_written(self):
+        updater = _create_updater()
+        _build_filter(updater, ['TTL1-A'])
+        actions = [_delete_action('TTL1-A'), _delete_action('TTL2-B'), _index_action('TTL3-C'),
+                   _delete_action('TTL3-C')]
+
+        filtered_actions = list(id_filter.filter_actions(updater, actions))
+
+        assert [action['_id'] for action in filtered_actions] == ['TTL1-A', 'TTL3-C', 'TTL3-C']
+        assert id_filter.get_filter(updater.id).dropped_delete_count == 1
+
+    def test_filter_actions_keeps_deletes_until_filter_is_built(self):
+        updater = _create_updater()
+        written_during_build = []
+
+        def scroll_document_ids(*args):
+            yield 'TTL1-A'
+            written_during_build.extend(
+                id_filter.filter_actions(updater, [_index_action('TTL2-B'), _delete_action('X')])
+            )
+
+        with mock.patch('service.es_utils.count_documents', return_value=1), \
+                mock.patch('service.es_utils.scroll_document_ids', new=scroll_document_ids):
+            id_filter.build_filter(updater)
+
+        assert [action['_id'] for action in written_during_build] == ['TTL2-B', 'X']
+        assert 'TTL2-B' in id_filter.get_filter(updater.id).bloom_filter
+
+    def test_filter_actions_passes_actions_through_without_filter(self):
+        updater = _create_updater()
+        actions = [_delete_action('TTL1-A')]
+
+        assert list(id_filter.filter_actions(updater, actions)) == actions
+
+    def test_build_filter_does_nothing_for_updater_with_write_targets(self):
+        updater = _create_updater()
+        updater.write_targets = [mock.MagicMock()]
+
+        assert _build_filter(updater, ['TTL1-A']) is None
+
+    def test_build_filter_refreshes_index_before_scrolling_it(self, test_config):
+        mock_refresh_index = test_config
+        updater = _create_updater()
+
+        def scroll_document_ids(*args):
+            assert mock_refresh_index.mock_calls == [mock.call('index1')]
+            yield 'TTL1-A'
+
+        with mock.patch('service.es_utils.count_documents', return_value=1), \
+                mock.patch('service.es_utils.scroll_document_ids', new=scroll_document_ids):
+            id_filter.build_filter(updater)
+
+        assert 'TTL1-A' in id_filter.get_filter(updater.id).bloom_filter
+
+    def test_build_filter_does_nothing_without_sync_process(self):
+        updater = _create_updater()
+
+        with mock.patch.dict(CONFIG_DICT, {'SYNC_MODE': 'embedded'}):
+            assert _build_filter(updater, ['TTL1-A']) is None
+
+    def test_suspended_filter_is_dropped_and_not_built_until_resumed(self):
+        updater = _create_updater()
+        _build_filter(updater, ['TTL1-A'])
+
+        id_filter.suspend_filters(['updater1'])
+        id_filter.suspend_filters(['updater1'])
+
+        assert id_filter.get_filter(updater.id) is None
+        assert _build_filter(updater, ['TTL1-A']) is None
+
+        id_filter.resume_filters(['updater1'])
+        assert _build_filter(updater, ['TTL1-A']) is None
+
+        id_filter.resume_filters(['updater1'])
+        assert _build_filter(updater, ['TTL1-A']).is_ready
+
+    def test_build_filter_leaves_no_filter_when_scroll_fails(self):
+        updater = _create_updater()
+
+        with mock.patch('service.es_utils.count_documents', return_value=1), \
+                mock.patch('service.es_utils.scroll_document_ids',
+                           side_effect=Exception('Intentionally raised test exception')):
+            with pytest.raises(Exception):
+                id_filter.build_filter(updater)
+
+        assert id_filter.get_filter(updater.id) is None
+
+    def test_ensure_filter_current_rebuilds_filter_over_capacity(self):
+        updater = _create_updater()
+        _build_filter(updater, [])
+        actions = [_index_action('TTL{}'.format(number)) for number in range(1001)]
+        list(id_filter.filter_actions(updater, actions))
+
+        with mock.patch.object(id_filter, 'build_filter') as mock_build_filter:
+            id_filter.ensure_filter_current(updater)
+
+        mock_build_filter.assert_called_once_with(updater)
+
+    def test_ensure_filter_current_builds_missing_filter(self):
+        updater = _create_updater()
+
+        with mock.patch.object(id_filter, 'build_filter') as mock_build_filter:
+            id_filter.ensure_filter_current(updater)
+
+        mock_build_filter.assert_called_once_with(updater)
+
+    def test_synchroniser_drops_deletes_of_deleted_titles_never_indexed(self):
+        updater = _create_updater()
+        _build_filter(updater, [])
+        title = TitleRecord(
+            'TTL1', {'address': {'address_string': '1 high street'}}, datetime(2015, 4, 20), True
+        )
+
+        actions = list(synchroniser._prepare_elasticsearch_actions([title], updater))
+
+        assert actions == []
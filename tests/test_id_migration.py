@@ -0,0 +1,143 @@
+from datetime import datetime
+import mock
+from service import id_migration
+from service.database.model import TitleRecord
+from service.updaters.property_by_address_updater_v1 import PropertyByAddressUpdaterV1
+from service.updaters.property_by_address_updater_v2 import PropertyByAddressUpdaterV2
+
+
+def _create_updater(versioned_writes=True):
+    updater = PropertyByAddressUpdaterV2('index1', 'doctype1')
+    updater.id = 'updater1'
+    updater.versioned_writes = versioned_writes
+    return updater
+
+
+def _get_hits(updater, title_numbers, version=1429532614000005):
+    hits = []
+
+    for title_number in title_numbers:
+        title = TitleRecord(
+            title_number, {'address': {'address_string': '{} high street'.format(title_number)}},
+            datetime(2015, 4, 20), False,
+        )
+        action = updater.prepare_elasticsearch_actions(title)[0]
+        document = action['_source'] if '_source' in action else action['doc']
+        hits.append({'_id': action['_id'], '_source': document, '_version': version})
+
+    return hits
+
+
+def _migrate(updater, index_hits, migrate=True, results=None):
+    migration = id_migration.IdMigration(updater.id, migrate)
+
+    with mock.patch(
+            'service.es_utils.scroll_documents_by_id',
+            return_value=(index_hit for index_hit in index_hits)
+    ) as mock_scroll, mock.patch(
+            'service.es_utils.execute_elasticsearch_actions',
+            side_effect=results or (lambda actions, client: (len(actions), []))
+    ) as mock_execute_actions:
+        id_migration.migrate_document_ids(updater, migration, batch_size=2)
+
+    mock_scroll.assert_called_once_with(
+        'index1', 'doctype1', 2, None, with_versions=updater.versioned_writes
+    )
+    actions = [call[1][0] for call in mock_execute_actions.mock_calls]
+    return migration, actions
+
+
+class TestIdMigration:
+
+    def test_migrate_document_ids_copies_legacy_documents_and_deletes_them(self):
+        updater = _create_updater()
+        legacy_hits = _get_hits(PropertyByAddressUpdaterV1('index1', 'doctype1'), ['TTL1'])
+        compact_hits = _get_hits(updater, ['TTL1'])
+
+        migration, actions = _migrate(updater, legacy_hits)
+
+        assert actions == [
+            [{
+                '_op_type': 'index', '_index': 'index1', '_type': 'doctype1',
+                '_id': compact_hits[0]['_id'], '_source': legacy_hits[0]['_source'],
+                '_version': 1429532614000005, '_version_type': 'external',
+            }],
+            [{
+                '_op_type': 'delete', '_index': 'index1', '_type': 'doctype1',
+                '_id': 'TTL1-TTL1_HIGH_STREET', '_version': 1429532614000005,
+                '_version_type': 'external_gte',
+            }],
+        ]
+        assert migration.to_dict() == {
+            'updater_id': 'updater1', 'migrate': True, 'documents_checked': 1,
+            'legacy_count': 1, 'copied_count': 1, 'already_copied_count': 0,
+            'deleted_count': 1, 'failed_count': 0,
+        }
+
+    def test_migrate_document_ids_creates_copies_without_versioned_writes(self):
+        updater = _create_updater(versioned_writes=False)
+        legacy_hits = _get_hits(PropertyByAddressUpdaterV1('index1', 'doctype1'), ['TTL1'])
+
+        migration, actions = _migrate(updater, legacy_hits)
+
+        assert actions[0][0]['_op_type'] == 'create'
+        assert actions[1] == [
+            {'_op_type': 'delete', '_index': 'index1', '_type': 'doctype1',
+             '_id': 'TTL1-TTL1_HIGH_STREET'},
+        ]
+
+    def test_migrate_document_ids_leaves_compact_documents_alone(self):
+        updater = _create_updater()
+        legacy_hits = _get_hits(PropertyByAddressUpdaterV1('index1', 'doctype1'), ['TTL2', 'TTL3'])
+        hits = _get_hits(updater, ['TTL1']) + legacy_hits + _get_hits(updater, ['TTL4'])
+
+        migration, actions = _migrate(updater, hits)
+
+        # one batch of the two legacy documents - copies, then deletes
+        assert len(actions) == 2
+        assert [action['_id'] for action in actions[1]] == [hit['_id'] for hit in legacy_hits]
+        assert migration.documents_checked == 4
+        assert migration.legacy_count == 2
+
+    def test_migrate_document_ids_keeps_legacy_documents_whose_copy_failed(self):
+        updater = _create_updater()
+        legacy_hits = _get_hits(PropertyByAddressUpdaterV1('index1', 'doctype1'), ['TTL1', 'TTL2'])
+        compact_hits = _get_hits(updater, ['TTL1', 'TTL2'])
+        results = [
+            (0, [{'index': {'_id': compact_hits[0]['_id'], 'status': 500}},
+                 {'index': {'_id': compact_hits[1]['_id'], 'status': 409}}]),
+            (1, []),
+        ]
+
+        migration, actions = _migrate(updater, legacy_hits, results=results)
+
+        assert [action['_id'] for action in actions[1]] == [legacy_hits[1]['_id']]
+        assert migration.failed_count == 1
+        assert migration.already_copied_count == 1
+        assert migration.deleted_count == 1
+
+    def test_migrate_document_ids_only_counts_legacy_documents_on_dry_run(self):
+        updater = _create_updater()
+        legacy_hits = _get_hits(PropertyByAddressUpdaterV1('index1', 'doctype1'), ['TTL1'])
+
+        migration, actions = _migrate(updater, legacy_hits, migrate=False)
+
+        assert actions == []
+        assert migration.legacy_count == 1
+
+    def test_migrate_document_ids_migrates_each_write_target(self):
+        updater = _create_updater()
+        target1, target2 = mock.MagicMock(), mock.MagicMock()
+        target1.index_name, target1.doc_type = 'index1', 'doctype1'
+        target2.index_name, target2.doc_type = 'index2', 'doctype2'
+        updater.write_targets = [target1, target2]
+        migration = id_migration.IdMigration(updater.id)
+
+        with mock.patch('service.es_utils.scroll_documents_by_id', return_value=iter([])) \
+                as mock_scroll:
+            id_migration.migrate_document_ids(updater, migration, batch_size=2)
+
+        assert mock_scroll.mock_calls == [
+            mock.call('index1', 'doctype1', 2, target1.client, with_versions=True),
+            mock.call('index2', 'doctype2', 2, target2.client, with_versions=True),
+        ]
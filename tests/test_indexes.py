@@ -0,0 +1,38 @@
+import mock
+from service.database import indexes, page_reader
+
+
+class TestIndexes:
+
+    def test_get_filter_index_ddl_uses_filter_condition_as_predicate(self):
+        ddl = indexes.get_filter_index_ddl(page_reader.ADDRESS_PRESENT_FILTER)
+
+        assert ddl == (
+            'CREATE INDEX CONCURRENTLY ix_title_register_data_page_address_present '
+            'ON title_register_data (last_modified, title_number) '
+            "WHERE ((register_data #>> '{address,address_string}') IS NOT NULL)"
+        )
+
+    def test_get_index_ddl_for_updaters_skips_updaters_without_filter_and_duplicates(self):
+        updater1 = mock.MagicMock()
+        updater1.get_source_filter.return_value = page_reader.ADDRESS_PRESENT_FILTER
+        updater2 = mock.MagicMock()
+        updater2.get_source_filter.return_value = page_reader.ADDRESS_PRESENT_FILTER
+        updater3 = mock.MagicMock()
+        updater3.get_source_filter.return_value = None
+
+        result = indexes.get_index_ddl_for_updaters([updater1, updater2, updater3])
+
+        assert sorted(result) == [
+            'ix_title_register_data_page', 'ix_title_register_data_page_address_present'
+        ]
+
+    def test_get_index_ddl_for_updaters_always_includes_page_index(self):
+        result = indexes.get_index_ddl_for_updaters([])
+
+        assert result == {
+            'ix_title_register_data_page': (
+                'CREATE INDEX CONCURRENTLY ix_title_register_data_page '
+                'ON title_register_data (last_modified, title_number)'
+            )
+        }
@@ -1 +1,199 @@
+from datetime import datetime
+import mock
+import pytest
+from sqlalchemy.dialects import postgresql  # type: ignore
+from sqlalchemy.orm import Session          # type: ignore
+from config import CONFIG_DICT
+from service.database import page_reader, read_source
+from service.updaters.property_by_postcode_updater_v3 import POSTCODE_REGEX
+
+
+def _create_row(title_number):
+    row = mock.MagicMock()
+    row.title_number = title_number
+    row.register_data = {'title_number': title_number}
+    row.last_modified = datetime(2015, 4, 20)
+    row.is_deleted = False
+    return row
+
+
+def _create_engine(pages):
+    """Engine whose connections return the pages, each a list of rows, one per execution"""
+    engine = mock.MagicMock()
+    connection = engine.connect.return_value.execution_options.return_value
+    connection.execute.side_effect = [
+        mock.MagicMock(fetchmany=mock.MagicMock(side_effect=[page, []])) for page in pages
+    ]
+    return engine
+
+
+def _read_page(engine, **kwargs):
+    with mock.patch.object(read_source, 'get_read_source',
+                           return_value=read_source.ReadSource('primary', engine, None)):
+        return list(
+            page_reader.stream_next_data_page('TTL1', datetime(2015, 4, 20), 10, **kwargs)
+        )
+
+
+def _create_query_plan(plan_node):
+    return [{'Plan': {'Node Type': 'Limit', 'Plans': [plan_node]}}]
+
 # TODO: write integration tests
+
+
+def _get_page_query_sql(source_filter=None, max_last_modified=None):
+    page_query = page_reader._get_page_query(
+        Session(), 'TTL1', datetime(2015, 4, 20), 10, source_filter, max_last_modified
+    )
+    return str(page_query.statement.compile(dialect=postgresql.dialect()))
+
+
+class TestPageReader:
+
+    def test_page_query_compares_cursor_as_row_value(self):
+        sql = _get_page_query_sql()
+
+        assert (
+            '(title_register_data.last_modified, title_register_data.title_number) > '
+            '(%(param_1)s, %(param_2)s)'
+        ) in sql
+        assert ' OR ' not in sql
+
+    def test_page_query_is_capped_at_max_last_modified_when_given(self):
+        sql = _get_page_query_sql(max_last_modified=datetime(2015, 4, 21))
+
+        assert 'title_register_data.last_modified <= %(last_modified_1)s' in sql
+
+    def test_page_query_stops_at_high_water_mark_when_given(self):
+        page_query = page_reader._get_page_query(
+            Session(), 'TTL1', datetime(2015, 4, 20), 10,
+            high_water_mark=(datetime(2015, 5, 20), 'TTL9'),
+        )
+        sql = str(page_query.statement.compile(dialect=postgresql.dialect()))
+
+        assert (
+            '(title_register_data.last_modified, title_register_data.title_number) <= '
+            '(%(param_3)s, %(param_4)s)'
+        ) in sql
+
+    def test_page_query_is_not_capped_without_max_last_modified(self):
+        assert '<=' not in _get_page_query_sql()
+
+    def test_page_query_has_no_source_condition_without_filter(self):
+        assert '#>>' not in _get_page_query_sql()
+
+    def test_page_query_contains_condition_of_source_filter(self):
+        sql = _get_page_query_sql(page_reader.ADDRESS_PRESENT_FILTER)
+
+        assert "((register_data #>> '{address,address_string}') IS NOT NULL)" in sql
+        assert sql.index('IS NOT NULL') < sql.index('ORDER BY')
+
+    def test_postcode_filter_matches_postcode_or_address_with_postcode(self):
+        source_filter = page_reader.get_postcode_present_or_address_matches_filter(POSTCODE_REGEX)
+
+        assert source_filter.condition == (
+            "(register_data #>> '{address,postcode}') <> '' OR "
+            "(register_data #>> '{address,address_string}') ~ "
+            "'[A-Z]{1,2}[0-9R][0-9A-Z]? [0-9][A-Z]{2}'"
+        )
+
+    def test_uses_index_range_scan_returns_true_for_index_scan_with_condition(self):
+        query_plan = _create_query_plan({
+            'Node Type': 'Index Scan',
+            'Relation Name': 'title_register_data',
+            'Index Name': 'ix_title_register_data_page',
+            'Index Cond': '(ROW(last_modified, title_number) > ROW(...))',
+        })
+
+        assert page_reader.uses_index_range_scan(query_plan) is True
+
+    def test_uses_index_range_scan_returns_false_for_sorted_sequential_scan(self):
+        query_plan = _create_query_plan({
+            'Node Type': 'Sort',
+            'Plans': [{
+                'Node Type': 'Seq Scan',
+                'Relation Name': 'title_register_data',
+                'Filter': '(ROW(last_modified, title_number) > ROW(...))',
+            }],
+        })
+
+        assert page_reader.uses_index_range_scan(query_plan) is False
+
+    def test_uses_index_range_scan_returns_false_for_index_scan_without_condition(self):
+        query_plan = _create_query_plan({
+            'Node Type': 'Index Scan',
+            'Relation Name': 'title_register_data',
+            'Index Name': 'title_register_data_pkey',
+            'Filter': '(ROW(last_modified, title_number) > ROW(...))',
+        })
+
+        assert page_reader.uses_index_range_scan(query_plan) is False
+
+    def test_page_statement_binds_cursor_and_caps_as_parameters(self):
+        page_statement = page_reader.get_page_statement(
+            10, is_capped=True, has_high_water_mark=True
+        )
+        sql = str(page_statement.compile(dialect=postgresql.dialect()))
+
+        assert (
+            '(title_register_data.last_modified, title_register_data.title_number) > '
+            '(%(last_modified)s, %(title_number)s)'
+        ) in sql
+        assert 'title_register_data.last_modified <= %(max_last_modified)s' in sql
+        assert (
+            '(title_register_data.last_modified, title_register_data.title_number) <= '
+            '(%(high_water_last_modified)s, %(high_water_title_number)s)'
+        ) in sql
+        assert 'LIMIT' in sql
+
+    def test_page_statement_is_built_once_for_same_query(self):
+        page_statement = page_reader.get_page_statement(10, page_reader.ADDRESS_PRESENT_FILTER)
+
+        assert page_reader.get_page_statement(10, page_reader.ADDRESS_PRESENT_FILTER) is \
+            page_statement
+        assert page_reader.get_page_statement(10) is not page_statement
+
+    def test_stream_next_data_page_yields_title_records_and_closes_connection(self):
+        engine = _create_engine([[_create_row('TTL2'), _create_row('TTL3')]])
+
+        titles = _read_page(engine, high_water_mark=(datetime(2015, 5, 20), 'TTL9'))
+
+        assert [title.title_number for title in titles] == ['TTL2', 'TTL3']
+        connection = engine.connect.return_value.execution_options.return_value
+        parameters = connection.execute.call_args[0][1]
+        assert parameters == {
+            'last_modified': datetime(2015, 4, 20), 'title_number': 'TTL1',
+            'high_water_last_modified': datetime(2015, 5, 20), 'high_water_title_number': 'TTL9',
+        }
+        connection.close.assert_called_once_with()
+
+    def test_dedicated_page_connections_reads_pages_with_one_connection(self):
+        engine = _create_engine([[_create_row('TTL2')], [_create_row('TTL3')]])
+        connection = engine.connect.return_value.execution_options.return_value
+
+        with mock.patch.dict(CONFIG_DICT, {'DEDICATED_PAGE_CONNECTIONS': True}):
+            with page_reader.dedicated_page_connections():
+                _read_page(engine)
+                _read_page(engine)
+
+                assert connection.close.call_count == 0
+
+        assert engine.connect.call_count == 1
+        assert connection.begin.return_value.rollback.call_count == 2
+        connection.close.assert_called_once_with()
+
+    def test_dedicated_page_connections_replaces_connection_after_failure(self):
+        engine = _create_engine([[_create_row('TTL2')]])
+        connection = engine.connect.return_value.execution_options.return_value
+        connection.execute.side_effect = [Exception('Intentionally raised test exception')] + \
+            list(connection.execute.side_effect)
+
+        with mock.patch.dict(CONFIG_DICT, {'DEDICATED_PAGE_CONNECTIONS': True}):
+            with page_reader.dedicated_page_connections():
+                with pytest.raises(Exception):
+                    _read_page(engine)
+
+                assert connection.close.call_count == 1
+                assert [title.title_number for title in _read_page(engine)] == ['TTL2']
+
+        assert engine.connect.call_count == 2
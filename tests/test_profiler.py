@@ -0,0 +1,85 @@
+from collections import Counter
+import threading
+import time
+import mock
+import pytest
+from config import CONFIG_DICT
+from service import profiler
+
+
+def _busy_function_to_profile(stop_event):
+    while not stop_event.is_set():
+        time.sleep(0.001)
+
+
+class TestProfiler:
+
+    def test_stack_sampler_collects_stacks_of_given_threads(self):
+        stop_event = threading.Event()
+        thread = threading.Thread(
+            target=_busy_function_to_profile, args=(stop_event,), name='sync-updater1'
+        )
+        thread.start()
+
+        try:
+            stack_counts = profiler.StackSampler(lambda: [thread], 0.001).sample(0.05)
+        finally:
+            stop_event.set()
+            thread.join()
+
+        assert stack_counts
+        for stack in stack_counts:
+            assert stack.startswith('sync-updater1;')
+            assert '_busy_function_to_profile (test_profiler.py:' in stack
+
+    def test_stack_sampler_ignores_other_threads(self):
+        stack_counts = profiler.StackSampler(lambda: [], 0.001).sample(0.01)
+        assert stack_counts == Counter()
+
+    def test_format_collapsed_stacks_writes_one_line_per_stack(self):
+        stack_counts = Counter({'thread;a;b': 3, 'thread;a': 1})
+
+        result = profiler.format_collapsed_stacks(stack_counts)
+
+        assert result == 'thread;a 1\nthread;a;b 3\n'
+
+    def test_profile_sync_threads_rejects_concurrent_profiling(self):
+        with profiler._profiling_lock:
+            with pytest.raises(profiler.ProfilingInProgressError):
+                profiler.profile_sync_threads(lambda: [], 0.01)
+
+    @mock.patch('signal.signal')
+    def test_install_signal_handler_does_nothing_without_output_dir(self, mock_signal):
+        with mock.patch.dict(CONFIG_DICT, {'PROFILING_OUTPUT_DIR': ''}):
+            profiler.install_signal_handler(lambda: [])
+
+        assert mock_signal.mock_calls == []
+
+    @mock.patch('signal.signal')
+    def test_install_signal_handler_refuses_signals_gunicorn_uses(self, mock_signal, tmpdir):
+        config = {'PROFILING_OUTPUT_DIR': str(tmpdir), 'PROFILING_SIGNAL': 'SIGUSR2'}
+
+        with mock.patch.dict(CONFIG_DICT, config):
+            profiler.install_signal_handler(lambda: [])
+
+        assert mock_signal.mock_calls == []
+
+    def test_signal_handler_writes_profile_to_output_dir(self, tmpdir):
+        config = {
+            'PROFILING_OUTPUT_DIR': str(tmpdir),
+            'PROFILING_SIGNAL': 'SIGPROF',
+            'PROFILING_SIGNAL_SECS': 0,
+        }
+
+        with mock.patch.dict(CONFIG_DICT, config), mock.patch('signal.signal') as mock_signal:
+            profiler.install_signal_handler(lambda: [])
+            signal_handler = mock_signal.call_args[0][1]
+
+            with mock.patch('threading.Thread') as mock_thread:
+                signal_handler(None, None)
+
+            target = mock_thread.call_args[1]['target']
+            target(*mock_thread.call_args[1]['args'])
+
+        assert len(tmpdir.listdir()) == 1
+        assert tmpdir.listdir()[0].basename.endswith('.collapsed')
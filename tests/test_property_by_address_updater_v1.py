@@ -1,6 +1,8 @@
 from collections import namedtuple
 from datetime import datetime
 import mock
+from service.backfill_lane import BackfillLane
+from service.database import page_reader
 from service.updaters.property_by_address_updater_v1 import PropertyByAddressUpdaterV1
 
 MockTitleRegisterData = namedtuple(
@@ -15,7 +17,7 @@ class TestPropertyByAddressUpdaterV1:
         assert updater.index_name == 'index123'
         assert updater.doc_type == 'doctype321'
 
-    @mock.patch('service.database.page_reader.get_next_data_page', return_value=[])
+    @mock.patch('service.database.page_reader.stream_next_data_page', return_value=[])
     def test_get_next_source_data_page_calls_page_reader_with_right_args(self, mock_get_page):
         last_title_number = 'title123'
         last_modification_date = datetime.now()
@@ -28,14 +30,30 @@ class TestPropertyByAddressUpdaterV1:
         updater.get_next_source_data_page(page_size)
 
         mock_get_page.assert_called_once_with(
-            last_title_number, last_modification_date, page_size
+            last_title_number, last_modification_date, page_size, updater.get_source_filter(),
+            None,
+        )
+
+    @mock.patch('service.database.page_reader.stream_next_data_page', return_value=[])
+    def test_get_next_source_data_page_reads_backfill_lane_up_to_its_high_water_mark(
+            self, mock_get_page):
+        lane = BackfillLane(datetime(2015, 4, 20), 'TTL1', datetime(2015, 5, 20), 'TTL9')
+        updater = PropertyByAddressUpdaterV1('index', 'doctype')
+        updater.last_title_modification_date = datetime(2015, 5, 21)
+        updater.last_updated_title_number = 'TTL10'
+
+        updater.get_next_source_data_page(123, lane)
+
+        mock_get_page.assert_called_once_with(
+            'TTL1', datetime(2015, 4, 20), 123, updater.get_source_filter(),
+            (datetime(2015, 5, 20), 'TTL9'),
         )
 
     def test_get_next_source_data_page_returns_result_from_page_reader(self):
         title1 = MockTitleRegisterData('TTL1', {'register': 'data1'}, datetime.now(), False)
         title2 = MockTitleRegisterData('TTL2', {'register': 'data2'}, datetime.now(), False)
 
-        with mock.patch('service.database.page_reader.get_next_data_page',
+        with mock.patch('service.database.page_reader.stream_next_data_page',
                         return_value=[title1, title2]):
             updater = PropertyByAddressUpdaterV1('index', 'doctype')
             updater.last_title_modification_date = datetime.now()
@@ -85,6 +103,51 @@ class TestPropertyByAddressUpdaterV1:
 
         assert returned_actions == [{'upsert': 'action1'}]
 
+    @mock.patch('service.es_utils.get_versioned_index_action', return_value={'index': 'action1'})
+    def test_prepare_elasticsearch_actions_returns_versioned_action_when_versioned_writes_on(
+            self, mock_get_versioned_index_action):
+
+        entry_datetime = datetime(2015, 4, 20, 12, 23, 34, 5)
+        register_data = {'address': {'address_string': 'ADDRESS string 1'}}
+        updated_title = MockTitleRegisterData('TTL1', register_data, entry_datetime, False)
+        doc = {
+            'title_number': 'TTL1',
+            'entry_datetime': '2015-04-20T12:23:34.000+0000',
+            'address_string': 'address string 1'
+        }
+
+        updater = PropertyByAddressUpdaterV1('index_name1', 'doc_type1')
+        updater.versioned_writes = True
+        returned_actions = updater.prepare_elasticsearch_actions(updated_title)
+
+        mock_get_versioned_index_action.assert_called_once_with(
+            'index_name1', 'doc_type1', doc, 'TTL1-ADDRESS_STRING_1', 1429532614000005
+        )
+
+        assert returned_actions == [{'index': 'action1'}]
+
+    @mock.patch('service.es_utils.get_delete_action', return_value={'delete': 'action1'})
+    def test_prepare_elasticsearch_actions_returns_versioned_delete_when_versioned_writes_on(
+            self, mock_get_delete_action):
+
+        entry_datetime = datetime(2015, 4, 20, 12, 23, 34, 5)
+        register_data = {'address': {'address_string': 'address string 1'}}
+        deleted_title = MockTitleRegisterData('TTL1', register_data, entry_datetime, True)
+
+        updater = PropertyByAddressUpdaterV1('index_name1', 'doc_type1')
+        updater.versioned_writes = True
+        returned_actions = updater.prepare_elasticsearch_actions(deleted_title)
+
+        mock_get_delete_action.assert_called_once_with(
+            'index_name1', 'doc_type1', 'TTL1-ADDRESS_STRING_1', 1429532614000005
+        )
+
+        assert returned_actions == [{'delete': 'action1'}]
+
+    def test_get_source_filter_reads_only_titles_with_address(self):
+        source_filter = PropertyByAddressUpdaterV1('index', 'doctype').get_source_filter()
+        assert source_filter == page_reader.ADDRESS_PRESENT_FILTER
+
     def test_get_mapping_returns_correct_mapping(self):
         assert PropertyByAddressUpdaterV1('index', 'doctype').get_mapping() == {
             'properties': {
@@ -93,3 +156,44 @@ class TestPropertyByAddressUpdaterV1:
                 'entry_datetime': {'type': 'date', 'format': 'date_time', 'index': 'no'},
             }
         }
+
+    def test_prepare_page_actions_returns_actions_of_each_title_like_prepare_actions(self):
+        titles = [
+            MockTitleRegisterData(
+                'TTL{}'.format(number),
+                {'address': {
+                    'address_string': '{0} High  Street, (Plymouth) PL{0} 1AB'.format(number),
+                    'postcode': 'PL{} 1AB'.format(number) if number % 3 else None,
+                    'house_no': str(number) if number % 2 else None,
+                }},
+                datetime(2015, 4, 20, 12, number % 2),
+                number % 4 == 0,
+            )
+            for number in range(1, 9)
+        ]
+
+        for versioned_writes in [False, True]:
+            updater = PropertyByAddressUpdaterV1('index', 'doctype')
+            updater.versioned_writes = versioned_writes
+
+            assert updater.prepare_page_actions(titles) == [
+                updater.prepare_elasticsearch_actions(title) for title in titles
+            ]
+            assert updater.prepare_page_actions([]) == []
+
+    def test_prepare_page_actions_keeps_case_of_title_numbers_like_prepare_actions(self):
+        titles = [
+            MockTitleRegisterData(
+                title_number, {'address': {'address_string': '1 high st'}},
+                datetime(2015, 4, 20), is_deleted,
+            )
+            for title_number, is_deleted in [('dn1', False), ('Dn2', True)]
+        ]
+        updater = PropertyByAddressUpdaterV1('index', 'doctype')
+
+        page_actions = updater.prepare_page_actions(titles)
+
+        assert page_actions == [updater.prepare_elasticsearch_actions(title) for title in titles]
+        assert [actions[0]['_id'] for actions in page_actions] == [
+            'dn1-1_HIGH_ST', 'Dn2-1_HIGH_ST'
+        ]
@@ -0,0 +1,83 @@
+from collections import namedtuple
+from datetime import datetime
+from service.updaters.property_by_address_updater_v1 import PropertyByAddressUpdaterV1
+from service.updaters.property_by_address_updater_v2 import PropertyByAddressUpdaterV2
+from service.updaters.property_by_address_updater_v2 import get_compact_document_id
+
+MockTitleRegisterData = namedtuple(
+    'TitleRegisterData', ['title_number', 'register_data', 'last_modified', 'is_deleted']
+)
+
+
+def _create_title(title_number, address_string, is_deleted=False):
+    return MockTitleRegisterData(
+        title_number, {'address': {'address_string': address_string}},
+        datetime(2015, 4, 20, 12, 23, 34, 5), is_deleted,
+    )
+
+
+class TestPropertyByAddressUpdaterV2:
+
+    def test_prepare_elasticsearch_actions_writes_documents_of_v1_under_compact_id(self):
+        title = _create_title('TTL1', 'Flat 1, The Old Rectory, 12 High Street, Plymouth PL1 1AB')
+        legacy_action = PropertyByAddressUpdaterV1('index', 'doctype') \
+            .prepare_elasticsearch_actions(title)[0]
+
+        action = PropertyByAddressUpdaterV2('index', 'doctype').prepare_elasticsearch_actions(
+            title
+        )[0]
+
+        assert action['doc'] == legacy_action['doc']
+        assert action['_id'].startswith('TTL1-')
+        assert len(action['_id']) == len('TTL1-') + 16
+        assert len(action['_id']) < len(legacy_action['_id'])
+
+    def test_document_id_stays_the_same_while_normalised_address_does(self):
+        updater = PropertyByAddressUpdaterV2('index', 'doctype')
+
+        id1 = updater.prepare_elasticsearch_actions(_create_title('TTL1', '1 High  Street'))[0]
+        id2 = updater.prepare_elasticsearch_actions(_create_title('TTL1', '1 high street,'))[0]
+        id3 = updater.prepare_elasticsearch_actions(_create_title('TTL1', '2 high street'))[0]
+        id4 = updater.prepare_elasticsearch_actions(_create_title('TTL2', '1 high street'))[0]
+
+        assert id1['_id'] == id2['_id']
+        assert id1['_id'] != id3['_id']
+        assert id4['_id'].startswith('TTL2-')
+
+    def test_prepare_elasticsearch_actions_deletes_compact_id_when_title_deleted(self):
+        updater = PropertyByAddressUpdaterV2('index', 'doctype')
+        title = _create_title('TTL1', '1 high street')
+
+        written_id = updater.prepare_elasticsearch_actions(title)[0]['_id']
+        delete_action = updater.prepare_elasticsearch_actions(title._replace(is_deleted=True))[0]
+
+        assert delete_action == {
+            '_op_type': 'delete', '_index': 'index', '_type': 'doctype', '_id': written_id,
+        }
+
+    def test_prepare_page_actions_returns_actions_of_each_title_like_prepare_actions(self):
+        titles = [
+            _create_title(
+                'TTL{}'.format(number), '{0} High  Street, (Plymouth) PL{0} 1AB'.format(number),
+                number % 4 == 0,
+            )
+            for number in range(1, 9)
+        ]
+
+        for versioned_writes in [False, True]:
+            updater = PropertyByAddressUpdaterV2('index', 'doctype')
+            updater.versioned_writes = versioned_writes
+
+            assert updater.prepare_page_actions(titles) == [
+                updater.prepare_elasticsearch_actions(title) for title in titles
+            ]
+
+    def test_prepare_page_actions_hashes_ids_with_case_of_title_numbers_like_prepare_actions(
+            self):
+        titles = [_create_title('dn1', '1 high st'), _create_title('Dn2', '1 high st', True)]
+        updater = PropertyByAddressUpdaterV2('index', 'doctype')
+
+        page_actions = updater.prepare_page_actions(titles)
+
+        assert page_actions == [updater.prepare_elasticsearch_actions(title) for title in titles]
+        assert page_actions[0][0]['_id'] == get_compact_document_id('dn1', 'dn1-1_HIGH_ST')
@@ -1,7 +1,9 @@
 from collections import namedtuple
 from datetime import datetime
 import mock
-from service.updaters.property_by_postcode_updater_v3 import PropertyByPostcodeUpdaterV3
+from service.updaters.property_by_postcode_updater_v3 import (
+    PropertyByPostcodeUpdaterV3, POSTCODE_REGEX
+)
 
 MockTitleRegisterData = namedtuple(
     "TitleRegisterData", ['title_number', 'register_data', 'last_modified', 'is_deleted']
@@ -15,7 +17,7 @@ class TestPropertyByPostcodeUpdaterV3:
         assert updater.index_name == 'index123'
         assert updater.doc_type == 'doctype321'
 
-    @mock.patch('service.database.page_reader.get_next_data_page', return_value=[])
+    @mock.patch('service.database.page_reader.stream_next_data_page', return_value=[])
     def test_get_next_source_data_page_calls_page_reader_with_right_args(self, mock_get_page):
         last_title_number = 'title123'
         last_modification_date = datetime.now()
@@ -28,14 +30,15 @@ class TestPropertyByPostcodeUpdaterV3:
         updater.get_next_source_data_page(page_size)
 
         mock_get_page.assert_called_once_with(
-            last_title_number, last_modification_date, page_size
+            last_title_number, last_modification_date, page_size, updater.get_source_filter(),
+            None,
         )
 
     def test_get_next_source_data_page_returns_result_from_page_reader(self):
         title1 = MockTitleRegisterData('TTL1', {'register': 'data1'}, datetime.now(), False)
         title2 = MockTitleRegisterData('TTL2', {'register': 'data2'}, datetime.now(), False)
 
-        with mock.patch('service.database.page_reader.get_next_data_page',
+        with mock.patch('service.database.page_reader.stream_next_data_page',
                         return_value=[title1, title2]):
             updater = PropertyByPostcodeUpdaterV3('index', 'doctype')
             updater.last_title_modification_date = datetime.now()
@@ -121,6 +124,28 @@ class TestPropertyByPostcodeUpdaterV3:
 
         assert returned_actions == [{'upsert': 'action1'}]
 
+    @mock.patch('service.es_utils.get_versioned_index_action', return_value={'index': 'action1'})
+    def test_prepare_elasticsearch_actions_returns_versioned_action_when_versioned_writes_on(
+            self, mock_get_versioned_index_action):
+
+        entry_datetime = datetime(2015, 4, 20, 12, 23, 34, 5)
+        register_data = {'address': {'postcode': 'SW11 2DR', 'address_string': '1 A ST'}}
+        updated_title = MockTitleRegisterData('TTL1', register_data, entry_datetime, False)
+
+        updater = PropertyByPostcodeUpdaterV3('index_name1', 'doc_type1')
+        updater.versioned_writes = True
+        returned_actions = updater.prepare_elasticsearch_actions(updated_title)
+
+        assert returned_actions == [{'index': 'action1'}]
+        args = mock_get_versioned_index_action.call_args[0]
+        assert args[0:2] == ('index_name1', 'doc_type1')
+        assert args[3:] == ('TTL1-SW112DR', 1429532614000005)
+
+    def test_get_source_filter_reads_only_titles_with_postcodes(self):
+        source_filter = PropertyByPostcodeUpdaterV3('index', 'doctype').get_source_filter()
+        assert source_filter.name == 'postcode_present'
+        assert POSTCODE_REGEX in source_filter.condition
+
     def test_get_mapping_returns_correct_mapping(self):
         assert PropertyByPostcodeUpdaterV3('index', 'doctype').get_mapping() == {
             'properties': {
@@ -133,3 +158,28 @@ class TestPropertyByPostcodeUpdaterV3:
                                    'index': 'no'}
             }
         }
+
+    def test_prepare_page_actions_returns_actions_of_each_title_like_prepare_actions(self):
+        titles = [
+            MockTitleRegisterData(
+                'TTL{}'.format(number),
+                {'address': {
+                    'address_string': '{0} High  Street, (Plymouth) PL{0} 1AB'.format(number),
+                    'postcode': 'PL{} 1AB'.format(number) if number % 3 else None,
+                    'house_no': str(number) if number % 2 else None,
+                }},
+                datetime(2015, 4, 20, 12, number % 2),
+                number % 4 == 0,
+            )
+            for number in range(1, 9)
+        ]
+
+        for versioned_writes in [False, True]:
+            updater = PropertyByPostcodeUpdaterV3('index', 'doctype')
+            updater.versioned_writes = versioned_writes
+
+            assert updater.prepare_page_actions(titles) == [
+                updater.prepare_elasticsearch_actions(title) for title in titles
+            ]
+            assert updater.prepare_page_actions([]) == []
+
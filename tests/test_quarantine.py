@@ -0,0 +1,233 @@
+from collections import namedtuple
+from datetime import datetime, timedelta
+import mock
+import pytest
+from freezegun import freeze_time
+from config import CONFIG_DICT
+from service import quarantine, resync, status, synchroniser
+from service.updaters.property_by_address_updater_v1 import PropertyByAddressUpdaterV1
+
+MockTitleRegisterData = namedtuple(
+    'TitleRegisterData', ['title_number', 'register_data', 'last_modified', 'is_deleted']
+)
+
+TEST_CONFIG = {
+    'QUARANTINE_ENABLED': True,
+    # the synchronisations of the tests don't retry, as that reads the database
+    'QUARANTINE_RETRY_INTERVAL_SECS': 0,
+    'QUARANTINE_MAX_TITLES': 2,
+}
+
+FROZEN_NOW = datetime(2015, 4, 30, 12, 0, 0)
+
+
+@pytest.fixture(autouse=True)
+def test_config():
+    with mock.patch.dict(CONFIG_DICT, TEST_CONFIG), \
+            mock.patch.dict(quarantine._quarantines_by_updater, clear=True), \
+            mock.patch.dict(resync._queues, clear=True), \
+            mock.patch('service.es_utils.index_document') as mock_index_document, \
+            mock.patch('service.es_utils.delete_document') as mock_delete_document:
+        yield mock_index_document, mock_delete_document
+
+
+def _create_updater(updater_id='updater1'):
+    updater = PropertyByAddressUpdaterV1('index1', 'doctype1')
+    updater.id = updater_id
+    updater.last_title_modification_date = datetime(2015, 4, 1)
+    updater.last_updated_title_number = 'TTL0'
+    return updater
+
+
+def _create_title(title_number, register_data=None):
+    return MockTitleRegisterData(
+        title_number,
+        register_data or {'address': {'address_string': '{} high street'.format(title_number)}},
+        datetime(2015, 4, 20, 10, int(title_number[3:])), False,
+    )
+
+
+def _synchronise_page(updater, titles):
+    executed_actions = []
+
+    def execute_actions(actions, client=None):
+        executed_actions.extend(actions)
+        return len(executed_actions), []
+
+    with mock.patch.object(synchroniser, 'page_size', len(titles) + 1), \
+            mock.patch.object(updater, 'get_next_source_data_page', return_value=titles), \
+            mock.patch('service.es_utils.execute_elasticsearch_actions',
+                       side_effect=execute_actions):
+        synchroniser.synchronise_index_with_source(updater)
+
+    return executed_actions
+
+
+class TestQuarantine:
+
+    def test_synchronisation_quarantines_failing_title_and_writes_the_rest(self, test_config):
+        mock_index_document, _ = test_config
+        updater = _create_updater()
+        titles = [_create_title('TTL1'), _create_title('TTL2', {'address': None}),
+                  _create_title('TTL3')]
+
+        with freeze_time(FROZEN_NOW):
+            actions = _synchronise_page(updater, titles)
+
+        assert [action['_id'] for action in actions] == [
+            'TTL1-TTL1_HIGH_STREET', 'TTL3-TTL3_HIGH_STREET'
+        ]
+        assert updater.last_updated_title_number == 'TTL3'
+        assert quarantine.is_quarantined('updater1', 'TTL2')
+        mock_index_document.assert_called_once_with(
+            'index1', quarantine.QUARANTINE_DOC_TYPE, 'updater1-TTL2', {
+                'updater_id': 'updater1',
+                'title_number': 'TTL2',
+                'last_modified_micros': 1429524120000000,
+                'error': "TypeError: 'NoneType' object is not subscriptable",
+                'quarantined_at_micros': 1430395200000000,
+                'failed_at_micros': 1430395200000000,
+                'attempt_count': 1,
+            }
+        )
+
+    def test_synchronisation_releases_quarantined_title_it_no_longer_fails_on(self, test_config):
+        _, mock_delete_document = test_config
+        updater = _create_updater()
+        _synchronise_page(updater, [_create_title('TTL1', {'address': None})])
+
+        actions = _synchronise_page(updater, [_create_title('TTL1')])
+
+        assert [action['_id'] for action in actions] == ['TTL1-TTL1_HIGH_STREET']
+        assert not quarantine.is_quarantined('updater1', 'TTL1')
+        mock_delete_document.assert_called_once_with(
+            'index1', quarantine.QUARANTINE_DOC_TYPE, 'updater1-TTL1'
+        )
+
+    def test_quarantined_title_failing_again_counts_attempts(self):
+        updater = _create_updater()
+        title = _create_title('TTL1', {'address': None})
+
+        with freeze_time(FROZEN_NOW):
+            _synchronise_page(updater, [title])
+
+        with freeze_time(FROZEN_NOW + timedelta(hours=1)):
+            _synchronise_page(updater, [title])
+
+        [quarantined_title] = quarantine.get_quarantined_titles('updater1')
+        assert quarantined_title.attempt_count == 2
+        assert quarantined_title.quarantined_at == FROZEN_NOW
+        assert quarantined_title.failed_at == FROZEN_NOW + timedelta(hours=1)
+
+    def test_synchronisation_fails_page_when_quarantine_is_full(self):
+        updater = _create_updater()
+        titles = [_create_title('TTL{}'.format(number), {'address': None}) for number in [1, 2, 3]]
+
+        actions = _synchronise_page(updater, titles)
+
+        assert actions == []
+        assert updater.last_updated_title_number == 'TTL0'
+        assert len(quarantine.get_quarantined_titles('updater1')) == 2
+
+    def test_synchronisation_fails_page_when_quarantine_disabled(self, test_config):
+        mock_index_document, _ = test_config
+        updater = _create_updater()
+
+        with mock.patch.dict(CONFIG_DICT, {'QUARANTINE_ENABLED': False}):
+            _synchronise_page(updater, [_create_title('TTL1', {'address': None})])
+
+        assert updater.last_updated_title_number == 'TTL0'
+        assert not mock_index_document.called
+
+    @mock.patch.dict(CONFIG_DICT, {'QUARANTINE_RETRY_INTERVAL_SECS': 600})
+    def test_enqueue_due_retries_queues_resync_of_titles_due(self):
+        updater = _create_updater()
+
+        with freeze_time(FROZEN_NOW):
+            quarantine.quarantine_title(updater, _create_title('TTL1'), Exception('error1'))
+
+        with freeze_time(FROZEN_NOW + timedelta(seconds=300)):
+            quarantine.quarantine_title(updater, _create_title('TTL2'), Exception('error2'))
+
+        with freeze_time(FROZEN_NOW + timedelta(seconds=600)):
+            quarantine.enqueue_due_retries(updater)
+            quarantine.enqueue_due_retries(updater)
+
+        [job] = resync.get_jobs('updater1')
+        assert job.selector == {'title_numbers': ['TTL1']}
+
+    def test_retry_releases_quarantined_titles_no_longer_in_source(self, test_config):
+        _, mock_delete_document = test_config
+        updater = _create_updater()
+        quarantine.quarantine_title(updater, _create_title('TTL1'), Exception('error1'))
+        quarantine.quarantine_title(updater, _create_title('TTL2'), Exception('error2'))
+        job = resync.ResyncJob(updater.id, {'title_numbers': ['TTL1', 'TTL2']})
+        job.start()
+
+        # TTL2 is gone from the source, or left out by the source filter
+        with mock.patch('service.database.page_reader.stream_titles_with_numbers',
+                        return_value=iter([_create_title('TTL1')])), \
+                mock.patch('service.es_utils.execute_elasticsearch_actions',
+                           side_effect=lambda actions, client=None: (len(list(actions)), [])):
+            synchroniser.run_resync_job(updater, job)
+
+        assert quarantine.get_quarantined_titles('updater1') == []
+        assert sorted(mock_delete_document.mock_calls) == [
+            mock.call('index1', quarantine.QUARANTINE_DOC_TYPE, 'updater1-TTL1'),
+            mock.call('index1', quarantine.QUARANTINE_DOC_TYPE, 'updater1-TTL2'),
+        ]
+
+    def test_updaters_sharing_index_keep_their_quarantines_apart(self, test_config):
+        mock_index_document, mock_delete_document = test_config
+        updater1, updater2 = _create_updater('updater1'), _create_updater('updater2')
+        _synchronise_page(updater1, [_create_title('TTL1', {'address': None})])
+        _synchronise_page(updater2, [_create_title('TTL1', {'address': None})])
+
+        _synchronise_page(updater2, [_create_title('TTL1')])
+
+        assert [call[1][2] for call in mock_index_document.mock_calls] == [
+            'updater1-TTL1', 'updater2-TTL1'
+        ]
+        mock_delete_document.assert_called_once_with(
+            'index1', quarantine.QUARANTINE_DOC_TYPE, 'updater2-TTL1'
+        )
+        assert quarantine.is_quarantined('updater1', 'TTL1')
+        assert not quarantine.is_quarantined('updater2', 'TTL1')
+
+    def test_load_quarantine_restores_quarantined_titles(self):
+        updater = _create_updater()
+        quarantined_title = quarantine.QuarantinedTitle(
+            'updater1', 'TTL1', datetime(2015, 4, 20), 'KeyError: address', FROZEN_NOW
+        )
+
+        with mock.patch('service.es_utils.scroll_documents_by_id',
+                        return_value=iter([{'_source': quarantined_title.to_document()}])) \
+                as mock_scroll:
+            quarantine.load_quarantine(updater)
+
+        mock_scroll.assert_called_once_with(
+            'index1', quarantine.QUARANTINE_DOC_TYPE, 2, query={'term': {'updater_id': 'updater1'}}
+        )
+        assert quarantine.get_quarantine_status('updater1') == {
+            'count': 1,
+            'titles': [{
+                'title_number': 'TTL1',
+                'last_modified': '2015-04-20T00:00:00.000+0000',
+                'error': 'KeyError: address',
+                'quarantined_at': '2015-04-30T12:00:00.000+0000',
+                'failed_at': '2015-04-30T12:00:00.000+0000',
+                'attempts': 1,
+            }],
+        }
+
+    def test_status_returns_quarantine_of_updater(self):
+        updater = _create_updater()
+        updater.last_successful_sync_time = None
+        updater.last_unsuccessful_sync_time = None
+        quarantine.quarantine_title(updater, _create_title('TTL1'), Exception('error1'))
+
+        with mock.patch('service.sync_manager.is_index_updater_busy', return_value=False):
+            updater_status = status._get_updater_status(updater)
+
+        assert updater_status['quarantine']['count'] == 1
+        assert updater_status['quarantine']['titles'][0]['error'] == 'Exception: error1'
@@ -0,0 +1,66 @@
+from datetime import datetime
+import mock
+from config import CONFIG_DICT
+from service.database import read_source
+
+
+class TestReadSource:
+
+    @mock.patch('service.database.read_source.read_replica_db', None)
+    @mock.patch('service.database.read_source.db')
+    def test_get_read_source_returns_primary_when_no_replica_configured(self, mock_db):
+        assert read_source.get_read_source() == read_source.ReadSource('primary', mock_db, None)
+
+    @mock.patch('service.database.read_source.read_replica_db')
+    @mock.patch('service.database.read_source.db')
+    def test_get_read_source_returns_replica_capped_at_replayed_time(
+            self, mock_db, mock_replica_db):
+        mock_replica_db.connect.return_value.execute.return_value.fetchone.return_value = (
+            2.5, datetime(2015, 4, 20, 10, 11, 12)
+        )
+
+        with mock.patch.dict(CONFIG_DICT, {'REPLICA_SAFETY_MARGIN_SECS': 5}):
+            result = read_source.get_read_source()
+
+        assert result == read_source.ReadSource(
+            'replica', mock_replica_db, datetime(2015, 4, 20, 10, 11, 7)
+        )
+        assert read_source.get_last_replica_check().lag_secs == 2.5
+        assert read_source.get_last_replica_check().source_name == 'replica'
+        mock_replica_db.connect.return_value.close.assert_called_once_with()
+
+    @mock.patch('service.database.read_source.read_replica_db')
+    @mock.patch('service.database.read_source.db')
+    def test_get_read_source_returns_primary_when_replica_lags_too_much(
+            self, mock_db, mock_replica_db):
+        mock_replica_db.connect.return_value.execute.return_value.fetchone.return_value = (
+            61.0, datetime(2015, 4, 20, 10, 11, 12)
+        )
+
+        with mock.patch.dict(CONFIG_DICT, {'REPLICA_MAX_LAG_SECS': 60}):
+            result = read_source.get_read_source()
+
+        assert result == read_source.ReadSource('primary', mock_db, None)
+        assert read_source.get_last_replica_check().lag_secs == 61.0
+        assert read_source.get_last_replica_check().source_name == 'primary'
+
+    @mock.patch('service.database.read_source.read_replica_db')
+    @mock.patch('service.database.read_source.db')
+    def test_get_read_source_returns_primary_when_replica_unavailable(
+            self, mock_db, mock_replica_db):
+        mock_replica_db.connect.side_effect = Exception('Intentionally raised test exception')
+
+        result = read_source.get_read_source()
+
+        assert result == read_source.ReadSource('primary', mock_db, None)
+        assert read_source.get_last_replica_check().error == 'Intentionally raised test exception'
+
+    @mock.patch('service.database.read_source.read_replica_db')
+    @mock.patch('service.database.read_source.db')
+    def test_get_read_source_returns_primary_when_replica_has_not_replayed_anything(
+            self, mock_db, mock_replica_db):
+        mock_replica_db.connect.return_value.execute.return_value.fetchone.return_value = (
+            None, None
+        )
+
+        assert read_source.get_read_source() == read_source.ReadSource('primary', mock_db, None)
@@ -0,0 +1,253 @@
+from datetime import datetime
+import mock
+import pytest
+from service import date_utils, reconciler
+from service.backfill_lane import BackfillLane
+from service.database.model import TitleRecord
+from service.updaters.property_by_address_updater_v1 import PropertyByAddressUpdaterV1
+
+
+def _create_title(title_number, address_string='1 high street', last_modified=None,
+                  is_deleted=False):
+    return TitleRecord(
+        title_number, {'address': {'address_string': address_string}},
+        last_modified or datetime(2015, 4, 20, 10, 11, 12), is_deleted,
+    )
+
+
+def _create_updater(versioned_writes=True):
+    updater = PropertyByAddressUpdaterV1('index1', 'doctype1')
+    updater.id = 'updater1'
+    updater.versioned_writes = versioned_writes
+    updater.last_title_modification_date = datetime(2015, 5, 1)
+    updater.last_updated_title_number = 'TTL9'
+    return updater
+
+
+def _get_hits(updater, titles):
+    hits = []
+
+    for title in titles:
+        for action in updater.prepare_elasticsearch_actions(title):
+            document = action['_source'] if '_source' in action else action['doc']
+            hits.append({'_id': action['_id'], '_source': document})
+
+    return sorted(hits, key=lambda hit: hit['_id'])
+
+
+def _reconcile(updater, source_titles, index_hits, repair=True, title_lookup=None):
+    reconciliation = reconciler.Reconciliation(updater.id, repair)
+
+    with mock.patch(
+            'service.database.page_reader.stream_titles_by_title_number',
+            return_value=(source_title for source_title in source_titles)
+    ), mock.patch(
+            'service.es_utils.scroll_documents_by_id',
+            return_value=(index_hit for index_hit in index_hits)
+    ), mock.patch(
+            'service.database.page_reader.get_title', return_value=title_lookup
+    ), mock.patch(
+            'service.es_utils.execute_elasticsearch_actions', return_value=(0, [])
+    ) as mock_execute_actions:
+        reconciler.reconcile(updater, reconciliation)
+
+    assert reconciliation.state == reconciler.RECONCILIATION_FINISHED
+    actions = [
+        action for call in mock_execute_actions.mock_calls for action in call[1][0]
+    ]
+    return reconciliation, actions
+
+
+class TestReconciler:
+
+    def test_merge_by_title_number_joins_titles_with_their_documents(self):
+        title1, title3 = _create_title('TTL1'), _create_title('TTL3')
+        source_titles = iter([(title1, True), (title3, True)])
+        index_documents = iter([('TTL2', {'id2': {}}), ('TTL3', {'id3': {}})])
+
+        result = list(reconciler.merge_by_title_number(source_titles, index_documents))
+
+        assert result == [
+            ('TTL1', (title1, True), {}),
+            ('TTL2', None, {'id2': {}}),
+            ('TTL3', (title3, True), {'id3': {}}),
+        ]
+
+    def test_group_documents_by_title_groups_consecutive_documents_of_title(self):
+        hits = [
+            {'_id': 'TTL1-A', '_source': {'title_number': 'TTL1'}},
+            {'_id': 'TTL1-B', '_source': {'title_number': 'TTL1'}},
+            {'_id': 'TTL2-A', '_source': {'title_number': 'TTL2'}},
+        ]
+
+        result = list(reconciler.group_documents_by_title(iter(hits)))
+
+        assert [(title_number, sorted(documents)) for title_number, documents in result] == [
+            ('TTL1', ['TTL1-A', 'TTL1-B']), ('TTL2', ['TTL2-A'])
+        ]
+
+    def test_group_documents_by_title_rejects_documents_out_of_title_order(self):
+        hits = [
+            {'_id': 'TTL2-A', '_source': {'title_number': 'TTL2'}},
+            {'_id': 'TTL3-A', '_source': {'title_number': 'TTL1'}},
+        ]
+
+        with pytest.raises(Exception) as e:
+            list(reconciler.group_documents_by_title(iter(hits)))
+
+        assert 'out of title number order' in str(e.value)
+
+    def test_get_digest_ignores_order_of_fields(self):
+        assert reconciler.get_digest({'id1': {'a': 1, 'b': 2}}) == \
+            reconciler.get_digest({'id1': {'b': 2, 'a': 1}})
+
+    def test_reconcile_repairs_nothing_when_index_matches_source(self):
+        updater = _create_updater()
+        titles = [_create_title('TTL1'), _create_title('TTL2', '2 high street')]
+
+        reconciliation, actions = _reconcile(
+            updater, [(title, True) for title in titles], _get_hits(updater, titles)
+        )
+
+        assert actions == []
+        assert reconciliation.titles_checked == 2
+        assert reconciliation.documents_checked == 2
+
+    def test_reconcile_writes_missing_and_stale_documents(self):
+        updater = _create_updater()
+        title1, title2 = _create_title('TTL1'), _create_title('TTL2')
+        index_hits = _get_hits(updater, [title2])
+        index_hits[0]['_source']['address_string'] = 'old address'
+
+        reconciliation, actions = _reconcile(
+            updater, [(title1, True), (title2, True)], index_hits
+        )
+
+        assert [(action['_op_type'], action['_id']) for action in actions] == [
+            ('index', 'TTL1-1_HIGH_STREET'), ('index', 'TTL2-1_HIGH_STREET'),
+        ]
+        assert actions[1]['_source']['address_string'] == '1 high street'
+        assert actions[1]['_version'] == date_utils.to_epoch_micros(title2.last_modified)
+        assert actions[1]['_version_type'] == 'external_gte'
+        assert (reconciliation.missing_count, reconciliation.stale_count) == (1, 1)
+
+    def test_reconcile_deletes_orphaned_documents_with_version_of_cursor(self):
+        updater = _create_updater()
+        old_title, title = _create_title('TTL1', 'old street'), _create_title('TTL1')
+        index_hits = _get_hits(updater, [old_title, title])
+
+        reconciliation, actions = _reconcile(updater, [(title, True)], index_hits)
+
+        assert actions == [{
+            '_op_type': 'delete',
+            '_index': 'index1',
+            '_type': 'doctype1',
+            '_id': 'TTL1-OLD_STREET',
+            '_version': date_utils.to_epoch_micros(updater.last_title_modification_date),
+            '_version_type': 'external_gte',
+        }]
+        assert reconciliation.orphaned_count == 1
+
+    def test_reconcile_deletes_documents_of_titles_not_in_source_or_filtered_out(self):
+        updater = _create_updater(versioned_writes=False)
+        title1, title2 = _create_title('TTL1'), _create_title('TTL2')
+
+        reconciliation, actions = _reconcile(
+            updater, [(title2, False)], _get_hits(updater, [title1, title2])
+        )
+
+        assert [(action['_op_type'], action['_id']) for action in actions] == [
+            ('delete', 'TTL1-1_HIGH_STREET'), ('delete', 'TTL2-1_HIGH_STREET'),
+        ]
+
+    def test_reconcile_compares_title_added_after_source_stream_started(self):
+        updater = _create_updater()
+        title = _create_title('TTL1')
+
+        reconciliation, actions = _reconcile(
+            updater, [], _get_hits(updater, [title]), title_lookup=(title, True)
+        )
+
+        assert actions == []
+        assert reconciliation.titles_checked == 1
+
+    def test_reconcile_skips_titles_not_synchronised_yet(self):
+        updater = _create_updater()
+        updater.backfill_lane = BackfillLane(
+            datetime(2015, 1, 1), 'TTL0', datetime(2015, 2, 1), 'TTL0'
+        )
+        titles = [
+            _create_title('TTL1', last_modified=datetime(2015, 5, 2)),
+            _create_title('TTL2', last_modified=datetime(2015, 1, 15)),
+        ]
+
+        reconciliation, actions = _reconcile(updater, [(title, True) for title in titles], [])
+
+        assert actions == []
+        assert reconciliation.titles_skipped == 2
+
+    def test_reconcile_carries_on_past_title_updater_fails_on(self):
+        updater = _create_updater()
+        titles = [_create_title('TTL1'), _create_title('TTL2'), _create_title('TTL3')]
+        poison_title = titles[1]._replace(register_data=None)
+
+        reconciliation, actions = _reconcile(
+            updater, [(title, True) for title in [titles[0], poison_title, titles[2]]], []
+        )
+
+        assert [action['_id'] for action in actions] == [
+            'TTL1-1_HIGH_STREET', 'TTL3-1_HIGH_STREET'
+        ]
+        assert reconciliation.titles_checked == 3
+        assert reconciliation.to_dict()['failed_titles'] == 1
+
+    def test_reconcile_skips_quarantined_titles(self):
+        updater = _create_updater()
+        titles = [_create_title('TTL1'), _create_title('TTL2')]
+
+        with mock.patch('service.quarantine.is_quarantined',
+                        side_effect=lambda updater_id, title_number: title_number == 'TTL2'):
+            reconciliation, actions = _reconcile(updater, [(title, True) for title in titles], [])
+
+        assert [action['_id'] for action in actions] == ['TTL1-1_HIGH_STREET']
+        assert reconciliation.titles_skipped == 1
+        assert reconciliation.failed_title_count == 0
+
+    def test_reconcile_only_counts_differences_without_repair(self):
+        updater = _create_updater()
+
+        reconciliation, actions = _reconcile(
+            updater, [(_create_title('TTL1'), True)], [], repair=False
+        )
+
+        assert actions == []
+        assert reconciliation.missing_count == 1
+
+    def test_reconcile_records_failure(self):
+        updater = _create_updater()
+        reconciliation = reconciler.Reconciliation(updater.id)
+
+        with mock.patch(
+                'service.database.page_reader.stream_titles_by_title_number',
+                side_effect=Exception('Intentionally raised test exception')):
+            reconciler.reconcile(updater, reconciliation)
+
+        assert reconciliation.state == reconciler.RECONCILIATION_FAILED
+        assert reconciliation.error == 'Intentionally raised test exception'
+        assert reconciliation.finished_at is not None
+
+    def test_reconcile_stops_when_cancelled(self):
+        updater = _create_updater()
+        reconciliation = reconciler.Reconciliation(updater.id)
+        reconciliation.cancel()
+
+        with mock.patch(
+                'service.database.page_reader.stream_titles_by_title_number',
+                return_value=(source_title for source_title in [(_create_title('TTL1'), True)])
+        ), mock.patch(
+                'service.es_utils.scroll_documents_by_id',
+                return_value=(index_hit for index_hit in [])):
+            reconciler.reconcile(updater, reconciliation)
+
+        assert reconciliation.state == reconciler.RECONCILIATION_CANCELLED
+        assert reconciliation.titles_checked == 0
@@ -0,0 +1,159 @@
+from collections import namedtuple
+from datetime import datetime
+import gzip
+import os
+import mock
+import pytest
+from config import CONFIG_DICT
+from service import recorder, synchroniser
+from service.database.model import TitleRecord
+
+MockTitleRegisterData = namedtuple(
+    'TitleRegisterData', ['title_number', 'register_data', 'last_modified', 'is_deleted']
+)
+
+
+@pytest.fixture
+def mock_updater():
+    updater = mock.MagicMock()
+    updater.id = 'updater1'
+    updater.index_name = 'index1'
+    updater.doc_type = 'doctype1'
+    return updater
+
+
+@pytest.fixture(autouse=True)
+def close_recorder():
+    yield
+    recorder.close()
+
+
+def _create_data_page(last_modified, last_title_number):
+    data_page = mock.MagicMock()
+    data_page.title_count = 1
+    data_page.last_modified = last_modified
+    data_page.last_title_number = last_title_number
+    return data_page
+
+
+def _recording_config(recording_dir, record_pages=True, record_actions=True):
+    return mock.patch.dict(CONFIG_DICT, {
+        'RECORDING_DIR': str(recording_dir),
+        'RECORD_PAGES': record_pages,
+        'RECORD_ACTIONS': record_actions,
+        'RECORDING_SEGMENT_MAX_BYTES': 1000000,
+        'RECORDING_MAX_SEGMENTS': 0,
+    })
+
+
+class TestSegmentWriter:
+
+    def test_write_starts_new_segment_when_size_limit_reached(self, tmpdir):
+        writer = recorder.SegmentWriter(str(tmpdir), 'page', 10)
+
+        writer.write({'record': 1})
+        writer.write({'record': 2})
+        writer.close()
+
+        assert len(os.listdir(str(tmpdir))) == 2
+        assert list(recorder.read_records(str(tmpdir), 'page')) == [{'record': 1}, {'record': 2}]
+
+    def test_write_removes_oldest_segments_beyond_max_segments(self, tmpdir):
+        tmpdir.join('actions-1-000001.ndjson.gz').write('')
+        writer = recorder.SegmentWriter(str(tmpdir), 'page', 10, max_segments=2)
+
+        for record_number in range(1, 5):
+            writer.write({'record': record_number})
+
+        writer.close()
+
+        assert len(os.listdir(str(tmpdir))) == 3
+        assert list(recorder.read_records(str(tmpdir), 'page')) == [{'record': 3}, {'record': 4}]
+
+    def test_records_can_be_read_before_segment_is_closed(self, tmpdir):
+        writer = recorder.SegmentWriter(str(tmpdir), 'page', 1000)
+
+        writer.write({'record': 1})
+
+        assert list(recorder.read_records(str(tmpdir), 'page')) == [{'record': 1}]
+        writer.close()
+
+    def test_read_records_skips_incomplete_segment_tail(self, tmpdir):
+        with gzip.open(str(tmpdir.join('page-1-000001.ndjson.gz')), 'wb') as file:
+            file.write(b'{"record": 1}\n{"rec')
+
+        assert list(recorder.read_records(str(tmpdir), 'page')) == [{'record': 1}]
+
+
+class TestRecorder:
+
+    def test_page_recording_records_titles_with_cursor_once_written(self, tmpdir, mock_updater):
+        title1 = MockTitleRegisterData('TTL1', {'a': 1}, datetime(2015, 4, 20, 1, 2, 3), False)
+        title2 = MockTitleRegisterData('TTL2', None, datetime(2015, 4, 20, 1, 2, 4, 5), True)
+
+        with _recording_config(tmpdir, record_actions=False):
+            page_recording = recorder.PageRecording(mock_updater)
+            assert list(page_recording.track_titles(iter([title1, title2]))) == [title1, title2]
+            assert not tmpdir.join('updater1').check()
+
+            page_recording.record_written(_create_data_page(title2.last_modified, 'TTL2'))
+            recorder.close()
+
+        records = list(recorder.read_records(str(tmpdir.join('updater1')), 'page'))
+        assert len(records) == 1
+        assert records[0]['cursor'] == {
+            'last_modified': '2015-04-20T01:02:04.000005', 'title_number': 'TTL2'
+        }
+        assert records[0]['index_name'] == 'index1'
+        assert [recorder.dict_to_title(title) for title in records[0]['titles']] == [
+            TitleRecord('TTL1', {'a': 1}, datetime(2015, 4, 20, 1, 2, 3), False),
+            TitleRecord('TTL2', None, datetime(2015, 4, 20, 1, 2, 4, 5), True),
+        ]
+
+    def test_page_recording_records_actions_with_cursor_of_data_page(self, tmpdir, mock_updater):
+        with _recording_config(tmpdir, record_pages=False):
+            page_recording = recorder.PageRecording(mock_updater)
+            assert list(page_recording.track_actions(iter([{'_id': 'id1'}]))) == [{'_id': 'id1'}]
+            data_page = _create_data_page(datetime(2015, 4, 20, 1, 2, 3), 'TTL1')
+            page_recording.record_written(data_page)
+            recorder.close()
+
+        records = list(recorder.read_records(str(tmpdir.join('updater1')), 'actions'))
+        assert [record['actions'] for record in records] == [[{'_id': 'id1'}]]
+        assert records[0]['cursor'] == {
+            'last_modified': '2015-04-20T01:02:03.000000', 'title_number': 'TTL1'
+        }
+        assert list(recorder.read_records(str(tmpdir.join('updater1')), 'page')) == []
+
+    def test_page_failing_to_be_written_is_not_recorded(self, tmpdir, mock_updater):
+        title = MockTitleRegisterData('TTL1', {'a': 1}, datetime(2015, 4, 20, 1, 2, 3), False)
+        mock_updater.write_targets = []
+        mock_updater.dual_lanes = False
+        mock_updater.get_next_source_data_page.return_value = [title]
+        mock_updater.prepare_elasticsearch_actions.return_value = [{'_id': 'id1'}]
+
+        def execute_actions(actions):
+            list(actions)
+            raise Exception('Intentionally raised test exception')
+
+        with _recording_config(tmpdir), \
+                mock.patch('service.es_utils.execute_elasticsearch_actions',
+                           side_effect=execute_actions):
+            synchroniser.synchronise_index_with_source(mock_updater)
+            recorder.close()
+
+        assert not tmpdir.join('updater1').check()
+
+    def test_nothing_is_recorded_when_recording_disabled(self, tmpdir, mock_updater):
+        title = MockTitleRegisterData('TTL1', {'a': 1}, datetime(2015, 4, 20, 1, 2, 3), False)
+
+        titles = [title]
+        actions = [{'_id': 'id1'}]
+
+        with _recording_config(tmpdir, record_pages=False, record_actions=False):
+            page_recording = recorder.PageRecording(mock_updater)
+            assert page_recording.track_titles(titles) is titles
+            assert page_recording.track_actions(actions) is actions
+            page_recording.record_written(_create_data_page(title.last_modified, 'TTL1'))
+
+        assert tmpdir.listdir() == []
@@ -0,0 +1,69 @@
+from datetime import datetime
+import mock
+from service import recorder, replay
+from service.database.model import TitleRecord
+
+
+def _write_records(recording_dir, records):
+    writer = recorder.SegmentWriter(str(recording_dir), records[0]['type'], 1000000)
+    for record in records:
+        writer.write(record)
+    writer.close()
+
+
+def _record(record_type, title_number, **kwargs):
+    record = {
+        'type': record_type,
+        'cursor': {'last_modified': '2015-04-20T01:02:03.000000', 'title_number': title_number},
+    }
+    record.update(kwargs)
+    return record
+
+
+class TestReplay:
+
+    def test_replay_actions_sends_all_recorded_actions_in_order(self, tmpdir):
+        _write_records(tmpdir, [
+            _record('actions', 'TTL1', actions=[{'_id': '1'}, {'_id': '2'}]),
+            _record('actions', 'TTL2', actions=[{'_id': '3'}]),
+        ])
+        sent_actions = []
+
+        def execute(actions):
+            sent_actions.extend(actions)
+            return len(sent_actions), []
+
+        with mock.patch('service.es_utils.execute_elasticsearch_actions', side_effect=execute):
+            result = replay.replay_actions(str(tmpdir))
+
+        assert sent_actions == [{'_id': '1'}, {'_id': '2'}, {'_id': '3'}]
+        assert result == {
+            'record_count': 2,
+            'success_count': 3,
+            'error_count': 0,
+            'cursor': {'last_modified': '2015-04-20T01:02:03.000000', 'title_number': 'TTL2'},
+        }
+
+    def test_replay_pages_runs_titles_through_given_updater(self, tmpdir):
+        title_dict = {
+            'title_number': 'TTL1',
+            'register_data': {'address': {}},
+            'last_modified': '2015-04-20T01:02:03.000000',
+            'is_deleted': False,
+        }
+        _write_records(tmpdir, [_record('page', 'TTL1', titles=[title_dict])])
+
+        mock_updater = mock.MagicMock()
+        mock_updater.prepare_elasticsearch_actions.return_value = [{'_id': 'TTL1'}]
+
+        def execute(actions):
+            return len(list(actions)), []
+
+        with mock.patch('service.es_utils.execute_elasticsearch_actions', side_effect=execute):
+            result = replay.replay_pages(str(tmpdir), mock_updater)
+
+        mock_updater.prepare_elasticsearch_actions.assert_called_once_with(
+            TitleRecord('TTL1', {'address': {}}, datetime(2015, 4, 20, 1, 2, 3), False)
+        )
+        assert result['success_count'] == 1
+        assert result['record_count'] == 1
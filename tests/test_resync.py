@@ -0,0 +1,222 @@
+from datetime import datetime
+import mock
+import pytest
+from config import CONFIG_DICT
+from service import resync, synchroniser
+from service.database.model import TitleRecord
+from service.updaters.property_by_address_updater_v1 import PropertyByAddressUpdaterV1
+
+
+def _create_title(title_number, last_modified=None):
+    return TitleRecord(
+        title_number, {'address': {'address_string': '1 high street'}},
+        last_modified or datetime(2015, 4, 20, 10, 11, 12), False,
+    )
+
+
+def _create_updater():
+    updater = PropertyByAddressUpdaterV1('index1', 'doctype1')
+    updater.id = 'updater1'
+    updater.versioned_writes = True
+    updater.last_title_modification_date = datetime(2015, 5, 1)
+    updater.last_updated_title_number = 'TTL9'
+    return updater
+
+
+def _execute_actions(actions, client=None):
+    """Consumes the streamed actions, like the bulk helper does"""
+    return len(list(actions)), []
+
+
+@pytest.fixture(autouse=True)
+def clear_queues():
+    resync._queues.clear()
+
+
+class TestResync:
+
+    def test_parse_selector_sorts_title_numbers_and_removes_duplicates(self):
+        selector = {'title_numbers': ['TTL2', 'TTL1', 'TTL2']}
+        assert resync.parse_selector(selector) == ('title_numbers', ['TTL1', 'TTL2'])
+
+    def test_parse_selector_parses_dates_of_modified_window(self):
+        selector = {'modified_window': {'from': '2015-04-20T10:00:00+01:00', 'to': '2015-04-21'}}
+
+        assert resync.parse_selector(selector) == (
+            'modified_window', (datetime(2015, 4, 20, 9), datetime(2015, 4, 21))
+        )
+
+    @pytest.mark.parametrize('selector', [
+        {},
+        {'title_numbers': ['TTL1'], 'title_number_range': {'from': 'TTL1', 'to': 'TTL2'}},
+        {'title_numbers': []},
+        {'title_numbers': 'TTL1'},
+        {'title_number_range': {'from': 'TTL2', 'to': 'TTL1'}},
+        {'title_number_range': {'from': 'TTL1'}},
+        {'modified_window': {'from': 'yesterday', 'to': '2015-04-21'}},
+    ])
+    def test_parse_selector_rejects_invalid_selector(self, selector):
+        with pytest.raises(resync.InvalidResyncRequestError):
+            resync.parse_selector(selector)
+
+    def test_take_next_job_takes_pending_jobs_in_order_they_were_queued(self):
+        job1 = resync.ResyncJob('updater1', {'title_numbers': ['TTL1']})
+        job2 = resync.ResyncJob('updater1', {'title_numbers': ['TTL2']})
+        resync.enqueue(job1)
+        resync.enqueue(job2)
+
+        assert resync.take_next_job('updater1') is job1
+        assert job1.state == resync.RESYNC_RUNNING
+        assert resync.take_next_job('updater1') is job2
+        assert resync.take_next_job('updater1') is None
+        assert resync.take_next_job('updater2') is None
+
+    def test_enqueue_forgets_oldest_ended_jobs(self):
+        for i in range(resync.ENDED_JOB_HISTORY + 2):
+            job = resync.ResyncJob('updater1', {'title_numbers': ['TTL{}'.format(i)]})
+            resync.enqueue(job)
+            job.finish()
+
+        pending_job = resync.ResyncJob('updater1', {'title_numbers': ['TTL1']})
+        resync.enqueue(pending_job)
+
+        jobs = resync.get_jobs('updater1')
+        assert len(jobs) == resync.ENDED_JOB_HISTORY + 1
+        assert jobs[-1] is pending_job
+        assert resync.has_pending_jobs('updater1')
+
+    @mock.patch.object(synchroniser, 'page_size', 2)
+    @mock.patch('service.es_utils.execute_elasticsearch_actions', side_effect=_execute_actions)
+    def test_run_resync_job_reads_title_numbers_page_by_page(self, mock_execute_actions):
+        updater = _create_updater()
+        job = resync.ResyncJob(updater.id, {'title_numbers': ['TTL3', 'TTL1', 'TTL2']})
+        job.start()
+
+        with mock.patch(
+                'service.database.page_reader.stream_titles_with_numbers',
+                side_effect=lambda title_numbers, source_filter: (
+                    _create_title(title_number) for title_number in title_numbers
+                )) as mock_stream_titles:
+            synchroniser.run_resync_job(updater, job)
+
+        assert mock_stream_titles.mock_calls == [
+            mock.call(['TTL1', 'TTL2'], updater.get_source_filter()),
+            mock.call(['TTL3'], updater.get_source_filter()),
+        ]
+        assert job.state == resync.RESYNC_FINISHED
+        assert job.title_count == 3
+        assert mock_execute_actions.call_count == 2
+
+    @mock.patch.object(synchroniser, 'page_size', 2)
+    def test_run_resync_job_continues_title_number_range_after_last_title_of_page(self):
+        updater = _create_updater()
+        job = resync.ResyncJob(updater.id, {'title_number_range': {'from': 'TTL1', 'to': 'TTL5'}})
+        pages = [[_create_title('TTL1'), _create_title('TTL2')], [_create_title('TTL4')]]
+
+        with mock.patch(
+                'service.database.page_reader.stream_title_number_range_page',
+                side_effect=[iter(page) for page in pages]
+        ) as mock_stream_page, mock.patch(
+                'service.es_utils.execute_elasticsearch_actions', side_effect=_execute_actions):
+            synchroniser.run_resync_job(updater, job)
+
+        assert [page_call[1][2] for page_call in mock_stream_page.mock_calls] == [None, 'TTL2']
+        assert job.title_count == 3
+
+    @mock.patch.object(synchroniser, 'page_size', 2)
+    def test_run_resync_job_reads_modified_window_from_its_start_up_to_its_end(self):
+        updater = _create_updater()
+        job = resync.ResyncJob(
+            updater.id, {'modified_window': {'from': '2015-04-20', 'to': '2015-04-21'}}
+        )
+
+        with mock.patch(
+                'service.database.page_reader.stream_modified_window_page', return_value=iter([])
+        ) as mock_stream_page, mock.patch(
+                'service.es_utils.execute_elasticsearch_actions', side_effect=_execute_actions):
+            synchroniser.run_resync_job(updater, job)
+
+        mock_stream_page.assert_called_once_with(
+            '', datetime(2015, 4, 20), 2, datetime(2015, 4, 21), updater.get_source_filter()
+        )
+        assert job.state == resync.RESYNC_FINISHED
+
+    def test_run_resync_job_replaces_documents_of_same_version_and_leaves_cursor(self):
+        updater = _create_updater()
+        job = resync.ResyncJob(updater.id, {'title_numbers': ['TTL1']})
+
+        with mock.patch(
+                'service.database.page_reader.stream_titles_with_numbers',
+                return_value=iter([_create_title('TTL1')])
+        ), mock.patch(
+                'service.es_utils.execute_elasticsearch_actions', return_value=(1, [])
+        ) as mock_execute_actions:
+            synchroniser.run_resync_job(updater, job)
+
+        actions = list(mock_execute_actions.call_args[0][0])
+        assert [action['_version_type'] for action in actions] == ['external_gte']
+        assert updater.last_title_modification_date == datetime(2015, 5, 1)
+        assert updater.last_updated_title_number == 'TTL9'
+
+    def test_run_resync_job_writes_actions_to_all_write_targets(self):
+        updater = _create_updater()
+        write_targets = [mock.MagicMock(), mock.MagicMock()]
+        for write_target in write_targets:
+            write_target.write_actions.return_value = (1, [])
+        updater.write_targets = write_targets
+        job = resync.ResyncJob(updater.id, {'title_numbers': ['TTL1']})
+
+        with mock.patch(
+                'service.database.page_reader.stream_titles_with_numbers',
+                return_value=iter([_create_title('TTL1')])):
+            synchroniser.run_resync_job(updater, job)
+
+        for write_target in write_targets:
+            assert [action['_id'] for action in write_target.write_actions.call_args[0][0]] == \
+                ['TTL1-1_HIGH_STREET']
+            assert not write_target.submit_page.called
+
+    def test_run_resync_job_counts_failed_actions_but_not_stale_writes(self):
+        updater = _create_updater()
+        job = resync.ResyncJob(updater.id, {'title_numbers': ['TTL1']})
+        errors = [{'index': {'status': 409}}, {'index': {'status': 500}}]
+
+        with mock.patch(
+                'service.database.page_reader.stream_titles_with_numbers',
+                return_value=iter([_create_title('TTL1')])
+        ), mock.patch('service.es_utils.execute_elasticsearch_actions', return_value=(0, errors)):
+            synchroniser.run_resync_job(updater, job)
+
+        assert job.failed_action_count == 1
+
+    def test_run_resync_job_records_failure(self):
+        updater = _create_updater()
+        job = resync.ResyncJob(updater.id, {'title_numbers': ['TTL1']})
+
+        with mock.patch(
+                'service.database.page_reader.stream_titles_with_numbers',
+                side_effect=Exception('Intentionally raised test exception')):
+            synchroniser.run_resync_job(updater, job)
+
+        assert job.state == resync.RESYNC_FAILED
+        assert job.error == 'Intentionally raised test exception'
+        assert job.finished_at is not None
+
+    @mock.patch('service.es_utils.execute_elasticsearch_actions', return_value=(1, []))
+    def test_synchronise_index_with_source_runs_queued_resyncs_before_pages(
+            self, mock_execute_actions):
+        updater = _create_updater()
+        resync.enqueue(resync.ResyncJob(updater.id, {'title_numbers': ['TTL1']}))
+        calls = []
+
+        with mock.patch.dict(CONFIG_DICT, {'READ_BATCH_SIZE': 10}), mock.patch(
+                'service.database.page_reader.stream_titles_with_numbers',
+                side_effect=lambda *args: calls.append('resync') or iter([_create_title('TTL1')])
+        ), mock.patch.object(
+                updater, 'get_next_source_data_page',
+                side_effect=lambda *args: calls.append('page') or iter([])):
+            synchroniser.synchronise_index_with_source(updater)
+
+        assert calls == ['resync', 'page']
+        assert resync.get_jobs(updater.id)[0].state == resync.RESYNC_FINISHED
+        assert updater.last_updated_title_number == 'TTL9'
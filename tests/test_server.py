@@ -3,6 +3,8 @@ import json
 import mock
 from mock import call
 from config import CONFIG_DICT
+from service import bulk_backpressure, freshness, reconciler, resync
+from service.database import read_source
 from service.server import app
 
 
@@ -79,6 +81,67 @@ class TestServer:
                 }
             }
 
+    @mock.patch('service.sync_manager.is_index_updater_busy', return_value=False)
+    @mock.patch('service.sync_manager.get_index_updaters', return_value=[])
+    @mock.patch('service.database.read_source.is_replica_configured', return_value=True)
+    def test_status_returns_read_replica_check_when_replica_configured(
+            self, mock_is_replica_configured, mock_get_index_updaters, mock_is_updater_busy):
+        replica_check = read_source.ReplicaCheck(
+            datetime(2015, 4, 20, 10, 11, 12), 1.5, 'replica', None
+        )
+
+        with mock.patch(
+                'service.database.read_source.get_last_replica_check', return_value=replica_check):
+            response = app.test_client().get('/status')
+
+        assert json.loads(response.data.decode())['read_replica'] == {
+            'last_check_time': '2015-04-20T10:11:12.000+0000',
+            'lag_secs': 1.5,
+            'reading_from': 'replica',
+            'error': None,
+        }
+
+    @mock.patch('service.sync_manager.get_index_updaters', return_value=[])
+    def test_status_returns_bulk_budgets_of_clusters_written_to(self, mock_get_index_updaters):
+        budget = bulk_backpressure.BulkBudget()
+
+        with mock.patch(
+                'service.es_utils.get_bulk_budgets', return_value={'http://es:9200': budget}):
+            response = app.test_client().get('/status')
+
+        assert json.loads(response.data.decode())['bulk_budgets'] == {
+            'http://es:9200': {
+                'chunk_size': CONFIG_DICT['BULK_CHUNK_SIZE'],
+                'concurrency_limit': CONFIG_DICT['BULK_MAX_CONCURRENCY'],
+                'in_flight': 0,
+                'latency_ms': None,
+                'rejection_rate': 0.0,
+                'rejected_actions': 0,
+            }
+        }
+
+    @mock.patch('service.sync_manager.is_index_updater_busy', return_value=False)
+    def test_status_returns_owner_of_updater_when_leases_enabled(self, mock_is_updater_busy):
+        mock_index_updater = mock.MagicMock()
+        mock_index_updater.id = 'id1'
+        mock_index_updater.last_successful_sync_time = None
+        mock_index_updater.last_unsuccessful_sync_time = None
+        mock_index_updater.last_title_modification_date = None
+        mock_index_updater.last_updated_title_number = None
+        mock_index_updater.index_name = 'index1'
+        mock_index_updater.doc_type = 'doctype1'
+        mock_lease_manager = mock.MagicMock()
+        mock_lease_manager.get_owner.return_value = 'instance-1'
+
+        with mock.patch(
+                'service.sync_manager.get_index_updaters', return_value=[mock_index_updater]
+        ), mock.patch(
+                'service.sync_manager.get_lease_manager', return_value=mock_lease_manager):
+            response = app.test_client().get('/status')
+
+        assert json.loads(response.data.decode())['status']['id1']['owner'] == 'instance-1'
+        mock_lease_manager.get_owner.assert_called_once_with('id1')
+
     def test_status_returns_500_response_when_sync_manager_raises_error(self):
         exception_to_raise = Exception('Intentionally raised test exception')
 
@@ -148,3 +211,245 @@ class TestServer:
                 'Problem talking to PostgreSQL: Test PG exception',
             ],
         }
+
+    def test_profile_returns_404_when_profiling_disabled(self):
+        with mock.patch.dict(CONFIG_DICT, {'PROFILING_TOKEN': ''}):
+            response = app.test_client().get('/debug/profile')
+
+        assert response.status_code == 404
+
+    def test_profile_returns_403_when_token_invalid(self):
+        with mock.patch.dict(CONFIG_DICT, {'PROFILING_TOKEN': 'secret'}):
+            response = app.test_client().get(
+                '/debug/profile', headers={'X-Profiling-Token': 'wrong'}
+            )
+
+        assert response.status_code == 403
+
+    @mock.patch('service.profiler.profile_sync_threads', return_value='sync-id1;a;b 3\n')
+    def test_profile_returns_collapsed_stacks_of_updater_threads(self, mock_profile):
+        mock_index_updater = mock.MagicMock()
+        mock_index_updater.id = 'id1'
+
+        with mock.patch.dict(CONFIG_DICT, {'PROFILING_TOKEN': 'secret'}), mock.patch(
+                'service.sync_manager.get_index_updaters', return_value=[mock_index_updater]
+        ), mock.patch('service.sync_manager.get_sync_threads') as mock_get_sync_threads:
+            response = app.test_client().get(
+                '/debug/profile?updater=id1&seconds=5', headers={'X-Profiling-Token': 'secret'}
+            )
+
+            get_threads, seconds = mock_profile.call_args[0]
+            get_threads()
+            mock_get_sync_threads.assert_called_once_with('id1')
+
+        assert response.status_code == 200
+        assert response.data.decode() == 'sync-id1;a;b 3\n'
+        assert seconds == 5
+
+    def test_profile_returns_400_when_seconds_exceed_limit(self):
+        config = {'PROFILING_TOKEN': 'secret', 'PROFILING_MAX_SECS': 10}
+
+        with mock.patch.dict(CONFIG_DICT, config), mock.patch(
+                'service.sync_manager.get_index_updaters', return_value=[]):
+            response = app.test_client().get(
+                '/debug/profile?seconds=11', headers={'X-Profiling-Token': 'secret'}
+            )
+
+        assert response.status_code == 400
+
+    def test_profile_returns_400_when_seconds_exceed_worker_timeout_margin(self):
+        config = {
+            'PROFILING_TOKEN': 'secret', 'PROFILING_MAX_SECS': 300, 'WORKER_TIMEOUT_SECS': 30,
+            'PROFILING_TIMEOUT_MARGIN_SECS': 10,
+        }
+
+        with mock.patch.dict(CONFIG_DICT, config), mock.patch(
+                'service.sync_manager.get_index_updaters', return_value=[]):
+            response = app.test_client().get(
+                '/debug/profile?seconds=21', headers={'X-Profiling-Token': 'secret'}
+            )
+
+        assert response.status_code == 400
+        assert json.loads(response.data.decode())['error'] == \
+            'Number of seconds must be between 1 and 20'
+
+    def test_reconciliation_returns_404_when_admin_endpoints_disabled(self):
+        with mock.patch.dict(CONFIG_DICT, {'ADMIN_TOKEN': ''}):
+            response = app.test_client().post('/reconciliation/id1')
+
+        assert response.status_code == 404
+
+    def test_reconciliation_returns_403_when_token_invalid(self):
+        with mock.patch.dict(CONFIG_DICT, {'ADMIN_TOKEN': 'secret'}):
+            response = app.test_client().post(
+                '/reconciliation/id1', headers={'X-Admin-Token': 'wrong'}
+            )
+
+        assert response.status_code == 403
+
+    @mock.patch('service.sync_manager.start_reconciliation')
+    def test_reconciliation_starts_reconciliation_of_updater(self, mock_start_reconciliation):
+        mock_index_updater = mock.MagicMock()
+        mock_index_updater.id = 'id1'
+        mock_start_reconciliation.return_value = reconciler.Reconciliation('id1', repair=False)
+
+        with mock.patch.dict(CONFIG_DICT, {'ADMIN_TOKEN': 'secret'}), mock.patch(
+                'service.sync_manager.get_index_updaters', return_value=[mock_index_updater]):
+            response = app.test_client().post(
+                '/reconciliation/id1?repair=false', headers={'X-Admin-Token': 'secret'}
+            )
+
+        assert response.status_code == 202
+        assert json.loads(response.data.decode())['state'] == 'running'
+        mock_start_reconciliation.assert_called_once_with('id1', False)
+
+    @mock.patch(
+        'service.sync_manager.start_reconciliation',
+        side_effect=reconciler.ReconciliationInProgressError('In progress'),
+    )
+    def test_reconciliation_returns_409_when_already_running(self, mock_start_reconciliation):
+        mock_index_updater = mock.MagicMock()
+        mock_index_updater.id = 'id1'
+
+        with mock.patch.dict(CONFIG_DICT, {'ADMIN_TOKEN': 'secret'}), mock.patch(
+                'service.sync_manager.get_index_updaters', return_value=[mock_index_updater]):
+            response = app.test_client().post(
+                '/reconciliation/id1', headers={'X-Admin-Token': 'secret'}
+            )
+
+        assert response.status_code == 409
+
+    def test_reconciliation_cancels_running_reconciliation(self):
+        mock_index_updater = mock.MagicMock()
+        mock_index_updater.id = 'id1'
+        updater_reconciliation = reconciler.Reconciliation('id1')
+
+        with mock.patch.dict(CONFIG_DICT, {'ADMIN_TOKEN': 'secret'}), mock.patch(
+                'service.sync_manager.get_index_updaters', return_value=[mock_index_updater]
+        ), mock.patch(
+                'service.sync_manager.get_reconciliation', return_value=updater_reconciliation):
+            response = app.test_client().delete(
+                '/reconciliation/id1', headers={'X-Admin-Token': 'secret'}
+            )
+
+        assert response.status_code == 200
+        assert updater_reconciliation.is_cancelled
+
+    def test_status_returns_status_of_sync_process_in_external_mode(self):
+        status_info = {'status': {'id1': {'is_busy': True}}, 'sync_process': {'pid': 123}}
+
+        with mock.patch.dict(CONFIG_DICT, {'SYNC_MODE': 'external'}), mock.patch(
+                'service.status.read_status_file', return_value=status_info
+        ), mock.patch('service.sync_manager.get_index_updaters') as mock_get_index_updaters:
+            response = app.test_client().get('/status')
+
+        assert json.loads(response.data.decode()) == status_info
+        assert not mock_get_index_updaters.called
+
+    def test_status_returns_503_when_sync_process_has_not_reported(self):
+        with mock.patch.dict(CONFIG_DICT, {'SYNC_MODE': 'external'}), mock.patch(
+                'service.status.read_status_file', return_value=None):
+            response = app.test_client().get('/status')
+
+        assert response.status_code == 503
+
+    @mock.patch('service.sync_process.send_command')
+    def test_reconciliation_is_passed_on_to_sync_process_in_external_mode(self, mock_send_command):
+        config = {'SYNC_MODE': 'external', 'ADMIN_TOKEN': 'secret'}
+
+        with mock.patch.dict(CONFIG_DICT, config), mock.patch(
+                'service.sync_manager.get_index_updater_config', return_value={'id1': {}}):
+            response = app.test_client().post(
+                '/reconciliation/id1?repair=false', headers={'X-Admin-Token': 'secret'}
+            )
+
+        assert response.status_code == 202
+        mock_send_command.assert_called_once_with(
+            'start_reconciliation', updater_id='id1', repair=False
+        )
+
+    @mock.patch('service.sync_manager.enqueue_resync')
+    def test_resync_queues_resync_of_selected_titles(self, mock_enqueue_resync):
+        mock_index_updater = mock.MagicMock()
+        mock_index_updater.id = 'id1'
+        selector = {'title_numbers': ['TTL1', 'TTL2']}
+        mock_enqueue_resync.return_value = [resync.ResyncJob('id1', selector)]
+
+        with mock.patch.dict(CONFIG_DICT, {'ADMIN_TOKEN': 'secret'}), mock.patch(
+                'service.sync_manager.get_index_updaters', return_value=[mock_index_updater]):
+            response = app.test_client().post(
+                '/resync', headers={'X-Admin-Token': 'secret'},
+                data=json.dumps(dict(selector, updaters=['id1'])),
+            )
+
+        assert response.status_code == 202
+        assert json.loads(response.data.decode())['id1']['state'] == 'pending'
+        mock_enqueue_resync.assert_called_once_with(['id1'], selector)
+
+    def test_resync_returns_400_when_selector_invalid(self):
+        mock_index_updater = mock.MagicMock()
+        mock_index_updater.id = 'id1'
+        request_body = {
+            'updaters': ['id1'],
+            'title_numbers': ['TTL1'],
+            'title_number_range': {'from': 'TTL1', 'to': 'TTL2'},
+        }
+
+        with mock.patch.dict(CONFIG_DICT, {'ADMIN_TOKEN': 'secret'}), mock.patch(
+                'service.sync_manager.get_index_updaters', return_value=[mock_index_updater]):
+            response = app.test_client().post(
+                '/resync', headers={'X-Admin-Token': 'secret'}, data=json.dumps(request_body)
+            )
+
+        assert response.status_code == 400
+        assert 'Exactly one of' in json.loads(response.data.decode())['error']
+
+    def test_resync_returns_404_when_updater_unknown(self):
+        with mock.patch.dict(CONFIG_DICT, {'ADMIN_TOKEN': 'secret'}), mock.patch(
+                'service.sync_manager.get_index_updaters', return_value=[]):
+            response = app.test_client().post(
+                '/resync', headers={'X-Admin-Token': 'secret'},
+                data=json.dumps({'updaters': ['id1'], 'title_numbers': ['TTL1']}),
+            )
+
+        assert response.status_code == 404
+
+    @mock.patch('service.sync_process.send_command')
+    def test_resync_is_passed_on_to_sync_process_in_external_mode(self, mock_send_command):
+        config = {'SYNC_MODE': 'external', 'ADMIN_TOKEN': 'secret'}
+        selector = {
+            'modified_window': {'from': '2015-04-20T00:00:00', 'to': '2015-04-21T00:00:00'}
+        }
+
+        with mock.patch.dict(CONFIG_DICT, config), mock.patch(
+                'service.sync_manager.get_index_updater_config', return_value={'id1': {}}):
+            response = app.test_client().post(
+                '/resync', headers={'X-Admin-Token': 'secret'},
+                data=json.dumps(dict(selector, updaters=['id1'])),
+            )
+
+        assert response.status_code == 202
+        mock_send_command.assert_called_once_with(
+            'enqueue_resync', updater_ids=['id1'], selector=selector
+        )
+
+    def test_metrics_returns_freshness_histograms_in_prometheus_format(self):
+        snapshot = {'id1': {
+            name: freshness.Histogram().to_dict() for name in [freshness.TOTAL] + freshness.STAGES
+        }}
+
+        with mock.patch('service.freshness.get_snapshot', return_value=snapshot):
+            response = app.test_client().get('/metrics')
+
+        assert response.status_code == 200
+        assert response.content_type == 'text/plain; version=0.0.4'
+        assert 'sync_freshness_seconds_count{updater="id1"} 0' in response.data.decode()
+
+    def test_metrics_returns_histograms_of_sync_process_in_external_mode(self):
+        with mock.patch.dict(CONFIG_DICT, {'SYNC_MODE': 'external'}), mock.patch(
+                'service.status.read_freshness_snapshot_file', return_value={}
+        ), mock.patch('service.freshness.get_snapshot') as mock_get_snapshot:
+            response = app.test_client().get('/metrics')
+
+        assert response.status_code == 200
+        assert not mock_get_snapshot.called
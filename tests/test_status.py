@@ -0,0 +1,41 @@
+import json
+import os
+import mock
+from config import CONFIG_DICT
+from service import status
+
+
+class TestStatus:
+
+    def test_read_status_file_returns_written_status_with_sync_process_details(self, tmpdir):
+        file_path = str(tmpdir.join('status.json'))
+
+        status.write_status_file({'status': {'id1': {'is_busy': True}}}, file_path)
+        result = status.read_status_file(file_path)
+
+        assert result['status'] == {'id1': {'is_busy': True}}
+        assert result['sync_process']['pid'] == os.getpid()
+        assert not result['sync_process']['is_stalled']
+        assert os.listdir(str(tmpdir)) == ['status.json']
+
+    def test_read_status_file_returns_none_when_no_file(self, tmpdir):
+        assert status.read_status_file(str(tmpdir.join('status.json'))) is None
+
+    def test_read_status_file_reports_stalled_sync_process(self, tmpdir):
+        file_path = tmpdir.join('status.json')
+        file_path.write(json.dumps({'written_at': 1000.0, 'pid': 123, 'status': {}}))
+
+        with mock.patch('time.time', return_value=1000.0 + 100):
+            with mock.patch.dict(CONFIG_DICT, {'SYNC_STATUS_INTERVAL_SECS': 5}):
+                result = status.read_status_file(str(file_path))
+
+        assert result['sync_process'] == {'pid': 123, 'status_age_secs': 100.0, 'is_stalled': True}
+
+    def test_read_freshness_snapshot_file_returns_written_histograms(self, tmpdir):
+        file_path = str(tmpdir.join('status.json'))
+        snapshot = {'id1': {'total': {'bucket_counts': [1], 'count': 1, 'sum': 2.0, 'max': 2.0}}}
+
+        status.write_status_file({'status': {}}, file_path, freshness_snapshot=snapshot)
+
+        assert status.read_freshness_snapshot_file(file_path) == snapshot
+        assert status.read_freshness_snapshot_file(str(tmpdir.join('other.json'))) is None
@@ -0,0 +1,150 @@
+import threading
+import mock
+import pytest
+from service import id_filter, synchroniser, sync_manager
+
+
+@pytest.fixture
+def stop_mocks():
+    updater = mock.MagicMock(id='updater1', index_name='index1', write_targets=[])
+
+    with mock.patch.object(sync_manager, '_is_stopped', False), \
+            mock.patch.object(sync_manager, '_index_updaters', [updater]), \
+            mock.patch.object(sync_manager, '_updater_statuses',
+                              {'updater1': sync_manager.UPDATER_STATUS_IDLE}), \
+            mock.patch.dict(sync_manager._sync_threads, clear=True), \
+            mock.patch.object(sync_manager, 'scheduler') as mock_scheduler, \
+            mock.patch.object(sync_manager, 'db') as mock_db, \
+            mock.patch('service.es_utils.refresh_index') as mock_refresh_index, \
+            mock.patch('service.es_utils.close_clients') as mock_close_clients, \
+            mock.patch('service.recorder.close'):
+        yield {
+            'updater': updater,
+            'scheduler': mock_scheduler,
+            'db': mock_db,
+            'refresh_index': mock_refresh_index,
+            'close_clients': mock_close_clients,
+        }
+
+    synchroniser._stop_requested.clear()
+
+
+def _start_sync_thread(updater, stop_on_request=True):
+    """Sync thread that stays busy until a stop is requested, or forever"""
+    never_stops = threading.Event()
+
+    def synchronise(index_updater):
+        if stop_on_request:
+            while not synchroniser.is_stop_requested():
+                never_stops.wait(0.01)
+        else:
+            never_stops.wait(5)
+
+    sync_manager._update_index_updater_status(updater, busy=True)
+    thread = threading.Thread(
+        target=sync_manager._synchronise_index_with_source, args=(updater, synchronise)
+    )
+    thread.daemon = True
+    sync_manager._sync_threads[updater.id] = thread
+    thread.start()
+    return never_stops
+
+
+class TestSyncManagerStop:
+
+    def test_stop_waits_for_sync_to_stop_then_flushes_and_closes_pools(self, stop_mocks):
+        _start_sync_thread(stop_mocks['updater'])
+
+        assert sync_manager.stop(timeout_secs=5) is True
+
+        stop_mocks['scheduler'].shutdown.assert_called_once_with(wait=False)
+        assert not sync_manager.is_index_updater_busy(stop_mocks['updater'])
+        stop_mocks['refresh_index'].assert_called_once_with('index1', None)
+        stop_mocks['db'].dispose.assert_called_once_with()
+        stop_mocks['close_clients'].assert_called_once_with()
+
+    def test_stop_gives_up_on_sync_not_stopping_in_time(self, stop_mocks):
+        never_stops = _start_sync_thread(stop_mocks['updater'], stop_on_request=False)
+
+        try:
+            assert sync_manager.stop(timeout_secs=0.1) is False
+        finally:
+            never_stops.set()
+
+        # the index of an updater still writing isn't flushed
+        assert stop_mocks['refresh_index'].mock_calls == []
+        stop_mocks['db'].dispose.assert_called_once_with()
+
+    def test_stop_closes_write_targets_once_their_pages_are_written(self, stop_mocks):
+        write_target = mock.MagicMock(index_name='index2', client=None)
+        stop_mocks['updater'].write_targets = [write_target]
+
+        sync_manager.stop(timeout_secs=0)
+
+        write_target.close.assert_called_once_with(wait=True)
+
+    def test_stop_only_stops_once(self, stop_mocks):
+        sync_manager.stop(timeout_secs=0)
+        sync_manager.stop(timeout_secs=0)
+
+        stop_mocks['db'].dispose.assert_called_once_with()
+
+
+class TestSyncManagerLeases:
+
+    def test_taking_over_busy_updater_fails_without_reloading_its_status(self, stop_mocks):
+        updater = stop_mocks['updater']
+        sync_manager._update_index_updater_status(updater, busy=True)
+
+        with mock.patch.object(sync_manager, '_prepare_index_updater_for_use') as mock_prepare:
+            with pytest.raises(Exception):
+                sync_manager._prepare_index_updater_with_id_for_use('updater1')
+
+        assert mock_prepare.mock_calls == []
+
+    def test_taking_over_idle_updater_reloads_its_status(self, stop_mocks):
+        with mock.patch.object(sync_manager, '_prepare_index_updater_for_use') as mock_prepare:
+            sync_manager._prepare_index_updater_with_id_for_use('updater1')
+
+        mock_prepare.assert_called_once_with(stop_mocks['updater'])
+
+    @mock.patch.object(id_filter, 'build_filter')
+    @mock.patch('service.quarantine.is_enabled', return_value=False)
+    @mock.patch('service.es_status_loader.load_index_updater_status')
+    @mock.patch.object(sync_manager, '_ensure_mapping_exists')
+    def test_taking_over_updater_drops_its_id_filter_without_building_it(
+            self, mock_ensure_mapping, mock_load_status, mock_is_enabled, mock_build_filter,
+            stop_mocks):
+        stop_mocks['updater'].dual_lanes = False
+
+        with mock.patch.dict(id_filter._filters_by_updater, {'updater1': mock.MagicMock()}):
+            sync_manager._prepare_index_updater_with_id_for_use('updater1')
+
+            assert id_filter.get_filter('updater1') is None
+
+        mock_load_status.assert_called_once_with(stop_mocks['updater'])
+        # it's built by the updater's next synchronisation, outside the lease refresh
+        assert mock_build_filter.mock_calls == []
+
+
+class TestSyncManagerQueryPlans:
+
+    def test_check_page_query_plans_explains_page_queries_on_every_read_source(self):
+        primary_engine = mock.MagicMock()
+        replica_engine = mock.MagicMock()
+
+        with mock.patch('service.database.read_source.get_source_engines',
+                        return_value=[('primary', primary_engine), ('replica', replica_engine)]), \
+                mock.patch('service.database.indexes.get_source_filters', return_value=[]), \
+                mock.patch('service.database.page_reader.get_page_query_plan',
+                           return_value=[{'Plan': {}}]) as mock_get_plan, \
+                mock.patch('service.database.page_reader.uses_index_range_scan',
+                           side_effect=[True, False]), \
+                mock.patch.object(sync_manager, 'LOGGER') as mock_logger:
+            sync_manager._check_page_query_plans([])
+
+        assert mock_get_plan.mock_calls == [
+            mock.call(None, primary_engine), mock.call(None, replica_engine)
+        ]
+        [warning_call] = mock_logger.warning.mock_calls
+        assert "database: 'replica'" in warning_call[1][0]
@@ -0,0 +1,137 @@
+import os
+import sys
+import time
+import mock
+from config import CONFIG_DICT
+from service import sync_process, sync_supervisor
+
+
+class TestSyncProcess:
+
+    def test_process_pending_commands_runs_commands_in_order_and_removes_them(self, tmpdir):
+        with mock.patch.dict(CONFIG_DICT, {'SYNC_COMMAND_DIR': str(tmpdir)}):
+            sync_process.send_command(
+                sync_process.START_RECONCILIATION_COMMAND, updater_id='id1', repair=False
+            )
+            sync_process.send_command(sync_process.CANCEL_RECONCILIATION_COMMAND, updater_id='id1')
+            mock_reconciliation = mock.MagicMock()
+
+            with mock.patch(
+                    'service.sync_manager.start_reconciliation') as mock_start_reconciliation, \
+                    mock.patch('service.sync_manager.get_reconciliation',
+                               return_value=mock_reconciliation):
+                sync_process.process_pending_commands()
+
+        mock_start_reconciliation.assert_called_once_with(updater_id='id1', repair=False)
+        mock_reconciliation.cancel.assert_called_once_with()
+        assert os.listdir(str(tmpdir)) == []
+
+    def test_process_pending_commands_removes_commands_that_fail(self, tmpdir):
+        with mock.patch.dict(CONFIG_DICT, {'SYNC_COMMAND_DIR': str(tmpdir)}):
+            sync_process.send_command('unknown_command')
+            sync_process.process_pending_commands()
+
+        assert os.listdir(str(tmpdir)) == []
+
+    def test_process_pending_commands_leaves_commands_with_other_names(self, tmpdir):
+        with mock.patch.dict(CONFIG_DICT, {'SYNC_COMMAND_DIR': str(tmpdir)}):
+            sync_process.send_command(sync_process.CANCEL_RECONCILIATION_COMMAND, updater_id='id1')
+            sync_process.send_command(sync_process.SUSPEND_ID_FILTERS_COMMAND, updater_ids=['id1'])
+
+            with mock.patch('service.id_filter.suspend_filters') as mock_suspend_filters, \
+                    mock.patch('service.sync_manager.get_reconciliation') \
+                    as mock_get_reconciliation:
+                sync_process.process_pending_commands(sync_process.ID_FILTER_COMMANDS)
+
+        mock_suspend_filters.assert_called_once_with(updater_ids=['id1'])
+        assert not mock_get_reconciliation.called
+        assert len(os.listdir(str(tmpdir))) == 1
+
+    def test_suspend_id_filters_waits_for_sync_process_to_suspend_them(self, tmpdir):
+        config = {'SYNC_COMMAND_DIR': str(tmpdir), 'SYNC_MODE': 'external',
+                  'DELETE_FILTER_ENABLED': True, 'SYNC_STATUS_INTERVAL_SECS': 5}
+
+        def process_command(command_file_path, timeout_secs):
+            sync_process.process_pending_commands()
+            return True
+
+        with mock.patch.dict(CONFIG_DICT, config), \
+                mock.patch('service.id_filter.suspend_filters') as mock_suspend_filters, \
+                mock.patch('service.id_filter.resume_filters') as mock_resume_filters:
+            with mock.patch.object(sync_process, 'wait_for_command',
+                                   side_effect=process_command) as mock_wait_for_command:
+                with sync_process.suspend_id_filters(['id1']):
+                    mock_suspend_filters.assert_called_once_with(updater_ids=['id1'])
+                    assert not mock_resume_filters.called
+
+            sync_process.process_pending_commands()
+
+        assert mock_wait_for_command.call_args[0][1] == 15
+        mock_resume_filters.assert_called_once_with(updater_ids=['id1'])
+        assert os.listdir(str(tmpdir)) == []
+
+    def test_suspend_id_filters_sends_nothing_without_sync_process(self, tmpdir):
+        config = {'SYNC_COMMAND_DIR': str(tmpdir), 'SYNC_MODE': 'embedded',
+                  'DELETE_FILTER_ENABLED': True}
+
+        with mock.patch.dict(CONFIG_DICT, config):
+            with sync_process.suspend_id_filters(['id1']):
+                pass
+
+        assert os.listdir(str(tmpdir)) == []
+
+    def test_wait_for_command_times_out_while_command_is_pending(self, tmpdir):
+        with mock.patch.dict(CONFIG_DICT, {'SYNC_COMMAND_DIR': str(tmpdir)}):
+            command_file_path = sync_process.send_command(
+                sync_process.SUSPEND_ID_FILTERS_COMMAND, updater_ids=['id1']
+            )
+
+        assert not sync_process.wait_for_command(command_file_path, 0)
+        os.unlink(command_file_path)
+        assert sync_process.wait_for_command(command_file_path, 0)
+
+    def test_run_writes_status_until_stopped(self):
+        stop_event = mock.MagicMock()
+        stop_event.is_set.side_effect = [False, True]
+
+        with mock.patch('service.sync_manager.start') as mock_start, \
+                mock.patch('service.sync_manager.stop') as mock_stop, \
+                mock.patch('service.status.get_sync_status', return_value={'status': {}}), \
+                mock.patch('service.status.write_status_file') as mock_write_status_file, \
+                mock.patch('service.freshness.get_snapshot', return_value={'id1': {}}), \
+                mock.patch('service.sync_process.process_pending_commands'):
+            sync_process.run(stop_event)
+
+        mock_start.assert_called_once_with()
+        mock_write_status_file.assert_called_once_with(
+            {'status': {}}, freshness_snapshot={'id1': {}}
+        )
+        mock_stop.assert_called_once_with()
+
+
+class TestSyncProcessSupervisor:
+
+    def test_supervisor_restarts_process_that_exits(self):
+        supervisor = sync_supervisor.SyncProcessSupervisor([sys.executable, '-c', 'pass'])
+
+        with mock.patch.dict(CONFIG_DICT, {'SYNC_PROCESS_RESTART_DELAY_SECS': 0}):
+            supervisor.start()
+            first_pid = supervisor.pid
+            deadline = time.monotonic() + 10
+
+            while supervisor.pid == first_pid and time.monotonic() < deadline:
+                time.sleep(0.01)
+
+            supervisor.stop()
+
+        assert supervisor.pid != first_pid
+
+    def test_stop_terminates_running_process(self):
+        supervisor = sync_supervisor.SyncProcessSupervisor(
+            [sys.executable, '-c', 'import time; time.sleep(60)']
+        )
+        supervisor.start()
+
+        supervisor.stop(timeout_secs=10)
+
+        assert supervisor._process.poll() is not None
@@ -3,9 +3,10 @@ from datetime import datetime
 from mock import MagicMock, call
 import mock
 import pytest
+import tracemalloc
 from config import CONFIG_DICT
 from freezegun import freeze_time
-from service import synchroniser
+from service import bulk_backpressure, es_utils, synchroniser
 
 MockTitleRegisterData = namedtuple(
     "TitleRegisterData", ['title_number', 'register_data', 'last_modified', 'is_deleted']
@@ -15,10 +16,37 @@ FROZEN_NOW_STRING = '2015-04-30 12:34:56'
 FROZEN_NOW = datetime(2015, 4, 30, 12, 34, 56)
 
 
+def _execute_actions(actions):
+    """Consumes the streamed actions, like the bulk helper does, and remembers them"""
+    executed_actions = list(actions)
+    _execute_actions.executed_action_lists.append(executed_actions)
+    return len(executed_actions), []
+
+
+_execute_actions.executed_action_lists = []
+
+
+def _create_mock_updater():
+    mock_updater = MagicMock()
+    mock_updater.dual_lanes = False
+    return mock_updater
+
+
+@pytest.fixture(autouse=True)
+def reset_executed_actions():
+    _execute_actions.executed_action_lists = []
+
+
+@pytest.fixture(autouse=True)
+def clear_stop_request():
+    yield
+    synchroniser._stop_requested.clear()
+
+
 class TestSynchroniser:
 
     @freeze_time(FROZEN_NOW_STRING)
-    @mock.patch('service.es_utils.execute_elasticsearch_actions', return_value=(1, []))
+    @mock.patch('service.es_utils.execute_elasticsearch_actions', side_effect=_execute_actions)
     def test_synchronise_index_with_source_uses_updater_correctly(self, mock_execute_es_actions):
         last_title_number = 'TTL123'
         last_modified_datetime = datetime(2015, 5, 10, 11, 12, 13)
@@ -30,7 +58,7 @@ class TestSynchroniser:
         elasticsearch_action_1 = [{'update': 'action1'}]
         elasticsearch_action_2 = [{'update': 'action2'}]
 
-        mock_updater = MagicMock()
+        mock_updater = _create_mock_updater()
 
         mock_updater.get_next_source_data_page.return_value = data_page
         mock_updater.prepare_elasticsearch_actions.side_effect = [
@@ -48,15 +76,16 @@ class TestSynchroniser:
         assert mock_updater.last_updated_title_number == last_title_number
         assert mock_updater.last_successful_sync_time == FROZEN_NOW
 
-        mock_execute_es_actions.assert_called_once_with(
+        assert len(mock_execute_es_actions.mock_calls) == 1
+        assert _execute_actions.executed_action_lists == [
             [elasticsearch_action_1, elasticsearch_action_2]
-        )
+        ]
 
     @mock.patch('service.es_status_loader.load_index_updater_status')
     def test_synchronise_index_calls_status_loader_when_updater_has_no_status(
             self, mock_load_index_updater_status):
 
-        mock_updater = MagicMock()
+        mock_updater = _create_mock_updater()
         mock_updater.last_title_modification_date = None
         synchroniser.synchronise_index_with_source(mock_updater)
         mock_load_index_updater_status.assert_called_once_with(mock_updater)
@@ -65,7 +94,7 @@ class TestSynchroniser:
     def test_synchronise_index_does_not_call_status_loader_when_updater_has_status(
             self, mock_load_index_updater_status):
 
-        mock_updater = MagicMock()
+        mock_updater = _create_mock_updater()
         mock_updater.last_title_modification_date = datetime.now()
         synchroniser.synchronise_index_with_source(mock_updater)
         assert mock_load_index_updater_status.mock_calls == []
@@ -75,7 +104,7 @@ class TestSynchroniser:
                 'service.es_status_loader.load_index_updater_status',
                 side_effect=Exception('Intentionally raised test exception')
         ):
-            mock_updater = MagicMock()
+            mock_updater = _create_mock_updater()
             mock_updater.last_title_modification_date = None
 
             synchroniser.synchronise_index_with_source(mock_updater)
@@ -84,7 +113,7 @@ class TestSynchroniser:
             assert mock_updater.get_next_source_data_page.mock_calls == []
 
     @freeze_time(FROZEN_NOW_STRING)
-    @mock.patch('service.es_utils.execute_elasticsearch_actions', return_value=(1, []))
+    @mock.patch('service.es_utils.execute_elasticsearch_actions', side_effect=_execute_actions)
     def test_synchronise_index_with_source_repeats_until_no_source_data_present(
             self, mock_execute_es_actions):
 
@@ -98,7 +127,7 @@ class TestSynchroniser:
             last_title_number, {'register': 'data3'}, last_modified_datetime, False
         )
 
-        mock_updater = MagicMock()
+        mock_updater = _create_mock_updater()
 
         mock_updater.get_next_source_data_page.side_effect = [[title1, title2], [title3]]
         mock_updater.prepare_elasticsearch_actions.return_value = [{'update': 'action1'}]
@@ -114,8 +143,59 @@ class TestSynchroniser:
         assert mock_updater.last_successful_sync_time == FROZEN_NOW
         assert len(mock_execute_es_actions.mock_calls) == 2
 
+    @mock.patch('service.es_utils.execute_elasticsearch_actions', side_effect=_execute_actions)
+    def test_synchronise_index_with_source_stops_after_page_when_stop_requested(
+            self, mock_execute_es_actions):
+        synchroniser.page_size = 1
+        title1 = MockTitleRegisterData('TTL1', {'register': 'data1'}, datetime(2015, 4, 20), False)
+        title2 = MockTitleRegisterData('TTL2', {'register': 'data2'}, datetime(2015, 4, 21), False)
+
+        def prepare_elasticsearch_actions(title):
+            # the stop comes while the first page is being written
+            synchroniser.request_stop()
+            return [{'update': title.title_number}]
+
+        mock_updater = _create_mock_updater()
+        mock_updater.get_next_source_data_page.side_effect = [[title1], [title2]]
+        mock_updater.prepare_elasticsearch_actions.side_effect = prepare_elasticsearch_actions
+
+        synchroniser.synchronise_index_with_source(mock_updater)
+
+        assert len(mock_updater.get_next_source_data_page.mock_calls) == 1
+        assert _execute_actions.executed_action_lists == [[{'update': 'TTL1'}]]
+        assert mock_updater.last_updated_title_number == 'TTL1'
+
+    @mock.patch('service.es_utils.execute_elasticsearch_actions', side_effect=_execute_actions)
+    def test_synchronise_index_with_source_stops_when_lease_lost(self, mock_execute_es_actions):
+        synchroniser.page_size = 1
+        title1 = MockTitleRegisterData('TTL1', {'register': 'data1'}, datetime(2015, 4, 20), False)
+        title2 = MockTitleRegisterData('TTL2', {'register': 'data2'}, datetime(2015, 4, 21), False)
+        lease_checks = iter([True, False])
+
+        mock_updater = _create_mock_updater()
+        mock_updater.id = 'updater1'
+        mock_updater.get_next_source_data_page.side_effect = [[title1], [title2]]
+        mock_updater.prepare_elasticsearch_actions.side_effect = lambda title: [
+            {'update': title.title_number}
+        ]
+
+        with mock.patch.object(synchroniser, '_lease_check',
+                               side_effect=lambda updater_id: next(lease_checks)):
+            synchroniser.synchronise_index_with_source(mock_updater)
+
+        assert _execute_actions.executed_action_lists == [[{'update': 'TTL1'}]]
+        assert mock_updater.last_updated_title_number == 'TTL1'
+
+    def test_synchronise_index_with_source_does_nothing_once_stop_requested(self):
+        mock_updater = _create_mock_updater()
+        synchroniser.request_stop()
+
+        synchroniser.synchronise_index_with_source(mock_updater)
+
+        assert mock_updater.get_next_source_data_page.mock_calls == []
+
     @freeze_time(FROZEN_NOW_STRING)
-    @mock.patch('service.es_utils.execute_elasticsearch_actions', return_value=(1, []))
+    @mock.patch('service.es_utils.execute_elasticsearch_actions', side_effect=_execute_actions)
     def test_synchronise_index_stops_when_updater_fails(self, mock_execute_es_actions):
         synchroniser.page_size = 1
         last_modified_datetime = datetime(2015, 5, 10, 11, 12, 13)
@@ -124,7 +204,7 @@ class TestSynchroniser:
         title1 = MockTitleRegisterData('TTL1', {'register': 'data1'}, datetime.now(), False)
         title2 = MockTitleRegisterData('TTL2', {'register': 'data2'}, datetime.now(), False)
 
-        mock_updater = MagicMock()
+        mock_updater = _create_mock_updater()
 
         mock_updater.get_next_source_data_page.side_effect = [[title1], [title2]]
         mock_updater.prepare_elasticsearch_actions.side_effect = Exception(
@@ -146,4 +226,214 @@ class TestSynchroniser:
         assert not mock_updater.last_successful_sync_time
         assert mock_updater.last_unsuccessful_sync_time == FROZEN_NOW
 
-        assert mock_execute_es_actions.mock_calls == []
+        # nothing has been sent, as the failure happened while preparing the first chunk
+        assert _execute_actions.executed_action_lists == []
+
+
+def _generate_titles(count):
+    for number in range(count):
+        address_string = '{} high street, plymouth (PL{} 1AB)'.format(number, number % 20)
+        yield MockTitleRegisterData(
+            'TTL{:07d}'.format(number),
+            {'address': {'address_string': address_string}},
+            datetime(2015, 4, 20, 12, 23, 34, number),
+            False,
+        )
+
+
+def _perform_bulk_request(method, url, params=None, body=None):
+    # every action in the test is an update, made of an action line and a document line
+    action_count = body.count('\n') // 2
+    return 200, {'items': [{'update': {'status': 200}} for _ in range(action_count)]}
+
+
+class TestSynchroniserMemory:
+
+    def _measure_peak_memory(self, page_size):
+        from service.updaters.property_by_address_updater_v1 import PropertyByAddressUpdaterV1
+
+        synchroniser.page_size = page_size
+        updater = PropertyByAddressUpdaterV1('index', 'doctype')
+        updater.id = 'updater1'
+        updater.last_title_modification_date = datetime(2015, 1, 1)
+        updater.last_updated_title_number = ''
+
+        tracemalloc.start()
+        try:
+            with mock.patch.object(
+                    updater, 'get_next_source_data_page',
+                    side_effect=[_generate_titles(page_size), iter([])]
+            ), mock.patch.object(
+                # not a mock, which would keep every request body in its call list
+                es_utils.elasticsearch_client.transport, 'perform_request',
+                new=_perform_bulk_request
+            ), mock.patch.dict(
+                CONFIG_DICT, {'BULK_CHUNK_SIZE': 100, 'BULK_MAX_CHUNK_SIZE': 100}
+            ), mock.patch.dict(bulk_backpressure._budgets_by_client, clear=True):
+                synchroniser.synchronise_index_with_source(updater)
+
+            return tracemalloc.get_traced_memory()[1]
+        finally:
+            tracemalloc.stop()
+            assert updater.last_updated_title_number == 'TTL{:07d}'.format(page_size - 1)
+
+    def test_peak_memory_does_not_grow_with_page_size(self):
+        small_page_peak = self._measure_peak_memory(500)
+        large_page_peak = self._measure_peak_memory(5000)
+
+        assert large_page_peak < small_page_peak * 1.5
+
+
+class TestSynchroniserWriteTargets:
+
+    def _create_updater(self, write_targets):
+        mock_updater = _create_mock_updater()
+        mock_updater.write_targets = write_targets
+        mock_updater.max_target_lag_pages = 2
+        mock_updater.last_title_modification_date = datetime(2015, 4, 1)
+        mock_updater.last_updated_title_number = 'TTL0'
+        return mock_updater
+
+    def _create_write_target(self, last_modified, last_title_number):
+        from service.write_target import WriteTarget
+
+        write_target = WriteTarget('index', 'doctype')
+        write_target.last_title_modification_date = last_modified
+        write_target.last_updated_title_number = last_title_number
+        return write_target
+
+    @mock.patch('service.es_utils.execute_elasticsearch_actions')
+    def test_synchronise_index_with_source_writes_actions_built_once_to_all_targets(
+            self, mock_execute_es_actions):
+
+        executed_action_lists = []
+        mock_execute_es_actions.side_effect = lambda actions, client: (
+            executed_action_lists.append(list(actions)), []
+        )
+        synchroniser.page_size = 10
+        last_modified_datetime = datetime(2015, 5, 10, 11, 12, 13)
+        title = MockTitleRegisterData('TTL1', {'register': 'data'}, last_modified_datetime, False)
+        write_targets = [
+            self._create_write_target(datetime(2015, 4, 1), 'TTL0'),
+            self._create_write_target(datetime(2015, 4, 1), 'TTL0'),
+        ]
+        mock_updater = self._create_updater(write_targets)
+        mock_updater.get_next_source_data_page.return_value = [title]
+        mock_updater.prepare_elasticsearch_actions.return_value = [
+            {'_index': 'index', '_type': 'doctype', '_id': 'id1'}
+        ]
+
+        synchroniser.synchronise_index_with_source(mock_updater)
+
+        assert mock_updater.prepare_elasticsearch_actions.mock_calls == [call(title)]
+        assert len(executed_action_lists) == 2
+        for write_target in write_targets:
+            assert write_target.last_title_modification_date == last_modified_datetime
+            assert write_target.last_updated_title_number == 'TTL1'
+        assert mock_updater.last_updated_title_number == 'TTL1'
+
+    def test_synchronise_index_with_source_rewinds_to_slowest_target_when_target_fails(self):
+        synchroniser.page_size = 1
+        title1 = MockTitleRegisterData('TTL1', {'register': 'data'}, datetime(2015, 5, 1), False)
+        title2 = MockTitleRegisterData('TTL2', {'register': 'data'}, datetime(2015, 5, 2), False)
+        healthy_target = self._create_write_target(datetime(2015, 4, 1), 'TTL0')
+        failing_target = self._create_write_target(datetime(2015, 4, 1), 'TTL0')
+        mock_updater = self._create_updater([healthy_target, failing_target])
+        mock_updater.get_next_source_data_page.side_effect = [[title1], [title2], []]
+        mock_updater.prepare_elasticsearch_actions.return_value = []
+
+        def execute(actions, client):
+            list(actions)
+            if execute.calls_by_target.setdefault(client, 0) and client is failing_target.client:
+                raise Exception('Intentionally raised test exception')
+            execute.calls_by_target[client] += 1
+            return 0, []
+
+        execute.calls_by_target = {}
+        failing_target.client = mock.MagicMock()
+
+        with mock.patch('service.es_utils.execute_elasticsearch_actions', side_effect=execute):
+            synchroniser.synchronise_index_with_source(mock_updater)
+
+        assert healthy_target.last_updated_title_number == 'TTL2'
+        assert failing_target.last_updated_title_number == 'TTL1'
+        assert mock_updater.last_updated_title_number == 'TTL1'
+        assert mock_updater.last_title_modification_date == datetime(2015, 5, 1)
+
+
+class TestSynchroniserDualLanes:
+
+    def _create_updater(self, last_modified, last_title_number):
+        mock_updater = _create_mock_updater()
+        mock_updater.dual_lanes = True
+        mock_updater.backfill_threshold_secs = 3600
+        mock_updater.backfill_lane = None
+        mock_updater.last_title_modification_date = last_modified
+        mock_updater.last_updated_title_number = last_title_number
+        mock_updater.prepare_elasticsearch_actions.return_value = []
+        return mock_updater
+
+    @freeze_time(FROZEN_NOW_STRING)
+    @mock.patch('service.backfill_lane.delete_backfill_lane')
+    @mock.patch('service.backfill_lane.save_backfill_lane')
+    @mock.patch('service.es_utils.execute_elasticsearch_actions', side_effect=_execute_actions)
+    def test_synchronise_index_with_source_backfills_behind_live_lane_when_far_behind(
+            self, mock_execute_es_actions, mock_save_lane, mock_delete_lane):
+
+        synchroniser.page_size = 1
+        backfill_title = MockTitleRegisterData('TTL1', {}, datetime(2015, 1, 1), False)
+        live_title = MockTitleRegisterData('TTL20', {}, datetime(2015, 4, 30, 12), False)
+        mock_updater = self._create_updater(datetime(2014, 12, 1), 'TTL0')
+        mock_updater.get_latest_source_position.return_value = (datetime(2015, 4, 30), 'TTL10')
+        read_pages = []
+
+        def get_next_source_data_page(page_size, lane=None):
+            read_pages.append('backfill' if lane else 'live')
+            pages = {
+                'live': {'TTL10': [live_title], 'TTL20': []},
+                'backfill': {'TTL0': [backfill_title], 'TTL1': []},
+            }
+            position = lane or mock_updater
+            return pages[read_pages[-1]][position.last_updated_title_number]
+
+        mock_updater.get_next_source_data_page.side_effect = get_next_source_data_page
+
+        synchroniser.synchronise_index_with_source(mock_updater)
+
+        assert read_pages == ['live', 'live', 'backfill', 'live', 'backfill', 'live']
+        assert mock_updater.prepare_elasticsearch_actions.mock_calls == [
+            call(live_title), call(backfill_title)
+        ]
+        assert mock_save_lane.mock_calls == [call(mock_updater), call(mock_updater)]
+        mock_delete_lane.assert_called_once_with(mock_updater)
+        assert mock_updater.backfill_lane is None
+        assert mock_updater.last_updated_title_number == 'TTL20'
+        assert mock_updater.last_title_modification_date == datetime(2015, 4, 30, 12)
+
+    @freeze_time(FROZEN_NOW_STRING)
+    @mock.patch('service.backfill_lane.save_backfill_lane')
+    @mock.patch('service.es_utils.execute_elasticsearch_actions', side_effect=_execute_actions)
+    def test_synchronise_index_with_source_starts_no_backfill_when_not_far_behind(
+            self, mock_execute_es_actions, mock_save_lane):
+
+        mock_updater = self._create_updater(datetime(2015, 4, 30, 12), 'TTL0')
+        mock_updater.get_next_source_data_page.return_value = []
+
+        synchroniser.synchronise_index_with_source(mock_updater)
+
+        assert mock_updater.get_latest_source_position.mock_calls == []
+        assert mock_save_lane.mock_calls == []
+        assert mock_updater.backfill_lane is None
+
+    def test_skip_to_backfill_high_water_mark_moves_cursor_behind_the_mark(self):
+        from service.backfill_lane import BackfillLane
+
+        mock_updater = self._create_updater(datetime(2015, 1, 1), 'TTL1')
+        mock_updater.backfill_lane = BackfillLane(
+            datetime(2014, 1, 1), 'TTL0', datetime(2015, 4, 30), 'TTL10'
+        )
+
+        synchroniser.skip_to_backfill_high_water_mark(mock_updater)
+
+        assert mock_updater.last_title_modification_date == datetime(2015, 4, 30)
+        assert mock_updater.last_updated_title_number == 'TTL10'
@@ -0,0 +1,82 @@
+from collections import namedtuple
+from datetime import datetime
+import mock
+import pytest
+from service.updaters import base
+from service.updaters.property_by_address_updater_v1 import PropertyByAddressUpdaterV1
+
+MockTitleRegisterData = namedtuple(
+    'TitleRegisterData', ['title_number', 'register_data', 'last_modified', 'is_deleted']
+)
+
+
+def _create_titles(count):
+    return [
+        MockTitleRegisterData(
+            'TTL{}'.format(number),
+            {'address': {'address_string': '{} high street'.format(number)}},
+            datetime(2015, 4, 20), False,
+        )
+        for number in range(count)
+    ]
+
+
+class TitleByTitleUpdater(PropertyByAddressUpdaterV1):
+    prepare_page_actions = base.AbstractIndexUpdater.prepare_page_actions
+
+
+class TestUpdatersBase:
+
+    def test_implements_page_actions_tells_apart_overridden_method(self):
+        assert base.implements_page_actions(PropertyByAddressUpdaterV1('index', 'doctype'))
+        assert not base.implements_page_actions(TitleByTitleUpdater('index', 'doctype'))
+        assert not base.implements_page_actions(mock.MagicMock())
+
+    def test_stream_actions_prepares_actions_in_batches_for_updater_with_page_actions(self):
+        updater = PropertyByAddressUpdaterV1('index', 'doctype')
+        titles = _create_titles(5)
+
+        with mock.patch.object(updater, 'prepare_page_actions',
+                               wraps=updater.prepare_page_actions) as mock_page_actions:
+            actions = list(base.stream_actions(updater, iter(titles), batch_size=2))
+
+        assert [len(call[0][0]) for call in mock_page_actions.call_args_list] == [2, 2, 1]
+        assert [action['_id'] for action in actions] == [
+            'TTL{}-{}_HIGH_STREET'.format(number, number) for number in range(5)
+        ]
+
+    def test_stream_actions_prepares_actions_title_by_title_for_other_updaters(self):
+        updater = TitleByTitleUpdater('index', 'doctype')
+        titles = _create_titles(3)
+
+        with mock.patch.object(updater, 'prepare_elasticsearch_actions',
+                               wraps=updater.prepare_elasticsearch_actions) as mock_actions:
+            actions = list(base.stream_actions(updater, titles))
+
+        assert mock_actions.call_count == 3
+        assert len(actions) == 3
+
+    def test_stream_actions_passes_titles_updater_fails_on_to_error_handler(self):
+        titles = _create_titles(4)
+        titles[2] = titles[2]._replace(register_data=None)
+        failed_titles = []
+
+        for updater_class in [PropertyByAddressUpdaterV1, TitleByTitleUpdater]:
+            updater = updater_class('index', 'doctype')
+            actions = list(base.stream_actions(
+                updater, titles, batch_size=2,
+                on_title_error=lambda title, error: failed_titles.append(title.title_number),
+            ))
+
+            assert [action['_id'] for action in actions] == [
+                'TTL0-0_HIGH_STREET', 'TTL1-1_HIGH_STREET', 'TTL3-3_HIGH_STREET'
+            ]
+
+        assert failed_titles == ['TTL2', 'TTL2']
+
+    def test_stream_actions_raises_error_of_title_without_error_handler(self):
+        titles = _create_titles(2)
+        titles[1] = titles[1]._replace(register_data=None)
+
+        with pytest.raises(TypeError):
+            list(base.stream_actions(PropertyByAddressUpdaterV1('index', 'doctype'), titles))
@@ -0,0 +1,93 @@
+from datetime import datetime
+import threading
+import mock
+import pytest
+from service import es_utils
+from service.write_target import WriteTarget, WriteTargetFailedError
+
+
+def _execute_actions(actions, client):
+    return len(list(actions)), []
+
+
+class TestWriteTarget:
+
+    @mock.patch('service.es_utils.execute_elasticsearch_actions')
+    def test_submit_page_writes_actions_retargeted_to_target_index(self, mock_execute):
+        executed_actions = []
+        mock_execute.side_effect = lambda actions, client: (executed_actions.extend(actions), [])
+        write_target = WriteTarget('index2', 'doctype2')
+
+        write_target.submit_page(
+            [{'_index': 'index1', '_type': 'doctype1', '_id': 'id1'}], datetime(2015, 4, 20),
+            'TTL1',
+        )
+        write_target.wait_until_lag_at_most(0)
+
+        assert executed_actions == [{'_index': 'index2', '_type': 'doctype2', '_id': 'id1'}]
+        assert mock_execute.call_args[0][1] is es_utils.elasticsearch_client
+
+    @mock.patch('service.es_utils.execute_elasticsearch_actions', side_effect=_execute_actions)
+    def test_submit_page_moves_checkpoint_once_page_written(self, mock_execute):
+        write_target = WriteTarget('index', 'doctype')
+
+        write_target.submit_page([], datetime(2015, 4, 20), 'TTL1')
+        write_target.submit_page([], datetime(2015, 4, 21), 'TTL2')
+        write_target.wait_until_lag_at_most(0)
+
+        assert write_target.last_title_modification_date == datetime(2015, 4, 21)
+        assert write_target.last_updated_title_number == 'TTL2'
+        assert write_target.pending_page_count == 0
+
+    def test_pages_after_failed_page_are_skipped(self):
+        write_target = WriteTarget('index', 'doctype')
+        write_target.last_updated_title_number = 'TTL0'
+
+        with mock.patch(
+                'service.es_utils.execute_elasticsearch_actions',
+                side_effect=[Exception('Intentionally raised test exception'), (1, [])]
+        ) as mock_execute:
+            write_target.submit_page([], datetime(2015, 4, 20), 'TTL1')
+            write_target.submit_page([], datetime(2015, 4, 21), 'TTL2')
+
+            with pytest.raises(Exception):
+                write_target.wait_until_lag_at_most(0)
+            with pytest.raises(WriteTargetFailedError):
+                write_target.wait_until_lag_at_most(0)
+
+        assert len(mock_execute.mock_calls) == 1
+        assert write_target.last_updated_title_number == 'TTL0'
+
+    def test_wait_until_lag_at_most_lets_given_number_of_pages_stay_pending(self):
+        release_event = threading.Event()
+
+        def execute_when_released(actions, client):
+            release_event.wait(5)
+            return 0, []
+
+        write_target = WriteTarget('index', 'doctype')
+
+        with mock.patch(
+                'service.es_utils.execute_elasticsearch_actions', side_effect=execute_when_released
+        ):
+            write_target.submit_page([], datetime(2015, 4, 20), 'TTL1')
+            write_target.submit_page([], datetime(2015, 4, 21), 'TTL2')
+            write_target.wait_until_lag_at_most(2)
+
+            assert write_target.pending_page_count == 2
+            release_event.set()
+            write_target.wait_until_lag_at_most(0)
+
+        assert write_target.pending_page_count == 0
+
+    @mock.patch('service.es_utils.execute_elasticsearch_actions', side_effect=_execute_actions)
+    def test_close_waits_for_pages_submitted(self, mock_execute):
+        write_target = WriteTarget('index', 'doctype')
+
+        write_target.submit_page([], datetime(2015, 4, 20), 'TTL1')
+        write_target.close()
+
+        assert write_target.last_updated_title_number == 'TTL1'
+
+        with pytest.raises(RuntimeError):
+            write_target.submit_page([], datetime(2015, 4, 21), 'TTL2')